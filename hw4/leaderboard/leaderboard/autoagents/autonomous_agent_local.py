@@ -32,6 +32,12 @@ class AutonomousAgent(object):
     Autonomous agent base class. All user agents have to be derived from this class
     """
 
+    # Amount of measurements of each sensor kept by the sensor interface, and whether or not
+    # the sensor data is copied for the agent. Agents keeping the sensor data for longer
+    # than 'sensor_slots' - 1 frames have to increase it, or copy the data
+    sensor_slots = 4
+    copy_sensor_data = False
+
     def __init__(self, path_to_conf_file, route_index=None):
         self.track = Track.SENSORS
         #  current global plans to reach a destination
@@ -39,7 +45,7 @@ class AutonomousAgent(object):
         self._global_plan_world_coord = None
 
         # this data structure will contain all sensor data
-        self.sensor_interface = SensorInterface()
+        self.sensor_interface = SensorInterface(self.sensor_slots, self.copy_sensor_data)
 
         self.wallclock_t0 = None
         
@@ -1,12 +1,8 @@
-import copy
 import logging
 import numpy as np
 import os
 import time
-from threading import Thread
-
-from queue import Queue
-from queue import Empty
+from threading import Condition, Thread
 
 import carla
 from srunner.scenariomanager.carla_data_provider import CarlaDataProvider
@@ -155,22 +151,16 @@ class CallBack(object):
 
     # Parsing CARLA physical Sensors
     def _parse_image_cb(self, image, tag):
-        array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-        array = copy.deepcopy(array)
-        array = np.reshape(array, (image.height, image.width, 4))
+        array = self._data_provider.copy_to_slot(tag, image.raw_data, np.dtype("uint8"), (image.height, image.width, 4))
         self._data_provider.update_sensor(tag, array, image.frame)
 
     def _parse_lidar_cb(self, lidar_data, tag):
-        points = np.frombuffer(lidar_data.raw_data, dtype=np.dtype('f4'))
-        points = copy.deepcopy(points)
-        points = np.reshape(points, (int(points.shape[0] / 4), 4))
+        points = self._data_provider.copy_to_slot(tag, lidar_data.raw_data, np.dtype('f4'), (-1, 4))
         self._data_provider.update_sensor(tag, points, lidar_data.frame)
 
     def _parse_radar_cb(self, radar_data, tag):
         # [depth, azimuth, altitute, velocity]
-        points = np.frombuffer(radar_data.raw_data, dtype=np.dtype('f4'))
-        points = copy.deepcopy(points)
-        points = np.reshape(points, (int(points.shape[0] / 4), 4))
+        points = self._data_provider.copy_to_slot(tag, radar_data.raw_data, np.dtype('f4'), (-1, 4))
         points = np.flip(points, 1)
         self._data_provider.update_sensor(tag, points, radar_data.frame)
 
@@ -195,12 +185,95 @@ class CallBack(object):
         self._data_provider.update_sensor(tag, package.data, package.frame)
 
 
-class SensorInterface(object):
+class SensorBuffer(object):
+    """
+    Ring of preallocated slots where the raw data of a sensor is copied.
+    The data of a slot is valid until the ring goes back to it, 'num_slots' measurements later
+    """
+
+    def __init__(self, num_slots):
+        self._slots = [None] * num_slots
+        self._index = -1
+
+    def copy(self, raw_data, dtype, shape):
+        """Copies the raw data into the next slot, and returns it as an array of the given dtype and shape"""
+        source = np.frombuffer(raw_data, dtype=dtype).reshape(shape)
+
+        self._index = (self._index + 1) % len(self._slots)
+        slot = self._slots[self._index]
+        if slot is None or slot.nbytes < source.nbytes:
+            # LiDAR and radar measurements change their size, so keep the largest one
+            slot = self._slots[self._index] = np.empty(source.nbytes, dtype=np.uint8)
+
+        array = slot[:source.nbytes].view(dtype).reshape(source.shape)
+        np.copyto(array, source)
+        return array
+
+
+class SensorLatency(object):
+    """
+    Accumulated timings of a sensor: how long the agent waited for it at each tick,
+    and how long its data took to be copied
+    """
+
     def __init__(self):
+        self.count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.copies = 0
+        self.total_copy = 0.0
+
+    def add_copy(self, copy_time):
+        self.copies += 1
+        self.total_copy += copy_time
+
+    def add_wait(self, wait):
+        self.count += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_wait': self.total_wait / max(self.count, 1),
+            'max_wait': self.max_wait,
+            'mean_copy': self.total_copy / max(self.copies, 1)
+        }
+
+
+class SensorInterface(object):
+    """
+    Gathers the data of all the sensors, frame by frame. The data of each frame is stored
+    as it arrives, and 'get_data' is only woken up once all the sensors of a frame are there.
+
+    The images, LiDARs and radars are copied into per sensor rings of slots (see SensorBuffer),
+    so the data returned by 'get_data' is valid for the next 'num_slots' - 1 frames.
+    Agents keeping that data for longer have to use more slots, or 'copy_on_read'.
+    """
+
+    def __init__(self, num_slots=4, copy_on_read=False):
+        """
+        Args:
+            num_slots (int): Number of measurements of each sensor kept before overwriting them
+            copy_on_read (bool): Whether or not 'get_data' returns copies of the data of the slots
+        """
+        if num_slots < 2:
+            raise ValueError("The sensor interface needs at least 2 slots per sensor, got {}".format(num_slots))
+
         self._sensors_objects = {}
-        self._data_buffers = Queue()
+        self._sensor_buffers = {}
+        self._num_slots = num_slots
+        self._copy_on_read = copy_on_read
         self._queue_timeout = 10
 
+        # Data of the frames that haven't been read yet, and their arrival times
+        self._frames_data = {}
+        self._arrival_times = {}
+        self._last_frame = -1
+        self._data_ready = Condition()
+
+        self._latencies = {}
+
         # Only sensor that doesn't get the data on tick, needs special treatment
         self._opendrive_tag = None
 
@@ -209,32 +282,82 @@ class SensorInterface(object):
             raise SensorConfigurationInvalid("Duplicated sensor tag [{}]".format(tag))
 
         self._sensors_objects[tag] = sensor
+        self._sensor_buffers[tag] = SensorBuffer(self._num_slots)
+        self._latencies[tag] = SensorLatency()
 
         if sensor_type == 'sensor.opendrive_map': 
             self._opendrive_tag = tag
 
+    def copy_to_slot(self, tag, raw_data, dtype, shape):
+        """Copies the raw data of a sensor into its next slot"""
+        if tag not in self._sensors_objects:
+            raise SensorConfigurationInvalid("The sensor with tag [{}] has not been created!".format(tag))
+
+        start_time = time.perf_counter()
+        array = self._sensor_buffers[tag].copy(raw_data, dtype, shape)
+        self._latencies[tag].add_copy(time.perf_counter() - start_time)
+        return array
+
+    def _is_frame_ready(self, frame):
+        """Whether or not all the sensors (except the opendrive one) have sent the data of a frame"""
+        frame_data = self._frames_data.get(frame, {})
+        missing = len(self._sensors_objects) - len(frame_data)
+        if self._opendrive_tag and self._opendrive_tag not in frame_data:
+            missing -= 1
+        return missing <= 0
+
     def update_sensor(self, tag, data, frame):
         if tag not in self._sensors_objects:
             raise SensorConfigurationInvalid("The sensor with tag [{}] has not been created!".format(tag))
 
-        self._data_buffers.put((tag, frame, data))
+        with self._data_ready:
+            # The frame has already been read
+            if frame <= self._last_frame:
+                return
+
+            self._frames_data.setdefault(frame, {})[tag] = (frame, data)
+            self._arrival_times.setdefault(frame, {})[tag] = time.perf_counter()
+            if self._is_frame_ready(frame):
+                self._data_ready.notify_all()
 
     def get_data(self, frame):
-        """Read the queue to get the sensors data"""
-        try:
-            data_dict = {}
-            while len(data_dict.keys()) < len(self._sensors_objects.keys()):
-                # Don't wait for the opendrive sensor
-                if self._opendrive_tag and self._opendrive_tag not in data_dict.keys() \
-                        and len(self._sensors_objects.keys()) == len(data_dict.keys()) + 1:
-                    break
-
-                sensor_data = self._data_buffers.get(True, self._queue_timeout)
-                if sensor_data[1] != frame:
-                    continue
-                data_dict[sensor_data[0]] = ((sensor_data[1], sensor_data[2]))
-
-        except Empty:
-            raise SensorReceivedNoData("A sensor took too long to send their data")
+        """
+        Waits until the data of all the sensors of the frame has arrived.
+
+        The arrays of the images, LiDARs and radars are views of the slots of their sensor, and are
+        overwritten once the sensor has sent 'num_slots' more measurements. As the sensors can be a frame
+        ahead of the agent, they are only valid for the next 'num_slots' - 1 frames, unless 'copy_on_read' is set.
+
+        Returns:
+            dict: tag -> (frame, data) of each sensor
+        """
+        with self._data_ready:
+            start_time = time.perf_counter()
+            if not self._data_ready.wait_for(lambda: self._is_frame_ready(frame), self._queue_timeout):
+                raise SensorReceivedNoData("A sensor took too long to send their data")
+
+            data_dict = self._frames_data.pop(frame, {})
+            arrival_times = self._arrival_times.pop(frame, {})
+
+            # Remove the data of the previous frames, it won't be read anymore
+            self._last_frame = max(self._last_frame, frame)
+            for old_frame in [f for f in self._frames_data if f <= self._last_frame]:
+                del self._frames_data[old_frame]
+                del self._arrival_times[old_frame]
+
+        for tag, arrival_time in arrival_times.items():
+            self._latencies[tag].add_wait(max(arrival_time - start_time, 0.0))
+
+        if self._copy_on_read:
+            for tag, (data_frame, data) in data_dict.items():
+                if isinstance(data, np.ndarray):
+                    data_dict[tag] = (data_frame, data.copy())
 
         return data_dict
+
+    def get_latencies(self):
+        """
+        Returns, for each sensor, its amount of frames, the mean and max time the agent waited
+        for it after asking for the data (in seconds), and the mean time spent copying its data
+        """
+        return {tag: latency.to_dict() for tag, latency in self._latencies.items()}
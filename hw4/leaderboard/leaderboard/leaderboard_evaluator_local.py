@@ -24,7 +24,6 @@ import pkg_resources
 import sys
 import carla
 import signal
-import socket
 import numpy as np
 import torch
 
@@ -38,6 +37,7 @@ from leaderboard.envs.sensor_interface import SensorConfigurationInvalid
 from leaderboard.autoagents.agent_wrapper_local import AgentError, validate_sensor_configuration
 from leaderboard.utils.statistics_manager_local import StatisticsManager, FAILURE_MESSAGES
 from leaderboard.utils.route_indexer import RouteIndexer
+from leaderboard.utils.parallel_tools import find_free_port
 
 import pathlib
 
@@ -98,7 +98,8 @@ class LeaderboardEvaluator(object):
         self.module_agent = importlib.import_module(module_name)
 
         # Create the ScenarioManager
-        self.manager = ScenarioManager(args.timeout, self.statistics_manager, args.debug)
+        self.manager = ScenarioManager(args.timeout, self.statistics_manager, args.debug,
+                                       getattr(args, 'profile_dir', ''))
 
         # Time control for summary purposes
         self._start_time = GameTime.get_time()
@@ -173,19 +174,7 @@ class LeaderboardEvaluator(object):
 
 
     def find_free_port(self, start_port=2_000, end_port=40_000):
-        for port in range(start_port, end_port + 1):
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-            try:
-                s.bind(('localhost', port))
-                return port
-            except OSError as e: # Address already in use or Address already in use (WinError)
-                pass
-            finally:
-                s.close()
-
-        return None
+        return find_free_port(start_port, end_port)
 
     def _setup_simulation(self, args):
         """
@@ -202,7 +191,8 @@ class LeaderboardEvaluator(object):
         )
         client.get_world().apply_settings(settings)
 
-        traffic_manager_port = self.find_free_port()
+        # Parallel evaluations give each worker its own port, as they could find the same free one
+        traffic_manager_port = args.traffic_manager_port or self.find_free_port()
         traffic_manager = client.get_trafficmanager(traffic_manager_port)
         traffic_manager.set_synchronous_mode(True)
         traffic_manager.set_hybrid_physics_mode(True)
@@ -481,8 +471,8 @@ def main():
                         help='IP of the host server (default: localhost)')
     parser.add_argument('--port', default=2000, type=int,
                         help='TCP port to listen to (default: 2000)')
-    parser.add_argument('--traffic-manager-port', default=8000, type=int,
-                        help='Port to use for the TrafficManager (default: 8000)')
+    parser.add_argument('--traffic-manager-port', default=0, type=int,
+                        help='Port to use for the TrafficManager (default: the first free one)')
     parser.add_argument('--traffic-manager-seed', default=100, type=int,
                         help='Seed used by the TrafficManager (default: 100)')
     parser.add_argument('--debug', type=int,
@@ -491,6 +481,9 @@ def main():
                         help='Use CARLA recording feature to create a recording of the scenario')
     parser.add_argument('--timeout', default=300.0, type=float,
                         help='Set the CARLA client timeout value in seconds')
+    parser.add_argument('--profile-dir', type=str, default='',
+                        help='Folder where the durations of the ticks of each route are saved\n'
+                             '(see leaderboard/utils/tick_profiler.py for the report)')
 
     # simulation setup
     parser.add_argument('--routes', required=True,
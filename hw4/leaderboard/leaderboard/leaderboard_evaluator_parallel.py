@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+CARLA Challenge Parallel Evaluator
+
+Splits the routes file into shards with a similar total route length, and evaluates each of them
+with its own leaderboard_evaluator_local.py process, CARLA server and traffic manager.
+The checkpoints of the shards are merged into a single one, which can be resumed.
+"""
+from __future__ import print_function
+
+import argparse
+from argparse import RawTextHelpFormatter
+import json
+import os
+import pathlib
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from leaderboard.utils.checkpoint_tools import fetch_dict
+from leaderboard.utils.parallel_tools import (find_free_port, parse_routes_subset, get_route_length, shard_routes,
+                                              write_routes_file, get_record_route_id, is_record_finished)
+from leaderboard.utils.statistics_manager_local import StatisticsManager
+
+
+class Shard(object):
+
+    """
+    Group of routes evaluated by one worker, with its own files and ports
+    """
+
+    def __init__(self, index, route_ids, folder):
+        self.index = index
+        self.route_ids = route_ids
+        self.folder = folder
+        self.routes = os.path.join(folder, 'routes_shard{}.xml'.format(index))
+        self.checkpoint = os.path.join(folder, 'checkpoint.json')
+        self.debug_checkpoint = os.path.join(folder, 'live_results.txt')
+        self.log = os.path.join(folder, 'log.txt')
+
+        self.port = None
+        self.traffic_manager_port = None
+        self.server = None
+        self.worker = None
+        self.attempts = 0
+        self.return_code = None
+
+
+class ParallelEvaluator(object):
+
+    """
+    Runs the leaderboard evaluation of the routes with several workers, one per CARLA server
+    """
+
+    server_poll_period = 1.0  # in seconds
+
+    def __init__(self, args):
+        self._args = args
+        self._shards = []
+        self._kept_records = []
+        self._shard_dir = args.shard_dir or os.path.splitext(args.checkpoint)[0] + '_shards'
+        self._manifest = os.path.join(self._shard_dir, 'manifest.json')
+
+        self._tree = ET.parse(args.routes)
+        all_route_ids = [route.attrib['id'] for route in self._tree.iter('route')]
+        self._route_ids = parse_routes_subset(args.routes_subset, all_route_ids)
+        self._route_lengths = {route.attrib['id']: get_route_length(route) for route in self._tree.iter('route')}
+
+    def _get_previous_records(self):
+        """
+        Gets the records of the merged checkpoint, updated with the ones of the shards of the previous
+        run, which might not have been merged if it was interrupted
+        """
+        records = {}
+        endpoints = [self._args.checkpoint]
+        if os.path.exists(self._manifest):
+            with open(self._manifest) as fd:
+                endpoints += [shard['checkpoint'] for shard in json.load(fd)['shards']]
+
+        for endpoint in endpoints:
+            data = fetch_dict(endpoint)
+            for record in (data.get('_checkpoint', {}).get('records', []) if data else []):
+                if record['route_id'] not in records or is_record_finished(record):
+                    records[record['route_id']] = record
+
+        return records
+
+    def _create_shards(self):
+        """
+        Gets the routes to be evaluated, and splits them into shards. When resuming,
+        the routes with all their repetitions finished are skipped and their records kept
+        """
+        remaining_ids = self._route_ids
+        if self._args.resume:
+            records = self._get_previous_records()
+            finished_ids = set()
+            for route_id in self._route_ids:
+                route_records = [r for r in records.values() if get_record_route_id(r) == route_id]
+                if len(route_records) == self._args.repetitions and all(is_record_finished(r) for r in route_records):
+                    finished_ids.add(route_id)
+                    self._kept_records.extend(route_records)
+
+            remaining_ids = [route_id for route_id in self._route_ids if route_id not in finished_ids]
+            print("Resuming the evaluation. {} out of {} routes are already finished".format(
+                len(finished_ids), len(self._route_ids)))
+
+        route_lengths = [(route_id, self._route_lengths[route_id]) for route_id in remaining_ids]
+        for i, route_ids in enumerate(shard_routes(route_lengths, self._args.workers)):
+            shard = Shard(i, route_ids, os.path.join(self._shard_dir, 'shard{}'.format(i)))
+            os.makedirs(shard.folder, exist_ok=True)
+            write_routes_file(self._tree, route_ids, shard.routes)
+            if os.path.exists(shard.checkpoint):
+                os.remove(shard.checkpoint)
+            self._shards.append(shard)
+
+        with open(self._manifest, 'w') as fd:
+            json.dump({'shards': [{'routes': s.route_ids, 'checkpoint': s.checkpoint} for s in self._shards]}, fd, indent=4)
+
+        for shard in self._shards:
+            length = sum(self._route_lengths[route_id] for route_id in shard.route_ids)
+            print("Shard {}: {} routes, {} m".format(shard.index, len(shard.route_ids), round(length)))
+
+    def _assign_ports(self):
+        """
+        Each shard uses the server at 'port + index * port_step', and the first free traffic manager port
+        """
+        used_ports = set()
+        for shard in self._shards:
+            shard.port = self._args.port + shard.index * self._args.port_step
+            used_ports.update(range(shard.port, shard.port + self._args.port_step))
+
+        tm_port = self._args.traffic_manager_port
+        for shard in self._shards:
+            tm_port = find_free_port(tm_port, excluded=used_ports)
+            if tm_port is None:
+                raise RuntimeError("Couldn't find a free port for the traffic manager of the shard {}".format(shard.index))
+            shard.traffic_manager_port = tm_port
+            used_ports.add(tm_port)
+
+    def _wait_for_server(self, shard):
+        """Waits until the server of the shard accepts connections"""
+        start_time = time.time()
+        while time.time() - start_time < self._args.server_timeout:
+            if shard.server is not None and shard.server.poll() is not None:
+                raise RuntimeError("The server of the shard {} has stopped".format(shard.index))
+            try:
+                with socket.create_connection((self._args.host, shard.port), timeout=self.server_poll_period):
+                    return
+            except OSError:
+                time.sleep(self.server_poll_period)
+
+        raise RuntimeError("Timeout: The server of the shard {} took longer than {}s to start".format(
+            shard.index, self._args.server_timeout))
+
+    def _start_server(self, shard):
+        """Starts the server of the shard, if a server command is given. Otherwise, it must be already running"""
+        if self._args.server_command:
+            gpus = self._args.gpus.split(',') if self._args.gpus else ['0']
+            command = self._args.server_command.format(port=shard.port, gpu=gpus[shard.index % len(gpus)])
+            with open(shard.log, 'a') as log:
+                shard.server = subprocess.Popen(shlex.split(command), stdout=log, stderr=subprocess.STDOUT,
+                                                start_new_session=True)
+
+    @staticmethod
+    def _stop_process(process):
+        """Stops a process and all its children"""
+        if process is None or process.poll() is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _start_worker(self, shard):
+        """Starts the evaluation of a shard. After the first attempt, the evaluation is resumed"""
+        args = self._args
+        command = [sys.executable, args.evaluator,
+                   '--host', args.host,
+                   '--port', str(shard.port),
+                   '--traffic-manager-port', str(shard.traffic_manager_port),
+                   '--traffic-manager-seed', str(args.traffic_manager_seed),
+                   '--debug', str(args.debug),
+                   '--timeout', str(args.timeout),
+                   '--routes', shard.routes,
+                   '--repetitions', str(args.repetitions),
+                   '--agent', args.agent,
+                   '--agent-config', args.agent_config,
+                   '--track', args.track,
+                   '--checkpoint', shard.checkpoint,
+                   '--debug-checkpoint', shard.debug_checkpoint]
+        if args.record:
+            command += ['--record', '{}_shard{}'.format(args.record, shard.index)]
+        if args.profile_dir:
+            command += ['--profile-dir', args.profile_dir]
+        if shard.attempts > 0:
+            command += ['--resume', '1']
+
+        # Keep the data saved by the agents of each shard apart
+        env = os.environ.copy()
+        if 'SAVE_PATH' in env:
+            env['SAVE_PATH'] = os.path.join(env['SAVE_PATH'], 'shard{}'.format(shard.index))
+
+        shard.attempts += 1
+        with open(shard.log, 'a') as log:
+            shard.worker = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env,
+                                            start_new_session=True)
+
+    def _run_shards(self):
+        """Runs all the shards in parallel, restarting the failed ones up to 'max_retries' times"""
+        for shard in self._shards:
+            self._start_server(shard)
+        for shard in self._shards:
+            self._wait_for_server(shard)
+            self._start_worker(shard)
+
+        running = list(self._shards)
+        while running:
+            time.sleep(self.server_poll_period)
+            for shard in list(running):
+                return_code = shard.worker.poll()
+                if return_code is None:
+                    continue
+
+                if return_code != 0 and shard.attempts <= self._args.max_retries:
+                    print("Shard {} failed (code {}), resuming it. Log: {}".format(shard.index, return_code, shard.log))
+                    if shard.server is not None:
+                        self._stop_process(shard.server)
+                        self._start_server(shard)
+                    self._wait_for_server(shard)
+                    self._start_worker(shard)
+                    continue
+
+                print("Shard {} finished (code {})".format(shard.index, return_code))
+                shard.return_code = return_code
+                self._stop_process(shard.server)
+                running.remove(shard)
+
+    def _stop(self):
+        for shard in self._shards:
+            self._stop_process(shard.worker)
+            self._stop_process(shard.server)
+
+    def _merge_checkpoints(self):
+        """Merges the records of all shards into the checkpoint. Returns False if any route is missing"""
+        statistics_manager = StatisticsManager(self._args.checkpoint, self._args.debug_checkpoint)
+        statistics_manager.add_records(self._kept_records)
+
+        sensors = fetch_dict(self._args.checkpoint).get('sensors', []) if self._args.resume else []
+        for shard in self._shards:
+            data = fetch_dict(shard.checkpoint)
+            if not data:
+                continue
+            statistics_manager.add_file_records(shard.checkpoint)
+            sensors = sensors or data.get('sensors', [])
+
+        records = statistics_manager._results.checkpoint.records  # pylint: disable=protected-access
+        total = len(self._route_ids) * self._args.repetitions
+        finished = len(records) == total and all(is_record_finished(vars(record)) for record in records)
+
+        statistics_manager.sort_records()
+        statistics_manager.save_sensors(sensors)
+        statistics_manager.save_progress(len(records), total)
+        if finished:
+            statistics_manager.save_entry_status('Started')
+            statistics_manager.compute_global_statistics()
+            statistics_manager.validate_and_write_statistics(True, False)
+        else:
+            # Allow resuming the missing routes
+            statistics_manager.save_entry_status('Crashed')
+            statistics_manager.write_statistics()
+
+        return finished
+
+    def run(self):
+        """
+        Run the challenge mode with all the workers. Returns True if any route is missing
+        """
+        os.makedirs(self._shard_dir, exist_ok=True)
+        self._create_shards()
+        self._assign_ports()
+
+        start_time = time.time()
+        try:
+            self._run_shards()
+        finally:
+            self._stop()
+
+        finished = self._merge_checkpoints()
+        print("\033[1m> Evaluated {} shards in {}s\033[0m".format(len(self._shards), round(time.time() - start_time)))
+        return not finished
+
+
+def main():
+    description = "CARLA AD Leaderboard Evaluation: evaluate your Agent in CARLA scenarios, using several servers\n"
+
+    # general parameters
+    parser = argparse.ArgumentParser(description=description, formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--host', default='localhost',
+                        help='IP of the host servers (default: localhost)')
+    parser.add_argument('--port', default=2000, type=int,
+                        help='TCP port of the first server (default: 2000)')
+    parser.add_argument('--port-step', default=4, type=int,
+                        help='Difference between the ports of consecutive servers (default: 4)')
+    parser.add_argument('--traffic-manager-port', default=8000, type=int,
+                        help='First port used to look for free TrafficManager ports (default: 8000)')
+    parser.add_argument('--traffic-manager-seed', default=100, type=int,
+                        help='Seed used by the TrafficManager (default: 100)')
+    parser.add_argument('--debug', type=int,
+                        help='Run with debug output', default=0)
+    parser.add_argument('--record', type=str, default='',
+                        help='Use CARLA recording feature to create a recording of the scenario')
+    parser.add_argument('--timeout', default=300.0, type=float,
+                        help='Set the CARLA client timeout value in seconds')
+    parser.add_argument('--profile-dir', type=str, default='',
+                        help='Folder where the durations of the ticks of each route are saved\n'
+                             '(see leaderboard/utils/tick_profiler.py for the report)')
+
+    # parallelization
+    parser.add_argument('--workers', default=2, type=int,
+                        help='Number of parallel evaluations, each one with its own server (default: 2)')
+    parser.add_argument('--server-command', type=str, default='',
+                        help="Command starting a server, formatted with its '{port}' and '{gpu}'\n"
+                             "(i.e. 'CarlaUE4.sh -RenderOffScreen -carla-rpc-port={port} -graphicsadapter={gpu}').\n"
+                             "If not given, the servers must be already running")
+    parser.add_argument('--gpus', type=str, default='',
+                        help='Comma separated GPUs assigned to the servers in a round robin (default: 0)')
+    parser.add_argument('--server-timeout', default=120.0, type=float,
+                        help='Maximum time waiting for a server to start, in seconds')
+    parser.add_argument('--max-retries', default=2, type=int,
+                        help='Number of times a failed shard is resumed')
+    parser.add_argument('--shard-dir', type=str, default='',
+                        help="Folder of the shards' files (default: next to the checkpoint)")
+    parser.add_argument('--evaluator', type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'leaderboard_evaluator_local.py'),
+                        help='Evaluator script run by each worker')
+
+    # simulation setup
+    parser.add_argument('--routes', required=True,
+                        help='Name of the routes file to be executed.')
+    parser.add_argument('--routes-subset', default='', type=str,
+                        help='Execute a specific set of routes')
+    parser.add_argument('--repetitions', type=int, default=1,
+                        help='Number of repetitions per route.')
+
+    # agent-related options
+    parser.add_argument("-a", "--agent", type=str,
+                        help="Path to Agent's py file to evaluate", required=True)
+    parser.add_argument("--agent-config", type=str,
+                        help="Path to Agent's configuration file", default="")
+
+    parser.add_argument("--track", type=str, default='SENSORS',
+                        help="Participation track: SENSORS, MAP")
+    parser.add_argument('--resume', type=int, default=0,
+                        help='Resume execution from last checkpoint?')
+    parser.add_argument("--checkpoint", type=str, default='./simulation_results.json',
+                        help="Path to checkpoint used for saving statistics and resuming")
+    parser.add_argument("--debug-checkpoint", type=str, default='./live_results.txt',
+                        help="Path to checkpoint used for saving live results")
+
+    arguments = parser.parse_args()
+
+    pathlib.Path(arguments.checkpoint).parent.mkdir(parents=True, exist_ok=True)
+
+    parallel_evaluator = ParallelEvaluator(arguments)
+    missing_routes = parallel_evaluator.run()
+
+    if missing_routes:
+        sys.exit(-1)
+    else:
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -43,7 +43,7 @@ from srunner.scenariomanager.weather_sim import RouteWeatherBehavior
 from srunner.scenariomanager.lights_sim import RouteLightsBehavior
 from srunner.scenariomanager.timer import RouteTimeoutBehavior
 
-from leaderboard.utils.route_parser import RouteParser, DIST_THRESHOLD
+from leaderboard.utils.route_parser import RouteIndex, DIST_THRESHOLD
 from leaderboard.utils.route_manipulation import interpolate_trajectory
 
 import leaderboard.utils.parked_vehicles as parked_vehicles
@@ -130,9 +130,10 @@ class RouteScenario(BasicScenario):
         - scenario_configs: list of ScenarioConfiguration
         """
         new_scenarios_config = []
-        for scenario_number, scenario_config in enumerate(scenario_configs):
-            trigger_point = scenario_config.trigger_points[0]
-            if not RouteParser.is_scenario_at_route(trigger_point, self.route):
+        trigger_points = [scenario_config.trigger_points[0] for scenario_config in scenario_configs]
+        are_at_route = RouteIndex(self.route).are_triggers_at_route(trigger_points)
+        for scenario_number, (scenario_config, is_at_route) in enumerate(zip(scenario_configs, are_at_route)):
+            if not is_at_route:
                 print("WARNING: Ignoring scenario '{}' as it is too far from the route".format(scenario_config.name))
                 continue
 
@@ -165,7 +165,8 @@ class ScenarioManager(object):
         if self._running and self.get_running_status():
             CarlaDataProvider.get_world().tick(self._timeout)
 
-        timestamp = CarlaDataProvider.get_world().get_snapshot().timestamp
+        snapshot = CarlaDataProvider.get_world().get_snapshot()
+        timestamp = snapshot.timestamp
 
         if self._timestamp_last_run < timestamp.elapsed_seconds and self._running:
             self._timestamp_last_run = timestamp.elapsed_seconds
@@ -173,7 +174,7 @@ class ScenarioManager(object):
             self._watchdog.update()
             # Update game time and actor information
             GameTime.on_carla_tick(timestamp)
-            CarlaDataProvider.on_carla_tick()
+            CarlaDataProvider.on_carla_tick(snapshot)
             self._watchdog.pause()
 
             try:
@@ -11,6 +11,7 @@ It must not be modified and is for reference only!
 """
 
 from __future__ import print_function
+import os
 import signal
 import sys
 import time
@@ -26,6 +27,7 @@ from srunner.scenariomanager.watchdog import Watchdog
 from leaderboard.autoagents.agent_wrapper_local import AgentWrapperFactory, AgentError
 from leaderboard.envs.sensor_interface import SensorReceivedNoData
 from leaderboard.utils.result_writer import ResultOutputProvider
+from leaderboard.utils.tick_profiler import TickProfiler
 
 
 class ScenarioManager(object):
@@ -45,9 +47,11 @@ class ScenarioManager(object):
     4. If needed, cleanup with manager.stop_scenario()
     """
 
-    def __init__(self, timeout, statistics_manager, debug_mode=0):
+    def __init__(self, timeout, statistics_manager, debug_mode=0, profile_dir=''):
         """
-        Setups up the parameters, which will be filled at load_scenario()
+        Setups up the parameters, which will be filled at load_scenario().
+        If 'profile_dir' is given, the durations of the ticks of each route are saved there
+        (see tick_profiler.py)
         """
         self.route_index = None
         self.scenario = None
@@ -73,6 +77,9 @@ class ScenarioManager(object):
 
         self._statistics_manager = statistics_manager
 
+        self._profile_dir = profile_dir
+        self._profiler = TickProfiler(enabled=False)
+
         # Use the callback_id inside the signal handler to allow external interrupts
         signal.signal(signal.SIGINT, self.signal_handler)
 
@@ -123,6 +130,10 @@ class ScenarioManager(object):
 
         self._agent_wrapper.setup_sensors(self.ego_vehicles[0])
 
+        self._profiler.uninstall()
+        self._profiler = TickProfiler(enabled=bool(self._profile_dir))
+        self._profiler.install(agent)
+
     def build_scenarios_loop(self, debug):
         """
         Keep periodically trying to start the scenarios that are close to the ego vehicle
@@ -161,10 +172,15 @@ class ScenarioManager(object):
         """
         Run next tick of scenario and the agent and tick the world.
         """
+        profiler = self._profiler
+        profiler.start_tick()
+
         if self._running and self.get_running_status():
             CarlaDataProvider.get_world().tick(self._timeout)
 
-        timestamp = CarlaDataProvider.get_world().get_snapshot().timestamp
+        snapshot = CarlaDataProvider.get_world().get_snapshot()
+        timestamp = snapshot.timestamp
+        profiler.lap('world_tick')
 
         if self._timestamp_last_run < timestamp.elapsed_seconds and self._running:
             self._timestamp_last_run = timestamp.elapsed_seconds
@@ -172,7 +188,9 @@ class ScenarioManager(object):
             self._watchdog.update()
             # Update game time and actor information
             GameTime.on_carla_tick(timestamp)
-            CarlaDataProvider.on_carla_tick()
+            profiler.lap('game_time')
+            CarlaDataProvider.on_carla_tick(snapshot)
+            profiler.lap('data_provider')
             self._watchdog.pause()
 
             try:
@@ -188,12 +206,15 @@ class ScenarioManager(object):
             except Exception as e:
                 raise AgentError(e)
 
+            profiler.lap('agent')
             self._watchdog.resume()
             self.ego_vehicles[0].apply_control(ego_action)
+            profiler.lap('apply_control')
 
             # Tick scenario. Add the ego control to the blackboard in case some behaviors want to change it
             py_trees.blackboard.Blackboard().set("AV_control", ego_action, overwrite=True)
             self.scenario_tree.tick_once()
+            profiler.lap('scenario_tree')
 
             if self._debug_mode > 1:
                 self.compute_duration_time()
@@ -216,6 +237,7 @@ class ScenarioManager(object):
                 print("\n")
                 py_trees.display.print_ascii_tree(self.scenario_tree, show_status=True)
                 sys.stdout.flush()
+            profiler.lap('statistics')
 
             if self.scenario_tree.status != py_trees.common.Status.RUNNING:
                 self._running = False
@@ -232,6 +254,8 @@ class ScenarioManager(object):
             
             # For bird's eye view
             self._spectator.set_transform(carla.Transform(ego_trans.location + carla.Location(z=30), carla.Rotation(pitch=-90)))
+            profiler.lap('spectator')
+            profiler.end_tick()
 
     def get_running_status(self):
         """
@@ -253,6 +277,7 @@ class ScenarioManager(object):
             self._agent_watchdog.stop()
 
         self.compute_duration_time()
+        self._save_profile()
 
         if self.get_running_status():
             if self.scenario is not None:
@@ -264,6 +289,23 @@ class ScenarioManager(object):
 
             self.analyze_scenario()
 
+    def _save_profile(self):
+        """
+        Saves the durations of the ticks of the route, and stops profiling
+        """
+        self._profiler.uninstall()
+        if not self._profiler.enabled:
+            return
+
+        config = getattr(self.scenario, 'config', None)
+        route_name = config.name if config is not None else 'route{}'.format(self.route_index)
+        path = os.path.join(self._profile_dir, '{}_rep{}.npz'.format(route_name, self.repetition_number))
+        try:
+            self._profiler.save(path)
+        except OSError as e:
+            print("WARNING: Couldn't save the tick profile {}: {}".format(path, e))
+        self._profiler = TickProfiler(enabled=False)
+
     def compute_duration_time(self):
         """
         Computes system and game duration times
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Stand-in for the CARLA server, used to test the parallel evaluator. It only accepts connections at its port
+"""
+
+import argparse
+import socket
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, required=True)
+    args = parser.parse_args()
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('localhost', args.port))
+    server.listen()
+    while True:
+        connection, _ = server.accept()
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
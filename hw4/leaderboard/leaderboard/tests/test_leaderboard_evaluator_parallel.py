@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides tests of the parallel evaluator, with stand-ins of the CARLA server and
+of the local evaluator (see mock_server.py and mock_evaluator.py)
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from unittest import TestCase
+
+from leaderboard.utils.parallel_tools import find_free_port
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PARALLEL_EVALUATOR = os.path.join(os.path.dirname(TESTS_DIR), 'leaderboard_evaluator_parallel.py')
+
+
+class TestParallelEvaluator(TestCase):
+    """
+    Test class to run the parallel evaluator and check its merged checkpoint
+    """
+
+    ROUTE_LENGTHS = {'10': 400, '11': 100, '12': 300, '13': 200, '14': 500, '15': 100}
+    REPETITIONS = 2
+    WORKERS = 2
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._routes = os.path.join(self._dir, 'routes.xml')
+        self._checkpoint = os.path.join(self._dir, 'results', 'checkpoint.json')
+
+        root = ET.Element('routes')
+        for route_id, length in self.ROUTE_LENGTHS.items():
+            route = ET.SubElement(root, 'route', id=route_id, town='Town01')
+            waypoints = ET.SubElement(route, 'waypoints')
+            ET.SubElement(waypoints, 'position', x='0', y='0', z='0')
+            ET.SubElement(waypoints, 'position', x=str(length), y='0', z='0')
+        ET.ElementTree(root).write(self._routes)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _run(self, resume=False, crash_route=None, max_retries=2):
+        """Runs the parallel evaluator, returning its exit code"""
+        port = find_free_port(20000, 30000)
+        while find_free_port(port + 1, port + 1) is None:
+            port = find_free_port(port + 2, 30000)
+
+        command = [sys.executable, PARALLEL_EVALUATOR,
+                   '--routes', self._routes,
+                   '--repetitions', str(self.REPETITIONS),
+                   '--agent', 'agent.py',
+                   '--checkpoint', self._checkpoint,
+                   '--debug-checkpoint', os.path.join(self._dir, 'results', 'live_results.txt'),
+                   '--workers', str(self.WORKERS),
+                   '--port', str(port),
+                   '--port-step', '1',
+                   '--server-command', '{} {} --port {{port}}'.format(sys.executable,
+                                                                      os.path.join(TESTS_DIR, 'mock_server.py')),
+                   '--server-timeout', '20',
+                   '--max-retries', str(max_retries),
+                   '--evaluator', os.path.join(TESTS_DIR, 'mock_evaluator.py'),
+                   '--resume', str(int(resume))]
+
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+        env.pop('MOCK_EVALUATOR_CRASH', None)
+        if crash_route is not None:
+            env['MOCK_EVALUATOR_CRASH'] = crash_route
+
+        process = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 universal_newlines=True, timeout=120, check=False)
+        self._output = process.stdout
+        return process.returncode
+
+    def _read_manifest(self):
+        with open(os.path.join(self._dir, 'results', 'checkpoint_shards', 'manifest.json')) as fd:
+            return json.load(fd)
+
+    def _read_checkpoint(self):
+        with open(self._checkpoint) as fd:
+            return json.load(fd)
+
+    def _assert_all_routes_merged(self, data):
+        records = data['_checkpoint']['records']
+        expected = ['RouteScenario_{}_rep{}'.format(route_id, repetition)
+                    for route_id in sorted(self.ROUTE_LENGTHS, key=int) for repetition in range(self.REPETITIONS)]
+        self.assertEqual([record['route_id'] for record in records], expected, self._output)
+        self.assertEqual([record['index'] for record in records], list(range(len(expected))))
+        self.assertEqual(data['_checkpoint']['progress'], [len(expected), len(expected)])
+        self.assertEqual(data['entry_status'], 'Finished')
+        self.assertEqual(data['sensors'], ['carla_camera'])
+        self.assertEqual(data['_checkpoint']['global_record']['meta']['total_length'],
+                         self.REPETITIONS * sum(self.ROUTE_LENGTHS.values()))
+
+    def test_sharding(self):
+        """The routes are split into balanced shards, and their records merged into the checkpoint"""
+        self.assertEqual(self._run(), 0, self._output)
+
+        shards = [shard['routes'] for shard in self._read_manifest()['shards']]
+        self.assertEqual(len(shards), self.WORKERS)
+        self.assertEqual(sorted(route_id for shard in shards for route_id in shard), sorted(self.ROUTE_LENGTHS))
+        self.assertEqual([sum(self.ROUTE_LENGTHS[route_id] for route_id in shard) for shard in shards], [800, 800])
+
+        self._assert_all_routes_merged(self._read_checkpoint())
+
+    def test_retry(self):
+        """A failed shard is resumed, keeping the records of the routes it had finished"""
+        self.assertEqual(self._run(crash_route='12'), 0, self._output)
+        self.assertIn('resuming it', self._output)
+
+        data = self._read_checkpoint()
+        self._assert_all_routes_merged(data)
+
+        # The routes before the crash are only evaluated by the first attempt
+        pids = {record['route_id']: record['meta']['pid'] for record in data['_checkpoint']['records']}
+        shard = next(shard['routes'] for shard in self._read_manifest()['shards'] if '12' in shard['routes'])
+        first_route = 'RouteScenario_{}_rep0'.format(shard[0])
+        self.assertNotEqual(pids[first_route], pids['RouteScenario_12_rep0'])
+
+    def test_resume(self):
+        """The routes missing from an interrupted evaluation are evaluated when resuming it"""
+        self.assertNotEqual(self._run(crash_route='12', max_retries=0), 0, self._output)
+
+        data = self._read_checkpoint()
+        self.assertEqual(data['entry_status'], 'Crashed')
+        finished = {record['route_id']: record['meta']['pid'] for record in data['_checkpoint']['records']}
+        self.assertNotIn('RouteScenario_12_rep0', finished)
+
+        self.assertEqual(self._run(resume=True), 0, self._output)
+
+        # Only the routes with unfinished repetitions are sharded again
+        resumed_ids = {route_id for shard in self._read_manifest()['shards'] for route_id in shard['routes']}
+        finished_ids = {route_id for route_id in self.ROUTE_LENGTHS
+                        if all('RouteScenario_{}_rep{}'.format(route_id, repetition) in finished
+                               for repetition in range(self.REPETITIONS))}
+        self.assertIn('12', resumed_ids)
+        self.assertFalse(resumed_ids & finished_ids)
+
+        data = self._read_checkpoint()
+        self._assert_all_routes_merged(data)
+        for record in data['_checkpoint']['records']:
+            if record['route_id'].split('_')[1] in finished_ids:
+                self.assertEqual(record['meta']['pid'], finished[record['route_id']])
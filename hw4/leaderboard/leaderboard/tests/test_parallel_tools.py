@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides unit tests for the helpers of the parallel evaluation
+"""
+
+from unittest import TestCase
+
+from leaderboard.utils.parallel_tools import parse_routes_subset, shard_routes
+
+
+class TestParseRoutesSubset(TestCase):
+    """
+    Test class of the parsing of the --routes-subset argument
+    """
+
+    ROUTE_IDS = ['3', '1', '7', '12', '5']
+
+    def test_empty_subset(self):
+        self.assertEqual(parse_routes_subset('', self.ROUTE_IDS), self.ROUTE_IDS)
+
+    def test_single_ids(self):
+        self.assertEqual(parse_routes_subset('12, 3', self.ROUTE_IDS), ['3', '12'])
+
+    def test_groups(self):
+        """Groups follow the order of the routes file, not the numeric one"""
+        self.assertEqual(parse_routes_subset('1-12', self.ROUTE_IDS), ['1', '7', '12'])
+        self.assertEqual(parse_routes_subset('3-1,7-7,12-5', self.ROUTE_IDS), self.ROUTE_IDS)
+
+    def test_overlapping_groups(self):
+        self.assertEqual(parse_routes_subset('3-7,1-12', self.ROUTE_IDS), ['3', '1', '7', '12'])
+
+    def test_unknown_id(self):
+        with self.assertRaises(ValueError):
+            parse_routes_subset('4', self.ROUTE_IDS)
+        with self.assertRaises(ValueError):
+            parse_routes_subset('3-4', self.ROUTE_IDS)
+
+    def test_reversed_group(self):
+        with self.assertRaises(ValueError):
+            parse_routes_subset('12-1', self.ROUTE_IDS)
+
+
+class TestShardRoutes(TestCase):
+    """
+    Test class of the splitting of the routes between the workers
+    """
+
+    def test_balanced_lengths(self):
+        route_lengths = [('a', 100), ('b', 700), ('c', 300), ('d', 400), ('e', 500)]
+        shards = shard_routes(route_lengths, 2)
+
+        lengths = dict(route_lengths)
+        self.assertEqual(sorted(sum(lengths[route_id] for route_id in shard) for shard in shards), [1000, 1000])
+
+    def test_all_routes_once_and_in_order(self):
+        route_lengths = [(str(i), (i * 37) % 11 + 1) for i in range(20)]
+        shards = shard_routes(route_lengths, 3)
+
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(sorted(route_id for shard in shards for route_id in shard),
+                         sorted(route_id for route_id, _ in route_lengths))
+        order = [route_id for route_id, _ in route_lengths]
+        for shard in shards:
+            self.assertEqual(shard, sorted(shard, key=order.index))
+
+    def test_more_shards_than_routes(self):
+        shards = shard_routes([('a', 10), ('b', 20)], 4)
+        self.assertEqual(sorted(shards), [['a'], ['b']])
+
+    def test_no_routes(self):
+        self.assertEqual(shard_routes([], 2), [])
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Helpers to split an evaluation across several CARLA servers: port selection, sharding of
+the routes file, balanced by route length, and merging of the checkpoints of each shard.
+
+They only use the routes XML and the checkpoint JSON, so they don't need a running simulator.
+"""
+
+import copy
+import math
+import socket
+import xml.etree.ElementTree as ET
+
+
+def find_free_port(start_port=2_000, end_port=40_000, excluded=()):
+    """
+    Returns the first port of the range that can be bound, skipping the 'excluded' ones.
+    Returns None if all of them are in use
+    """
+    for port in range(start_port, end_port + 1):
+        if port in excluded:
+            continue
+
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(('localhost', port))
+            return port
+        except OSError:  # Address already in use
+            pass
+        finally:
+            s.close()
+
+    return None
+
+
+def parse_routes_subset(routes_subset, route_ids):
+    """
+    Returns the ids of 'route_ids' that are part of the subset, given as single ids separated
+    by commas, or groups of ids separated by dashes (same format as RouteParser.parse_routes_file)
+    """
+    if not routes_subset:
+        return list(route_ids)
+
+    subset_ids = set()
+    for group in routes_subset.replace(" ", "").split(','):
+        start, _, end = group.partition('-')
+        end = end or start
+        if start not in route_ids:
+            raise ValueError(f"Couldn't find the route with id '{start}' inside the given routes file")
+        if end not in route_ids:
+            raise ValueError(f"Couldn't find the route with id '{end}' inside the given routes file")
+
+        start_index = route_ids.index(start)
+        end_index = route_ids.index(end)
+        if end_index < start_index:
+            raise ValueError(f"Malformed route subset '{group}', found the end id before the starting one")
+        subset_ids.update(route_ids[start_index:end_index + 1])
+
+    return [route_id for route_id in route_ids if route_id in subset_ids]
+
+
+def get_route_length(route):
+    """Returns the length of the polyline of the waypoints of a route XML element"""
+    length = 0.0
+    prev_position = None
+    for elem in route.find('waypoints').iter('position'):
+        position = (float(elem.attrib['x']), float(elem.attrib['y']), float(elem.attrib['z']))
+        if prev_position:
+            length += math.dist(prev_position, position)
+        prev_position = position
+    return length
+
+
+def shard_routes(route_lengths, num_shards):
+    """
+    Splits the routes into 'num_shards' groups with a similar total length, by assigning the longest
+    routes first, each to the shorter group (LPT scheduling). Each group keeps the order of the routes.
+
+    Args:
+        route_lengths (list): Pairs of (route id, length), in the order of the routes file
+    """
+    order = {route_id: i for i, (route_id, _) in enumerate(route_lengths)}
+    shards = [[] for _ in range(num_shards)]
+    shard_lengths = [0.0] * num_shards
+
+    for route_id, length in sorted(route_lengths, key=lambda x: (-x[1], order[x[0]])):
+        index = shard_lengths.index(min(shard_lengths))
+        shards[index].append(route_id)
+        shard_lengths[index] += length
+
+    return [sorted(shard, key=order.get) for shard in shards if shard]
+
+
+def write_routes_file(tree, route_ids, path):
+    """Writes a copy of the routes XML tree with only the given route ids"""
+    root = copy.deepcopy(tree.getroot())
+    for route in list(root.iter('route')):
+        if route.attrib['id'] not in route_ids:
+            root.remove(route)
+    ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def get_record_route_id(record):
+    """Returns the id of the routes file (i.e '28035') of a checkpoint record (i.e 'RouteScenario_28035_rep0')"""
+    return record['route_id'].split('_')[1]
+
+
+def is_record_finished(record):
+    """Checks if a checkpoint record has finished. Crashed simulations are repeated, as done when resuming"""
+    return record['status'] != 'Started' and 'Simulation crashed' not in record['status']
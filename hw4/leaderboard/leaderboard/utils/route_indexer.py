@@ -1,4 +1,3 @@
-from collections import OrderedDict
 from dictor import dictor
 
 import copy
@@ -9,21 +8,34 @@ from leaderboard.utils.checkpoint_tools import fetch_dict
 
 class RouteIndexer():
     def __init__(self, routes_file, repetitions, routes_subset):
-        self._configs_dict = OrderedDict()
-        self._configs_list = []
+        self._routes_file = routes_file
+        self._routes_subset = routes_subset
+        self._repetitions = repetitions
         self.index = 0
 
-        route_configurations = RouteParser.parse_routes_file(routes_file, routes_subset)
-        self.total = len(route_configurations) * repetitions
+        # Only the ids are read here, the routes are parsed once they are needed
+        self._route_ids = RouteParser.get_route_ids(routes_file, routes_subset)
+        self.total = len(self._route_ids) * repetitions
 
-        for i, config in enumerate(route_configurations):
-            for repetition in range(repetitions):
-                config.index = i * repetitions + repetition
-                config.repetition_index = repetition
-                self._configs_dict['{}.{}'.format(config.name, repetition)] = copy.copy(config)
+        self._routes = None
+        self._route_index = -1
+        self._route_config = None
 
-        self._configs_list = list(self._configs_dict.values())
+    def _get_route_config(self, route_index):
+        """Parses the routes file up to the given route, restarting it if that route has already been parsed"""
+        if self._routes is None or route_index < self._route_index:
+            self._routes = RouteParser.iter_routes_file(self._routes_file, self._routes_subset)
+            self._route_index = -1
 
+        while self._route_index < route_index:
+            self._route_config = next(self._routes)
+            self._route_index += 1
+
+        return self._route_config
+
+    def _get_config_name(self, index):
+        """Returns the name of the route of the given index, without parsing it"""
+        return "RouteScenario_{}".format(self._route_ids[index // self._repetitions])
 
     def peek(self):
         return self.index < self.total
@@ -32,7 +44,9 @@ class RouteIndexer():
         if self.index >= self.total:
             return None
 
-        config = self._configs_list[self.index]
+        config = copy.copy(self._get_route_config(self.index // self._repetitions))
+        config.index = self.index
+        config.repetition_index = self.index % self._repetitions
         self.index += 1
 
         return config
@@ -72,8 +86,8 @@ class RouteIndexer():
         resume_index = progress[0]
         while check_index < resume_index:
             try:
-                route_id = self._configs_list[check_index].name
-                route_id += "_rep" + str(self._configs_list[check_index].repetition_index)
+                route_id = self._get_config_name(check_index)
+                route_id += "_rep" + str(check_index % self._repetitions)
                 checkpoint_route_id = route_data[check_index]['route_id']
 
                 if route_id != checkpoint_route_id:
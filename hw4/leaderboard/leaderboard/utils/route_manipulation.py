@@ -13,7 +13,7 @@ It also contains functions to convert the CARLA world location do GPS coordinate
 import math
 import xml.etree.ElementTree as ET
 from srunner.scenariomanager.carla_data_provider import CarlaDataProvider
-from agents.navigation.global_route_planner import GlobalRoutePlanner
+from srunner.tools.route_planner_cache import get_route_planner
 from agents.navigation.local_planner import RoadOption
 
 
@@ -143,7 +143,7 @@ def interpolate_trajectory(waypoints_trajectory, hop_resolution=1.0):
         - hop_resolution: distance between the trajectory's waypoints
     """
 
-    grp = GlobalRoutePlanner(CarlaDataProvider.get_map(), hop_resolution)
+    grp = get_route_planner(CarlaDataProvider.get_map(), hop_resolution)
     # Obtain route plan
     lat_ref, lon_ref = _get_latlon_ref(CarlaDataProvider.get_world())
 
@@ -6,8 +6,9 @@
 """
 Module used to parse all the route and scenario configuration parameters.
 """
-import math
 import xml.etree.ElementTree as ET
+import numpy as np
+from scipy.spatial import cKDTree
 
 import carla
 from agents.navigation.local_planner import RoadOption
@@ -49,100 +50,126 @@ class RouteParser(object):
         :param single_route: If set, only this route shall be returned
         :return: List of dicts containing the waypoints, id and town of the routes
         """
-        def get_routes_subset():
-            """
-            The route subset can be indicated by single routes separated by commas,
-            or group of routes separated by dashes (or a combination of the two)"""
-            subset_ids = []
-            subset_groups = routes_subset.replace(" ","").split(',')
-            for group in subset_groups:
-                if "-" in group:
-                    # Group of route, iterate from start to end, making sure both ids exist
-                    start, end = group.split('-')
-                    found_start, found_end = (False, False)
-
-                    for route in tree.iter("route"):
-                        route_id = route.attrib['id']
-                        if not found_start and route_id == start:
-                            found_start = True
-                        if not found_start and route_id == end:
-                            raise ValueError(f"Malformed route subset '{group}', found the end id before the starting one")
-                        if not found_end and found_start:
-                            if route_id in subset_ids:
-                                raise ValueError(f"Found a repeated route with id '{route_id}'")
-                            else:
-                                subset_ids.append(route_id)
-                            if route_id == end:
-                                found_end = True
-
-                    if not found_start:
-                        raise ValueError(f"Couldn\'t find the route with id '{start}' inside the given routes file")
-                    if not found_end:
-                        raise ValueError(f"Couldn\'t find the route with id '{end}' inside the given routes file")
+        return list(RouteParser.iter_routes_file(route_filename, routes_subset))
 
+    @staticmethod
+    def iter_routes_file(route_filename, routes_subset=''):
+        """
+        Same as parse_routes_file, but parses the routes one at a time, as they are requested
+        """
+        subset_ids = set(RouteParser.get_route_ids(route_filename, routes_subset)) if routes_subset else None
+
+        for route in RouteParser.iter_route_elements(route_filename):
+            if subset_ids is None or route.attrib['id'] in subset_ids:
+                yield RouteParser.parse_route(route)
+
+    @staticmethod
+    def iter_route_elements(route_filename):
+        """
+        Incrementally parses the routes file, yielding its route elements. Each one is
+        freed once the next one is requested, so the whole file is never kept in memory
+        """
+        root = None
+        for event, elem in ET.iterparse(route_filename, events=('start', 'end')):
+            if root is None:
+                root = elem
+            elif event == 'end' and elem.tag == 'route':
+                yield elem
+                root.clear()
+
+    @staticmethod
+    def get_route_ids(route_filename, routes_subset=''):
+        """
+        Returns the ids of the routes of the file that are part of the subset, in the order of the file.
+        The route subset can be indicated by single routes separated by commas,
+        or group of routes separated by dashes (or a combination of the two)
+        """
+        route_ids = [route.attrib['id'] for route in RouteParser.iter_route_elements(route_filename)]
+        if not routes_subset:
+            return route_ids
+
+        subset_ids = []
+        subset_groups = routes_subset.replace(" ","").split(',')
+        for group in subset_groups:
+            if "-" in group:
+                # Group of route, iterate from start to end, making sure both ids exist
+                start, end = group.split('-')
+                found_start, found_end = (False, False)
+
+                for route_id in route_ids:
+                    if not found_start and route_id == start:
+                        found_start = True
+                    if not found_start and route_id == end:
+                        raise ValueError(f"Malformed route subset '{group}', found the end id before the starting one")
+                    if not found_end and found_start:
+                        if route_id in subset_ids:
+                            raise ValueError(f"Found a repeated route with id '{route_id}'")
+                        else:
+                            subset_ids.append(route_id)
+                        if route_id == end:
+                            found_end = True
+
+                if not found_start:
+                    raise ValueError(f"Couldn\'t find the route with id '{start}' inside the given routes file")
+                if not found_end:
+                    raise ValueError(f"Couldn\'t find the route with id '{end}' inside the given routes file")
+
+            else:
+                # Just one route, get its id while making sure it exists
+
+                found = False
+                for route_id in route_ids:
+                    if route_id == group:
+                        if route_id in subset_ids:
+                            raise ValueError(f"Found a repeated route with id '{route_id}'")
+                        else:
+                            subset_ids.append(route_id)
+                        found = True
+
+                if not found:
+                    raise ValueError(f"Couldn't find the route with id '{group}' inside the given routes file")
+
+        return [route_id for route_id in route_ids if route_id in subset_ids]
+
+    @staticmethod
+    def parse_route(route):
+        """
+        Returns the route configuration of a route element
+        """
+        route_id = route.attrib['id']
+
+        route_config = RouteScenarioConfiguration()
+        route_config.town = route.attrib['town']
+        route_config.name = "RouteScenario_{}".format(route_id)
+        route_config.weather = RouteParser.parse_weather(route)
+
+        # The list of carla.Location that serve as keypoints on this route
+        positions = []
+        for position in route.find('waypoints').iter('position'):
+            positions.append(carla.Location(x=float(position.attrib['x']),
+                                            y=float(position.attrib['y']),
+                                            z=float(position.attrib['z'])))
+        route_config.keypoints = positions
+
+        # The list of ScenarioConfigurations that store the scenario's data
+        scenario_configs = []
+        for scenario in route.find('scenarios').iter('scenario'):
+            scenario_config = ScenarioConfiguration()
+            scenario_config.name = scenario.attrib.get('name')
+            scenario_config.type = scenario.attrib.get('type')
+
+            for elem in scenario:
+                if elem.tag == 'trigger_point':
+                    scenario_config.trigger_points.append(convert_elem_to_transform(elem))
+                elif elem.tag == 'other_actor':
+                    scenario_config.other_actors.append(ActorConfigurationData.parse_from_node(elem, 'scenario'))
                 else:
-                    # Just one route, get its id while making sure it exists
-
-                    found = False
-                    for route in tree.iter("route"):
-                        route_id = route.attrib['id']
-                        if route_id == group:
-                            if route_id in subset_ids:
-                                raise ValueError(f"Found a repeated route with id '{route_id}'")
-                            else:
-                                subset_ids.append(route_id)
-                            found = True
-
-                    if not found:
-                        raise ValueError(f"Couldn't find the route with id '{group}' inside the given routes file")
-
-            subset_ids.sort(key=lambda k: int(k))
-            return subset_ids
-
-        route_configs = []
-        tree = ET.parse(route_filename)
-        if routes_subset:
-            subset_list = get_routes_subset()
-        for route in tree.iter("route"):
-
-            route_id = route.attrib['id']
-            if routes_subset and route_id not in subset_list:
-                continue
-
-            route_config = RouteScenarioConfiguration()
-            route_config.town = route.attrib['town']
-            route_config.name = "RouteScenario_{}".format(route_id)
-            route_config.weather = RouteParser.parse_weather(route)
-
-            # The list of carla.Location that serve as keypoints on this route
-            positions = []
-            for position in route.find('waypoints').iter('position'):
-                positions.append(carla.Location(x=float(position.attrib['x']),
-                                                y=float(position.attrib['y']),
-                                                z=float(position.attrib['z'])))
-            route_config.keypoints = positions
-
-            # The list of ScenarioConfigurations that store the scenario's data
-            scenario_configs = []
-            for scenario in route.find('scenarios').iter('scenario'):
-                scenario_config = ScenarioConfiguration()
-                scenario_config.name = scenario.attrib.get('name')
-                scenario_config.type = scenario.attrib.get('type')
-
-                for elem in scenario.getchildren():
-                    if elem.tag == 'trigger_point':
-                        scenario_config.trigger_points.append(convert_elem_to_transform(elem))
-                    elif elem.tag == 'other_actor':
-                        scenario_config.other_actors.append(ActorConfigurationData.parse_from_node(elem, 'scenario'))
-                    else:
-                        scenario_config.other_parameters[elem.tag] = elem.attrib
-
-                scenario_configs.append(scenario_config)
-            route_config.scenario_configs = scenario_configs
-
-            route_configs.append(route_config)
-
-        return route_configs
+                    scenario_config.other_parameters[elem.tag] = elem.attrib
+
+            scenario_configs.append(scenario_config)
+        route_config.scenario_configs = scenario_configs
+
+        return route_config
 
     @staticmethod
     def parse_weather(route):
@@ -175,22 +202,46 @@ class RouteParser(object):
     def is_scenario_at_route(trigger_transform, route):
         """
         Check if the scenario is affecting the route.
-        This is true if the trigger position is very close to any route point
+        This is true if the trigger position is very close to any route point.
+        To check several triggers of the same route, use a RouteIndex
+        """
+        return RouteIndex(route).are_triggers_at_route([trigger_transform])[0]
+
+
+class RouteIndex(object):
+
+    """
+    Spatial index of the transforms of a route, used to check which scenario triggers are part of it
+    """
+
+    def __init__(self, route):
+        locations = np.array([[transform.location.x, transform.location.y, transform.location.z]
+                              for transform, _ in route], dtype=float).reshape(-1, 3)
+        self._heights = locations[:, 2]
+        self._yaws = np.array([transform.rotation.yaw for transform, _ in route], dtype=float)
+        self._tree = cKDTree(locations[:, :2])
+
+    def are_triggers_at_route(self, trigger_transforms):
+        """
+        Returns, for each trigger transform, whether or not it is very close to any route point,
+        both in position and orientation (see DIST_THRESHOLD and ANGLE_THRESHOLD)
         """
-        def is_trigger_close(trigger_transform, route_transform):
-            """Check if the two transforms are similar"""
-            dx = trigger_transform.location.x - route_transform.location.x
-            dy = trigger_transform.location.y - route_transform.location.y
-            dz = trigger_transform.location.z - route_transform.location.z
-            dpos = math.sqrt(dx * dx + dy * dy)
+        if not trigger_transforms or not len(self._yaws):
+            return [False] * len(trigger_transforms)
 
-            dyaw = (float(trigger_transform.rotation.yaw) - route_transform.rotation.yaw) % 360
+        triggers = np.array([[t.location.x, t.location.y, t.location.z, float(t.rotation.yaw)]
+                             for t in trigger_transforms], dtype=float)
+        candidates = self._tree.query_ball_point(triggers[:, :2], r=DIST_THRESHOLD)
 
-            return dz < DIST_THRESHOLD and dpos < DIST_THRESHOLD \
-                and (dyaw < ANGLE_THRESHOLD or dyaw > (360 - ANGLE_THRESHOLD))
+        results = []
+        for trigger, indices in zip(triggers, candidates):
+            indices = np.asarray(indices, dtype=int)
+            dpos = np.hypot(trigger[0] - self._tree.data[indices, 0], trigger[1] - self._tree.data[indices, 1])
+            dz = trigger[2] - self._heights[indices]
+            dyaw = np.mod(trigger[3] - self._yaws[indices], 360)
 
-        for route_transform, _ in route:
-            if is_trigger_close(trigger_transform, route_transform):
-                return True
+            is_close = (dz < DIST_THRESHOLD) & (dpos < DIST_THRESHOLD) \
+                & ((dyaw < ANGLE_THRESHOLD) | (dyaw > (360 - ANGLE_THRESHOLD)))
+            results.append(bool(is_close.any()))
 
-        return False
+        return results
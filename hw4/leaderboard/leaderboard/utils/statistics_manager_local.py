@@ -210,8 +210,12 @@ class StatisticsManager(object):
         if data:
             route_records = dictor(data, '_checkpoint.records')
             if route_records:
-                for record in route_records:
-                    self._results.checkpoint.records.append(to_route_record(record))
+                self.add_records(route_records)
+
+    def add_records(self, route_records):
+        """Saves a list of records, given as dictionaries, onto the statistics manager"""
+        for record in route_records:
+            self._results.checkpoint.records.append(to_route_record(record))
 
     def clear_records(self):
         """Cleanes up the file"""
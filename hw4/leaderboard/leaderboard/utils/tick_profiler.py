@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Profiling of the ticks of the routes.
+
+TickProfiler records the wall time of the phases of ScenarioManager._tick_scenario, of the agent stages
+and of the update() of every behavior and criterion of the scenario tree. Each time is added to a histogram
+with logarithmic bins, so that the memory and the cost of a sample don't grow with the route length.
+The histograms of each route are saved to a compressed npz, and running this module merges the files of a
+run and reports the slowest entries of each category:
+
+    python leaderboard/utils/tick_profiler.py <profile dir> [--top 10] [--by-class]
+"""
+
+from __future__ import print_function
+
+import argparse
+import contextlib
+import functools
+import glob
+import math
+import os
+import time
+
+import numpy as np
+
+PROFILE_VERSION = 1
+CATEGORIES = ('phase', 'agent', 'behavior', 'criterion')
+
+# Histogram bins, from 0.1us to 100s, plus one for smaller and one for larger times
+BINS_PER_DECADE = 10
+MIN_EXPONENT = -7
+MAX_EXPONENT = 2
+NUM_BINS = (MAX_EXPONENT - MIN_EXPONENT) * BINS_PER_DECADE + 2
+
+_active_profiler = None
+
+
+def get_bin(duration):
+    """Returns the histogram bin of a duration, in seconds"""
+    if duration <= 0:
+        return 0
+    index = int((math.log10(duration) - MIN_EXPONENT) * BINS_PER_DECADE) + 1
+    return min(max(index, 0), NUM_BINS - 1)
+
+
+def get_bin_upper_edges():
+    """Returns the upper edge of each histogram bin, in seconds"""
+    edges = 10.0 ** (MIN_EXPONENT + np.arange(NUM_BINS) / BINS_PER_DECADE)
+    edges[-1] = np.inf
+    return edges
+
+
+def get_profiler():
+    """Returns the profiler of the running route, or None if it isn't being profiled"""
+    return _active_profiler
+
+
+@contextlib.contextmanager
+def time_stage(name):
+    """
+    Times a stage of the agent, if the route is being profiled. To be used by the agents, i.e.:
+
+        with time_stage('perception'):
+            ...
+    """
+    profiler = _active_profiler
+    if profiler is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.record('agent', name, time.perf_counter() - start)
+
+
+class TickProfiler(object):
+
+    """
+    Records the durations of the ticks of a route. A disabled profiler ignores all calls,
+    so that the scenario manager can always use one
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.ticks = 0
+        self._stats = {}  # (category, name) -> [count, total, max, histogram]
+        self._last_lap = 0.0
+        self._tick_start = 0.0
+
+        self._timed_nodes = set()
+        self._criterion_class = None
+        self._patched_classes = {}
+        self._patched_agent = []
+
+    def record(self, category, name, duration):
+        """Adds a duration, in seconds, to the histogram of an entry"""
+        stats = self._stats.get((category, name))
+        if stats is None:
+            stats = [0, 0.0, 0.0, [0] * NUM_BINS]
+            self._stats[(category, name)] = stats
+        stats[0] += 1
+        stats[1] += duration
+        if duration > stats[2]:
+            stats[2] = duration
+        stats[3][get_bin(duration)] += 1
+
+    def start_tick(self):
+        """Starts timing a tick, and its first phase"""
+        if self.enabled:
+            self._tick_start = self._last_lap = time.perf_counter()
+
+    def lap(self, phase):
+        """Ends the current phase of the tick, and starts the next one"""
+        if self.enabled:
+            now = time.perf_counter()
+            self.record('phase', phase, now - self._last_lap)
+            self._last_lap = now
+
+    def end_tick(self):
+        """Records the whole duration of the tick"""
+        if self.enabled:
+            self.ticks += 1
+            self.record('phase', 'tick', time.perf_counter() - self._tick_start)
+
+    def install(self, agent=None):
+        """
+        Times the update() of all the py_trees behaviors, by wrapping the method of their classes,
+        and the sensor data and run_step of the agent. Undone by 'uninstall'
+        """
+        global _active_profiler  # pylint: disable=global-statement
+        if not self.enabled:
+            return
+        _active_profiler = self
+
+        # Imported here, so that the report doesn't need the simulator packages
+        import py_trees
+        from srunner.scenariomanager.scenarioatomics.atomic_criteria import Criterion
+        self._criterion_class = Criterion
+
+        classes = [py_trees.behaviour.Behaviour]
+        while classes:
+            cls = classes.pop()
+            classes.extend(cls.__subclasses__())
+            if 'update' in cls.__dict__ and cls not in self._patched_classes:
+                self._patched_classes[cls] = cls.__dict__['update']
+                cls.update = self._wrap_update(cls.__dict__['update'])
+
+        if agent is not None:
+            for stage, owner, method in (('sensor_data', getattr(agent, 'sensor_interface', None), 'get_data'),
+                                         ('run_step', agent, 'run_step')):
+                if owner is not None and hasattr(owner, method):
+                    setattr(owner, method, self._wrap_agent_stage(stage, getattr(owner, method)))
+                    self._patched_agent.append((owner, method))
+
+    def uninstall(self):
+        """Restores the methods wrapped by 'install'"""
+        global _active_profiler  # pylint: disable=global-statement
+        if _active_profiler is self:
+            _active_profiler = None
+
+        for cls, update in self._patched_classes.items():
+            cls.update = update
+        self._patched_classes = {}
+
+        for owner, method in self._patched_agent:
+            owner.__dict__.pop(method, None)
+        self._patched_agent = []
+        self._timed_nodes = set()
+
+    def _wrap_update(self, update):
+        """Returns the update method, timed per node"""
+        profiler = self
+
+        @functools.wraps(update)
+        def timed_update(node):
+            node_id = id(node)
+            if node_id in profiler._timed_nodes:
+                # Called through super() by the update of a subclass, which is already timed
+                return update(node)
+
+            profiler._timed_nodes.add(node_id)
+            start = time.perf_counter()
+            try:
+                return update(node)
+            finally:
+                duration = time.perf_counter() - start
+                profiler._timed_nodes.discard(node_id)
+                category = 'criterion' if isinstance(node, profiler._criterion_class) else 'behavior'
+                class_name = type(node).__name__
+                name = class_name if node.name == class_name else '{}({})'.format(class_name, node.name)
+                profiler.record(category, name, duration)
+
+        return timed_update
+
+    def _wrap_agent_stage(self, stage, method):
+        """Returns the bound method of the agent, timed as the given stage"""
+        profiler = self
+
+        @functools.wraps(method)
+        def timed_method(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                profiler.record('agent', stage, time.perf_counter() - start)
+
+        return timed_method
+
+    def save(self, path):
+        """Saves the histograms to a compressed npz"""
+        if not self.enabled:
+            return
+        keys = sorted(self._stats)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(
+            path,
+            version=PROFILE_VERSION,
+            ticks=self.ticks,
+            categories=np.array([category for category, _ in keys], dtype=str),
+            names=np.array([name for _, name in keys], dtype=str),
+            counts=np.array([self._stats[key][0] for key in keys], dtype=np.int64),
+            totals=np.array([self._stats[key][1] for key in keys], dtype=np.float64),
+            maxs=np.array([self._stats[key][2] for key in keys], dtype=np.float64),
+            histograms=np.array([self._stats[key][3] for key in keys], dtype=np.int64).reshape(-1, NUM_BINS))
+
+
+def load_profiles(paths, by_class=False):
+    """
+    Merges the profiles saved by TickProfiler.save. Returns the amount of ticks and
+    a dictionary of (category, name) -> [count, total, max, histogram]
+    """
+    ticks = 0
+    stats = {}
+    for path in paths:
+        with np.load(path) as data:
+            if data['version'] != PROFILE_VERSION:
+                print("WARNING: Ignoring the profile {} of another version".format(path))
+                continue
+            ticks += int(data['ticks'])
+            for category, name, count, total, max_, histogram in zip(
+                    data['categories'].tolist(), data['names'].tolist(), data['counts'].tolist(),
+                    data['totals'].tolist(), data['maxs'].tolist(), data['histograms']):
+                if by_class:
+                    name = name.split('(')[0]
+                entry = stats.get((category, name))
+                if entry is None:
+                    stats[(category, name)] = [count, total, max_, histogram.copy()]
+                else:
+                    entry[0] += count
+                    entry[1] += total
+                    entry[2] = max(entry[2], max_)
+                    entry[3] += histogram
+    return ticks, stats
+
+
+def get_percentile(histogram, percentile):
+    """Returns the upper edge of the bin that holds the given percentile of the histogram, in seconds"""
+    cumulative = np.cumsum(histogram)
+    index = np.searchsorted(cumulative, percentile / 100.0 * cumulative[-1])
+    return get_bin_upper_edges()[min(index, NUM_BINS - 1)]
+
+
+def print_report(ticks, stats, top=10):
+    """Prints the entries of each category with the largest total time"""
+    tick_total = stats.get(('phase', 'tick'), [0, 0.0])[1]
+    print("{} ticks, {:.1f}s".format(ticks, tick_total))
+
+    for category in CATEGORIES:
+        entries = sorted(((name, value) for (c, name), value in stats.items() if c == category),
+                         key=lambda entry: entry[1][1], reverse=True)
+        if not entries:
+            continue
+
+        print("\n{} (slowest {} of {})".format(category.upper(), min(top, len(entries)), len(entries)))
+        print("{:<48} {:>9} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}".format(
+            'name', 'calls', 'total s', 'tick %', 'mean ms', 'p50 ms', 'p95 ms', 'max ms'))
+        for name, (count, total, max_, histogram) in entries[:top]:
+            print("{:<48} {:>9d} {:>9.2f} {:>7.1f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}".format(
+                name[:48], count, total, 100.0 * total / tick_total if tick_total else 0.0,
+                1000.0 * total / count, 1000.0 * min(get_percentile(histogram, 50), max_),
+                1000.0 * min(get_percentile(histogram, 95), max_), 1000.0 * max_))
+
+
+def main():
+    """
+    Reports the slowest phases, agent stages, behaviors and criteria of the profiled routes
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('profiles', nargs='+',
+                        help='Profile files, or folders with them (i.e. the --profile-dir of the evaluation)')
+    parser.add_argument('--top', default=10, type=int,
+                        help='Number of entries shown per category (default: 10)')
+    parser.add_argument('--by-class', action='store_true',
+                        help='Merge the behaviors and criteria of the same class')
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.profiles:
+        paths += sorted(glob.glob(os.path.join(path, '*.npz'))) if os.path.isdir(path) else [path]
+    if not paths:
+        parser.error("No profiles found")
+
+    ticks, stats = load_profiles(paths, args.by_class)
+    print_report(ticks, stats, args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,10 @@ from argparse import RawTextHelpFormatter
 
 import carla
 from srunner.metrics.tools.metrics_log import MetricsLog
+from srunner.metrics.tools.metrics_parser import (MetricsParser,
+                                                  get_metrics_cache_file,
+                                                  load_metrics_cache,
+                                                  save_metrics_cache)
 
 
 class MetricsManager(object):
@@ -42,24 +46,25 @@ class MetricsManager(object):
         self._args = args
 
         # Parse the arguments
-        recorder_str = self._get_recorder(self._args.log)
+        recorder_info = self._get_recorder(self._args.log)
         criteria_dict = self._get_criteria(self._args.criteria)
 
+        # Instanciate the MetricsLog, used to querry the needed information
+        log = MetricsLog(recorder_info)
+
         # Get the correct world and load it
-        map_name = self._get_recorder_map(recorder_str)
+        map_name = log.get_map_name()
         world = self._client.load_world(map_name)
         town_map = world.get_map()
 
-        # Instanciate the MetricsLog, used to querry the needed information
-        log = MetricsLog(recorder_str)
-
         # Read and run the metric class
         metric_class = self._get_metric_class(self._args.metric)
         metric_class(town_map, log, criteria_dict)
 
     def _get_recorder(self, log):
         """
-        Parses the log argument into readable information
+        Parses the log argument into readable information. The parsed recorder is cached
+        next to the log file, so that it is only parsed again if the log changes
         """
 
         # Get the log information.
@@ -74,9 +79,14 @@ class MetricsManager(object):
             print("ERROR: The specified log file does not exist")
             sys.exit(-1)
 
-        recorder_str = self._client.show_recorder_file_info(recorder_file, True)
+        cache_file = get_metrics_cache_file(recorder_file)
+        recorder_info = load_metrics_cache(cache_file, recorder_file)
+        if recorder_info is None:
+            recorder_str = self._client.show_recorder_file_info(recorder_file, True)
+            recorder_info = MetricsParser(recorder_str).parse_recorder_info()
+            save_metrics_cache(cache_file, *recorder_info)
 
-        return recorder_str
+        return recorder_info
 
     def _get_criteria(self, criteria_file):
         """
@@ -113,16 +123,6 @@ class MetricsManager(object):
         print("No child class of BasicMetric was found ... Exiting")
         sys.exit(-1)
 
-    def _get_recorder_map(self, recorder_str):
-        """
-        Returns the name of the map the simulation took place in
-        """
-
-        header = recorder_str.split("\n")
-        sim_map = header[1][5:]
-
-        return sim_map
-
 
 def main():
     """
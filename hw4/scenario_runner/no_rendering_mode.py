@@ -53,12 +53,18 @@ except IndexError:
 import carla
 from carla import TrafficLightState as tls
 
+from srunner.tools.map_cache import MAP_CACHE_DIR, get_map_id
+
 import argparse
 import logging
 import datetime
 import weakref
 import math
 import random
+import json
+from collections import OrderedDict
+
+import numpy as np
 
 try:
     import pygame
@@ -149,6 +155,10 @@ HERO_DEFAULT_SCALE = 1.0
 
 PIXELS_AHEAD_VEHICLE = 150
 
+# Size, in pixels, of the tiles of the map image, and maximum amount of them kept in memory
+MAP_TILE_SIZE = 512
+MAP_MAX_LOADED_TILES = 256
+
 # ==============================================================================
 # -- Util -----------------------------------------------------------
 # ==============================================================================
@@ -183,6 +193,33 @@ class Util(object):
         t.transform(corners)
         return corners
 
+    @staticmethod
+    def transform_points(transforms, points):
+        """
+        Vectorized version of carla.Transform.transform, for 2D points (z=0) in the top view.
+        Each of the N transforms is applied to its own K points, given as an array (N, K, 2)
+        """
+        params = np.array([[t.location.x, t.location.y, t.rotation.pitch, t.rotation.yaw, t.rotation.roll]
+                           for t in transforms], dtype=float).reshape(-1, 5)
+        location_x, location_y = params[:, 0:1], params[:, 1:2]
+        cp, sp = np.cos(np.radians(params[:, 2:3])), np.sin(np.radians(params[:, 2:3]))
+        cy, sy = np.cos(np.radians(params[:, 3:4])), np.sin(np.radians(params[:, 3:4]))
+        cr, sr = np.cos(np.radians(params[:, 4:5])), np.sin(np.radians(params[:, 4:5]))
+
+        x, y = points[..., 0], points[..., 1]
+        world_x = location_x + x * cp * cy + y * (cy * sp * sr - sy * cr)
+        world_y = location_y + x * cp * sy + y * (sy * sp * sr + cy * cr)
+        return np.stack([world_x, world_y], axis=-1)
+
+    @staticmethod
+    def get_visible(surface, pixels, margin=0):
+        """Returns which of the groups of pixels (N, K, 2) touch the clipping area of the surface"""
+        clip = surface.get_clip()
+        min_pixels = pixels.min(axis=1)
+        max_pixels = pixels.max(axis=1)
+        return (max_pixels[:, 0] >= clip.left - margin) & (min_pixels[:, 0] < clip.right + margin) \
+            & (max_pixels[:, 1] >= clip.top - margin) & (min_pixels[:, 1] < clip.bottom + margin)
+
 # ==============================================================================
 # -- ModuleManager -------------------------------------------------------------
 # ==============================================================================
@@ -432,6 +469,14 @@ class TrafficLightSurfaces(object):
 
 
 class MapImage(object):
+    """
+    Image of the town. It is drawn once per map and pixels per meter, and saved to the map cache as a
+    pyramid of tiles, each level being half the size of the previous one. When rendering, only the
+    tiles visible at the current scale are loaded and scaled, from the closest level to that scale.
+    """
+
+    CACHE_VERSION = 1
+
     def __init__(self, carla_world, carla_map, pixels_per_meter, show_triggers, show_connections, show_spawn_points):
         self._pixels_per_meter = pixels_per_meter
         self.scale = 1.0
@@ -439,6 +484,43 @@ class MapImage(object):
         self.show_connections = show_connections
         self.show_spawn_points = show_spawn_points
 
+        flags = ''.join(flag for flag, show in (('t', show_triggers), ('c', show_connections), ('s', show_spawn_points))
+                        if show)
+        self._cache_dir = os.path.join(MAP_CACHE_DIR, 'no_rendering_map', '{}_{}{}'.format(
+            get_map_id(carla_map), pixels_per_meter, '_' + flags if flags else ''))
+        self._tiles = OrderedDict()  # (level, row, column) -> surface, the least recently used first
+        self._scaled_tiles = {}  # (level, row, column) -> surface at the current scale
+        self._keep_tiles = False  # Tiles that couldn't be saved can't be released
+
+        metadata = self._load_metadata()
+        if metadata is None:
+            metadata = self._build_tiles(carla_world, carla_map)
+
+        self.width = metadata['width']
+        self._world_offset = tuple(metadata['world_offset'])
+        self.width_in_pixels = metadata['width_in_pixels']
+        self._level_widths = metadata['level_widths']
+
+    def _get_tile_path(self, level, row, column):
+        return os.path.join(self._cache_dir, 'level_{}'.format(level), '{}_{}.png'.format(row, column))
+
+    def _load_metadata(self):
+        """Returns the metadata of the cached tiles, or None if they don't exist"""
+        path = os.path.join(self._cache_dir, 'metadata.json')
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as fd:
+                metadata = json.load(fd)
+        except (OSError, ValueError) as e:
+            logging.warning('Ignoring the corrupted map tiles %s: %s', path, e)
+            return None
+        if metadata.get('version') != self.CACHE_VERSION or metadata.get('tile_size') != MAP_TILE_SIZE:
+            return None
+        return metadata
+
+    def _build_tiles(self, carla_world, carla_map):
+        """Draws the whole town and splits it into the tiles of all the levels, saving them to the cache"""
         waypoints = carla_map.generate_waypoints(2)
         margin = 50
         max_x = max(waypoints, key=lambda x: x.transform.location.x).transform.location.x + margin
@@ -451,9 +533,112 @@ class MapImage(object):
 
         width_in_pixels = int(self._pixels_per_meter * self.width)
 
-        self.big_map_surface = pygame.Surface((width_in_pixels, width_in_pixels)).convert()
-        self.draw_road_map(self.big_map_surface, carla_world, carla_map, self.world_to_pixel, self.world_to_pixel_width)
-        self.surface = self.big_map_surface
+        level_surface = pygame.Surface((width_in_pixels, width_in_pixels)).convert()
+        self.draw_road_map(level_surface, carla_world, carla_map, self.world_to_pixel, self.world_to_pixel_width)
+
+        level_widths = []
+        saved = True
+        while True:
+            level = len(level_widths)
+            level_width = level_surface.get_width()
+            level_widths.append(level_width)
+            for row in range(int(math.ceil(level_width / float(MAP_TILE_SIZE)))):
+                for column in range(int(math.ceil(level_width / float(MAP_TILE_SIZE)))):
+                    rect = pygame.Rect(column * MAP_TILE_SIZE, row * MAP_TILE_SIZE, MAP_TILE_SIZE, MAP_TILE_SIZE)
+                    tile = level_surface.subsurface(rect.clip(level_surface.get_rect())).copy()
+                    self._tiles[(level, row, column)] = tile
+                    saved = saved and self._save_tile(tile, self._get_tile_path(level, row, column))
+
+            if level_width <= MAP_TILE_SIZE:
+                break
+            level_width = max(1, level_width // 2)
+            level_surface = pygame.transform.smoothscale(level_surface, (level_width, level_width))
+
+        metadata = {
+            'version': self.CACHE_VERSION,
+            'tile_size': MAP_TILE_SIZE,
+            'width': self.width,
+            'world_offset': self._world_offset,
+            'width_in_pixels': width_in_pixels,
+            'level_widths': level_widths
+        }
+        if saved:
+            tmp_path = os.path.join(self._cache_dir, 'metadata.json.{}.tmp'.format(os.getpid()))
+            try:
+                with open(tmp_path, 'w') as fd:
+                    json.dump(metadata, fd)
+                os.replace(tmp_path, os.path.join(self._cache_dir, 'metadata.json'))
+            except OSError as e:
+                logging.warning("Couldn't save the map tiles to %s: %s", self._cache_dir, e)
+                saved = False
+
+        self._keep_tiles = not saved
+        while not self._keep_tiles and len(self._tiles) > MAP_MAX_LOADED_TILES:
+            self._tiles.popitem(last=False)
+        return metadata
+
+    @staticmethod
+    def _save_tile(tile, path):
+        """Saves a tile, returning whether or not it succeeded"""
+        tmp_path = '{}.{}.tmp.png'.format(path[:-4], os.getpid())
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            pygame.image.save(tile, tmp_path)
+            os.replace(tmp_path, path)
+        except (OSError, pygame.error) as e:
+            logging.warning("Couldn't save the map tile %s: %s", path, e)
+            return False
+        return True
+
+    def _get_tile(self, level, row, column):
+        """Returns a tile, loading it from the cache if needed"""
+        key = (level, row, column)
+        tile = self._tiles.get(key)
+        if tile is None:
+            tile = pygame.image.load(self._get_tile_path(level, row, column)).convert()
+            self._tiles[key] = tile
+            if not self._keep_tiles and len(self._tiles) > MAP_MAX_LOADED_TILES:
+                self._tiles.popitem(last=False)
+        else:
+            self._tiles.move_to_end(key)
+        return tile
+
+    def blit_visible(self, surface, rect):
+        """Blits the parts of the map inside 'rect', given in pixels at the current scale"""
+        # Closest level with more resolution than the current scale
+        level = int(math.floor(math.log(1.0 / self.scale, 2) + 1e-6)) if self.scale < 1.0 else 0
+        level = min(level, len(self._level_widths) - 1)
+        level_width = self._level_widths[level]
+        factor = self.scale * self.width_in_pixels / float(level_width)  # From level pixels to scaled ones
+        scaled_tile_size = MAP_TILE_SIZE * factor
+        n_tiles = int(math.ceil(level_width / float(MAP_TILE_SIZE)))
+
+        first_column = max(0, int(rect.left // scaled_tile_size))
+        last_column = min(n_tiles - 1, int((rect.right - 1) // scaled_tile_size))
+        first_row = max(0, int(rect.top // scaled_tile_size))
+        last_row = min(n_tiles - 1, int((rect.bottom - 1) // scaled_tile_size))
+
+        if len(self._scaled_tiles) > MAP_MAX_LOADED_TILES:
+            self._scaled_tiles.clear()
+
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                x = int(round(column * scaled_tile_size))
+                y = int(round(row * scaled_tile_size))
+                key = (level, row, column)
+                scaled_tile = self._scaled_tiles.get(key)
+                if scaled_tile is None:
+                    tile = self._get_tile(level, row, column)
+                    # Computed from the tile borders so that there are no gaps between tiles
+                    width = int(round((column * MAP_TILE_SIZE + tile.get_width()) * factor)) - x
+                    height = int(round((row * MAP_TILE_SIZE + tile.get_height()) * factor)) - y
+                    if (width, height) == tile.get_size():
+                        scaled_tile = tile
+                    else:
+                        scaled_tile = pygame.transform.smoothscale(tile, (max(1, width), max(1, height)))
+                    self._scaled_tiles[key] = scaled_tile
+                surface.blit(scaled_tile, (x, y))
 
     def draw_road_map(self, map_surface, carla_world, carla_map, world_to_pixel, world_to_pixel_width):
         map_surface.fill(COLOR_ALUMINIUM_4)
@@ -765,14 +950,18 @@ class MapImage(object):
         y = self.scale * self._pixels_per_meter * (location.y - self._world_offset[1])
         return [int(x - offset[0]), int(y - offset[1])]
 
+    def world_to_pixel_array(self, points):
+        """Vectorized world_to_pixel of an array (..., 2) of world positions"""
+        points = np.asarray(points, dtype=float)
+        return (self.scale * self._pixels_per_meter * (points - np.asarray(self._world_offset))).astype(int)
+
     def world_to_pixel_width(self, width):
         return int(self.scale * self._pixels_per_meter * width)
 
     def scale_map(self, scale):
         if scale != self.scale:
             self.scale = scale
-            width = int(self.big_map_surface.get_width() * self.scale)
-            self.surface = pygame.transform.smoothscale(self.big_map_surface, (width, width))
+            self._scaled_tiles.clear()
 
 
 class ModuleWorld(object):
@@ -809,6 +998,10 @@ class ModuleWorld(object):
         self.traffic_light_surfaces = TrafficLightSurfaces()
         self.affected_traffic_light = None
 
+        # Data of the actors that doesn't change during their lifetime, by actor id
+        self._actors_info = {}
+        self._speed_limit_fonts = {}
+
         # Map info
         self.map_image = None
         self.border_round_surface = None
@@ -850,13 +1043,13 @@ class ModuleWorld(object):
         self.module_input = module_manager.get_module(MODULE_INPUT)
 
         self.original_surface_size = min(self.module_hud.dim[0], self.module_hud.dim[1])
-        self.surface_size = self.map_image.big_map_surface.get_width()
+        self.surface_size = self.map_image.width_in_pixels
 
         self.scaled_size = int(self.surface_size)
         self.prev_scaled_size = int(self.surface_size)
 
         # Render Actors
-        self.actors_surface = pygame.Surface((self.map_image.surface.get_width(), self.map_image.surface.get_height()))
+        self.actors_surface = pygame.Surface((self.surface_size, self.surface_size))
         self.actors_surface.set_colorkey(COLOR_BLACK)
 
         self.vehicle_id_surface = pygame.Surface((self.surface_size, self.surface_size)).convert()
@@ -913,11 +1106,53 @@ class ModuleWorld(object):
 
     def tick(self, clock):
         actors = self.world.get_actors()
-        self.actors_with_transforms = [(actor, actor.get_transform()) for actor in actors]
+        transforms = {actor_snapshot.id: actor_snapshot.get_transform() for actor_snapshot in self.world.get_snapshot()}
+
+        self.actors_with_transforms = []
+        actors_info = {}
+        for actor in actors:
+            transform = transforms.get(actor.id)
+            if transform is None:
+                transform = actor.get_transform()
+            self.actors_with_transforms.append((actor, transform))
+            actors_info[actor.id] = self._actors_info.get(actor.id) or self._get_actor_info(actor)
+        self._actors_info = actors_info
+
         if self.hero_actor is not None:
-            self.hero_transform = self.hero_actor.get_transform()
+            self.hero_transform = transforms.get(self.hero_actor.id)
+            if self.hero_transform is None:
+                self.hero_transform = self.hero_actor.get_transform()
         self.update_hud_info(clock)
 
+    @staticmethod
+    def _get_actor_info(actor):
+        """Returns the data of the actor needed to render it, which doesn't change during its lifetime"""
+        type_id = actor.type_id
+        info = {'type': None}
+        if 'vehicle' in type_id:
+            info['type'] = 'vehicle'
+            bb = actor.bounding_box.extent
+            info['extent'] = (bb.x, bb.y)
+            info['color'] = COLOR_SKY_BLUE_0
+            if int(actor.attributes['number_of_wheels']) == 2:
+                info['color'] = COLOR_CHOCOLATE_1
+            if actor.attributes['role_name'] == 'hero':
+                info['color'] = COLOR_CHAMELEON_0
+        elif 'traffic_light' in type_id:
+            info['type'] = 'traffic_light'
+            info['trigger_corners'] = [[p.x, p.y] for p in Util.get_bounding_box(actor)]
+            info['trigger_location'] = actor.get_transform().transform(actor.trigger_volume.location)
+            info['trigger_length'] = Util.length(actor.trigger_volume.extent)
+        elif 'speed_limit' in type_id:
+            info['type'] = 'speed_limit'
+            info['trigger_corners'] = [[p.x, p.y] for p in Util.get_bounding_box(actor)]
+            info['limit'] = type_id.split('.')[2]
+        elif 'walker' in type_id:
+            info['type'] = 'walker'
+            bb = actor.bounding_box.extent
+            info['extent'] = (bb.x, bb.y)
+        return info
+
     def update_hud_info(self, clock):
         hero_mode_text = []
         if self.hero_actor is not None:
@@ -978,26 +1213,21 @@ class ModuleWorld(object):
         speed_limits = []
         walkers = []
 
+        actors_by_type = {'vehicle': vehicles, 'traffic_light': traffic_lights,
+                          'speed_limit': speed_limits, 'walker': walkers}
         for actor_with_transform in self.actors_with_transforms:
-            actor = actor_with_transform[0]
-            if 'vehicle' in actor.type_id:
-                vehicles.append(actor_with_transform)
-            elif 'traffic_light' in actor.type_id:
-                traffic_lights.append(actor_with_transform)
-            elif 'speed_limit' in actor.type_id:
-                speed_limits.append(actor_with_transform)
-            elif 'walker' in actor.type_id:
-                walkers.append(actor_with_transform)
+            actor_list = actors_by_type.get(self._actors_info[actor_with_transform[0].id]['type'])
+            if actor_list is not None:
+                actor_list.append(actor_with_transform)
 
         info_text = []
         if self.hero_actor is not None and len(vehicles) > 1:
             location = self.hero_transform.location
-            vehicle_list = [x[0] for x in vehicles if x[0].id != self.hero_actor.id]
-
-            def distance(v): return location.distance(v.get_location())
-            for n, vehicle in enumerate(sorted(vehicle_list, key=distance)):
-                if n > 15:
-                    break
+            vehicle_list = [x for x in vehicles if x[0].id != self.hero_actor.id]
+            positions = np.array([[t.location.x, t.location.y, t.location.z] for _, t in vehicle_list])
+            distances = np.linalg.norm(positions - np.array([location.x, location.y, location.z]), axis=1)
+            for index in np.argsort(distances, kind='stable')[:16]:
+                vehicle = vehicle_list[index][0]
                 vehicle_type = get_actor_display_name(vehicle, truncate=22)
                 info_text.append('% 5d %s' % (vehicle.id, vehicle_type))
         module_manager.get_module(MODULE_HUD).add_info(
@@ -1006,117 +1236,138 @@ class ModuleWorld(object):
 
         return (vehicles, traffic_lights, speed_limits, walkers)
 
-    def _render_traffic_lights(self, surface, list_tl, world_to_pixel):
+    def _get_triggers(self, surface, infos, world_to_pixel_array):
+        """Returns the pixels of the trigger volumes of the static actors, or None for the hidden ones"""
+        if not self.args.show_triggers:
+            return [None] * len(infos)
+        pixels = world_to_pixel_array([info['trigger_corners'] for info in infos])
+        visible = Util.get_visible(surface, pixels, 2)
+        return [corners if is_visible else None for corners, is_visible in zip(pixels.tolist(), visible)]
+
+    def _render_traffic_lights(self, surface, list_tl, world_to_pixel_array):
         self.affected_traffic_light = None
+        if not list_tl:
+            return
 
-        for tl in list_tl:
-            world_pos = tl.get_location()
-            pos = world_to_pixel(world_pos)
+        infos = [self._actors_info[tl[0].id] for tl in list_tl]
+        positions = world_to_pixel_array([[t.location.x, t.location.y] for _, t in list_tl])
+        # Traffic light surfaces are at most 49 pixels high
+        visible = Util.get_visible(surface, positions[:, None], 50)
+        triggers = self._get_triggers(surface, infos, world_to_pixel_array)
 
-            if self.args.show_triggers:
-                corners = Util.get_bounding_box(tl)
-                corners = [world_to_pixel(p) for p in corners]
+        affected = np.zeros(len(list_tl), dtype=bool)
+        if self.hero_actor is not None:
+            hero_location = self.hero_transform.location
+            trigger_locations = np.array([[info['trigger_location'].x, info['trigger_location'].y,
+                                           info['trigger_location'].z] for info in infos])
+            d = np.linalg.norm(trigger_locations - np.array([hero_location.x, hero_location.y, hero_location.z]), axis=1)
+            s = np.array([info['trigger_length'] for info in infos]) + Util.length(self.hero_actor.bounding_box.extent)
+            affected = d <= s
+
+        for (tl, _), pos, is_visible, corners, is_affected in zip(
+                list_tl, positions.tolist(), visible, triggers, affected):
+            if corners is not None:
                 pygame.draw.lines(surface, COLOR_BUTTER_1, True, corners, 2)
 
-            if self.hero_actor is not None:
-                corners = Util.get_bounding_box(tl)
-                corners = [world_to_pixel(p) for p in corners]
-                tl_t = tl.get_transform()
-
-                transformed_tv = tl_t.transform(tl.trigger_volume.location)
-                hero_location = self.hero_actor.get_location()
-                d = hero_location.distance(transformed_tv)
-                s = Util.length(tl.trigger_volume.extent) + Util.length(self.hero_actor.bounding_box.extent)
-                if (d <= s):
-                    # Highlight traffic light
-                    self.affected_traffic_light = tl
+            if is_affected:
+                # Highlight traffic light
+                self.affected_traffic_light = tl
+                if is_visible:
                     srf = self.traffic_light_surfaces.surfaces['h']
                     surface.blit(srf, srf.get_rect(center=pos))
 
-            srf = self.traffic_light_surfaces.surfaces[tl.state]
-            surface.blit(srf, srf.get_rect(center=pos))
+            if is_visible:
+                srf = self.traffic_light_surfaces.surfaces[tl.state]
+                surface.blit(srf, srf.get_rect(center=pos))
 
-    def _render_speed_limits(self, surface, list_sl, world_to_pixel, world_to_pixel_width):
+    def _render_speed_limits(self, surface, list_sl, world_to_pixel_array, world_to_pixel_width):
+        if not list_sl:
+            return
 
         font_size = world_to_pixel_width(2)
         radius = world_to_pixel_width(2)
-        font = pygame.font.SysFont('Arial', font_size)
-
-        for sl in list_sl:
-
-            x, y = world_to_pixel(sl.get_location())
-
-            # Render speed limit
-            white_circle_radius = int(radius * 0.75)
-
-            pygame.draw.circle(surface, COLOR_SCARLET_RED_1, (x, y), radius)
-            pygame.draw.circle(surface, COLOR_ALUMINIUM_0, (x, y), white_circle_radius)
+        if font_size not in self._speed_limit_fonts:
+            self._speed_limit_fonts[font_size] = pygame.font.SysFont('Arial', font_size)
+        font = self._speed_limit_fonts[font_size]
+
+        infos = [self._actors_info[sl[0].id] for sl in list_sl]
+        positions = world_to_pixel_array([[t.location.x, t.location.y] for _, t in list_sl])
+        visible = Util.get_visible(surface, positions[:, None], radius)
+        triggers = self._get_triggers(surface, infos, world_to_pixel_array)
+
+        # Render speed limit
+        white_circle_radius = int(radius * 0.75)
+        font_surfaces = {}
+        for info, (x, y), is_visible, corners in zip(infos, positions.tolist(), visible, triggers):
+            if is_visible:
+                pygame.draw.circle(surface, COLOR_SCARLET_RED_1, (x, y), radius)
+                pygame.draw.circle(surface, COLOR_ALUMINIUM_0, (x, y), white_circle_radius)
+
+            if corners is not None:
+                pygame.draw.lines(surface, COLOR_PLUM_2, True, corners, 2)
 
-            limit = sl.type_id.split('.')[2]
-            font_surface = font.render(limit, True, COLOR_ALUMINIUM_5)
+            if not is_visible:
+                continue
 
-            if self.args.show_triggers:
-                corners = Util.get_bounding_box(sl)
-                corners = [world_to_pixel(p) for p in corners]
-                pygame.draw.lines(surface, COLOR_PLUM_2, True, corners, 2)
+            limit = info['limit']
+            if limit not in font_surfaces:
+                font_surface = font.render(limit, True, COLOR_ALUMINIUM_5)
+                if self.hero_actor is not None:
+                    # Rotate font surface with respect to hero vehicle front
+                    angle = -self.hero_transform.rotation.yaw - 90.0
+                    font_surface = pygame.transform.rotate(font_surface, angle)
+                font_surfaces[limit] = font_surface
+            font_surface = font_surfaces[limit]
 
             # Blit
             if self.hero_actor is not None:
-                # Rotate font surface with respect to hero vehicle front
-                angle = -self.hero_transform.rotation.yaw - 90.0
-                font_surface = pygame.transform.rotate(font_surface, angle)
                 offset = font_surface.get_rect(center=(x, y))
                 surface.blit(font_surface, offset)
-
             else:
                 surface.blit(font_surface, (x - radius / 2, y - radius / 2))
 
-    def _render_walkers(self, surface, list_w, world_to_pixel):
-        for w in list_w:
-            color = COLOR_PLUM_0
-
-            # Compute bounding box points
-            bb = w[0].bounding_box.extent
-            corners = [
-                carla.Location(x=-bb.x, y=-bb.y),
-                carla.Location(x=bb.x, y=-bb.y),
-                carla.Location(x=bb.x, y=bb.y),
-                carla.Location(x=-bb.x, y=bb.y)]
-
-            w[1].transform(corners)
-            corners = [world_to_pixel(p) for p in corners]
-            pygame.draw.polygon(surface, color, corners)
-
-    def _render_vehicles(self, surface, list_v, world_to_pixel):
-
-        for v in list_v:
-            color = COLOR_SKY_BLUE_0
-            if int(v[0].attributes['number_of_wheels']) == 2:
-                color = COLOR_CHOCOLATE_1
-            if v[0].attributes['role_name'] == 'hero':
-                color = COLOR_CHAMELEON_0
-            # Compute bounding box points
-            bb = v[0].bounding_box.extent
-            corners = [carla.Location(x=-bb.x, y=-bb.y),
-                       carla.Location(x=bb.x - 0.8, y=-bb.y),
-                       carla.Location(x=bb.x, y=0),
-                       carla.Location(x=bb.x - 0.8, y=bb.y),
-                       carla.Location(x=-bb.x, y=bb.y),
-                       carla.Location(x=-bb.x, y=-bb.y)
-                       ]
-            v[1].transform(corners)
-            corners = [world_to_pixel(p) for p in corners]
-            pygame.draw.lines(surface, color, False, corners, int(math.ceil(4.0 * self.map_image.scale)))
+    def _render_walkers(self, surface, list_w, world_to_pixel_array):
+        if not list_w:
+            return
+        color = COLOR_PLUM_0
+
+        # Compute bounding box points
+        bb = np.array([self._actors_info[w[0].id]['extent'] for w in list_w])
+        bb_x, bb_y = bb[:, 0:1], bb[:, 1:2]
+        corners = np.stack([np.concatenate([-bb_x, bb_x, bb_x, -bb_x], axis=1),
+                            np.concatenate([-bb_y, -bb_y, bb_y, bb_y], axis=1)], axis=-1)
+
+        pixels = world_to_pixel_array(Util.transform_points([w[1] for w in list_w], corners))
+        for corners, is_visible in zip(pixels.tolist(), Util.get_visible(surface, pixels)):
+            if is_visible:
+                pygame.draw.polygon(surface, color, corners)
+
+    def _render_vehicles(self, surface, list_v, world_to_pixel_array):
+        if not list_v:
+            return
+        infos = [self._actors_info[v[0].id] for v in list_v]
+
+        # Compute bounding box points
+        bb = np.array([info['extent'] for info in infos])
+        bb_x, bb_y = bb[:, 0:1], bb[:, 1:2]
+        corners = np.stack([np.concatenate([-bb_x, bb_x - 0.8, bb_x, bb_x - 0.8, -bb_x, -bb_x], axis=1),
+                            np.concatenate([-bb_y, -bb_y, 0 * bb_y, bb_y, bb_y, -bb_y], axis=1)], axis=-1)
+
+        pixels = world_to_pixel_array(Util.transform_points([v[1] for v in list_v], corners))
+        width = int(math.ceil(4.0 * self.map_image.scale))
+        for info, corners, is_visible in zip(infos, pixels.tolist(), Util.get_visible(surface, pixels, width)):
+            if is_visible:
+                pygame.draw.lines(surface, info['color'], False, corners, width)
 
     def render_actors(self, surface, vehicles, traffic_lights, speed_limits, walkers):
         # Static actors
-        self._render_traffic_lights(surface, [tl[0] for tl in traffic_lights], self.map_image.world_to_pixel)
-        self._render_speed_limits(surface, [sl[0] for sl in speed_limits], self.map_image.world_to_pixel,
+        self._render_traffic_lights(surface, traffic_lights, self.map_image.world_to_pixel_array)
+        self._render_speed_limits(surface, speed_limits, self.map_image.world_to_pixel_array,
                                   self.map_image.world_to_pixel_width)
 
         # Dynamic actors
-        self._render_vehicles(surface, vehicles, self.map_image.world_to_pixel)
-        self._render_walkers(surface, walkers, self.map_image.world_to_pixel)
+        self._render_vehicles(surface, vehicles, self.map_image.world_to_pixel_array)
+        self._render_walkers(surface, walkers, self.map_image.world_to_pixel_array)
 
     def clip_surfaces(self, clipping_rect):
         self.actors_surface.set_clip(clipping_rect)
@@ -1147,7 +1398,6 @@ class ModuleWorld(object):
     def render(self, display):
         if self.actors_with_transforms is None:
             return
-        self.result_surface.fill(COLOR_BLACK)
         vehicles, traffic_lights, speed_limits, walkers = self._split_actors()
 
         scale_factor = self.module_input.wheel_offset
@@ -1155,29 +1405,10 @@ class ModuleWorld(object):
         if self.scaled_size != self.prev_scaled_size:
             self._compute_scale(scale_factor)
 
-        # Render Actors
-
-        self.actors_surface.fill(COLOR_BLACK)
-        self.render_actors(
-            self.actors_surface,
-            vehicles,
-            traffic_lights,
-            speed_limits,
-            walkers)
-
-        # Render Ids
-        self.module_hud.render_vehicles_ids(self.vehicle_id_surface, vehicles,
-                                            self.map_image.world_to_pixel, self.hero_actor, self.hero_transform)
-
-        # Blit surfaces
-        surfaces = ((self.map_image.surface, (0, 0)),
-                    (self.actors_surface, (0, 0)),
-                    (self.vehicle_id_surface, (0, 0)),
-                    )
-
         angle = 0.0 if self.hero_actor is None else self.hero_transform.rotation.yaw + 90.0
         self.traffic_light_surfaces.rotozoom(-angle, self.map_image.scale)
 
+        # Apply clipping rect. Done before rendering the actors, as the ones outside of it are skipped
         center_offset = (0, 0)
         if self.hero_actor is not None:
 
@@ -1195,15 +1426,44 @@ class ModuleWorld(object):
                  hero_front.y *
                  PIXELS_AHEAD_VEHICLE))
 
-            # Apply clipping rect
             clipping_rect = pygame.Rect(translation_offset[0],
                                         translation_offset[1],
                                         self.hero_surface.get_width(),
                                         self.hero_surface.get_height())
-            self.clip_surfaces(clipping_rect)
+        else:
+            # Translation offset
+            translation_offset = (self.module_input.mouse_offset[0] * scale_factor + self.scale_offset[0],
+                                  self.module_input.mouse_offset[1] * scale_factor + self.scale_offset[1])
+            center_offset = (abs(display.get_width() - self.surface_size) / 2 * scale_factor, 0)
+
+            clipping_rect = pygame.Rect(-translation_offset[0] - center_offset[0], -translation_offset[1],
+                                        self.module_hud.dim[0], self.module_hud.dim[1])
+        self.clip_surfaces(clipping_rect)
+        self.result_surface.fill(COLOR_BLACK)
+
+        # Render Actors
+
+        self.actors_surface.fill(COLOR_BLACK)
+        self.render_actors(
+            self.actors_surface,
+            vehicles,
+            traffic_lights,
+            speed_limits,
+            walkers)
+
+        # Render Ids
+        self.module_hud.render_vehicles_ids(self.vehicle_id_surface, vehicles,
+                                            self.map_image.world_to_pixel, self.hero_actor, self.hero_transform)
 
-            Util.blits(self.result_surface, surfaces)
+        # Blit surfaces
+        surfaces = ((self.actors_surface, (0, 0)),
+                    (self.vehicle_id_surface, (0, 0)),
+                    )
+
+        self.map_image.blit_visible(self.result_surface, clipping_rect)
+        Util.blits(self.result_surface, surfaces)
 
+        if self.hero_actor is not None:
             self.border_round_surface.set_clip(clipping_rect)
 
             self.hero_surface.fill(COLOR_ALUMINIUM_4)
@@ -1218,17 +1478,6 @@ class ModuleWorld(object):
 
             display.blit(self.border_round_surface, (0, 0))
         else:
-            # Translation offset
-            translation_offset = (self.module_input.mouse_offset[0] * scale_factor + self.scale_offset[0],
-                                  self.module_input.mouse_offset[1] * scale_factor + self.scale_offset[1])
-            center_offset = (abs(display.get_width() - self.surface_size) / 2 * scale_factor, 0)
-
-            # Apply clipping rect
-            clipping_rect = pygame.Rect(-translation_offset[0] - center_offset[0], -translation_offset[1],
-                                        self.module_hud.dim[0], self.module_hud.dim[1])
-            self.clip_surfaces(clipping_rect)
-            Util.blits(self.result_surface, surfaces)
-
             display.blit(self.result_surface, (translation_offset[0] + center_offset[0],
                                                translation_offset[1]))
 
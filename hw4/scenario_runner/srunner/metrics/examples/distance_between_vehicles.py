@@ -14,7 +14,7 @@ It is meant to serve as an example of how to use the information from
 the recorder
 """
 
-import math
+import numpy as np
 import matplotlib.pyplot as plt
 
 from srunner.metrics.examples.basic_metric import BasicMetric
@@ -35,31 +35,26 @@ class DistanceBetweenVehicles(BasicMetric):
         ego_id = log.get_ego_vehicle_id()
         adv_id = log.get_actor_ids_with_role_name("scenario")[0]  # Could have also used its type_id
 
-        dist_list = []
-        frames_list = []
-
         # Get the frames both actors were alive
         start_ego, end_ego = log.get_actor_alive_frames(ego_id)
         start_adv, end_adv = log.get_actor_alive_frames(adv_id)
         start = max(start_ego, start_adv)
         end = min(end_ego, end_adv)
 
-        # Get the distance between the two
-        for i in range(start, end):
-
-            # Get the transforms
-            ego_location = log.get_actor_transform(ego_id, i).location
-            adv_location = log.get_actor_transform(adv_id, i).location
+        # Get their locations, as (frames, [x, y, z, roll, pitch, yaw]) arrays
+        ego_frames, ego_transforms = log.get_actor_states_array(ego_id, "transform", start, end - 1)
+        adv_frames, adv_transforms = log.get_actor_states_array(adv_id, "transform", start, end - 1)
 
-            # Filter some points for a better graph
-            if adv_location.z < -10:
-                continue
+        # Get the distance between the two at the frames where both are recorded
+        frames, ego_index, adv_index = np.intersect1d(ego_frames, adv_frames, return_indices=True)
+        ego_locations = ego_transforms[ego_index, :3]
+        adv_locations = adv_transforms[adv_index, :3]
 
-            dist_v = ego_location - adv_location
-            dist = math.sqrt(dist_v.x * dist_v.x + dist_v.y * dist_v.y + dist_v.z * dist_v.z)
+        # Filter some points for a better graph
+        valid = adv_locations[:, 2] >= -10
 
-            dist_list.append(dist)
-            frames_list.append(i)
+        dist_list = np.linalg.norm(ego_locations - adv_locations, axis=1)[valid]
+        frames_list = frames[valid]
 
         # Use matplotlib to show the results
         plt.plot(frames_list, dist_list)
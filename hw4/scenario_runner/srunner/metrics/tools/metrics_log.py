@@ -14,21 +14,127 @@ It also provides a series of functions to help the user querry
 specific information
 """
 
+import bisect
 import fnmatch
-from srunner.metrics.tools.metrics_parser import MetricsParser
+
+import numpy as np
+
+import carla
+
+from srunner.metrics.tools.metrics_parser import (MetricsParser,
+                                                  get_traffic_light_state,
+                                                  get_vehicle_lights,
+                                                  parse_physics_control,
+                                                  parse_scene_lights,
+                                                  parse_state_times)
+
+
+def to_location(values):
+    """Converts the (x, y, z) values into a carla.Location"""
+    return carla.Location(x=float(values[0]), y=float(values[1]), z=float(values[2]))
+
+def to_vector(values):
+    """Converts the (x, y, z) values into a carla.Vector3D"""
+    return carla.Vector3D(x=float(values[0]), y=float(values[1]), z=float(values[2]))
+
+def to_transform(values):
+    """Converts the (x, y, z, roll, pitch, yaw) values into a carla.Transform"""
+    return carla.Transform(
+        to_location(values[:3]),
+        carla.Rotation(roll=float(values[3]), pitch=float(values[4]), yaw=float(values[5]))
+    )
+
+def to_control(values):
+    """Converts the (throttle, steer, brake, hand_brake, gear) values into a carla.VehicleControl"""
+    return carla.VehicleControl(
+        throttle=float(values[0]),
+        steer=float(values[1]),
+        brake=float(values[2]),
+        hand_brake=bool(values[3]),
+        reverse=int(values[4]) < 0,
+        manual_gear_shift=False,
+        gear=int(values[4]),
+    )
+
+def to_bounding_box(values):
+    """Converts the (location x, y, z, extent x, y, z) values into a carla.BoundingBox"""
+    return carla.BoundingBox(to_location(values[:3]), to_vector(values[3:]))
+
+
+# Conversion of each actor state from its recorded values
+STATE_CONVERTERS = {
+    "transform": to_transform,
+    "velocity": to_vector,
+    "angular_velocity": to_vector,
+    "acceleration": to_vector,
+    "control": to_control,
+    "state": lambda values: get_traffic_light_state(values[0]),
+    "frozen": lambda values: bool(values[0]),
+    "elapsed_time": lambda values: float(values[0]),
+    "speed": lambda values: float(values[0]),
+    "lights": lambda values: get_vehicle_lights(values[0]),
+}
+
 
 class MetricsLog(object):  # pylint: disable=too-many-public-methods
     """
     Utility class to query the log.
+
+    The actor states are stored as per actor time series (see MetricsParser), so the
+    queries over frame intervals are array slices. Besides the functions returning
+    CARLA objects, 'get_actor_states_array' gives direct access to the arrays,
+    to compute the metrics in a vectorized way.
     """
 
     def __init__(self, recorder):
         """
         Initializes the log class and parses it to extract the dictionaries.
+
+        Args:
+            recorder (str or tuple): string given by the recorder, or the already parsed
+                recorder (see MetricsParser.parse_recorder_info and load_metrics_cache)
         """
         # Parse the information
-        parser = MetricsParser(recorder)
-        self._simulation, self._actors, self._frames = parser.parse_recorder_info()
+        if isinstance(recorder, tuple):
+            info, self._arrays = recorder
+        else:
+            info, self._arrays = MetricsParser(recorder).parse_recorder_info()
+
+        self._simulation = info["simulation"]
+        self._actors = info["actors"]
+        self._events = info["events"]
+
+        self._keys = set(self._arrays.keys())
+        self._loaded_arrays = {}
+
+        self._elapsed_times = self._get_array("frames/elapsed_time")
+        self._delta_times = self._get_array("frames/delta_time")
+        self._platform_times = self._get_array("frames/platform_time")
+        self._alive_ids = self._get_array("alive/ids")
+        self._alive_offsets = self._get_array("alive/offsets")
+
+    def _get_array(self, key):
+        """
+        Returns an array of the log, loading it only once
+        """
+        if key not in self._loaded_arrays:
+            self._loaded_arrays[key] = np.asarray(self._arrays[key]) if key in self._keys else None
+        return self._loaded_arrays[key]
+
+    def _get_last_event(self, event, actor_id, frame):
+        """
+        Returns the value of the last event of an actor at, or before, the given frame.
+        Returns None if there is no such event.
+        """
+        actor_events = self._events[event].get(actor_id)
+        if not actor_events:
+            return None
+
+        index = bisect.bisect_right([event_frame for event_frame, _ in actor_events], frame)
+        if index == 0:
+            return None
+
+        return actor_events[index - 1][1]
 
     ### Functions used to get general info of the simulation ###
     def get_actor_collisions(self, actor_id):
@@ -41,11 +147,8 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         """
         actor_collisions = {}
 
-        for i, frame in enumerate(self._frames):
-            collisions = frame["events"]["collisions"]
-
-            if actor_id in collisions:
-                actor_collisions.update({i: collisions[actor_id]})
+        for frame, other_id in self._events["collisions"].get(actor_id, []):
+            actor_collisions.setdefault(frame - 1, []).append(other_id)
 
         return actor_collisions
 
@@ -61,23 +164,30 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         Returns a float with the elapsed time of a specific frame.
         """
 
-        return self._frames[frame]["frame"]["elapsed_time"]
+        return float(self._elapsed_times[frame])
 
     def get_delta_time(self, frame):
         """
         Returns a float with the delta time of a specific frame.
         """
 
-        return self._frames[frame]["frame"]["delta_time"]
+        return float(self._delta_times[frame])
 
     def get_platform_time(self, frame):
         """
         Returns a float with the platform time time of a specific frame.
         """
 
-        return self._frames[frame]["frame"]["platform_time"]
+        platform_time = float(self._platform_times[frame])
+        return None if np.isnan(platform_time) else platform_time
 
     ### Functions used to get info about the actors ###
+    def get_map_name(self):
+        """
+        Returns the name of the map the simulation took place in.
+        """
+        return self._simulation["map"]
+
     def get_ego_vehicle_id(self):
         """
         Returns the id of the ego vehicle.
@@ -124,7 +234,12 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
             actor_id (int): ID of the actor.
         """
         if actor_id in self._actors:
-            return self._actors[actor_id]
+            attributes = dict(self._actors[actor_id])
+            attributes["location"] = to_location(attributes["location"])
+            for name in ("bounding_box", "trigger_volume"):
+                if name in attributes:
+                    attributes[name] = to_bounding_box(attributes[name])
+            return attributes
 
         return None
 
@@ -138,7 +253,7 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
 
         if actor_id in self._actors:
             if "bounding_box" in self._actors[actor_id]:
-                return self._actors[actor_id]["bounding_box"]
+                return to_bounding_box(self._actors[actor_id]["bounding_box"])
             return None
 
         return None
@@ -153,7 +268,7 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
 
         if traffic_light_id in self._actors:
             if "trigger_volume" in self._actors[traffic_light_id]:
-                return self._actors[traffic_light_id]["trigger_volume"]
+                return to_bounding_box(self._actors[traffic_light_id]["trigger_volume"])
             return None
 
         return None
@@ -180,7 +295,38 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
 
         return None, None
 
+    def get_actor_ids_at_frame(self, frame):
+        """
+        Returns an array with the ids of the actors that are part of the simulation at a given frame.
+        """
+        return self._alive_ids[self._alive_offsets[frame - 1]:self._alive_offsets[frame]]
+
     ### Functions used to get the actor states ###
+    def get_actor_states_array(self, actor_id, state, first_frame=None, last_frame=None):
+        """
+        Given an actor id, returns the time series of the specific variable of that actor
+        during a frame interval, as two arrays: the frames at which the variable was recorded,
+        and its values at those frames (see STATE_COLUMNS for their columns).
+        Returns None if the actor_id or the state are missing.
+
+        By default, first_frame and last_frame are the start and end of the simulation, respectively.
+
+        Args:
+            actor_id (int): ID of the actor.
+            state (str): name of the actor's variable to be returned.
+            first_frame (int): First frame checked. By default, 1.
+            last_frame (int): Last frame checked. By default, max number of frames.
+        """
+        frames = self._get_array("{}/{}/frames".format(state, actor_id))
+        if frames is None:
+            return None
+        values = self._get_array("{}/{}/values".format(state, actor_id))
+
+        start = 0 if first_frame is None else np.searchsorted(frames, first_frame, side='left')
+        end = len(frames) if last_frame is None else np.searchsorted(frames, last_frame, side='right')
+
+        return frames[start:end], values[start:end]
+
     def _get_actor_state(self, actor_id, state, frame):
         """
         Given an actor id, returns the specific variable of that actor at a given frame.
@@ -191,19 +337,11 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
             frame: (int): frame number of the simulation.
             attribute (str): name of the actor's attribute to be returned.
         """
-        frame_state = self._frames[frame - 1]["actors"]
-
-        # Check if the actor exists
-        if actor_id in frame_state:
-
-            # Check if the state exists
-            if state not in frame_state[actor_id]:
-                return None
+        series = self.get_actor_states_array(actor_id, state, frame, frame)
+        if series is None or len(series[0]) == 0:
+            return None
 
-            state_info = frame_state[actor_id][state]
-            return state_info
-
-        return None
+        return STATE_CONVERTERS[state](series[1][0])
 
     def _get_all_actor_states(self, actor_id, state, first_frame=None, last_frame=None):
         """
@@ -223,25 +361,26 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         if last_frame is None:
             last_frame = self.get_total_frame_count()
 
-        state_list = []
+        state_list = [None] * max(last_frame - first_frame + 1, 0)
 
-        for frame_number in range(first_frame, last_frame + 1):
-            state_info = self._get_actor_state(actor_id, state, frame_number)
-            state_list.append(state_info)
+        series = self.get_actor_states_array(actor_id, state, first_frame, last_frame)
+        if series is not None:
+            converter = STATE_CONVERTERS[state]
+            for frame_number, values in zip(series[0], series[1]):
+                state_list[frame_number - first_frame] = converter(values)
 
         return state_list
 
     def _get_states_at_frame(self, frame, state, actor_list=None):
         """
-        Returns a dict where the keys are the frame number, and the values are the
-        carla.Transform of the actor at the given frame.
+        Returns a dict where the keys are the actor ids, and the values are the
+        specific variable of the actor at the given frame.
 
         By default, all actors will be considered.
         """
         states = {}
-        actor_info = self._frames[frame]["actors"]
 
-        for actor_id in actor_info:
+        for actor_id in self.get_actor_ids_at_frame(frame).tolist():
             if not actor_list:
                 _state = self._get_actor_state(actor_id, state, frame)
                 if _state:
@@ -344,14 +483,11 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         Returns the carla.VehiclePhysicsControl of a vehicle at a given frame.
         Returns None if the id can't be found.
         """
+        rows = self._get_last_event("physics_control", vehicle_id, frame)
+        if rows is None:
+            return None
 
-        for i in range(frame - 1, -1, -1):  # Go backwards from the frame until 0
-            physics_info = self._frames[i]["events"]["physics_control"]
-
-            if vehicle_id in physics_info:
-                return physics_info[vehicle_id]
-
-        return None
+        return parse_physics_control(rows)
 
     def get_walker_speed(self, walker_id, frame):
         """
@@ -383,16 +519,11 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         Returns the state time of the traffic light at a specific frame.
         Returns None if the id can't be found.
         """
+        elements = self._get_last_event("traffic_light_state_time", traffic_light_id, frame)
+        if elements is None:
+            return None
 
-        for i in range(frame - 1, -1, -1):  # Go backwards from the frame until 0
-            state_times_info = self._frames[i]["events"]["traffic_light_state_time"]
-
-            if traffic_light_id in state_times_info:
-                states = state_times_info[traffic_light_id]
-                if state in states:
-                    return state_times_info[traffic_light_id][state]
-
-        return None
+        return parse_state_times(elements).get(state)
 
     # Vehicle lights
     def get_vehicle_lights(self, vehicle_id, frame):
@@ -418,11 +549,8 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         Returns the state of the scene light at a specific frame.
         Returns None if the id can't be found.
         """
+        elements = self._get_last_event("scene_lights", light_id, frame)
+        if elements is None:
+            return None
 
-        for i in range(frame - 1, -1, -1):  # Go backwards from the frame until 0
-            scene_lights_info = self._frames[i]["events"]["scene_lights"]
-
-            if light_id in scene_lights_info:
-                return scene_lights_info[light_id]
-
-        return None
+        return parse_scene_lights(elements)
@@ -8,109 +8,126 @@
 
 """
 Support class of the MetricsManager to parse the information of
-the CARLA recorder into a readable dictionary
+the CARLA recorder into readable dictionaries and arrays,
+as well as to cache them next to the recorder file
 """
 
+import io
+import json
+import os
+
+import numpy as np
+
 import carla
 
 
+# Columns of the per actor time series. Traffic light states are stored as their number,
+# and vehicle lights as a bitmask of VEHICLE_LIGHTS
+STATE_COLUMNS = {
+    "transform": ("x", "y", "z", "roll", "pitch", "yaw"),
+    "velocity": ("x", "y", "z"),
+    "angular_velocity": ("x", "y", "z"),
+    "acceleration": ("x", "y", "z"),
+    "control": ("throttle", "steer", "brake", "hand_brake", "gear"),
+    "state": ("state",),
+    "frozen": ("frozen",),
+    "elapsed_time": ("elapsed_time",),
+    "speed": ("speed",),
+    "lights": ("lights",),
+}
+
+VEHICLE_LIGHTS = (
+    "None", "Position", "LowBeam", "HighBeam", "Brake", "RightBlinker",
+    "LeftBlinker", "Reverse", "Fog", "Interior", "Special1", "Special2"
+)
+
+CACHE_VERSION = 1
+
+
 def parse_actor(info):
     """Returns a dictionary with the basic actor information"""
     actor = {
         "type_id": info[2],
-        "location": carla.Location(
-            x=float(info[5][1:-1]) / 100,
-            y=float(info[6][:-1]) / 100,
-            z=float(info[7][:-1]) / 100
-        )
+        "location": [
+            float(info[5][1:-1]) / 100,
+            float(info[6][:-1]) / 100,
+            float(info[7][:-1]) / 100
+        ]
     }
     return actor
 
 def parse_transform(info):
-    """Parses a list into a carla.Transform"""
-    transform = carla.Transform(
-        carla.Location(
-            x=float(info[3][1:-1]) / 100,
-            y=float(info[4][:-1]) / 100,
-            z=float(info[5][:-1]) / 100,
-        ),
-        carla.Rotation(
-            roll=float(info[7][1:-1]),
-            pitch=float(info[8][:-1]), 
-            yaw=float(info[9][:-1])
-        )
+    """Parses a list into the transform values (x, y, z, roll, pitch, yaw)"""
+    return (
+        float(info[3][1:-1]) / 100,
+        float(info[4][:-1]) / 100,
+        float(info[5][:-1]) / 100,
+        float(info[7][1:-1]),
+        float(info[8][:-1]),
+        float(info[9][:-1])
     )
-    return transform
 
 def parse_control(info):
-    """Parses a list into a carla.VehicleControl"""
-    control = carla.VehicleControl(
-        throttle=float(info[5]),
-        steer=float(info[3]),
-        brake=float(info[7]),
-        hand_brake=bool(int(info[9])),
-        reverse=int(info[11]) < 0,
-        manual_gear_shift=False,
-        gear=int(info[11]),
+    """Parses a list into the control values (throttle, steer, brake, hand_brake, gear)"""
+    return (
+        float(info[5]),
+        float(info[3]),
+        float(info[7]),
+        float(int(info[9])),
+        float(int(info[11]))
     )
-    return control
 
 def parse_vehicle_lights(info):
-    """Parses a list into a carla.VehicleLightState"""
-    srt_to_vlight = {
-        "None": carla.VehicleLightState.NONE,
-        "Position": carla.VehicleLightState.Position,
-        "LowBeam": carla.VehicleLightState.LowBeam,
-        "HighBeam": carla.VehicleLightState.HighBeam,
-        "Brake": carla.VehicleLightState.Brake,
-        "RightBlinker": carla.VehicleLightState.RightBlinker,
-        "LeftBlinker": carla.VehicleLightState.LeftBlinker,
-        "Reverse": carla.VehicleLightState.Reverse,
-        "Fog": carla.VehicleLightState.Fog,
-        "Interior": carla.VehicleLightState.Interior,
-        "Special1": carla.VehicleLightState.Special1,
-        "Special2": carla.VehicleLightState.Special2,
-    }
+    """Parses a list into a bitmask of VEHICLE_LIGHTS"""
+    mask = 0
+    for i in range(2, len(info)):
+        mask |= 1 << VEHICLE_LIGHTS.index(info[i])
+
+    return mask
 
+def get_vehicle_lights(mask):
+    """Returns the list of carla.VehicleLightState of a bitmask"""
     lights = []
-    for i in range(2, len(info)):
-        lights.append(srt_to_vlight[info[i]])
+    for i, name in enumerate(VEHICLE_LIGHTS):
+        if int(mask) >> i & 1:
+            lights.append(carla.VehicleLightState.NONE if name == "None" else getattr(carla.VehicleLightState, name))
 
     return lights
 
 def parse_traffic_light(info):
-    """Parses a list into a dictionary with all the traffic light's information"""
+    """Parses a list into the traffic light values (state, frozen, elapsed_time)"""
+    return (
+        float(info[3]),
+        float(int(info[5])),
+        float(info[7])
+    )
+
+def get_traffic_light_state(number):
+    """Returns the carla.TrafficLightState of its number"""
     number_to_state = {
-        "0": carla.TrafficLightState.Red,
-        "1": carla.TrafficLightState.Yellow,
-        "2": carla.TrafficLightState.Green,
-        "3": carla.TrafficLightState.Off,
-        "4": carla.TrafficLightState.Unknown,
+        0: carla.TrafficLightState.Red,
+        1: carla.TrafficLightState.Yellow,
+        2: carla.TrafficLightState.Green,
+        3: carla.TrafficLightState.Off,
+        4: carla.TrafficLightState.Unknown,
     }
-    traffic_light = {
-        "state": number_to_state[info[3]],
-        "frozen": bool(int(info[5])),
-        "elapsed_time": float(info[7]),
-    }
-    return traffic_light
+    return number_to_state[int(number)]
 
 def parse_velocity(info):
-    """Parses a list into a carla.Vector3D with the velocity"""
-    velocity = carla.Vector3D(
-        x=float(info[3][1:-1]),
-        y=float(info[4][:-1]),
-        z=float(info[5][:-1])
+    """Parses a list into the velocity values"""
+    return (
+        float(info[3][1:-1]),
+        float(info[4][:-1]),
+        float(info[5][:-1])
     )
-    return velocity
 
 def parse_angular_velocity(info):
-    """Parses a list into a carla.Vector3D with the angular velocity"""
-    velocity = carla.Vector3D(
-        x=float(info[7][1:-1]),
-        y=float(info[8][:-1]),
-        z=float(info[9][:-1])
+    """Parses a list into the angular velocity values"""
+    return (
+        float(info[7][1:-1]),
+        float(info[8][:-1]),
+        float(info[9][:-1])
     )
-    return velocity
 
 def parse_scene_lights(info):
     """Parses a list into a carla.VehicleLightState"""
@@ -129,30 +146,28 @@ def parse_scene_lights(info):
 
 def parse_bounding_box(info):
     """
-    Parses a list into a carla.BoundingBox.
+    Parses a list into the bounding box values (location x, y, z, extent x, y, z).
     Some actors like sensors might have 'nan' location and 'inf' extent, so filter those.
     """
     if 'nan' in info[3]:
-        location = carla.Location()
+        location = [0.0, 0.0, 0.0]
     else:
-        location = carla.Location(
+        location = [
             float(info[3][1:-1])/100,
             float(info[4][:-1])/100,
             float(info[5][:-1])/100,
-        )
+        ]
 
     if 'inf' in info[7]:
-        extent = carla.Vector3D()
+        extent = [0.0, 0.0, 0.0]
     else:
-        extent = carla.Vector3D(
+        extent = [
             float(info[7][1:-1])/100,
             float(info[8][:-1])/100,
             float(info[9][:-1])/100,
-        )
-
-    bbox = carla.BoundingBox(location, extent)
+        ]
 
-    return bbox
+    return location + extent
 
 def parse_state_times(info):
     """Parses a list into a dict containing the state times of the traffic lights"""
@@ -201,340 +216,353 @@ def parse_wheels_control(info):
     return wheels_control
 
 
+def parse_physics_control(rows):
+    """Parses the rows of an actor at the 'Physics Control' section into a carla.VehiclePhysicsControl"""
+    physics_control = carla.VehiclePhysicsControl()
+
+    forward_gears = []
+    wheels = []
+    for row in rows:
+
+        if row.startswith('    '):
+            elements = row[4:].split(" ")
+            if elements[0] == "gear":
+                forward_gears.append(parse_gears_control(elements))
+            elif elements[0] == "wheel":
+                wheels.append(parse_wheels_control(elements))
+
+        else:
+            elements = row[3:].split(" = ")
+            name = elements[0]
+
+            if name == "center_of_mass":
+                values = elements[1].split(" ")
+                value = carla.Vector3D(
+                    float(values[0][1:-1]),
+                    float(values[1][:-1]),
+                    float(values[2][:-1]),
+                )
+                setattr(physics_control, name, value)
+            elif name == "torque_curve" or name == "steering_curve":
+                values = elements[1].split(" ")
+                value = parse_vector_list(values)
+                setattr(physics_control, name, value)
+
+            elif name == "use_gear_auto_box":
+                name = "use_gear_autobox"
+                value = True if elements[1] == "true" else False
+                setattr(physics_control, name, value)
+
+            elif "forward_gears" in name or "wheels" in name:
+                pass
+
+            else:
+                name = name.lower()
+                value = float(elements[1])
+                setattr(physics_control, name, value)
+
+    setattr(physics_control, "forward_gears", forward_gears)
+    setattr(physics_control, "wheels", wheels)
+    return physics_control
+
+
 class MetricsParser(object):
     """
-    Class used to parse the CARLA recorder into readable information
+    Class used to parse the CARLA recorder into readable information.
+
+    The recorder is read line by line, in a single pass. The states of the actors are
+    stored as one time series per actor and state (see STATE_COLUMNS), made out of
+    the frames at which the state was recorded, and its values at those frames.
+    The less frequent events (scene lights, physics controls...) are kept as their raw
+    recorder rows, and only parsed when queried.
     """
 
-    def __init__(self, recorder_info):
+    SECTIONS = (
+        (' Create', 'create'),
+        (' Destroy', 'destroy'),
+        (' Collision', 'collision'),
+        (' Parenting', 'parenting'),
+        (' Positions', 'positions'),
+        (' State traffic lights', 'traffic_lights'),
+        (' Vehicle animations', 'vehicle_animations'),
+        (' Walker animations', 'walker_animations'),
+        (' Vehicle light animations', 'vehicle_lights'),
+        (' Scene light changes', 'scene_lights'),
+        (' Dynamic actors', 'dynamic_actors'),
+        (' Actor bounding boxes', 'bounding_boxes'),
+        (' Actor trigger volumes', 'trigger_volumes'),
+        (' Current platform time', 'platform_time'),
+        (' Physics Control', 'physics_control'),
+        (' Traffic Light time events', 'traffic_light_state_time'),
+    )
 
+    def __init__(self, recorder_info):
+        """
+        Args:
+            recorder_info (str or iterable): string given by the recorder, or its lines
+        """
         self.recorder_info = recorder_info
-        self.frame_list = None
-        self.frame_row = None
-        self.i = 0
 
-    def get_row_elements(self, indent_num, split_string):
+        self.frame_number = None
+        self.section = None
+        self.actor_id = None
+
+        self._simulation = {}
+        self._actors = {}
+        self._events = {}
+        self._series = {}
+        self._frame_times = []
+        self._platform_times = []
+        self._alive_ids = []
+        self._alive_offsets = [0]
+
+    def _add_state(self, state, actor_id, values):
         """
-        returns a list with the elements of the row
+        Adds the values of an actor state at the current frame
         """
-        return self.frame_row[indent_num:].split(split_string)
+        frames, rows = self._series.setdefault(state, {}).setdefault(actor_id, ([], []))
+        frames.append(self.frame_number)
+        rows.append(values)
 
-    def next_row(self):
+    def _add_event(self, event, actor_id, value):
         """
-        Gets the next row of the recorder
+        Adds an event of an actor at the current frame
         """
-        self.i += 1
-        self.frame_row = self.frame_list[self.i]
+        self._events[event].setdefault(actor_id, []).append([self.frame_number, value])
 
-    def parse_recorder_info(self):
+    def _start_section(self, row):
         """
-        Parses the recorder into readable information.
-
-        Args:
-            recorder_info (str): string given by the recorder
+        Parses the header row of a section
         """
+        for prefix, section in self.SECTIONS:
+            if row.startswith(prefix):
+                self.section = section
+                break
+        else:
+            self.section = None
+            return
 
-        # Divide it into frames
-        recorder_list = self.recorder_info.split("Frame")
-
-        # Get general information
-        header = recorder_list[0].split("\n")
-        sim_map = header[1][5:]
-        sim_date = header[2][6:]
-
-        annex = recorder_list[-1].split("\n")
-        sim_frames = int(annex[0][3:])
-        sim_duration = float(annex[1][10:-8])
-
-        recorder_list = recorder_list[1:-1]
-
-        simulation_info = {
-            "map": sim_map,
-            "date:": sim_date,
-            "total_frames": sim_frames,
-            "duration": sim_duration
-        }
-
-        actors_info = {}
-        frames_info = []
-
-        for frame in recorder_list:
-
-            # Divide the frame in lines
-            self.frame_list = frame.split("\n")
-
-            # Get the general frame information
-            frame_info = self.frame_list[0].split(" ")
-            frame_number = int(frame_info[1])
-            frame_time = float(frame_info[3])
-
-            try:
-                prev_frame = frames_info[frame_number - 2]
-                prev_time = prev_frame["frame"]["elapsed_time"]
-                delta_time = round(frame_time - prev_time, 6)
-            except IndexError:
-                delta_time = 0
-
-            # Variable to store all the information about the frame
-            frame_state = {
-                "frame": {
-                    "elapsed_time": frame_time,
-                    "delta_time": delta_time,
-                    "platform_time": None
-                },
-                "actors": {},
-                "events":{
-                    "scene_lights": {},
-                    "physics_control": {},
-                    "traffic_light_state_time": {},
-                    "collisions": {}
-                }
-            }
-
-            # Loop through all the other rows.
-            self.i = 0
-            self.next_row()
-
-            while self.frame_row.startswith(' Create') or self.frame_row.startswith('  '):
-
-                if self.frame_row.startswith(' Create'):
-                    elements = self.get_row_elements(1, " ")
-                    actor_id = int(elements[1][:-1])
-
-                    actor = parse_actor(elements)
-                    actors_info.update({actor_id: actor})
-                    actors_info[actor_id].update({"created": frame_number})
-                else:
-                    elements = self.get_row_elements(2, " = ")
-                    actors_info[actor_id].update({elements[0]: elements[1]})
-
-                self.next_row()
-
-            while self.frame_row.startswith(' Destroy'):
+        if section in ('create', 'destroy', 'collision', 'parenting', 'platform_time'):
+            elements = row[1:].split(" ")
 
-                elements = self.get_row_elements(1, " ")
+        if section == 'create':
+            self.actor_id = int(elements[1][:-1])
+            actor = parse_actor(elements)
+            actor["created"] = self.frame_number
+            self._actors[self.actor_id] = actor
 
-                actor_id = int(elements[1])
-                actors_info[actor_id].update({"destroyed": frame_number})
+        elif section == 'destroy':
+            self._actors[int(elements[1])]["destroyed"] = self.frame_number
 
-                self.next_row()
+        elif section == 'collision':
+            self._add_event('collisions', int(elements[4]), int(elements[-1]))
 
-            while self.frame_row.startswith(' Collision'):
+        elif section == 'parenting':
+            self._actors[int(elements[1])]["parent"] = int(elements[3])
 
-                elements = self.get_row_elements(1, " ")
+        elif section == 'platform_time':
+            self._platform_times[-1] = float(elements[-1])
 
-                actor_id = int(elements[4])
-                other_id = int(elements[-1])
-
-                if actor_id not in frame_state["events"]["collisions"]:
-                    frame_state["events"]["collisions"][actor_id] = [other_id]
-                else:
-                    collisions = frame_state["events"]["collisions"][actor_id]
-                    collisions.append(other_id)
-                    frame_state["events"]["collisions"].update({actor_id: collisions})
-
-                self.next_row()
-
-            while self.frame_row.startswith(' Parenting'):
-
-                elements = self.get_row_elements(1, " ")
-
-                actor_id = int(elements[1])
-                parent_id = int(elements[3])
-                actors_info[actor_id].update({"parent": parent_id})
-
-                self.next_row()
-
-            if self.frame_row.startswith(' Positions'):
-                self.next_row()
-
-                while self.frame_row.startswith('  '):
-
-                    elements = self.get_row_elements(2, " ")
-                    actor_id = int(elements[1])
-
-                    transform = parse_transform(elements)
-                    frame_state["actors"].update({actor_id: {"transform": transform}})
-
-                    self.next_row()
-
-            if self.frame_row.startswith(' State traffic lights'):
-                self.next_row()
-
-                while self.frame_row.startswith('  '):
-
-                    elements = self.get_row_elements(2, " ")
-                    actor_id = int(elements[1])
-
-                    traffic_light = parse_traffic_light(elements)
-                    frame_state["actors"].update({actor_id: traffic_light})
-                    self.next_row()
-
-            if self.frame_row.startswith(' Vehicle animations'):
-                self.next_row()
-
-                while self.frame_row.startswith('  '):
-
-                    elements = self.get_row_elements(2, " ")
-                    actor_id = int(elements[1])
-
-                    control = parse_control(elements)
-                    frame_state["actors"][actor_id].update({"control": control})
-                    self.next_row()
-
-            if self.frame_row.startswith(' Walker animations'):
-                self.next_row()
-
-                while self.frame_row.startswith('  '):
-                    elements = self.get_row_elements(2, " ")
-                    actor_id = int(elements[1])
-
-                    frame_state["actors"][actor_id].update({"speed": elements[3]})
-                    self.next_row()
-
-            if self.frame_row.startswith(' Vehicle light animations'):
-                self.next_row()
-
-                while self.frame_row.startswith('  '):
-                    elements = self.get_row_elements(2, " ")
-                    actor_id = int(elements[1])
-
-                    lights = parse_vehicle_lights(elements)
-                    frame_state["actors"][actor_id].update({"lights": lights})
-                    self.next_row()
-
-            if self.frame_row.startswith(' Scene light changes'):
-                self.next_row()
-
-                while self.frame_row.startswith('  '):
-                    elements = self.get_row_elements(2, " ")
-                    actor_id = int(elements[1])
-
-                    scene_light = parse_scene_lights(elements)
-                    frame_state["events"]["scene_lights"].update({actor_id: scene_light})
-                    self.next_row()
-
-            if self.frame_row.startswith(' Dynamic actors'):
-                self.next_row()
-
-                while self.frame_row.startswith('  '):
-                    elements = self.get_row_elements(2, " ")
-                    actor_id = int(elements[1])
-
-                    velocity = parse_velocity(elements)
-                    frame_state["actors"][actor_id].update({"velocity": velocity})
-
-                    angular_v = parse_angular_velocity(elements)
-                    frame_state["actors"][actor_id].update({"angular_velocity": angular_v})
-
-                    if delta_time == 0:
-                        acceleration = carla.Vector3D(0, 0, 0)
-                    else:
-                        prev_velocity = frame_state["actors"][actor_id]["velocity"]
-                        acceleration = (velocity - prev_velocity) / delta_time
+    def _parse_row(self, row):
+        """
+        Parses a data row of the current section
+        """
+        section = self.section
 
-                    frame_state["actors"][actor_id].update({"acceleration": acceleration})
-                    self.next_row()
+        if section == 'create':
+            elements = row[2:].split(" = ")
+            self._actors[self.actor_id][elements[0]] = elements[1]
+            return
 
-            if self.frame_row.startswith(' Actor bounding boxes'):
-                self.next_row()
+        if section == 'physics_control':
+            if row.startswith('   '):
+                self._events['physics_control'][self.actor_id][-1][1].append(row)
+            else:
+                self.actor_id = int(row[2:].split(" ")[1])
+                self._add_event('physics_control', self.actor_id, [])
+            return
 
-                while self.frame_row.startswith('  '):
-                    elements = self.get_row_elements(2, " ")
-                    actor_id = int(elements[1])
+        elements = row[2:].split(" ")
+        actor_id = int(elements[1])
 
-                    bbox = parse_bounding_box(elements)
-                    actors_info[actor_id].update({"bounding_box": bbox})
-                    self.next_row()
+        if section == 'positions':
+            self._add_state("transform", actor_id, parse_transform(elements))
+            self._alive_ids.append(actor_id)
 
-            if self.frame_row.startswith(' Actor trigger volumes'):
-                self.next_row()
+        elif section == 'traffic_lights':
+            state, frozen, elapsed_time = parse_traffic_light(elements)
+            self._add_state("state", actor_id, state)
+            self._add_state("frozen", actor_id, frozen)
+            self._add_state("elapsed_time", actor_id, elapsed_time)
 
-                while self.frame_row.startswith('  '):
-                    elements = self.get_row_elements(2, " ")
-                    actor_id = int(elements[1])
+        elif section == 'vehicle_animations':
+            self._add_state("control", actor_id, parse_control(elements))
 
-                    trigvol = parse_bounding_box(elements)
-                    actors_info[actor_id].update({"trigger_volume": trigvol})
-                    self.next_row()
+        elif section == 'walker_animations':
+            self._add_state("speed", actor_id, float(elements[3]))
 
-            if self.frame_row.startswith(' Current platform time'):
+        elif section == 'vehicle_lights':
+            self._add_state("lights", actor_id, parse_vehicle_lights(elements))
 
-                elements = self.get_row_elements(1, " ")
+        elif section == 'scene_lights':
+            self._add_event('scene_lights', actor_id, elements)
 
-                platform_time = float(elements[-1])
-                frame_state["frame"]["platform_time"] = platform_time
-                self.next_row()
+        elif section == 'dynamic_actors':
+            self._add_state("velocity", actor_id, parse_velocity(elements))
+            self._add_state("angular_velocity", actor_id, parse_angular_velocity(elements))
 
-            if self.frame_row.startswith(' Physics Control'):
-                self.next_row()
+        elif section == 'bounding_boxes':
+            self._actors[actor_id]["bounding_box"] = parse_bounding_box(elements)
 
-                actor_id = None
-                while self.frame_row.startswith('  '):
+        elif section == 'trigger_volumes':
+            self._actors[actor_id]["trigger_volume"] = parse_bounding_box(elements)
 
-                    elements = self.get_row_elements(2, " ")
-                    actor_id = int(elements[1])
-                    physics_control = carla.VehiclePhysicsControl()
-                    self.next_row()
+        elif section == 'traffic_light_state_time':
+            self._add_event('traffic_light_state_time', actor_id, elements)
 
-                    forward_gears = []
-                    wheels = []
-                    while self.frame_row.startswith('   '):
+    def _start_frame(self, row):
+        """
+        Parses the header row of a frame, closing the alive actors of the previous one
+        """
+        if self.frame_number is not None:
+            self._alive_offsets.append(len(self._alive_ids))
 
-                        if self.frame_row.startswith('    '):
-                            elements = self.get_row_elements(4, " ")
-                            if elements[0] == "gear":
-                                forward_gears.append(parse_gears_control(elements))
-                            elif elements[0] == "wheel":
-                                wheels.append(parse_wheels_control(elements))
+        elements = row.split(" ")
+        self.frame_number = int(elements[1])
+        self._frame_times.append(float(elements[3]))
+        self._platform_times.append(float('nan'))
+        self.section = None
 
-                        else:
-                            elements = self.get_row_elements(3, " = ")
-                            name = elements[0]
+    def _get_lines(self):
+        if isinstance(self.recorder_info, str):
+            return io.StringIO(self.recorder_info)
+        return self.recorder_info
 
-                            if name == "center_of_mass":
-                                values = elements[1].split(" ")
-                                value = carla.Vector3D(
-                                    float(values[0][1:-1]),
-                                    float(values[1][:-1]),
-                                    float(values[2][:-1]),
-                                )
-                                setattr(physics_control, name, value)
-                            elif name == "torque_curve" or name == "steering_curve":
-                                values = elements[1].split(" ")
-                                value = parse_vector_list(values)
-                                setattr(physics_control, name, value)
+    def parse_recorder_info(self):
+        """
+        Parses the recorder into readable information.
 
-                            elif name == "use_gear_auto_box":
-                                name = "use_gear_autobox"
-                                value = True if elements[1] == "true" else False
-                                setattr(physics_control, name, value)
+        Returns:
+            tuple: (info, arrays), where info is a json serializable dictionary with the
+            simulation, actors and events information, and arrays a dictionary with:
+            - 'frames/elapsed_time', 'frames/delta_time' and 'frames/platform_time'
+            - 'alive/ids' and 'alive/offsets': ids of the actors at each frame, the ones
+              of frame i being ids[offsets[i - 1]:offsets[i]]
+            - '<state>/<actor id>/frames' and '<state>/<actor id>/values', with the
+              time series of all the actor states
+        """
+        self._events = {
+            "collisions": {},
+            "scene_lights": {},
+            "physics_control": {},
+            "traffic_light_state_time": {}
+        }
 
-                            elif "forward_gears" in name or "wheels" in name:
-                                pass
+        for row in self._get_lines():
+            row = row.rstrip('\n')
+
+            if row.startswith('  '):
+                self._parse_row(row)
+            elif row.startswith(' '):
+                self._start_section(row)
+            elif row.startswith('Frame '):
+                self._start_frame(row)
+            elif row.startswith('Frames: '):
+                self._simulation["total_frames"] = int(row[8:])
+            elif row.startswith('Duration: '):
+                self._simulation["duration"] = float(row[10:-8])
+            elif row.startswith('Map: '):
+                self._simulation["map"] = row[5:]
+            elif row.startswith('Date: '):
+                self._simulation["date:"] = row[6:]
+
+        if self.frame_number is not None:
+            self._alive_offsets.append(len(self._alive_ids))
+
+        elapsed_time = np.array(self._frame_times, dtype=np.float64)
+        delta_time = np.zeros_like(elapsed_time)
+        delta_time[1:] = np.round(np.diff(elapsed_time), 6)
+
+        arrays = {
+            "frames/elapsed_time": elapsed_time,
+            "frames/delta_time": delta_time,
+            "frames/platform_time": np.array(self._platform_times, dtype=np.float64),
+            "alive/ids": np.array(self._alive_ids, dtype=np.int64),
+            "alive/offsets": np.array(self._alive_offsets, dtype=np.int64),
+        }
 
-                            else:
-                                name = name.lower()
-                                value = float(elements[1])
-                                setattr(physics_control, name, value)
+        for state, actors in self._series.items():
+            for actor_id, (frames, rows) in actors.items():
+                arrays["{}/{}/frames".format(state, actor_id)] = np.array(frames, dtype=np.int64)
+                arrays["{}/{}/values".format(state, actor_id)] = np.array(rows, dtype=np.float32).reshape(len(rows), -1)
+
+        # Accelerations, from the velocities of consecutive frames
+        for actor_id in self._series.get("velocity", {}):
+            frames = arrays["velocity/{}/frames".format(actor_id)]
+            velocities = arrays["velocity/{}/values".format(actor_id)]
+
+            accelerations = np.zeros_like(velocities)
+            delta = delta_time[frames[1:] - 1]
+            valid = (np.diff(frames) == 1) & (delta != 0)
+            accelerations[1:][valid] = (velocities[1:][valid] - velocities[:-1][valid]) / delta[valid, None]
+
+            arrays["acceleration/{}/frames".format(actor_id)] = frames
+            arrays["acceleration/{}/values".format(actor_id)] = accelerations
+
+        info = {
+            "version": CACHE_VERSION,
+            "simulation": self._simulation,
+            "actors": self._actors,
+            "events": self._events
+        }
 
-                        self.next_row()
+        return info, arrays
 
-                    setattr(physics_control, "forward_gears", forward_gears)
-                    setattr(physics_control, "wheels", wheels)
-                    frame_state["events"]["physics_control"].update({actor_id: physics_control})
 
-            if self.frame_row.startswith(' Traffic Light time events'):
-                self.next_row()
+def get_metrics_cache_file(recorder_file):
+    """
+    Returns the path of the cache of a recorder file, next to it
+    """
+    return os.path.splitext(recorder_file)[0] + ".metrics.npz"
 
-                while self.frame_row.startswith('  '):
-                    elements = self.get_row_elements(2, " ")
-                    actor_id = int(elements[1])
 
-                    state_times = parse_state_times(elements)
-                    frame_state["events"]["traffic_light_state_time"].update({actor_id: state_times})
-                    self.next_row()
+def save_metrics_cache(cache_file, info, arrays):
+    """
+    Saves the parsed recorder. The arrays are compressed one by one,
+    so that they can be loaded only when needed
+    """
+    tmp_file = cache_file + ".tmp"
+    try:
+        with open(tmp_file, 'wb') as fd:
+            np.savez_compressed(fd, __info__=np.array(json.dumps(info)), **arrays)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print("WARNING: Couldn't save the metrics cache {}: {}".format(cache_file, e))
 
-            frames_info.append(frame_state)
 
-        return simulation_info, actors_info, frames_info
+def load_metrics_cache(cache_file, recorder_file=None):
+    """
+    Loads a parsed recorder, as given by MetricsParser.parse_recorder_info. The arrays are loaded lazily.
+    Returns None if the cache doesn't exist, is outdated, or is older than the recorder file
+    """
+    if not os.path.exists(cache_file):
+        return None
+    if recorder_file is not None and os.path.getmtime(cache_file) < os.path.getmtime(recorder_file):
+        return None
+
+    try:
+        arrays = np.load(cache_file)
+        info = json.loads(str(arrays["__info__"][()]))
+    except (OSError, ValueError, KeyError) as e:
+        print("WARNING: Couldn't load the metrics cache {}: {}".format(cache_file, e))
+        return None
+
+    if info.get("version") != CACHE_VERSION:
+        return None
+
+    # Json keys are strings
+    info["actors"] = {int(actor_id): actor for actor_id, actor in info["actors"].items()}
+    for event, actors in info["events"].items():
+        info["events"][event] = {int(actor_id): values for actor_id, values in actors.items()}
+
+    return info, arrays
@@ -15,27 +15,34 @@ from __future__ import print_function
 import math
 import re
 import threading
+import numpy as np
 from numpy import random
 from six import iteritems
 
 import carla
 from agents.navigation.global_route_planner import GlobalRoutePlanner
 
+from srunner.tools.map_cache import reset_map_ids
+from srunner.tools.route_progress import RouteProgress
+from srunner.tools.traffic_control_index import TrafficControlIndex
+from srunner.tools.waypoint_cache import WaypointCache
+
 
 def calculate_velocity(actor):
     """
     Method to calculate the velocity of a actor
     """
-    velocity_squared = actor.get_velocity().x**2
-    velocity_squared += actor.get_velocity().y**2
-    return math.sqrt(velocity_squared)
+    velocity = actor.get_velocity()
+    return math.sqrt(velocity.x**2 + velocity.y**2)
 
 
 class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
 
     """
     This class provides access to various data of all registered actors
-    It buffers the data and updates it on every CARLA tick
+    It buffers the data and updates it on every CARLA tick, reading all of it
+    from a single world snapshot. The buffered states are stored in arrays,
+    indexed by the row assigned to each actor id at registration
 
     Currently available data:
     - Absolute velocity
@@ -51,12 +58,19 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
     # the key saves the scenario type and the value all relevant data
     active_scenarios = []
 
-    _actor_velocity_map = {}
-    _actor_location_map = {}
-    _actor_transform_map = {}
+    _actor_state_index = {}     # actor id -> row of the state arrays
+    _actor_state_actors = []    # row -> actor
+    _actor_locations = np.zeros((0, 3))
+    _actor_rotations = np.zeros((0, 3))  # pitch, yaw, roll
+    _actor_velocities = np.zeros((0, 3))
+    _actor_state_valid = np.zeros(0, dtype=bool)   # the row holds a known state
+    _actor_state_alive = np.zeros(0, dtype=bool)   # the actor was part of the last snapshot
     _traffic_light_map = {}
+    _traffic_control_index = None
+    _waypoint_cache = None
     _carla_actor_pool = {}
     _global_osc_parameters = {}
+    _global_osc_parameters_version = 0  # increased whenever a parameter is set
     _client = None
     _world = None
     _map = None
@@ -66,6 +80,7 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
     _blueprint_library = None
     _all_actors = None
     _ego_vehicle_route = None
+    _route_progress = {}  # id(route) -> (route, RouteProgress)
     _traffic_manager_port = 8000
     _random_seed = 2000
     _rng = random.RandomState(_random_seed)
@@ -73,31 +88,53 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
     _runtime_init_flag = False
     _lock = threading.Lock()
 
+    @staticmethod
+    def _reserve_actor_state_row():
+        """
+        Returns the next free row of the state arrays, growing them if needed.
+        Has to be called with the lock held
+        """
+        row = len(CarlaDataProvider._actor_state_actors)
+        capacity = len(CarlaDataProvider._actor_state_valid)
+        if row >= capacity:
+            extra = max(capacity, 64)
+            CarlaDataProvider._actor_locations = np.concatenate(
+                (CarlaDataProvider._actor_locations, np.zeros((extra, 3))))
+            CarlaDataProvider._actor_rotations = np.concatenate(
+                (CarlaDataProvider._actor_rotations, np.zeros((extra, 3))))
+            CarlaDataProvider._actor_velocities = np.concatenate(
+                (CarlaDataProvider._actor_velocities, np.zeros((extra, 3))))
+            CarlaDataProvider._actor_state_valid = np.concatenate(
+                (CarlaDataProvider._actor_state_valid, np.zeros(extra, dtype=bool)))
+            CarlaDataProvider._actor_state_alive = np.concatenate(
+                (CarlaDataProvider._actor_state_alive, np.zeros(extra, dtype=bool)))
+        return row
+
     @staticmethod
     def register_actor(actor, transform=None):
         """
-        Add new actor to dictionaries
+        Add new actor to the state buffers
         If actor already exists, throw an exception
         """
         with CarlaDataProvider._lock:
-            if actor in CarlaDataProvider._actor_velocity_map:
+            if actor.id in CarlaDataProvider._actor_state_index:
                 raise KeyError(
                     "Vehicle '{}' already registered. Cannot register twice!".format(actor.id))
-            else:
-                CarlaDataProvider._actor_velocity_map[actor] = 0.0
-            if actor in CarlaDataProvider._actor_location_map:
-                raise KeyError(
-                    "Vehicle '{}' already registered. Cannot register twice!".format(actor.id))
-            elif transform:
-                CarlaDataProvider._actor_location_map[actor] = transform.location
-            else:
-                CarlaDataProvider._actor_location_map[actor] = None
 
-            if actor in CarlaDataProvider._actor_transform_map:
-                raise KeyError(
-                    "Vehicle '{}' already registered. Cannot register twice!".format(actor.id))
+            row = CarlaDataProvider._reserve_actor_state_row()
+            CarlaDataProvider._actor_state_index[actor.id] = row
+            CarlaDataProvider._actor_state_actors.append(actor)
+            CarlaDataProvider._actor_velocities[row] = 0.0
+
+            if transform:
+                location = transform.location
+                rotation = transform.rotation
+                CarlaDataProvider._actor_locations[row] = (location.x, location.y, location.z)
+                CarlaDataProvider._actor_rotations[row] = (rotation.pitch, rotation.yaw, rotation.roll)
+                CarlaDataProvider._actor_state_valid[row] = True
             else:
-                CarlaDataProvider._actor_transform_map[actor] = transform
+                CarlaDataProvider._actor_state_valid[row] = False
+            CarlaDataProvider._actor_state_alive[row] = True
 
     @staticmethod
     def update_osc_global_params(parameters):
@@ -105,6 +142,14 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
         updates/initializes global osc parameters.
         """
         CarlaDataProvider._global_osc_parameters.update(parameters)
+        CarlaDataProvider._global_osc_parameters_version += 1
+
+    @staticmethod
+    def get_osc_global_params_version():
+        """
+        returns a number that changes whenever the global osc parameters are updated.
+        """
+        return CarlaDataProvider._global_osc_parameters_version
 
     @staticmethod
     def get_osc_global_param_value(ref):
@@ -125,26 +170,42 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
             CarlaDataProvider.register_actor(actor, transform)
 
     @staticmethod
-    def on_carla_tick():
+    def on_carla_tick(snapshot=None):
         """
         Callback from CARLA
+
+        All the actor states are read from a single world snapshot, which avoids
+        querying the server once per actor. If no snapshot is given, a new one is taken
         """
         with CarlaDataProvider._lock:
-            for actor in CarlaDataProvider._actor_velocity_map:
-                if actor is not None and actor.is_alive:
-                    CarlaDataProvider._actor_velocity_map[actor] = calculate_velocity(actor)
-
-            for actor in CarlaDataProvider._actor_location_map:
-                if actor is not None and actor.is_alive:
-                    CarlaDataProvider._actor_location_map[actor] = actor.get_location()
-
-            for actor in CarlaDataProvider._actor_transform_map:
-                if actor is not None and actor.is_alive:
-                    CarlaDataProvider._actor_transform_map[actor] = actor.get_transform()
-
             world = CarlaDataProvider._world
             if world is None:
                 print("WARNING: CarlaDataProvider couldn't find the world")
+            elif CarlaDataProvider._actor_state_index:
+                if snapshot is None:
+                    snapshot = world.get_snapshot()
+
+                rows = []
+                states = []
+                for actor_id, row in CarlaDataProvider._actor_state_index.items():
+                    actor_snapshot = snapshot.find(actor_id)
+                    if actor_snapshot is None:
+                        continue  # The actor is no longer alive, keep its last known state
+                    transform = actor_snapshot.get_transform()
+                    velocity = actor_snapshot.get_velocity()
+                    rows.append(row)
+                    states.append((transform.location.x, transform.location.y, transform.location.z,
+                                   transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll,
+                                   velocity.x, velocity.y, velocity.z))
+
+                CarlaDataProvider._actor_state_alive[:] = False
+                if rows:
+                    states = np.array(states, dtype=float)
+                    CarlaDataProvider._actor_locations[rows] = states[:, 0:3]
+                    CarlaDataProvider._actor_rotations[rows] = states[:, 3:6]
+                    CarlaDataProvider._actor_velocities[rows] = states[:, 6:9]
+                    CarlaDataProvider._actor_state_valid[rows] = True
+                    CarlaDataProvider._actor_state_alive[rows] = True
 
             CarlaDataProvider._all_actors = None
 
@@ -153,9 +214,10 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
         """
         returns the absolute velocity for the given actor
         """
-        for key in CarlaDataProvider._actor_velocity_map:
-            if key.id == actor.id:
-                return CarlaDataProvider._actor_velocity_map[key]
+        row = CarlaDataProvider._actor_state_index.get(actor.id)
+        if row is not None:
+            velocity = CarlaDataProvider._actor_velocities[row]
+            return math.sqrt(velocity[0]**2 + velocity[1]**2)
 
         # We are intentionally not throwing here
         # This may cause exception loops in py_trees
@@ -167,9 +229,12 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
         """
         returns the location for the given actor
         """
-        for key in CarlaDataProvider._actor_location_map:
-            if key.id == actor.id:
-                return CarlaDataProvider._actor_location_map[key]
+        row = CarlaDataProvider._actor_state_index.get(actor.id)
+        if row is not None:
+            if not CarlaDataProvider._actor_state_valid[row]:
+                return None
+            x, y, z = CarlaDataProvider._actor_locations[row]
+            return carla.Location(x=float(x), y=float(y), z=float(z))
 
         # We are intentionally not throwing here
         # This may cause exception loops in py_trees
@@ -181,15 +246,60 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
         """
         returns the transform for the given actor
         """
-        for key in CarlaDataProvider._actor_transform_map:
-            if key.id == actor.id:
-                return CarlaDataProvider._actor_transform_map[key]
+        row = CarlaDataProvider._actor_state_index.get(actor.id)
+        if row is not None:
+            if not CarlaDataProvider._actor_state_valid[row]:
+                return None
+            x, y, z = CarlaDataProvider._actor_locations[row]
+            pitch, yaw, roll = CarlaDataProvider._actor_rotations[row]
+            return carla.Transform(carla.Location(x=float(x), y=float(y), z=float(z)),
+                                   carla.Rotation(pitch=float(pitch), yaw=float(yaw), roll=float(roll)))
 
         # We are intentionally not throwing here
         # This may cause exception loops in py_trees
         print('{}.get_transform: {} not found!' .format(__name__, actor))
         return None
 
+    @staticmethod
+    def get_locations(actors):
+        """
+        returns the buffered locations of the given actors, as a N x 3 array,
+        together with a mask of the actors with a known location
+        """
+        locations = np.zeros((len(actors), 3))
+        valid = np.zeros(len(actors), dtype=bool)
+
+        rows = [CarlaDataProvider._actor_state_index.get(actor.id) for actor in actors]
+        known = [i for i, row in enumerate(rows) if row is not None]
+        if known:
+            known_rows = [rows[i] for i in known]
+            locations[known] = CarlaDataProvider._actor_locations[known_rows]
+            valid[known] = CarlaDataProvider._actor_state_valid[known_rows]
+
+        return locations, valid
+
+    @staticmethod
+    def get_actors_in_radius(location, radius, actor_filter=None):
+        """
+        returns all the alive registered actors whose buffered location is closer than
+        'radius' to the given location. Optionally, 'actor_filter' can be a callable
+        used to discard some of them (i.e: lambda actor: actor.type_id.startswith('vehicle'))
+        """
+        num_actors = len(CarlaDataProvider._actor_state_actors)
+        if num_actors == 0:
+            return []
+
+        point = np.array([location.x, location.y, location.z])
+        distances = np.linalg.norm(CarlaDataProvider._actor_locations[:num_actors] - point, axis=1)
+        mask = distances < radius
+        mask &= CarlaDataProvider._actor_state_valid[:num_actors]
+        mask &= CarlaDataProvider._actor_state_alive[:num_actors]
+
+        actors = [CarlaDataProvider._actor_state_actors[row] for row in np.flatnonzero(mask)]
+        if actor_filter is not None:
+            actors = [actor for actor in actors if actor_filter(actor)]
+        return actors
+
     @staticmethod
     def set_client(client):
         """
@@ -212,6 +322,7 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
         CarlaDataProvider._world = world
         CarlaDataProvider._sync_flag = world.get_settings().synchronous_mode
         CarlaDataProvider._map = world.get_map()
+        reset_map_ids()
         CarlaDataProvider._blueprint_library = world.get_blueprint_library()
         CarlaDataProvider._grp = GlobalRoutePlanner(CarlaDataProvider._map, 2.0)
         CarlaDataProvider.generate_spawn_points()
@@ -261,6 +372,20 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
         """
         return CarlaDataProvider._grp
 
+    @staticmethod
+    def get_route_progress(route):
+        """
+        Returns the progress tracker of the given route, creating it the first time.
+        All the users of the same route share the tracker, so the progress is only computed once per tick.
+        As the criteria score the route with it, the tracker never rejoins the route further ahead
+        """
+        route_id = id(route)
+        if route_id not in CarlaDataProvider._route_progress:
+            # Keep a reference to the route, so that its id isn't reused
+            CarlaDataProvider._route_progress[route_id] = (route, RouteProgress.from_route(route))
+
+        return CarlaDataProvider._route_progress[route_id][1]
+
     @staticmethod
     def get_all_actors():
         """
@@ -316,6 +441,8 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
 
         # Parse all traffic lights
         CarlaDataProvider._traffic_light_map.clear()
+        CarlaDataProvider._traffic_control_index = None
+        CarlaDataProvider._reset_waypoint_cache()
         for traffic_light in CarlaDataProvider._world.get_actors().filter('*traffic_light*'):
             if traffic_light not in list(CarlaDataProvider._traffic_light_map):
                 CarlaDataProvider._traffic_light_map[traffic_light] = traffic_light.get_transform()
@@ -427,41 +554,118 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
             param['light'].set_yellow_time(param['yellow_time'])
 
     @staticmethod
-    def get_next_traffic_light(actor, use_cached_location=True):
+    def get_traffic_control_index():
         """
-        returns the next relevant traffic light for the provided actor
+        Returns the index of the traffic lights and stop signs of the current map.
+        It is created the first time it is needed, loading it from disk if it was already computed for this map
         """
+        if CarlaDataProvider._traffic_control_index is None:
+            stop_signs = CarlaDataProvider._world.get_actors().filter('*traffic.stop*')
+            CarlaDataProvider._traffic_control_index = TrafficControlIndex(
+                CarlaDataProvider.get_map(), list(CarlaDataProvider._traffic_light_map), stop_signs)
 
+        return CarlaDataProvider._traffic_control_index
+
+    @staticmethod
+    def get_waypoint_cache():
+        """
+        Returns the waypoint cache of the current map, creating it the first time it is needed
+        """
+        if CarlaDataProvider._waypoint_cache is None:
+            CarlaDataProvider._waypoint_cache = WaypointCache(CarlaDataProvider.get_map())
+
+        return CarlaDataProvider._waypoint_cache
+
+    @staticmethod
+    def _reset_waypoint_cache():
+        """
+        Saves the cells computed by the waypoint cache, and removes it
+        """
+        if CarlaDataProvider._waypoint_cache is not None:
+            CarlaDataProvider._waypoint_cache.save()
+            CarlaDataProvider._waypoint_cache = None
+
+    @staticmethod
+    def get_waypoint(location, project_to_road=True, lane_type=carla.LaneType.Driving):
+        """
+        Same as carla.Map.get_waypoint, but answered by the waypoint cache of the map.
+        The location is quantized to the cache resolution (10cm), so use the map directly
+        if more precision is needed, i.e. for the lane type and id near the lane borders
+        used by the infraction criteria
+        """
+        return CarlaDataProvider.get_waypoint_cache().get_waypoint(location, project_to_road, lane_type)
+
+    @staticmethod
+    def prefetch_route_waypoints(route, lane_types=(carla.LaneType.Driving,)):
+        """
+        Fills the waypoint cache along a route, given as a list of (carla.Transform, RoadOption)
+        """
+        CarlaDataProvider.get_waypoint_cache().prefetch_route(route, lane_types)
+
+    @staticmethod
+    def _get_actor_waypoint(actor, use_cached_location):
+        """
+        Returns the waypoint at the location of the actor. The cached location is answered by the waypoint cache,
+        while the current one is queried to the map, to avoid the quantization of the cache
+        """
         if not use_cached_location:
-            location = actor.get_transform().location
-        else:
-            location = CarlaDataProvider.get_location(actor)
+            return CarlaDataProvider.get_map().get_waypoint(actor.get_transform().location)
 
-        waypoint = CarlaDataProvider.get_map().get_waypoint(location)
+        location = CarlaDataProvider.get_location(actor)
+        if location is None:
+            return None
+        return CarlaDataProvider.get_waypoint(location)
+
+    @staticmethod
+    def _get_closest_traffic_light_to_intersection(waypoint):
+        """
+        Returns the traffic light whose trigger volume is the closest to the end of the lane of the waypoint,
+        before the next intersection, and the distance to that end of the lane
+        """
         # Create list of all waypoints until next intersection
         list_of_waypoints = []
-        while waypoint and not waypoint.is_intersection:
+        while waypoint and not waypoint.is_junction:
             list_of_waypoints.append(waypoint)
-            waypoint = waypoint.next(2.0)[0]
+            next_waypoints = waypoint.next(2.0)
+            waypoint = next_waypoints[0] if next_waypoints else None
 
         # If the list is empty, the actor is in an intersection
         if not list_of_waypoints:
-            return None
+            return None, float('inf')
 
         relevant_traffic_light = None
         distance_to_relevant_traffic_light = float("inf")
+        lane_end = list_of_waypoints[-1].transform.location
 
-        for traffic_light in CarlaDataProvider._traffic_light_map:
+        for traffic_light, tl_t in CarlaDataProvider._traffic_light_map.items():
             if hasattr(traffic_light, 'trigger_volume'):
-                tl_t = CarlaDataProvider._traffic_light_map[traffic_light]
                 transformed_tv = tl_t.transform(traffic_light.trigger_volume.location)
-                distance = carla.Location(transformed_tv).distance(list_of_waypoints[-1].transform.location)
+                distance = carla.Location(transformed_tv).distance(lane_end)
 
                 if distance < distance_to_relevant_traffic_light:
                     relevant_traffic_light = traffic_light
                     distance_to_relevant_traffic_light = distance
 
-        return relevant_traffic_light
+        return relevant_traffic_light, 2.0 * (len(list_of_waypoints) - 1)
+
+    @staticmethod
+    def get_next_traffic_light(actor, use_cached_location=True, return_distance=False):
+        """
+        returns the next relevant traffic light for the provided actor, until the next intersection.
+        If 'return_distance' is True, the distance to its stop line is also returned.
+
+        The traffic light with a stop line at the lanes followed by the actor is looked up at the TrafficControlIndex.
+        If there is none, the traffic light closest to the end of the lane at the intersection is returned,
+        together with the distance to that end of the lane
+        """
+        waypoint = CarlaDataProvider._get_actor_waypoint(actor, use_cached_location)
+        traffic_light, distance = CarlaDataProvider.get_traffic_control_index().get_next_traffic_light(waypoint)
+        if traffic_light is None:
+            traffic_light, distance = CarlaDataProvider._get_closest_traffic_light_to_intersection(waypoint)
+
+        if return_distance:
+            return traffic_light, distance
+        return traffic_light
 
     @staticmethod
     def generate_spawn_points():
@@ -873,14 +1077,22 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
                 else:
                     raise e
 
-        CarlaDataProvider._actor_velocity_map.clear()
-        CarlaDataProvider._actor_location_map.clear()
-        CarlaDataProvider._actor_transform_map.clear()
+        CarlaDataProvider._actor_state_index.clear()
+        CarlaDataProvider._actor_state_actors = []
+        CarlaDataProvider._actor_locations = np.zeros((0, 3))
+        CarlaDataProvider._actor_rotations = np.zeros((0, 3))
+        CarlaDataProvider._actor_velocities = np.zeros((0, 3))
+        CarlaDataProvider._actor_state_valid = np.zeros(0, dtype=bool)
+        CarlaDataProvider._actor_state_alive = np.zeros(0, dtype=bool)
         CarlaDataProvider._traffic_light_map.clear()
+        CarlaDataProvider._traffic_control_index = None
+        CarlaDataProvider._reset_waypoint_cache()
+        reset_map_ids()
         CarlaDataProvider._map = None
         CarlaDataProvider._world = None
         CarlaDataProvider._sync_flag = False
         CarlaDataProvider._ego_vehicle_route = None
+        CarlaDataProvider._route_progress.clear()
         CarlaDataProvider._all_actors = None
         CarlaDataProvider._carla_actor_pool = {}
         CarlaDataProvider._client = None
@@ -27,6 +27,8 @@ from agents.tools.misc import get_speed
 from srunner.scenariomanager.carla_data_provider import CarlaDataProvider
 from srunner.scenariomanager.timer import GameTime
 from srunner.scenariomanager.traffic_events import TrafficEvent, TrafficEventType
+from srunner.tools.grid_index import GridIndex
+from srunner.tools.traffic_control_index import get_traffic_light_waypoints
 
 
 class Criterion(py_trees.behaviour.Behaviour):
@@ -1399,7 +1401,6 @@ class InRouteTest(Criterion):
     - terminate_on_failure [optional]: If True, the complete scenario will terminate upon failure of this test
     """
     MAX_ROUTE_PERCENTAGE = 30  # %
-    WINDOWS_SIZE = 5  # Amount of additional waypoints checked
 
     def __init__(self, actor, route, offroad_min=None, offroad_max=30, name="InRouteTest", terminate_on_failure=False):
         """
@@ -1416,22 +1417,12 @@ class InRouteTest(Criterion):
             self._offroad_min = self._offroad_min
 
         self._world = CarlaDataProvider.get_world()
-        self._route_transforms, _ = zip(*self._route)
-        self._route_length = len(self._route)
+        self._route_progress = CarlaDataProvider.get_route_progress(self._route)
+        self._accum_meters = self._route_progress.accum_dist
         self._current_index = 0
         self._out_route_distance = 0
         self._in_safe_route = True
 
-        self._accum_meters = []
-        prev_loc = self._route_transforms[0].location
-        for i, tran in enumerate(self._route_transforms):
-            loc = tran.location
-            d = loc.distance(prev_loc)
-            accum = 0 if i == 0 else self._accum_meters[i - 1]
-
-            self._accum_meters.append(d + accum)
-            prev_loc = loc
-
         # Blackboard variable
         blackv = py_trees.blackboard.Blackboard()
         _ = blackv.set("InRoute", True)
@@ -1453,19 +1444,12 @@ class InRouteTest(Criterion):
 
             off_route = True
 
-            shortest_distance = float('inf')
-            closest_index = -1
-
-            # Get the closest distance
-            for index in range(self._current_index,
-                               min(self._current_index + self.WINDOWS_SIZE + 1, self._route_length)):
-                ref_location = self._route_transforms[index].location
-                distance = math.sqrt(((location.x - ref_location.x) ** 2) + ((location.y - ref_location.y) ** 2))
-                if distance <= shortest_distance:
-                    closest_index = index
-                    shortest_distance = distance
+            # Get the closest distance, from the progress tracker shared by all the users of the route
+            self._route_progress.update(location, GameTime.get_frame())
+            closest_index = self._route_progress.closest_index
+            shortest_distance = self._route_progress.distance
 
-            if closest_index == -1 or shortest_distance == float('inf'):
+            if shortest_distance == float('inf'):
                 return new_status
 
             # Check if the actor is out of route
@@ -1521,8 +1505,6 @@ class RouteCompletionTest(Criterion):
     - route: Route to be checked
     - terminate_on_failure [optional]: If True, the complete scenario will terminate upon failure of this test
     """
-    WINDOWS_SIZE = 2
-
     # Thresholds to return that a route has been completed
     DISTANCE_THRESHOLD = 10.0  # meters
     # TODO: move to _local file
@@ -1541,31 +1523,15 @@ class RouteCompletionTest(Criterion):
         self._map = CarlaDataProvider.get_map()
 
         self._index = 0
-        self._route_length = len(self._route)
-        self._route_transforms, _ = zip(*self._route)
-        self._route_accum_perc = self._get_acummulated_percentages()
+        self._route_progress = CarlaDataProvider.get_route_progress(self._route)
 
-        self.target_location = self._route_transforms[-1].location
+        self.target_location = self._route[-1][0].location
 
         self._traffic_event = TrafficEvent(event_type=TrafficEventType.ROUTE_COMPLETION, frame=0)
         self._traffic_event.set_dict({'route_completed': self.actual_value})
         self._traffic_event.set_message("Agent has completed {} of the route".format(self.actual_value))
         self.events.append(self._traffic_event)
 
-    def _get_acummulated_percentages(self):
-        """Gets the accumulated percentage of each of the route transforms"""
-        accum_meters = []
-        prev_loc = self._route_transforms[0].location
-        for i, tran in enumerate(self._route_transforms):
-            d = tran.location.distance(prev_loc)
-            new_d = 0 if i == 0 else accum_meters[i - 1]
-
-            accum_meters.append(d + new_d)
-            prev_loc = tran.location
-
-        max_dist = accum_meters[-1]
-        return [x / max_dist * 100 for x in accum_meters]
-
     def update(self):
         """
         Check if the actor location is within trigger region
@@ -1581,16 +1547,9 @@ class RouteCompletionTest(Criterion):
 
         elif self.test_status in ('RUNNING', 'INIT'):
 
-            for index in range(self._index, min(self._index + self.WINDOWS_SIZE + 1, self._route_length)):
-                # Get the dot product to know if it has passed this location
-                route_transform = self._route_transforms[index]
-                route_location = route_transform.location
-                wp_dir = route_transform.get_forward_vector()          # Waypoint's forward vector
-                wp_veh = location - route_location                     # vector route - vehicle
-
-                if wp_veh.dot(wp_dir) > 0:
-                    self._index = index
-                    self.actual_value = self._route_accum_perc[self._index]
+            # Get the last passed route point, from the progress tracker shared by all the users of the route
+            self._index = self._route_progress.update(location, GameTime.get_frame())
+            self.actual_value = self._route_progress.get_completion_percentage(self._index)
 
             self.actual_value = round(self.actual_value, 2)
             self._traffic_event.set_dict({'route_completed': self.actual_value})
@@ -1625,7 +1584,10 @@ class RouteCompletionTest(Criterion):
 class RunningRedLightTest(Criterion):
 
     """
-    Check if an actor is running a red light
+    Check if an actor is running a red light.
+
+    The traffic lights, and the stop lines of the lanes they affect, are computed once,
+    and stored at a grid index, so that only the lights close to the actor are checked
 
     Important parameters:
     - actor: CARLA actor to be used for this test
@@ -1641,14 +1603,32 @@ class RunningRedLightTest(Criterion):
         self._world = CarlaDataProvider.get_world()
         self._map = CarlaDataProvider.get_map()
         self._list_traffic_lights = []
+        self._traffic_light_index = GridIndex(self.DISTANCE_LIGHT)
         self._last_red_light_id = None
         self.debug = False
 
         all_actors = CarlaDataProvider.get_all_actors()
         for _actor in all_actors:
             if 'traffic_light' in _actor.type_id:
-                center, waypoints = self.get_traffic_light_waypoints(_actor)
+                center, waypoints = get_traffic_light_waypoints(_actor, self._map)
+                stop_lines = [self._get_stop_line(wp) for wp in waypoints]
                 self._list_traffic_lights.append((_actor, center, waypoints))
+                self._traffic_light_index.insert((_actor, carla.Location(center), stop_lines), center)
+
+    def _get_stop_line(self, wp):
+        """
+        Returns the lane of a stop line waypoint, its direction and the stop line itself
+        """
+        yaw_wp = wp.transform.rotation.yaw
+        lane_width = wp.lane_width
+        location_wp = wp.transform.location
+
+        lft_lane_wp = self.rotate_point(carla.Vector3D(0.6 * lane_width, 0, 0), yaw_wp + 90)
+        lft_lane_wp = location_wp + carla.Location(lft_lane_wp)
+        rgt_lane_wp = self.rotate_point(carla.Vector3D(0.6 * lane_width, 0, 0), yaw_wp - 90)
+        rgt_lane_wp = location_wp + carla.Location(rgt_lane_wp)
+
+        return (wp.road_id, wp.lane_id), wp.transform.get_forward_vector(), (lft_lane_wp, rgt_lane_wp)
 
     # pylint: disable=no-self-use
     def is_vehicle_crossing_line(self, seg1, seg2):
@@ -1661,6 +1641,26 @@ class RunningRedLightTest(Criterion):
 
         return not inter.is_empty
 
+    def _draw_traffic_lights(self):
+        """
+        Draws the traffic lights and their affected waypoints
+        """
+        z = 2.1
+        for traffic_light, center, waypoints in self._list_traffic_lights:
+            if traffic_light.state == carla.TrafficLightState.Red:
+                color = carla.Color(155, 0, 0)
+            elif traffic_light.state == carla.TrafficLightState.Green:
+                color = carla.Color(0, 155, 0)
+            else:
+                color = carla.Color(155, 155, 0)
+            self._world.debug.draw_point(center + carla.Location(z=z), size=0.2, color=color, life_time=0.01)
+            for wp in waypoints:
+                text = "{}.{}".format(wp.road_id, wp.lane_id)
+                self._world.debug.draw_string(
+                    wp.transform.location + carla.Location(x=1, z=z), text, color=color, life_time=0.01)
+                self._world.debug.draw_point(
+                    wp.transform.location + carla.Location(z=z), size=0.1, color=color, life_time=0.01)
+
     def update(self):
         """
         Check if the actor is running a red light
@@ -1672,6 +1672,9 @@ class RunningRedLightTest(Criterion):
         if location is None:
             return new_status
 
+        if self.debug:
+            self._draw_traffic_lights()
+
         veh_extent = self.actor.bounding_box.extent.x
 
         tail_close_pt = self.rotate_point(carla.Vector3D(-0.8 * veh_extent, 0, 0), transform.rotation.yaw)
@@ -1680,25 +1683,11 @@ class RunningRedLightTest(Criterion):
         tail_far_pt = self.rotate_point(carla.Vector3D(-veh_extent - 1, 0, 0), transform.rotation.yaw)
         tail_far_pt = location + carla.Location(tail_far_pt)
 
-        for traffic_light, center, waypoints in self._list_traffic_lights:
-
-            if self.debug:
-                z = 2.1
-                if traffic_light.state == carla.TrafficLightState.Red:
-                    color = carla.Color(155, 0, 0)
-                elif traffic_light.state == carla.TrafficLightState.Green:
-                    color = carla.Color(0, 155, 0)
-                else:
-                    color = carla.Color(155, 155, 0)
-                self._world.debug.draw_point(center + carla.Location(z=z), size=0.2, color=color, life_time=0.01)
-                for wp in waypoints:
-                    text = "{}.{}".format(wp.road_id, wp.lane_id)
-                    self._world.debug.draw_string(
-                        wp.transform.location + carla.Location(x=1, z=z), text, color=color, life_time=0.01)
-                    self._world.debug.draw_point(
-                        wp.transform.location + carla.Location(z=z), size=0.1, color=color, life_time=0.01)
+        # Only computed if there is a red light nearby
+        tail_lane = None
+        ve_dir = transform.get_forward_vector()
 
-            center_loc = carla.Location(center)
+        for traffic_light, center_loc, stop_lines in self._traffic_light_index.query(location, self.DISTANCE_LIGHT):
 
             if self._last_red_light_id and self._last_red_light_id == traffic_light.id:
                 continue
@@ -1707,40 +1696,30 @@ class RunningRedLightTest(Criterion):
             if traffic_light.state != carla.TrafficLightState.Red:
                 continue
 
-            for wp in waypoints:
-
+            if tail_lane is None:
                 tail_wp = self._map.get_waypoint(tail_far_pt)
+                tail_lane = (tail_wp.road_id, tail_wp.lane_id)
 
-                # Calculate the dot product (Might be unscaled, as only its sign is important)
-                ve_dir = CarlaDataProvider.get_transform(self.actor).get_forward_vector()
-                wp_dir = wp.transform.get_forward_vector()
+            for lane, wp_dir, stop_line in stop_lines:
 
                 # Check the lane until all the "tail" has passed
-                if tail_wp.road_id == wp.road_id and tail_wp.lane_id == wp.lane_id and ve_dir.dot(wp_dir) > 0:
-                    # This light is red and is affecting our lane
-                    yaw_wp = wp.transform.rotation.yaw
-                    lane_width = wp.lane_width
-                    location_wp = wp.transform.location
-
-                    lft_lane_wp = self.rotate_point(carla.Vector3D(0.6 * lane_width, 0, 0), yaw_wp + 90)
-                    lft_lane_wp = location_wp + carla.Location(lft_lane_wp)
-                    rgt_lane_wp = self.rotate_point(carla.Vector3D(0.6 * lane_width, 0, 0), yaw_wp - 90)
-                    rgt_lane_wp = location_wp + carla.Location(rgt_lane_wp)
-
+                # (the dot product might be unscaled, as only its sign is important)
+                if tail_lane == lane and ve_dir.dot(wp_dir) > 0:
+                    # This light is red and is affecting our lane.
                     # Is the vehicle traversing the stop line?
-                    if self.is_vehicle_crossing_line((tail_close_pt, tail_far_pt), (lft_lane_wp, rgt_lane_wp)):
+                    if self.is_vehicle_crossing_line((tail_close_pt, tail_far_pt), stop_line):
 
                         self.test_status = "FAILURE"
                         self.actual_value += 1
-                        location = traffic_light.get_transform().location
+                        light_location = traffic_light.get_transform().location
                         red_light_event = TrafficEvent(event_type=TrafficEventType.TRAFFIC_LIGHT_INFRACTION, frame=GameTime.get_frame())
                         red_light_event.set_message(
                             "Agent ran a red light {} at (x={}, y={}, z={})".format(
                                 traffic_light.id,
-                                round(location.x, 3),
-                                round(location.y, 3),
-                                round(location.z, 3)))
-                        red_light_event.set_dict({'id': traffic_light.id, 'location': location})
+                                round(light_location.x, 3),
+                                round(light_location.y, 3),
+                                round(light_location.z, 3)))
+                        red_light_event.set_dict({'id': traffic_light.id, 'location': light_location})
 
                         self.events.append(red_light_event)
                         self._last_red_light_id = traffic_light.id
@@ -1761,50 +1740,14 @@ class RunningRedLightTest(Criterion):
         y_ = math.sin(math.radians(angle)) * point.x + math.cos(math.radians(angle)) * point.y
         return carla.Vector3D(x_, y_, point.z)
 
-    def get_traffic_light_waypoints(self, traffic_light):
-        """
-        get area of a given traffic light
-        """
-        base_transform = traffic_light.get_transform()
-        base_rot = base_transform.rotation.yaw
-        area_loc = base_transform.transform(traffic_light.trigger_volume.location)
-
-        # Discretize the trigger box into points
-        area_ext = traffic_light.trigger_volume.extent
-        x_values = np.arange(-0.9 * area_ext.x, 0.9 * area_ext.x, 1.0)  # 0.9 to avoid crossing to adjacent lanes
-
-        area = []
-        for x in x_values:
-            point = self.rotate_point(carla.Vector3D(x, 0, area_ext.z), base_rot)
-            point_location = area_loc + carla.Location(x=point.x, y=point.y)
-            area.append(point_location)
-
-        # Get the waypoints of these points, removing duplicates
-        ini_wps = []
-        for pt in area:
-            wpx = self._map.get_waypoint(pt)
-            # As x_values are arranged in order, only the last one has to be checked
-            if not ini_wps or ini_wps[-1].road_id != wpx.road_id or ini_wps[-1].lane_id != wpx.lane_id:
-                ini_wps.append(wpx)
-
-        # Advance them until the intersection
-        wps = []
-        for wpx in ini_wps:
-            while not wpx.is_intersection:
-                next_wp = wpx.next(0.5)[0]
-                if next_wp and not next_wp.is_intersection:
-                    wpx = next_wp
-                else:
-                    break
-            wps.append(wpx)
-
-        return area_loc, wps
-
 
 class RunningStopTest(Criterion):
 
     """
-    Check if an actor is running a stop sign
+    Check if an actor is running a stop sign.
+
+    The trigger areas of the stop signs are computed once, and stored at a grid index,
+    so that only the stops close to the actor are checked
 
     Important parameters:
     - actor: CARLA actor to be used for this test
@@ -1821,6 +1764,8 @@ class RunningStopTest(Criterion):
         self._world = CarlaDataProvider.get_world()
         self._map = CarlaDataProvider.get_map()
         self._list_stop_signs = []
+        self._stop_sign_areas = {}
+        self._stop_sign_index = GridIndex(self.PROXIMITY_THRESHOLD)
         self._target_stop_sign = None
         self._stop_completed = False
 
@@ -1830,6 +1775,13 @@ class RunningStopTest(Criterion):
             if 'traffic.stop' in _actor.type_id:
                 self._list_stop_signs.append(_actor)
 
+                stop_location = _actor.get_transform().transform(_actor.trigger_volume.location)
+                stop_extent = _actor.trigger_volume.extent
+                stop_extent.x = max(0.5, stop_extent.x) # Increase the stop signs extents, otherwise they are sometimes < 2cm and are not detected reliably
+                stop_extent.y = max(0.5, stop_extent.y)
+                self._stop_sign_areas[_actor.id] = (stop_location, stop_extent)
+                self._stop_sign_index.insert(_actor, stop_location)
+
     def point_inside_boundingbox(self, point, bb_center, bb_extent, multiplier=1.2):
         """Checks whether or not a point is inside a bounding box."""
 
@@ -1855,16 +1807,13 @@ class RunningStopTest(Criterion):
         Without using waypoints, a stop might not be detected if the actor is moving at the lane edge.
         """
         # Quick distance test
-        stop_location = stop.get_transform().transform(stop.trigger_volume.location)
+        stop_location, stop_extent = self._stop_sign_areas[stop.id]
         actor_location = wp_list[0].transform.location
         if stop_location.distance(actor_location) > self.PROXIMITY_THRESHOLD:
             return False
 
         # Check if the any of the actor wps is inside the stop's bounding box.
         # Using more than one waypoint removes issues with small trigger volumes and backwards movement
-        stop_extent = stop.trigger_volume.extent
-        stop_extent.x = max(0.5, stop_extent.x) # Increase the stop signs extents, otherwise they are sometimes < 2cm and are not detected reliably
-        stop_extent.y = max(0.5, stop_extent.y)
         for actor_wp in wp_list:
             if self.point_inside_boundingbox(actor_wp.transform.location, stop_location, stop_extent):
                 return True
@@ -1888,17 +1837,19 @@ class RunningStopTest(Criterion):
         if actor_direction.dot(lane_direction) < -0.17:  # 100º, just in case
             return None
 
-        for stop in self._list_stop_signs:
+        # Only the stops around the actor can affect it
+        nearby_stops = self._stop_sign_index.query(wp_list[0].transform.location, self.PROXIMITY_THRESHOLD)
+        for stop in nearby_stops:
             if self.is_actor_affected_by_stop(wp_list, stop):
                 return stop
 
-    def _get_waypoints(self, actor):
+    def _get_waypoints(self, actor_location):
         """Returns a list of waypoints starting from the ego location and a set amount forward"""
         wp_list = []
         steps = int(self.PROXIMITY_THRESHOLD / self.WAYPOINT_STEP)
 
         # Add the actor location
-        wp = self._map.get_waypoint(actor.get_location())
+        wp = self._map.get_waypoint(actor_location)
         wp_list.append(wp)
 
         # And its forward waypoints
@@ -1918,8 +1869,10 @@ class RunningStopTest(Criterion):
         """
         new_status = py_trees.common.Status.RUNNING
 
-        actor_transform = self.actor.get_transform()
-        check_wps = self._get_waypoints(self.actor)
+        actor_transform = CarlaDataProvider.get_transform(self.actor)
+        if actor_transform is None:
+            return new_status
+        check_wps = self._get_waypoints(actor_transform.location)
 
         if not self._target_stop_sign:
             self._target_stop_sign = self._scan_for_stop_sign(actor_transform, check_wps)
@@ -1971,7 +1924,6 @@ class MinimumSpeedRouteTest(Criterion):
     - route: Route to be checked
     - terminate_on_failure [optional]: If True, the complete scenario will terminate upon failure of this test
     """
-    WINDOWS_SIZE = 2
     RATIO = 1
 
     def __init__(self, actor, route, checkpoints=1, name="MinimumSpeedRouteTest", terminate_on_failure=False):
@@ -1983,16 +1935,8 @@ class MinimumSpeedRouteTest(Criterion):
         self.actual_value = 100
 
         self._route = route
-        self._accum_dist = []
-        prev_trans = None
-        for trans, _ in route:
-            if prev_trans:
-                dist = trans.location.distance(prev_trans.location)
-                self._accum_dist.append(dist + self._accum_dist[-1])
-            else:
-                self._accum_dist.append(0)
-            prev_trans = trans
-        self._route_length = len(self._route)
+        self._route_progress = CarlaDataProvider.get_route_progress(self._route)
+        self._accum_dist = self._route_progress.accum_dist
 
         self._checkpoints = checkpoints
         self._checkpoint_dist = self._accum_dist[-1] / self._checkpoints
@@ -2021,15 +1965,7 @@ class MinimumSpeedRouteTest(Criterion):
         if location is None:
             return new_status
 
-        for index in range(self._index, min(self._index + self.WINDOWS_SIZE + 1, self._route_length)):
-            # Get the dot product to know if it has passed this location
-            route_transform = self._route[index][0]
-            route_location = route_transform.location
-            wp_dir = route_transform.get_forward_vector()
-            wp_veh = location - route_location
-
-            if wp_veh.dot(wp_dir) > 0:
-                self._index = index
+        self._index = self._route_progress.update(location, GameTime.get_frame())
 
         if self._accum_dist[self._index] - self._current_dist > self._checkpoint_dist:
             self._set_traffic_event()
@@ -9,6 +9,7 @@ Scenario spawning elements to make the town dynamic and interesting
 """
 
 from collections import OrderedDict
+import numpy as np
 import py_trees
 
 import carla
@@ -17,6 +18,9 @@ from agents.navigation.local_planner import RoadOption
 
 from srunner.scenariomanager.carla_data_provider import CarlaDataProvider
 from srunner.scenariomanager.scenarioatomics.atomic_behaviors import AtomicBehavior
+from srunner.scenariomanager.timer import GameTime
+from srunner.tools.actor_pool import ActorPool
+from srunner.tools.map_cache import load_map_cache, save_map_cache
 from srunner.tools.scenario_helper import get_same_dir_lanes, get_opposite_dir_lanes
 
 JUNCTION_ENTRY = 'entry'
@@ -162,6 +166,156 @@ class Junction(object):
         return False
 
 
+class JunctionTopologyCache(object):
+
+    """
+    Town level topology of the junctions, computed lazily and saved per map, as it doesn't depend on the route.
+    For each junction, it stores whether or not it is a fake one, the entry / exit lanes of its fake maneuvers,
+    and the waypoints just outside of it of each of its maneuvers (saved as their OpenDRIVE road, lane and s)
+    """
+
+    CACHE_TAG = 'junction_topology'
+    CACHE_VERSION = 1
+
+    def __init__(self, carla_map, use_cache=True):
+        self._map = carla_map
+        self._use_cache = use_cache
+        self._modified = False
+
+        data = load_map_cache(carla_map, self.CACHE_TAG, self.CACHE_VERSION) if use_cache else None
+        self._junctions = data['junctions'] if data is not None else {}
+
+    def _get_data(self, junction):
+        return self._junctions.setdefault(str(junction.id), {})
+
+    def _is_junction(self, waypoint):
+        """Same as 'BackgroundBehavior._is_junction', using the fake junctions of the whole town"""
+        return waypoint.is_junction and not self.is_fake(waypoint.get_junction())
+
+    @staticmethod
+    def _walk_out(waypoint, is_junction, step, backwards):
+        """Moves the waypoint out of the junction. Returns None if there are no more waypoints"""
+        while is_junction(waypoint):
+            waypoints = waypoint.previous(step) if backwards else waypoint.next(step)
+            if len(waypoints) == 0:
+                return None
+            waypoint = waypoints[0]
+        return waypoint
+
+    def _get_lane(self, waypoint):
+        return None if waypoint is None else [waypoint.road_id, waypoint.lane_id, waypoint.s]
+
+    def _get_waypoint(self, lane):
+        return None if lane is None else self._map.get_waypoint_xodr(*lane)
+
+    def is_fake(self, junction):
+        """
+        Checks if a junction is fake, that is, it has no intersecting maneuvers (i.e, no two maneuvers
+        start / end at the same lane). However, this fails for highway entry / exits with dedicated lanes,
+        so specifically check those
+        """
+        data = self._get_data(junction)
+        if 'fake' in data:
+            return data['fake']
+
+        maneuvers = []
+        for entry_wp, exit_wp in junction.get_waypoints(carla.LaneType.Driving):
+            maneuvers.append((self._walk_out(entry_wp, lambda wp: wp.is_junction, 0.2, True),
+                              self._walk_out(exit_wp, lambda wp: wp.is_junction, 0.2, False)))
+
+        data['fake'] = self._has_fake_maneuvers(maneuvers)
+        self._modified = True
+        return data['fake']
+
+    @staticmethod
+    def _has_fake_maneuvers(maneuvers):
+        """Checks the maneuvers of a junction, given as pairs of (entry, exit) waypoints outside of it"""
+        used_entries = []
+        used_exits = []
+
+        # Search for intersecting maneuvers
+        for entry_wp, exit_wp in maneuvers:
+            entry_key = get_lane_key(entry_wp)
+            exit_key = get_lane_key(exit_wp)
+
+            # Check if a maneuver starts / ends at another one.
+            # Checking if it was used isn't enough as some maneuvers are repeated in CARLA maps.
+            # Instead, check if the index of both entry and exit are different.
+            entry_index = -1 if entry_key not in used_entries else used_entries.index(entry_key)
+            exit_index = -1 if exit_key not in used_exits else used_exits.index(exit_key)
+
+            if exit_index != entry_index:
+                return False
+
+            used_entries.append(entry_key)
+            used_exits.append(exit_key)
+
+        # Search for highway dedicated lane entries.
+        used_entry_roads = {}
+        used_exit_roads = {}
+        for entry_wp, exit_wp in maneuvers:
+            entry_road_key = get_road_key(entry_wp)
+            exit_road_key = get_road_key(exit_wp)
+
+            # Entries / exits with dedicated lanes have no intersecting maneuvers
+            # (as the entry / exit is a lane that finishes, not a maneuvers part of a junction),
+            # so they are missfiltered as fake junctions.
+            # Detect them by an entry road having 3 or more lanes. TODO: Improve this
+            used_entry_roads[entry_road_key] = used_entry_roads.get(entry_road_key, -1) + 1
+            used_exit_roads[exit_road_key] = used_exit_roads.get(exit_road_key, -1) + 1
+
+            if used_entry_roads[entry_road_key] >= 3 or used_exit_roads[exit_road_key] >= 3:
+                return False
+
+        # TODO: Recheck for old CARLA maps
+        return True
+
+    def get_fake_lane_pairs(self, junction):
+        """Gets a list of entry-exit lane keys of a fake junction"""
+        data = self._get_data(junction)
+        if 'fake_lane_pairs' in data:
+            return data['fake_lane_pairs']
+
+        lane_pairs = []
+        for entry_wp, exit_wp in junction.get_waypoints(carla.LaneType.Driving):
+            entry_wp = self._walk_out(entry_wp, lambda wp: wp.is_junction, 0.5, True)
+            exit_wp = self._walk_out(exit_wp, lambda wp: wp.is_junction, 0.5, False)
+            if entry_wp and exit_wp:
+                lane_pairs.append([get_lane_key(entry_wp), get_lane_key(exit_wp)])
+
+        data['fake_lane_pairs'] = lane_pairs
+        self._modified = True
+        return lane_pairs
+
+    def get_maneuvers(self, junction):
+        """
+        Returns the maneuvers of a junction as pairs of (entry, exit) waypoints outside of it.
+        Any of them can be None, if their lane ends before leaving the junction
+        """
+        data = self._get_data(junction)
+        if 'maneuvers' in data:
+            # Recompute them if any of the waypoints can't be recreated
+            maneuvers = [(self._get_waypoint(entry), self._get_waypoint(exit_)) for entry, exit_ in data['maneuvers']]
+            if all((wp is None) == (lane is None) for maneuver, lanes in zip(maneuvers, data['maneuvers'])
+                   for wp, lane in zip(maneuver, lanes)):
+                return maneuvers
+
+        maneuvers = []
+        for entry_wp, exit_wp in junction.get_waypoints(carla.LaneType.Driving):
+            maneuvers.append((self._walk_out(entry_wp, self._is_junction, 0.2, True),
+                              self._walk_out(exit_wp, self._is_junction, 0.2, False)))
+
+        data['maneuvers'] = [[self._get_lane(entry_wp), self._get_lane(exit_wp)] for entry_wp, exit_wp in maneuvers]
+        self._modified = True
+        return maneuvers
+
+    def save(self):
+        """Saves the topology of the map, if new junctions have been computed"""
+        if self._use_cache and self._modified:
+            save_map_cache(self._map, self.CACHE_TAG, self.CACHE_VERSION, {'junctions': self._junctions})
+            self._modified = False
+
+
 class BackgroundBehavior(AtomicBehavior):
     """
     Handles the background activity
@@ -182,6 +336,11 @@ class BackgroundBehavior(AtomicBehavior):
 
         self._attribute_filter = {'base_type': 'car', 'special_type': '', 'has_lights': True, }
 
+        # Despawned vehicles are parked and reused by later spawns
+        self._actor_pool = ActorPool('vehicle.*', self._tm_port, 'background', self._attribute_filter, max_size=50)
+        self._actor_pool_warm_size = 10  # Vehicles parked at the start of the route
+        self._actors_with_path = set()  # The TM path of a vehicle can't be reset, so these aren't reused
+
         # Global variables
         self._ego_actor = ego_actor
         self._ego_state = EGO_ROAD
@@ -190,6 +349,8 @@ class BackgroundBehavior(AtomicBehavior):
         self._route_index = 0
         self._get_route_data(route)
         self._actors_speed_perc = {}  # Dictionary actor - percentage
+        self._actors_sent_speed = {}  # Dictionary actor - last speed sent to the TM
+        self._speed_tolerance = 0.1  # Speed changes smaller than this aren't sent to the TM [km/h]
         self._all_actors = []
         self._lane_width_threshold = 2.25  # Used to stop some behaviors at narrow lanes to avoid problems [m]
 
@@ -197,6 +358,7 @@ class BackgroundBehavior(AtomicBehavior):
         self._reuse_dist = 10  # When spawning actors, might reuse actors closer to this distance
         self._spawn_free_radius = 20  # Sources closer to the ego will not spawn actors
         self._fake_junction_ids = []
+        self._junction_topology = None
         self._fake_lane_pair_keys = []
 
         # Initialisation values
@@ -263,21 +425,16 @@ class BackgroundBehavior(AtomicBehavior):
         """Extract the information from the route"""
         self._route = []  # Transform the route into a list of waypoints
         self._route_options = []  # Extract the RoadOptions from the route
-        self._accum_dist = []  # Save the total traveled distance for each waypoint
-        prev_trans = None
         for trans, option in route:
             self._route.append(self._map.get_waypoint(trans.location))
             self._route_options.append(option)
-            if prev_trans:
-                dist = trans.location.distance(prev_trans.location)
-                self._accum_dist.append(dist + self._accum_dist[-1])
-            else:
-                self._accum_dist.append(0)
-            prev_trans = trans
+
+        # The ego progress is tracked by the tracker shared by all the users of the route
+        self._route_progress = CarlaDataProvider.get_route_progress(route)
+        self._accum_dist = self._route_progress.accum_dist  # Save the total traveled distance for each waypoint
 
         self._route_length = len(route)
         self._route_index = 0
-        self._route_buffer = 3
 
     def _get_road_radius(self):
         """
@@ -298,6 +455,7 @@ class BackgroundBehavior(AtomicBehavior):
         self._initialise_road_behavior(same_dir_wps)
         self._initialise_opposite_sources()
         self._initialise_road_checker()
+        self._actor_pool.warm_up(self._actor_pool_warm_size)
 
     def update(self):
         prev_ego_index = self._route_index
@@ -345,7 +503,8 @@ class BackgroundBehavior(AtomicBehavior):
         """Destroy all actors"""
         all_actors = list(self._actors_speed_perc)
         for actor in list(all_actors):
-            self._destroy_actor(actor)
+            self._destroy_actor(actor, reuse=False)
+        self._actor_pool.destroy()
         super(BackgroundBehavior, self).terminate(new_status)
 
     def _check_background_actors(self):
@@ -360,7 +519,12 @@ class BackgroundBehavior(AtomicBehavior):
     ################################
 
     def _create_junction_dict(self):
-        """Extracts the junctions the ego vehicle will pass through."""
+        """
+        Extracts the junctions the ego vehicle will pass through. Their topology is taken from
+        the one of the town, which is only computed for the junctions not seen by previous routes
+        """
+        self._junction_topology = JunctionTopologyCache(self._map)
+
         data = self._get_junctions_data()
         fake_data, filtered_data = self._filter_fake_junctions(data)
         self._get_fake_lane_pairs(fake_data)
@@ -368,6 +532,8 @@ class BackgroundBehavior(AtomicBehavior):
         self._add_junctions_topology(route_data)
         self._junctions = route_data
 
+        self._junction_topology.save()
+
     def _get_junctions_data(self):
         """Gets all the junctions the ego passes through"""
         junction_data = []
@@ -414,8 +580,7 @@ class BackgroundBehavior(AtomicBehavior):
     def _filter_fake_junctions(self, data):
         """
         Filters fake junctions. A fake junction is that which has no intersecting maneuvers
-        (i.e, no two maneuvers start / end at the same lane).
-        However, this fails for highway entry / exits with dedicated lanes, so specifically check those
+        (i.e, no two maneuvers start / end at the same lane). See 'JunctionTopologyCache.is_fake'
         """
         fake_data = []
         filtered_data = []
@@ -425,67 +590,10 @@ class BackgroundBehavior(AtomicBehavior):
                 filtered_data.append(junction_data)
                 continue  # These are always junctions
 
-            junction = junction_data.junctions[0]
-
-            found_intersecting_maneuvers = False
-            used_entries = []
-            used_exits = []
-
-            # Search for intersecting maneuvers
-            for entry_wp, exit_wp in junction.get_waypoints(carla.LaneType.Driving):
-                entry_key = get_lane_key(self._get_junction_entry_wp(entry_wp))
-                exit_key = get_lane_key(self._get_junction_exit_wp(exit_wp))
-
-                # Check if a maneuver starts / ends at another one.
-                # Checking if it was used isn't enough as some maneuvers are repeated in CARLA maps.
-                # Instead, check if the index of both entry and exit are different.
-                entry_index = -1 if entry_key not in used_entries else used_entries.index(entry_key)
-                exit_index = -1 if exit_key not in used_exits else used_exits.index(exit_key)
-
-                if exit_index != entry_index:
-                    found_intersecting_maneuvers = True
-                    break
-
-                used_entries.append(entry_key)
-                used_exits.append(exit_key)
-
-            if found_intersecting_maneuvers:
-                filtered_data.append(junction_data)
-                continue
-
-            # Search for highway dedicated lane entries.
-            found_highway = False
-            used_entry_roads = {}
-            used_exit_roads = {}
-            for entry_wp, exit_wp in junction.get_waypoints(carla.LaneType.Driving):
-                entry_road_key = get_road_key(self._get_junction_entry_wp(entry_wp))
-                exit_road_key = get_road_key(self._get_junction_exit_wp(exit_wp))
-
-                # Entries / exits with dedicated lanes have no intersecting maneuvers
-                # (as the entry / exit is a lane that finishes, not a maneuvers part of a junction),
-                # so they are missfiltered as fake junctions.
-                # Detect them by an entry road having 3 or more lanes. TODO: Improve this
-                if entry_road_key in used_entry_roads:
-                    used_entry_roads[entry_road_key] += 1
-                else:
-                    used_entry_roads[entry_road_key] = 0
-
-                if exit_road_key in used_exit_roads:
-                    used_exit_roads[exit_road_key] += 1
-                else:
-                    used_exit_roads[exit_road_key] = 0
-
-                if used_entry_roads[entry_road_key] >= 3 or used_exit_roads[exit_road_key] >= 3:
-                    found_highway = True
-                    break
-
-            if found_highway:
+            if self._junction_topology.is_fake(junction_data.junctions[0]):
+                fake_data.append(junction_data)
+            else:
                 filtered_data.append(junction_data)
-                continue
-
-            fake_data.append(junction_data)
-
-            # TODO: Recheck for old CARLA maps
 
         return fake_data, filtered_data
 
@@ -541,16 +649,16 @@ class BackgroundBehavior(AtomicBehavior):
         """
         route_data = []
         prev_index = -1
+        all_complex_junctions = self._get_complex_junctions() if filtered_data else []
 
         # If entering a complex, add all its junctions to the list
         for junction_data in filtered_data:
             junction = junction_data.junctions[0]
             prev_junction = route_data[-1] if len(route_data) > 0 else None
-            complex_junctions = self._get_complex_junctions()
 
             # Get the complex index
             current_index = -1
-            for i, complex_junctions in enumerate(complex_junctions):
+            for i, complex_junctions in enumerate(all_complex_junctions):
                 complex_ids = [j.id for j in complex_junctions]
                 if junction.id in complex_ids:
                     current_index = i
@@ -581,44 +689,10 @@ class BackgroundBehavior(AtomicBehavior):
         """Gets a list of entry-exit lanes of the fake junctions"""
         for fake_junctions_data in fake_data:
             for junction in fake_junctions_data.junctions:
-                for entry_wp, exit_wp in junction.get_waypoints(carla.LaneType.Driving):
-                    while self._is_junction(entry_wp):
-                        entry_wps = entry_wp.previous(0.5)
-                        if len(entry_wps) == 0:
-                            break  # Stop when there's no prev
-                        entry_wp = entry_wps[0]
-                    if self._is_junction(entry_wp):
-                        continue  # Triggered by the loops break
-
-                    while self._is_junction(exit_wp):
-                        exit_wps = exit_wp.next(0.5)
-                        if len(exit_wps) == 0:
-                            break  # Stop when there's no prev
-                        exit_wp = exit_wps[0]
-                    if self._is_junction(exit_wp):
-                        continue  # Triggered by the loops break
-
+                lane_pair_keys = self._junction_topology.get_fake_lane_pairs(junction)
+                if lane_pair_keys:
                     self._fake_junction_ids.append(junction.id)
-                    self._fake_lane_pair_keys.append([get_lane_key(entry_wp), get_lane_key(exit_wp)])
-
-    def _get_junction_entry_wp(self, entry_wp):
-        """For a junction waypoint, returns a waypoint outside of it that entrys into its lane"""
-        # Exit the junction
-        while self._is_junction(entry_wp):
-            entry_wps = entry_wp.previous(0.2)
-            if len(entry_wps) == 0:
-                return None  # Stop when there's no prev
-            entry_wp = entry_wps[0]
-        return entry_wp
-
-    def _get_junction_exit_wp(self, exit_wp):
-        """For a junction waypoint, returns a waypoint outside of it from which the lane exits the junction"""
-        while self._is_junction(exit_wp):
-            exit_wps = exit_wp.next(0.2)
-            if len(exit_wps) == 0:
-                return None  # Stop when there's no prev
-            exit_wp = exit_wps[0]
-        return exit_wp
+                    self._fake_lane_pair_keys.extend(lane_pair_keys)
 
     def _get_closest_junction_waypoint(self, waypoint, junction_wps):
         """
@@ -663,9 +737,8 @@ class BackgroundBehavior(AtomicBehavior):
             if self.debug:
                 print(' --------------------- ')
             for junction in junction_data.junctions:
-                for entry_wp, exit_wp in junction.get_waypoints(carla.LaneType.Driving):
+                for entry_wp, exit_wp in self._junction_topology.get_maneuvers(junction):
 
-                    entry_wp = self._get_junction_entry_wp(entry_wp)
                     if not entry_wp:
                         continue
                     if get_lane_key(entry_wp) not in used_entry_lanes:
@@ -674,7 +747,6 @@ class BackgroundBehavior(AtomicBehavior):
                         if self.debug:
                             draw_point(self._world, entry_wp.transform.location, DEBUG_SMALL, DEBUG_ENTRY, True)
 
-                    exit_wp = self._get_junction_exit_wp(exit_wp)
                     if not exit_wp:
                         continue
                     if get_lane_key(exit_wp) not in used_exit_lanes:
@@ -1009,7 +1081,7 @@ class BackgroundBehavior(AtomicBehavior):
             if source_location.distance(actor_location) > self._reuse_dist:
                 continue  # Don't use actors far away
 
-            actor_wp = self._map.get_waypoint(actor_location)
+            actor_wp = CarlaDataProvider.get_waypoint(actor_location)
             if get_lane_key(actor_wp) not in source.previous_lane_keys:
                 continue  # Don't use actors that won't pass through the source
 
@@ -1498,6 +1570,7 @@ class BackgroundBehavior(AtomicBehavior):
                     if i >= min_index and i <= max_index:
                         source_actors.append(actor)
                         self._tm.set_path(actor, side_path)
+                        self._actors_with_path.add(actor)
                     else:
                         self._destroy_actor(actor)
 
@@ -2109,7 +2182,11 @@ class BackgroundBehavior(AtomicBehavior):
     def _initialise_actor(self, actor):
         """
         Save the actor into the needed structures, disable its lane changes and set the leading distance.
+        Vehicles reused from the pool keep the TM settings of their previous life, so the rest of the
+        ones changed by this behavior are reset too.
         """
+        self._tm.ignore_lights_percentage(actor, 0)
+        self._tm.ignore_signs_percentage(actor, 0)
         self._tm.auto_lane_change(actor, self._vehicle_lane_change)
         self._tm.update_vehicle_lights(actor, self._vehicle_lights)
         self._tm.distance_to_leading_vehicle(actor, self._vehicle_leading_distance)
@@ -2127,10 +2204,13 @@ class BackgroundBehavior(AtomicBehavior):
             spawn_wp.transform.rotation
         )
 
-        actor = CarlaDataProvider.request_new_actor(
-            'vehicle.*', spawn_transform, 'background', True,
-            attribute_filter={'base_type': 'car', 'has_lights': True}, tick=False
-        )
+        # Parked vehicles also match this filter, so try to reuse one first
+        actor = self._actor_pool.acquire(spawn_transform)
+        if not actor:
+            actor = CarlaDataProvider.request_new_actor(
+                'vehicle.*', spawn_transform, 'background', True,
+                attribute_filter={'base_type': 'car', 'has_lights': True}, tick=False
+            )
 
         if not actor:
             return actor
@@ -2149,9 +2229,7 @@ class BackgroundBehavior(AtomicBehavior):
                                 wp.transform.rotation)
             )
 
-        actors = CarlaDataProvider.request_new_batch_actors(
-            'vehicle.*', len(spawn_transforms), spawn_transforms, True, False, 'background',
-            attribute_filter=self._attribute_filter, tick=False)
+        actors = self._actor_pool.spawn_actors(spawn_transforms)
 
         if not actors:
             return actors
@@ -2172,9 +2250,7 @@ class BackgroundBehavior(AtomicBehavior):
             source_transform.location + carla.Location(z=self._spawn_vertical_shift),
             source_transform.rotation
         )
-        actor = CarlaDataProvider.request_new_actor(
-            'vehicle.*', new_transform, rolename='background',
-            autopilot=True, random_location=False, attribute_filter=self._attribute_filter, tick=False)
+        actor = self._actor_pool.spawn_actor(new_transform)
 
         if not actor:
             return actor
@@ -2191,71 +2267,106 @@ class BackgroundBehavior(AtomicBehavior):
             return True
         return False
 
+    def _are_locations_behind_ego(self, locations):
+        """Vectorized version of '_is_location_behind_ego', for a N x 3 array of locations"""
+        ego_transform = self._route[self._route_index].transform
+        ego_heading = ego_transform.get_forward_vector()
+        ego_location = ego_transform.location
+        ego_actor_vecs = locations - np.array([ego_location.x, ego_location.y, ego_location.z])
+        return ego_actor_vecs.dot(np.array([ego_heading.x, ego_heading.y, ego_heading.z])) < - 0.17  # 100º
+
     def _update_road_actors(self):
         """
         Dynamically controls the actor speed in front of the ego.
         Not applied to those behind it so that they can catch up it
         """
-        # Updates their speed
         scenario_actors = self._scenario_stopped_actors + self._scenario_stopped_back_actors
+
+        road_actors = []
         for lane_key in self._road_dict:
             for i, actor in enumerate(self._road_dict[lane_key].actors):
-                location = CarlaDataProvider.get_location(actor)
-                if not location:
-                    continue
-                if self.debug:
-                    string = 'R_'
-                    string += 'B' if self._is_location_behind_ego(location) else 'F'
-                    string += '_(' + str(i) + ')'
-                    string += '_[' + lane_key + ']'
-                    draw_string(self._world, location, string, DEBUG_ROAD, False)
-
-                # Actors part of scenarios are their own category, ignore them
-                if actor in scenario_actors:
-                    continue
+                road_actors.append((lane_key, i, actor))
+        if not road_actors:
+            return
 
-                # TODO: Lane changes are weird with the TM, so just stop them
-                actor_wp = self._map.get_waypoint(location)
-                if actor_wp.lane_width < self._lane_width_threshold:
+        # Get all their locations at once
+        locations, valid = CarlaDataProvider.get_locations([actor for _, _, actor in road_actors])
+        if self.debug:
+            behind = self._are_locations_behind_ego(locations)
 
-                    # Ensure only ending lanes are affected. not sure if it is needed though
-                    next_wps = actor_wp.next(0.5)
-                    if next_wps and next_wps[0].lane_width < actor_wp.lane_width:
-                        actor.set_target_velocity(carla.Vector3D(0, 0, 0))
-                        self._actors_speed_perc[actor] = 0
-                        lights = actor.get_light_state()
-                        lights |= carla.VehicleLightState.RightBlinker
-                        lights |= carla.VehicleLightState.LeftBlinker
-                        lights |= carla.VehicleLightState.Position
-                        actor.set_light_state(carla.VehicleLightState(lights))
-                        actor.set_autopilot(False, self._tm_port)
-                        continue
+        speed_actors = []
+        speed_rows = []
+        for row, (lane_key, i, actor) in enumerate(road_actors):
+            if not valid[row]:
+                continue
+            location = carla.Location(*locations[row])
+            if self.debug:
+                string = 'R_'
+                string += 'B' if behind[row] else 'F'
+                string += '_(' + str(i) + ')'
+                string += '_[' + lane_key + ']'
+                draw_string(self._world, location, string, DEBUG_ROAD, False)
+
+            # Actors part of scenarios are their own category, ignore them
+            if actor in scenario_actors:
+                continue
 
-                self._set_road_actor_speed(location, actor)
+            # TODO: Lane changes are weird with the TM, so just stop them
+            actor_wp = CarlaDataProvider.get_waypoint(location)
+            if actor_wp.lane_width < self._lane_width_threshold:
 
-    def _set_road_actor_speed(self, location, actor, multiplier=1):
+                # Ensure only ending lanes are affected. not sure if it is needed though
+                next_wps = actor_wp.next(0.5)
+                if next_wps and next_wps[0].lane_width < actor_wp.lane_width:
+                    actor.set_target_velocity(carla.Vector3D(0, 0, 0))
+                    self._actors_speed_perc[actor] = 0
+                    lights = actor.get_light_state()
+                    lights |= carla.VehicleLightState.RightBlinker
+                    lights |= carla.VehicleLightState.LeftBlinker
+                    lights |= carla.VehicleLightState.Position
+                    actor.set_light_state(carla.VehicleLightState(lights))
+                    actor.set_autopilot(False, self._tm_port)
+                    continue
+
+            speed_actors.append(actor)
+            speed_rows.append(row)
+
+        # And update their speeds together
+        if speed_actors:
+            percentages = self._get_road_speed_percentages(locations[speed_rows])
+            self._actors_speed_perc.update(zip(speed_actors, percentages.tolist()))
+
+    def _get_road_speed_percentages(self, locations, multiplier=1):
         """
-        Changes the speed of the vehicle depending on its distance to the ego.
+        Returns the speed percentages of the vehicles at the N x 3 array of locations, depending on their distance to the ego.
         - Front vehicles: Gradually reduces the speed the further they are.
         - Back vehicles: Gradually reduces the speed the further they are to help them catch up to the ego.
         - Junction scenario behavior: Don't let vehicles behind the ego surpass it.
         """
-        distance = location.distance(self._ego_wp.transform.location)
-        if not self._is_location_behind_ego(location):
-            percentage = (self._max_radius - distance) / (self._max_radius - self._min_radius) * 100
-            percentage *= multiplier
-            percentage = max(min(percentage, 100), 0)
-        elif not self._scenario_junction_entry:
-            percentage = distance / (self._max_radius - self._min_radius) * 100 + 100
-            percentage = max(min(percentage, 200), 0)
+        ego_location = self._ego_wp.transform.location
+        distances = np.linalg.norm(locations - np.array([ego_location.x, ego_location.y, ego_location.z]), axis=1)
+        behind = self._are_locations_behind_ego(locations)
+        radius_range = self._max_radius - self._min_radius
+
+        front_percentages = (self._max_radius - distances) / radius_range * 100 * multiplier
+        percentages = np.clip(front_percentages, 0, 100)
+
+        if not self._scenario_junction_entry:
+            back_percentages = np.clip(distances / radius_range * 100 + 100, 0, 200)
         else:
             ego_speed = CarlaDataProvider.get_velocity(self._ego_actor)
             base_percentage = ego_speed / self._ego_target_speed * 100
-            true_distance = distance - self._scenario_junction_entry_distance
-            percentage = true_distance / (self._max_radius - self._min_radius) * 100 + base_percentage
-            percentage = max(min(percentage, 100), 0)
+            true_distances = distances - self._scenario_junction_entry_distance
+            back_percentages = np.clip(true_distances / radius_range * 100 + base_percentage, 0, 100)
+
+        return np.where(behind, back_percentages, percentages)
 
-        self._actors_speed_perc[actor] = percentage
+    def _set_road_actor_speed(self, location, actor, multiplier=1):
+        """
+        Changes the speed of the vehicle depending on its distance to the ego (see '_get_road_speed_percentages').
+        """
+        locations = np.array([[location.x, location.y, location.z]])
+        self._actors_speed_perc[actor] = float(self._get_road_speed_percentages(locations, multiplier)[0])
 
     def _monitor_road_changes(self, prev_route_index):
         """
@@ -2412,7 +2523,7 @@ class BackgroundBehavior(AtomicBehavior):
 
                 # Monitor its entry
                 elif state == JUNCTION_ENTRY:
-                    actor_wp = self._map.get_waypoint(location)
+                    actor_wp = CarlaDataProvider.get_waypoint(location)
                     if self._is_junction(actor_wp) and junction.contains_wp(actor_wp):
                         if junction.clear_middle:
                             self._destroy_actor(actor)  # Don't clutter the junction if a junction scenario is active
@@ -2421,7 +2532,7 @@ class BackgroundBehavior(AtomicBehavior):
 
                 # Monitor its exit and destroy an actor if needed
                 elif state == JUNCTION_MIDDLE:
-                    actor_wp = self._map.get_waypoint(location)
+                    actor_wp = CarlaDataProvider.get_waypoint(location)
                     actor_lane_key = get_lane_key(actor_wp)
                     if not self._is_junction(actor_wp) and actor_lane_key in exit_dict:
                         if i < max_index and actor_lane_key in junction.route_exit_keys:
@@ -2488,7 +2599,7 @@ class BackgroundBehavior(AtomicBehavior):
 
             # Ending / starting lanes create issues as the lane width gradually decreases until reaching 0,
             # where the lane starts / ends. Set their speed to 0, and they'll eventually dissapear.
-            actor_wp = self._map.get_waypoint(location)
+            actor_wp = CarlaDataProvider.get_waypoint(location)
             if actor_wp.lane_width < self._lane_width_threshold:
                 self._actors_speed_perc[actor] = 0
 
@@ -2497,14 +2608,25 @@ class BackgroundBehavior(AtomicBehavior):
         Sets the speed of all the BA actors, using the ego's target speed as reference.
         This avoids issues with the speed limits, as newly created actors don't have that information
         """
-        for actor, percentage in self._actors_speed_perc.items():
-            speed = self._ego_target_speed * percentage / 100
-            if self._scenario_max_speed:
-                speed = min(speed, self._scenario_max_speed)
+        if not self._actors_speed_perc:
+            return
+
+        actors = list(self._actors_speed_perc)
+        speeds = self._ego_target_speed * np.array(list(self._actors_speed_perc.values()), dtype=float) / 100
+        if self._scenario_max_speed:
+            speeds = np.minimum(speeds, self._scenario_max_speed)
+
+        # TODO: Fix very high speed traffic
+        speeds = np.minimum(speeds, 90)
 
-            # TODO: Fix very high speed traffic
-            speed = min(speed, 90)
+        # Only send the speeds that have changed
+        sent_speeds = np.array([self._actors_sent_speed.get(actor, np.nan) for actor in actors])
+        changed = ~(np.abs(speeds - sent_speeds) < self._speed_tolerance)
+        for index in np.flatnonzero(changed):
+            actor = actors[index]
+            speed = float(speeds[index])
             self._tm.set_desired_speed(actor, speed)
+            self._actors_sent_speed[actor] = speed
 
     def _remove_actor_info(self, actor):
         """Removes all the references of the actor"""
@@ -2541,12 +2663,18 @@ class BackgroundBehavior(AtomicBehavior):
                     break
 
         self._actors_speed_perc.pop(actor, None)
+        self._actors_sent_speed.pop(actor, None)
         if actor in self._all_actors:
             self._all_actors.remove(actor)
 
-    def _destroy_actor(self, actor):
-        """Destroy the actor and all its references"""
+    def _destroy_actor(self, actor, reuse=True):
+        """Destroy the actor and all its references. If possible, the actor is parked to be reused instead"""
         self._remove_actor_info(actor)
+        if actor in self._actors_with_path:
+            self._actors_with_path.discard(actor)
+            reuse = False
+        if reuse and self._actor_pool.release(actor):
+            return
         try:
             actor.set_autopilot(False, self._tm_port)
             actor.destroy()
@@ -2562,15 +2690,7 @@ class BackgroundBehavior(AtomicBehavior):
         location = CarlaDataProvider.get_location(self._ego_actor)
 
         prev_index = self._route_index
-        for index in range(self._route_index, min(self._route_index + self._route_buffer, self._route_length)):
-            route_wp = self._route[index]
-
-            route_wp_dir = route_wp.transform.get_forward_vector()    # Waypoint's forward vector
-            veh_wp_dir = location - route_wp.transform.location       # vector waypoint - vehicle
-            dot_ve_wp = veh_wp_dir.x * route_wp_dir.x + veh_wp_dir.y * route_wp_dir.y + veh_wp_dir.z * route_wp_dir.z
-
-            if dot_ve_wp > 0:
-                self._route_index = index
+        self._route_index = self._route_progress.update(location, GameTime.get_frame())
 
         # Monitor route changes for those scenario that remove and readd a specific lane
         if self._scenario_removed_lane:
@@ -156,6 +156,21 @@ class TrafficLightState:
     Off = 3
 
 
+class LaneType:
+    NONE = 1
+    Driving = 2
+    Shoulder = 1024
+    Sidewalk = 32
+    Any = -2
+
+
+class LaneChange:
+    NONE = 0
+    Right = 1
+    Left = 2
+    Both = 3
+
+
 class WeatherParameters:
     cloudiness = 0.000000
     cloudiness = 0.000000
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides unit tests for the cache of the GlobalRoutePlanner graph
+"""
+
+import math
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+import carla
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+
+from srunner.tools import map_cache
+from srunner.tools.route_planner_cache import CachedGlobalRoutePlanner
+
+
+class Location(carla.Location):
+    """Mocked location, with the actual distance between locations"""
+
+    def distance(self, other):
+        return math.sqrt((self.x - other.x) ** 2 + (self.y - other.y) ** 2 + (self.z - other.z) ** 2)
+
+
+class Rotation(carla.Rotation):
+    """Mocked rotation, with the actual forward vector"""
+
+    def get_forward_vector(self):
+        yaw = math.radians(self.yaw)
+        return carla.Vector3D(math.cos(yaw), math.sin(yaw), 0)
+
+
+class LaneMarking(object):
+    """Mocked lane marking"""
+
+    def __init__(self, lane_change):
+        self.lane_change = lane_change
+
+
+class Waypoint(object):
+    """Mocked waypoint of a straight lane of a MockMap"""
+
+    def __init__(self, wmap, key, s):
+        self._map = wmap
+        self._lane = wmap.lanes[key]
+        self.road_id, self.lane_id = key
+        self.section_id = 0
+        self.s = s
+        self.is_junction = self._lane['junction']
+        self.lane_type = carla.LaneType.Driving
+        self.lane_width = 3.5
+
+        (x1, y1), (x2, y2) = self._lane['start'], self._lane['end']
+        ratio = s / self._lane['length']
+        self.transform = carla.Transform(
+            Location(x1 + (x2 - x1) * ratio, y1 + (y2 - y1) * ratio, 0),
+            Rotation(yaw=math.degrees(math.atan2(y2 - y1, x2 - x1))))
+
+        self.left_lane_marking = LaneMarking(
+            carla.LaneChange.Left if self._lane.get('left') else carla.LaneChange.NONE)
+        self.right_lane_marking = LaneMarking(
+            carla.LaneChange.Right if self._lane.get('right') else carla.LaneChange.NONE)
+
+    def next(self, distance):
+        s = self.s + distance
+        if s <= self._lane['length']:
+            return [Waypoint(self._map, (self.road_id, self.lane_id), s)]
+
+        waypoints = []
+        for key in self._lane['successors']:
+            waypoints.extend(Waypoint(self._map, key, 0).next(s - self._lane['length']))
+        return waypoints
+
+    def get_left_lane(self):
+        key = self._lane.get('left')
+        return Waypoint(self._map, key, self.s) if key else None
+
+    def get_right_lane(self):
+        key = self._lane.get('right')
+        return Waypoint(self._map, key, self.s) if key else None
+
+
+class MockMap(carla.Map):
+    """
+    Mocked map of a two lane road that ends at a junction, from which it either continues
+    straight, through another two lane road, or turns to a one lane road
+    """
+
+    name = 'Carla/Maps/TestTown'
+
+    def __init__(self):
+        self.lanes = {
+            (1, -1): {'start': (0, 0), 'end': (50, 0), 'successors': [(10, -1), (11, -1)], 'right': (1, -2)},
+            (1, -2): {'start': (0, 3.5), 'end': (50, 3.5), 'successors': [(12, -1)], 'left': (1, -1)},
+            (10, -1): {'start': (50, 0), 'end': (60, 0), 'successors': [(2, -1)], 'junction': True},
+            (11, -1): {'start': (50, 0), 'end': (60, -10), 'successors': [(3, -1)], 'junction': True},
+            (12, -1): {'start': (50, 3.5), 'end': (60, 3.5), 'successors': [(2, -2)], 'junction': True},
+            (2, -1): {'start': (60, 0), 'end': (110, 0), 'successors': [], 'right': (2, -2)},
+            (2, -2): {'start': (60, 3.5), 'end': (110, 3.5), 'successors': [], 'left': (2, -1)},
+            (3, -1): {'start': (60, -10), 'end': (60, -60), 'successors': []},
+        }
+        for lane in self.lanes.values():
+            (x1, y1), (x2, y2) = lane['start'], lane['end']
+            lane['length'] = math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+            lane.setdefault('junction', False)
+
+    def to_opendrive(self):
+        return repr(sorted(self.lanes.items()))
+
+    def get_topology(self):
+        return [(Waypoint(self, key, 0), Waypoint(self, key, lane['length'])) for key, lane in self.lanes.items()]
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=carla.LaneType.Driving):
+        """Projects the location to the closest lane"""
+        closest, closest_distance = None, float('inf')
+        for key, lane in self.lanes.items():
+            (x1, y1), (x2, y2) = lane['start'], lane['end']
+            ratio = ((location.x - x1) * (x2 - x1) + (location.y - y1) * (y2 - y1)) / lane['length'] ** 2
+            ratio = min(max(ratio, 0), 1)
+            distance = math.hypot(x1 + (x2 - x1) * ratio - location.x, y1 + (y2 - y1) * ratio - location.y)
+            if distance < closest_distance:
+                closest, closest_distance = (key, ratio * lane['length']), distance
+        return Waypoint(self, *closest)
+
+    def get_waypoint_xodr(self, road_id, lane_id, s):
+        key = (road_id, lane_id)
+        if key not in self.lanes or not 0 <= s <= self.lanes[key]['length']:
+            return None
+        return Waypoint(self, key, s)
+
+
+class TestCachedGlobalRoutePlanner(TestCase):
+    """
+    Test class to check that the cached route planner plans the same routes as the GlobalRoutePlanner
+    """
+
+    ROUTES = [
+        (Location(2, 0), Location(100, 0)),  # Straight through the junction
+        (Location(2, 0), Location(60, -50)),  # Turn at the junction
+        (Location(2, 0), Location(100, 3.5)),  # Lane change
+        (Location(2, 3.5), Location(60, -50)),  # Lane change and turn
+    ]
+
+    def setUp(self):
+        self._cache_dir = tempfile.mkdtemp()
+        self._patch = mock.patch.object(map_cache, 'MAP_CACHE_DIR', self._cache_dir)
+        self._patch.start()
+        self._map = MockMap()
+
+    def tearDown(self):
+        self._patch.stop()
+        shutil.rmtree(self._cache_dir)
+
+    @staticmethod
+    def _get_route(planner, origin, destination):
+        return [(wp.road_id, wp.lane_id, wp.s, option) for wp, option in planner.trace_route(origin, destination)]
+
+    def test_save_and_load(self):
+        """
+        Builds and saves the graph, and checks that the graph loaded from the cache gives the same routes
+        """
+        CachedGlobalRoutePlanner(self._map, 2.0)
+        cache_path = map_cache.get_map_cache_path(self._map, CachedGlobalRoutePlanner.CACHE_TAG, 'npz', '2.0')
+        self.assertTrue(os.path.exists(cache_path))
+
+        with mock.patch.object(GlobalRoutePlanner, '_build_graph') as build_graph:
+            cached_planner = CachedGlobalRoutePlanner(self._map, 2.0)
+        build_graph.assert_not_called()
+
+        planner = GlobalRoutePlanner(self._map, 2.0)
+        self.assertEqual(sorted(cached_planner._graph.edges), sorted(planner._graph.edges))
+        self.assertEqual(cached_planner._road_id_to_edge, planner._road_id_to_edge)
+
+        for origin, destination in self.ROUTES:
+            route = self._get_route(planner, origin, destination)
+            self.assertTrue(route)
+            self.assertEqual(self._get_route(cached_planner, origin, destination), route)
+
+    def test_other_resolution(self):
+        """
+        Checks that the graph of a resolution isn't used for another one
+        """
+        CachedGlobalRoutePlanner(self._map, 2.0)
+        cached_planner = CachedGlobalRoutePlanner(self._map, 1.0)
+        self.assertIsNone(cached_planner._waypoint_refs)
+
+        planner = GlobalRoutePlanner(self._map, 1.0)
+        for origin, destination in self.ROUTES:
+            self.assertEqual(self._get_route(cached_planner, origin, destination),
+                             self._get_route(planner, origin, destination))
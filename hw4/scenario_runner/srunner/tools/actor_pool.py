@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a pool of reusable vehicles.
+
+Instead of destroying the vehicles that are no longer needed, they are parked below the map
+with their physics disabled. Later spawns teleport one of them to the spawn point, which is
+much cheaper for the server than creating a new actor.
+"""
+
+import carla
+
+from srunner.scenariomanager.carla_data_provider import CarlaDataProvider
+
+
+class ActorPool(object):
+
+    """
+    Pool of vehicles spawned with the same model, rolename and attribute filter, so that any of them
+    can replace a new spawn. Only the vehicles spawned by the pool are parked when released.
+    All the commands sent to the server to park and reuse the vehicles are batched and asynchronous
+    """
+
+    PARKING_HEIGHT = -500  # Height at which the vehicles are parked [m]
+    PARKING_SPACING = 10  # Distance between parked vehicles [m]
+    FREE_RADIUS = 3  # Parked vehicles aren't teleported to spawn points closer than this to other actors [m]
+
+    def __init__(self, model, tm_port, rolename='scenario', attribute_filter=None, max_size=50):
+        """
+        Args:
+            model (str): Blueprint filter of the vehicles
+            tm_port (int): Port of the traffic manager controlling the vehicles
+            rolename (str): Rolename of the vehicles
+            attribute_filter (dict): Attribute filter of the vehicles (see CarlaDataProvider.create_blueprint)
+            max_size (int): Maximum amount of parked vehicles. The rest are destroyed when released
+        """
+        self._model = model
+        self._tm_port = tm_port
+        self._rolename = rolename
+        self._attribute_filter = attribute_filter
+        self.max_size = max_size
+
+        self._parked = []
+        self._pooled_ids = set()
+        self._parking_index = 0
+
+    def __len__(self):
+        return len(self._parked)
+
+    def _get_parking_transform(self):
+        """
+        Returns a new transform below the map
+        """
+        self._parking_index += 1
+        return carla.Transform(carla.Location(x=self._parking_index * self.PARKING_SPACING, z=self.PARKING_HEIGHT))
+
+    def _park(self, actors):
+        """
+        Stops and hides the vehicles, and adds them to the pool
+        """
+        batch = []
+        for actor in actors:
+            batch.append(carla.command.SetAutopilot(actor, False, self._tm_port))
+            batch.append(carla.command.SetSimulatePhysics(actor, False))
+            batch.append(carla.command.ApplyTargetVelocity(actor, carla.Vector3D(0, 0, 0)))
+            batch.append(carla.command.ApplyTransform(actor, self._get_parking_transform()))
+        CarlaDataProvider.get_client().apply_batch(batch)
+
+        self._parked.extend(actors)
+
+    def _request_actors(self, transforms, autopilot):
+        """
+        Creates new vehicles at the transforms
+        """
+        if not transforms:
+            return []
+        actors = CarlaDataProvider.request_new_batch_actors(
+            self._model, len(transforms), transforms, autopilot, False, self._rolename,
+            attribute_filter=self._attribute_filter, tick=False)
+        self._pooled_ids.update(actor.id for actor in actors)
+        return actors
+
+    def warm_up(self, amount):
+        """
+        Creates and parks up to 'amount' vehicles, so that the first spawns don't need to create them
+        """
+        amount = min(amount, self.max_size - len(self._parked))
+        if amount <= 0:
+            return
+
+        actors = self._request_actors([self._get_parking_transform() for _ in range(amount)], False)
+        if actors:
+            self._park(actors)
+
+    def acquire(self, transform, autopilot=True):
+        """
+        Teleports a parked vehicle to the transform and enables it, with its lights off. Returns None
+        if the pool is empty, or if the transform is occupied by another actor
+        """
+        if not self._parked:
+            return None
+        if CarlaDataProvider.get_actors_in_radius(transform.location, self.FREE_RADIUS):
+            return None
+
+        actor = self._parked.pop()
+        while not actor.is_alive:
+            self._pooled_ids.discard(actor.id)
+            if not self._parked:
+                return None
+            actor = self._parked.pop()
+
+        # The light state set during its previous use is cleared. The TM settings of the vehicle
+        # aren't batchable, so they have to be reset by the user of the pool
+        CarlaDataProvider.get_client().apply_batch([
+            carla.command.SetVehicleLightState(actor, carla.VehicleLightState.NONE),
+            carla.command.ApplyTransform(actor, transform),
+            carla.command.SetSimulatePhysics(actor, True),
+            carla.command.SetAutopilot(actor, autopilot, self._tm_port)
+        ])
+        return actor
+
+    def spawn_actors(self, transforms, autopilot=True):
+        """
+        Same as CarlaDataProvider.request_new_batch_actors, reusing the parked vehicles first.
+        The returned actors keep the order of the transforms
+        """
+        actors = [self.acquire(transform, autopilot) for transform in transforms]
+
+        missing_transforms = [transform for transform, actor in zip(transforms, actors) if actor is None]
+        new_actors = iter(self._request_actors(missing_transforms, autopilot))
+        for i, actor in enumerate(actors):
+            if actor is None:
+                actors[i] = next(new_actors, None)
+
+        return [actor for actor in actors if actor is not None]
+
+    def spawn_actor(self, transform, autopilot=True):
+        """
+        Same as CarlaDataProvider.request_new_actor, reusing a parked vehicle if possible.
+        Returns None if the actor couldn't be spawned
+        """
+        actors = self.spawn_actors([transform], autopilot)
+        return actors[0] if actors else None
+
+    def release(self, actor):
+        """
+        Parks a vehicle that is no longer needed. Returns False if the vehicle can't be parked
+        (it wasn't spawned by the pool, it's already destroyed or the pool is full),
+        in which case it has to be destroyed by the caller
+        """
+        if actor.id not in self._pooled_ids or len(self._parked) >= self.max_size:
+            return False
+        if not actor.is_alive:
+            self._pooled_ids.discard(actor.id)
+            return False
+
+        self._park([actor])
+        return True
+
+    def destroy(self):
+        """
+        Destroys all the parked vehicles
+        """
+        batch = [carla.command.DestroyActor(actor) for actor in self._parked if actor.is_alive]
+        if batch:
+            CarlaDataProvider.get_client().apply_batch(batch)
+
+        self._parked = []
+        self._pooled_ids = set()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a uniform 2D grid to quickly find the static elements
+(traffic lights, stop signs...) close to a location.
+
+Each element is stored at all the cells touched by its bounding circle, so a query
+only has to check the cells touched by the query circle, instead of all the elements.
+"""
+
+import math
+
+
+class GridIndex(object):
+
+    """
+    Uniform grid over the XY plane, mapping each cell to the items overlapping it.
+    Queries return candidates, which still have to be checked by the caller
+    """
+
+    def __init__(self, cell_size):
+        """
+        Args:
+            cell_size (float): Size of the cells [m]. Ideally, similar to the query radius
+        """
+        self.cell_size = float(cell_size)
+        self._cells = {}
+        self._num_items = 0
+
+    def _get_cell_range(self, x, y, radius):
+        """
+        Returns the min and max cell coordinates touched by a circle
+        """
+        return (int(math.floor((x - radius) / self.cell_size)),
+                int(math.floor((y - radius) / self.cell_size)),
+                int(math.floor((x + radius) / self.cell_size)),
+                int(math.floor((y + radius) / self.cell_size)))
+
+    def insert(self, item, location, radius=0.0):
+        """
+        Adds an item whose area is the circle of the given location and radius
+        """
+        entry = (self._num_items, item)
+        self._num_items += 1
+
+        min_x, min_y, max_x, max_y = self._get_cell_range(location.x, location.y, radius)
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                self._cells.setdefault((cell_x, cell_y), []).append(entry)
+
+    def query(self, location, radius=0.0):
+        """
+        Returns the items whose cells overlap the circle of the given location and radius,
+        in insertion order and without duplicates
+        """
+        min_x, min_y, max_x, max_y = self._get_cell_range(location.x, location.y, radius)
+
+        entries = {}
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                for index, item in self._cells.get((cell_x, cell_y), ()):
+                    entries[index] = item
+
+        return [entries[index] for index in sorted(entries)]
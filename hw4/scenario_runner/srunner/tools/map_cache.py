@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Helper functions to persist data that only depends on the town (indices, graphs...)
+so that it is computed once per map instead of once per route.
+
+The files are stored at the folder given by the SCENARIO_RUNNER_CACHE environment
+variable, which defaults to ~/.cache/scenario_runner. They are keyed by the map name and
+a hash of its OpenDRIVE, so that custom or updated maps with the same name don't share them.
+"""
+
+from __future__ import print_function
+
+import gzip
+import hashlib
+import json
+import os
+
+MAP_CACHE_DIR = os.getenv('SCENARIO_RUNNER_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'scenario_runner'))
+
+_map_ids = {}  # Map name -> map id, until the world changes (see reset_map_ids)
+
+
+def get_map_name(carla_map):
+    """
+    Returns the short name of the map (i.e 'Town12' instead of 'Carla/Maps/Town12').
+    Strings are returned as they are, so that both maps and names can be used
+    """
+    name = carla_map if isinstance(carla_map, str) else carla_map.name
+    return name.split('/')[-1]
+
+
+def get_map_id(carla_map):
+    """
+    Returns the name of the map followed by a hash of its OpenDRIVE (i.e 'Town12_3f2a9c1b0d4e').
+    Getting the OpenDRIVE of the large towns is slow, so the id is only computed once per loaded map
+    """
+    map_id = _map_ids.get(carla_map.name)
+    if map_id is None:
+        opendrive = carla_map.to_opendrive()
+        digest = hashlib.sha1(opendrive.encode('utf-8')).hexdigest()[:12]
+        map_id = _map_ids[carla_map.name] = '{}_{}'.format(get_map_name(carla_map), digest)
+    return map_id
+
+
+def reset_map_ids():
+    """
+    Forgets the computed map ids. To be called when a world is loaded, as maps generated
+    from different OpenDRIVE files can have the same name
+    """
+    _map_ids.clear()
+
+
+def get_map_cache_path(carla_map, tag, extension='json.gz', suffix=''):
+    """
+    Returns the path of the cache file of the given tag for the given map.
+    The suffix tells apart the files of a map made with different parameters
+    """
+    return os.path.join(MAP_CACHE_DIR, tag, '{}{}.{}'.format(
+        get_map_id(carla_map), '_' + suffix if suffix else '', extension))
+
+
+def load_map_cache(carla_map, tag, version):
+    """
+    Loads the cached data of the given tag for the given map.
+    Returns None if there is no cache, or if it was made with a different version
+    """
+    path = get_map_cache_path(carla_map, tag)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as fd:
+            cache = json.load(fd)
+    except (OSError, ValueError) as e:
+        print("WARNING: Ignoring the corrupted map cache {}: {}".format(path, e))
+        return None
+
+    if cache.get('version') != version:
+        return None
+    return cache.get('data')
+
+
+def save_map_cache(carla_map, tag, version, data):
+    """
+    Saves the data of the given tag for the given map. The file is written to a
+    temporary path and then moved, so that concurrent readers never see a partial file.
+    Failing to save is not an error, as the data can always be recomputed
+    """
+    path = get_map_cache_path(carla_map, tag)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as fd:
+            json.dump({'version': version, 'data': data}, fd)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print("WARNING: Couldn't save the map cache {}: {}".format(path, e))
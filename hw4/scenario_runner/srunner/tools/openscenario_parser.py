@@ -91,12 +91,21 @@ class ParameterRef:
     """
     This class stores osc parameter reference in its original form.
     Returns the converted value whenever it is used.
+
+    The kind of reference is matched once, and its value is cached until the global
+    osc parameters change (i.e. by a ParameterSetAction), so that using it at every tick
+    doesn't parse the reference text again.
     """
 
     def __init__(self, reference_text) -> None:
         # TODO: (for OSC1.1) add methods(lexer and math_interpreter) to
         #  recognize and interpret math expression from reference_text
         self.reference_text = str(reference_text)
+        self._literal = self.is_literal()
+        self._parameter = not self._literal and self.is_parameter()
+        self._version = None
+        self._value = None
+        self._float = None
 
     def is_literal(self) -> bool:
         """
@@ -120,31 +129,46 @@ class ParameterRef:
             return matching_string == self.reference_text
         return False
 
-    def get_interpreted_value(self):
+    def _compile(self):
         """
-        Returns: interpreted value from reference_text
+        Updates the cached value, if the global osc parameters changed since it was computed
         """
-        if self.is_literal():
+        # Literals never change, so they always match their first version
+        version = CarlaDataProvider.get_osc_global_params_version() if self._parameter else -1
+        if version == self._version:
+            return
+        if self._literal:
             value = self.reference_text
-        elif self.is_parameter():
+        elif self._parameter:
             value = CarlaDataProvider.get_osc_global_param_value(self.reference_text)
             if value is None:
                 raise Exception("Parameter '{}' is not defined".format(self.reference_text[1:]))
         else:
             value = None
-        return value
+        self._value = value
+        self._float = None
+        self._version = version
+
+    def get_interpreted_value(self):
+        """
+        Returns: interpreted value from reference_text
+        """
+        self._compile()
+        return self._value
 
     def __float__(self) -> float:
         value = self.get_interpreted_value()
         if value is not None:
-            return float(value)
+            if self._float is None:
+                self._float = float(value)
+            return self._float
         else:
             raise Exception("could not convert '{}' to float".format(self.reference_text))
 
     def __int__(self) -> int:
         value = self.get_interpreted_value()
         if value is not None:
-            return int(float(value))
+            return int(self.__float__())
         else:
             raise Exception("could not convert '{}' to int".format(self.reference_text))
 
@@ -13,10 +13,10 @@ It also contains functions to convert the CARLA world location do GPS coordinate
 import math
 import xml.etree.ElementTree as ET
 
-from agents.navigation.global_route_planner import GlobalRoutePlanner
 from agents.navigation.local_planner import RoadOption
 
 from srunner.scenariomanager.carla_data_provider import CarlaDataProvider
+from srunner.tools.route_planner_cache import get_route_planner
 
 
 def _location_to_gps(lat_ref, lon_ref, location):
@@ -140,7 +140,7 @@ def interpolate_trajectory(waypoints_trajectory, hop_resolution=1.0):
         - hop_resolution: distance between the trajectory's waypoints
     """
 
-    grp = GlobalRoutePlanner(CarlaDataProvider.get_map(), hop_resolution)
+    grp = get_route_planner(CarlaDataProvider.get_map(), hop_resolution)
     # Obtain route plan
     lat_ref, lon_ref = _get_latlon_ref(CarlaDataProvider.get_world())
 
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+GlobalRoutePlanner whose graph is built once per map and hop resolution.
+
+Building the graph walks the whole town with 'waypoint.next', which on the large towns takes
+longer than the route itself. Once built, the graph is saved to the map cache (see map_cache.py),
+with its waypoints stored as their OpenDRIVE coordinates. Loading it only creates the graph,
+and the waypoints of an edge are recreated the first time a route goes through it.
+"""
+
+from __future__ import print_function
+
+import os
+import numpy as np
+import networkx as nx
+
+import carla
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.local_planner import RoadOption
+
+from srunner.tools.map_cache import get_map_cache_path, get_map_id
+
+
+class CachedGlobalRoutePlanner(GlobalRoutePlanner):
+    """
+    GlobalRoutePlanner that loads its graph from the map cache, building and saving it if needed
+    """
+
+    CACHE_TAG = 'route_planner'
+    CACHE_VERSION = 1
+
+    def __init__(self, wmap, sampling_resolution):  # pylint: disable=super-init-not-called
+        self._cache_path = get_map_cache_path(wmap, self.CACHE_TAG, 'npz', suffix=str(float(sampling_resolution)))
+        self._waypoint_refs = None
+        self._unloaded_edges = {}
+
+        if not self._load(wmap, sampling_resolution):
+            super(CachedGlobalRoutePlanner, self).__init__(wmap, sampling_resolution)
+            self._save()
+
+    def reset(self):
+        """Resets the turn decision state, so that the planner can be used for a new route"""
+        self._intersection_end_node = -1
+        self._previous_decision = RoadOption.VOID
+
+    def _path_search(self, origin, destination):
+        """Searches the route, and loads the waypoints of its edges"""
+        route = super(CachedGlobalRoutePlanner, self)._path_search(origin, destination)
+        for n1, n2 in zip(route[:-1], route[1:]):
+            self._load_edge(n1, n2)
+        return route
+
+    def _load_edge(self, n1, n2):
+        """Recreates the waypoints of an edge, if they haven't been already"""
+        index = self._unloaded_edges.pop((n1, n2), None)
+        if index is None:
+            return
+
+        refs = self._waypoint_refs
+        edge = self._graph.edges[n1, n2]
+        entry_index, exit_index = refs['edge_waypoints'][index]
+        path_start, path_end = refs['edge_paths'][index]
+        edge['entry_waypoint'] = self._get_waypoint(entry_index)
+        edge['exit_waypoint'] = self._get_waypoint(exit_index)
+        edge['path'] = [self._get_waypoint(i) for i in range(path_start, path_end)]
+
+        if refs['edge_has_change'][index]:
+            edge['change_waypoint'] = edge['exit_waypoint']
+            # The route continues through the edge of the lane it changes to
+            exit_wp = edge['exit_waypoint']
+            try:
+                self._load_edge(*self._road_id_to_edge[exit_wp.road_id][exit_wp.section_id][exit_wp.lane_id])
+            except KeyError:
+                pass
+
+    def _get_waypoint(self, index):
+        """Recreates a stored waypoint, falling back to its location if the OpenDRIVE one is not valid"""
+        road_id, lane_id, s = self._waypoint_refs['waypoint_xodr'][index]
+        waypoint = self._wmap.get_waypoint_xodr(int(road_id), int(lane_id), float(s))
+        if waypoint is None:
+            x, y, z = self._waypoint_refs['waypoint_locations'][index]
+            waypoint = self._wmap.get_waypoint(carla.Location(x=float(x), y=float(y), z=float(z)))
+        return waypoint
+
+    def _save(self):
+        """
+        Saves the graph to the map cache. Failing to save is not an error, as it can always be rebuilt
+        """
+        waypoint_xodr = []
+        waypoint_locations = []
+
+        def add_waypoint(waypoint):
+            location = waypoint.transform.location
+            waypoint_xodr.append([waypoint.road_id, waypoint.lane_id, waypoint.s])
+            waypoint_locations.append([location.x, location.y, location.z])
+            return len(waypoint_xodr) - 1
+
+        nodes = list(self._graph.nodes(data='vertex'))
+        edges = list(self._graph.edges(data=True))
+        edge_nodes, edge_info, edge_vectors, edge_waypoints, edge_paths, edge_has_change = [], [], [], [], [], []
+        for n1, n2, edge in edges:
+            edge_nodes.append([n1, n2])
+            edge_info.append([edge['length'], edge['type'].value, edge['intersection']])
+            edge_vectors.append([np.full(3, np.nan) if edge.get(key) is None else edge[key]
+                                 for key in ('entry_vector', 'exit_vector', 'net_vector')])
+            edge_waypoints.append([add_waypoint(edge['entry_waypoint']), add_waypoint(edge['exit_waypoint'])])
+            path_start = len(waypoint_xodr)
+            for waypoint in edge['path']:
+                add_waypoint(waypoint)
+            edge_paths.append([path_start, len(waypoint_xodr)])
+            edge_has_change.append('change_waypoint' in edge)
+
+        road_id_to_edge = [[road_id, section_id, lane_id, n1, n2]
+                           for road_id, sections in self._road_id_to_edge.items()
+                           for section_id, lanes in sections.items()
+                           for lane_id, (n1, n2) in lanes.items()]
+
+        tmp_path = '{}.{}.tmp'.format(self._cache_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self._cache_path), exist_ok=True)
+            with open(tmp_path, 'wb') as fd:
+                np.savez(
+                    fd,
+                    version=self.CACHE_VERSION,
+                    resolution=self._sampling_resolution,
+                    node_ids=np.array([node for node, _ in nodes], dtype=np.int64),
+                    node_vertices=np.array([vertex for _, vertex in nodes], dtype=np.float64).reshape(-1, 3),
+                    edge_nodes=np.array(edge_nodes, dtype=np.int64).reshape(-1, 2),
+                    edge_info=np.array(edge_info, dtype=np.int64).reshape(-1, 3),
+                    edge_vectors=np.array(edge_vectors, dtype=np.float64).reshape(-1, 3, 3),
+                    edge_waypoints=np.array(edge_waypoints, dtype=np.int64).reshape(-1, 2),
+                    edge_paths=np.array(edge_paths, dtype=np.int64).reshape(-1, 2),
+                    edge_has_change=np.array(edge_has_change, dtype=bool),
+                    waypoint_xodr=np.array(waypoint_xodr, dtype=np.float64).reshape(-1, 3),
+                    waypoint_locations=np.array(waypoint_locations, dtype=np.float64).reshape(-1, 3),
+                    road_id_to_edge=np.array(road_id_to_edge, dtype=np.int64).reshape(-1, 5),
+                )
+            os.replace(tmp_path, self._cache_path)
+        except OSError as e:
+            print("WARNING: Couldn't save the route planner cache {}: {}".format(self._cache_path, e))
+
+    def _load(self, wmap, sampling_resolution):
+        """
+        Loads the graph from the map cache, without creating any waypoint.
+        Returns False if there is no valid cache
+        """
+        if not os.path.exists(self._cache_path):
+            return False
+
+        try:
+            with np.load(self._cache_path) as data:
+                cache = {name: data[name] for name in data.files}
+        except (OSError, ValueError) as e:
+            print("WARNING: Ignoring the corrupted route planner cache {}: {}".format(self._cache_path, e))
+            return False
+
+        if cache['version'] != self.CACHE_VERSION or cache['resolution'] != sampling_resolution:
+            return False
+
+        # Same attributes as GlobalRoutePlanner.__init__, except for the topology, only used while building
+        self._sampling_resolution = sampling_resolution
+        self._wmap = wmap
+        self._topology = None
+        self._intersection_end_node = -1
+        self._previous_decision = RoadOption.VOID
+
+        self._graph = nx.DiGraph()
+        self._id_map = dict()
+        for node, vertex in zip(cache['node_ids'].tolist(), cache['node_vertices'].tolist()):
+            vertex = tuple(vertex)
+            self._graph.add_node(node, vertex=vertex)
+            if node >= 0:
+                self._id_map[vertex] = node
+
+        for index, ((n1, n2), (length, road_option, intersection), vectors) in enumerate(
+                zip(cache['edge_nodes'].tolist(), cache['edge_info'].tolist(), cache['edge_vectors'])):
+            entry_vector, exit_vector, net_vector = [None if np.isnan(v).any() else v for v in vectors]
+            self._graph.add_edge(
+                n1, n2,
+                length=length, path=None,
+                entry_waypoint=None, exit_waypoint=None,
+                entry_vector=entry_vector, exit_vector=exit_vector, net_vector=net_vector,
+                intersection=bool(intersection), type=RoadOption(road_option))
+            self._unloaded_edges[(n1, n2)] = index
+
+        self._road_id_to_edge = dict()
+        for road_id, section_id, lane_id, n1, n2 in cache['road_id_to_edge'].tolist():
+            self._road_id_to_edge.setdefault(road_id, {}).setdefault(section_id, {})[lane_id] = (n1, n2)
+
+        self._waypoint_refs = cache
+        return True
+
+
+_planners = {}
+
+
+def get_route_planner(wmap, sampling_resolution):
+    """
+    Returns the route planner of the given map and resolution, reusing the ones of previous routes
+    """
+    key = (get_map_id(wmap), float(sampling_resolution))
+    planner = _planners.get(key)
+    if planner is None:
+        planner = CachedGlobalRoutePlanner(wmap, sampling_resolution)
+        _planners[key] = planner
+    else:
+        planner._wmap = wmap  # pylint: disable=protected-access
+        planner.reset()
+    return planner
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a tracker of the progress of an actor along a route.
+
+The route is stored as arrays, together with its cumulative arc length, and the
+progress is advanced with a vectorized search over a small window ahead of a monotonic
+cursor. Optionally, if the actor is far away from that window (teleports, large deviations...),
+a KD-tree of the whole route is used to find where it has rejoined the route.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class RouteProgress(object):
+
+    """
+    Tracks the position of an actor along a route. Two monotonic cursors are kept:
+    - index: last route point passed by the actor (the actor is in front of it)
+    - closest_index: closest route point to the actor, as well as the distance to it
+
+    Both are updated by 'update', which only recomputes them once per frame, so that
+    several users can share the same tracker.
+
+    Rejoining the route further ahead skips the points in between, so it is disabled by default,
+    as the trackers used by the criteria would otherwise award the completion of skipped segments
+    """
+
+    WINDOW_SIZE = 3  # Amount of route points checked to update the passed index
+    CLOSEST_WINDOW_SIZE = 6  # Amount of route points checked to update the closest index
+    DEVIATION_DISTANCE = 10.0  # Distances to the window higher than this trigger a whole route search [m]
+    REJOIN_DISTANCE = 2.0  # Maximum distance to the route to consider the actor has rejoined it [m]
+
+    def __init__(self, points, forward_vectors=None, window_size=None, closest_window_size=None,
+                 allow_rejoin=False):
+        """
+        Args:
+            points (numpy.ndarray): N x 3 array with the route locations
+            forward_vectors (numpy.ndarray): N x 3 array with the route directions.
+                If not given, they are computed from the points
+            window_size (int): Overrides WINDOW_SIZE
+            closest_window_size (int): Overrides CLOSEST_WINDOW_SIZE
+            allow_rejoin (bool): Whether or not to search the whole route when the actor is far from the window
+        """
+        self.points = np.asarray(points, dtype=float)
+        if forward_vectors is None:
+            forward_vectors = self._compute_forward_vectors(self.points)
+        self.forward_vectors = np.asarray(forward_vectors, dtype=float)
+
+        self.window_size = window_size or self.WINDOW_SIZE
+        self.closest_window_size = closest_window_size or self.CLOSEST_WINDOW_SIZE
+        self.allow_rejoin = allow_rejoin
+
+        segment_lengths = np.linalg.norm(np.diff(self.points, axis=0), axis=1)
+        self.accum_dist = np.concatenate(([0.0], np.cumsum(segment_lengths)))
+        self.length = self.accum_dist[-1]
+
+        self.index = 0
+        self.closest_index = 0
+        self.distance = float('inf')
+
+        self._tree = None
+        self._last_frame = None
+
+    @classmethod
+    def from_route(cls, route, **kwargs):
+        """
+        Creates the tracker from a route, given as a list of (carla.Transform, RoadOption)
+        """
+        points = []
+        forward_vectors = []
+        for transform, _ in route:
+            forward = transform.get_forward_vector()
+            points.append([transform.location.x, transform.location.y, transform.location.z])
+            forward_vectors.append([forward.x, forward.y, forward.z])
+
+        return cls(np.array(points), np.array(forward_vectors), **kwargs)
+
+    @staticmethod
+    def _compute_forward_vectors(points):
+        """
+        Approximates the direction of the route at each point with the next segment
+        """
+        if len(points) < 2:
+            return np.tile([1.0, 0.0, 0.0], (len(points), 1))
+
+        diffs = np.diff(points, axis=0)
+        diffs = np.concatenate((diffs, diffs[-1:]))
+        norms = np.linalg.norm(diffs, axis=1, keepdims=True)
+        return diffs / np.maximum(norms, 1e-6)
+
+    def _get_tree(self):
+        """
+        Lazily builds the KD-tree of the route, as it is only needed after large deviations
+        """
+        if self._tree is None:
+            self._tree = cKDTree(self.points[:, :2])
+        return self._tree
+
+    def update(self, location, frame=None):
+        """
+        Updates the progress with the location of the actor.
+        If a frame is given and the tracker was already updated at that frame, nothing is recomputed
+
+        Args:
+            location (carla.Location or numpy.ndarray): Location of the actor
+            frame (int): Current simulation frame
+
+        Returns:
+            int: Index of the last route point passed by the actor
+        """
+        if frame is not None and frame == self._last_frame:
+            return self.index
+        self._last_frame = frame
+
+        if hasattr(location, 'x'):
+            location = np.array([location.x, location.y, location.z])
+        location = np.asarray(location, dtype=float)
+        num_points = self.points.shape[0]
+
+        # Closest point of the window (the last one in case of a tie)
+        end = min(self.closest_index + self.closest_window_size, num_points)
+        distances = np.linalg.norm(self.points[self.closest_index:end, :2] - location[:2], axis=1)
+        offset = distances.shape[0] - 1 - np.argmin(distances[::-1])
+        self.closest_index += offset
+        self.distance = distances[offset]
+
+        # The actor is far from the window, check if it has rejoined the route further ahead
+        if self.allow_rejoin and self.distance > self.DEVIATION_DISTANCE:
+            distance, index = self._get_tree().query(location[:2])
+            if index > self.closest_index and distance < self.REJOIN_DISTANCE:
+                self.closest_index = int(index)
+                self.distance = distance
+                self.index = max(self.index, int(index) - 1)
+
+        # Last point passed by the actor, that is, the actor is in front of it
+        end = min(self.index + self.window_size, num_points)
+        dots = np.sum((location - self.points[self.index:end]) * self.forward_vectors[self.index:end], axis=1)
+        passed = np.flatnonzero(dots > 0)
+        if passed.size > 0:
+            self.index += int(passed[-1])
+
+        return self.index
+
+    def get_closest_index(self, location, begin_index=0, chunk_size=64):
+        """
+        Finds the route point closest to a location by descending along the route distances,
+        starting at 'begin_index' in the direction in which the distance decreases.
+        The distances are computed in chunks, instead of one route point at a time.
+        This doesn't affect the tracker state.
+
+        Args:
+            location (carla.Location or numpy.ndarray): Location of interest
+            begin_index (int): Starting index for the search
+
+        Returns:
+            int: Index of the closest route point
+        """
+        if hasattr(location, 'x'):
+            location = np.array([location.x, location.y])
+        location = np.asarray(location, dtype=float)[:2]
+        num_points = self.points.shape[0]
+
+        index = begin_index
+        if index + 1 >= num_points:
+            return index
+
+        # calculate the search direction
+        direction = 1
+        if np.linalg.norm(location - self.points[index, :2]) < np.linalg.norm(location - self.points[index + 1, :2]):
+            direction = -1
+
+        # The search stops at the second and last route points
+        limit = 1 if direction == -1 else num_points - 1
+        while True:
+            if (index - limit) * direction >= 0:
+                return index
+
+            end = index + direction * chunk_size
+            end = max(end, limit) if direction == -1 else min(end, limit)
+            indices = np.arange(index, end + direction, direction)
+            distances = np.linalg.norm(self.points[indices, :2] - location, axis=1)
+
+            # Stop at the first point whose next one is further away
+            stop = np.flatnonzero(distances[:-1] < distances[1:])
+            if stop.size > 0:
+                return int(indices[stop[0]])
+
+            index = end
+
+    def get_distance_along_route(self, index=None):
+        """
+        Returns the distance traveled along the route until the given index (the passed one by default)
+        """
+        return self.accum_dist[self.index if index is None else index]
+
+    def get_completion_percentage(self, index=None):
+        """
+        Returns the percentage of the route completed until the given index (the passed one by default)
+        """
+        if self.length <= 0:
+            return 100.0
+        return 100.0 * self.get_distance_along_route(index) / self.length
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a map level index of the traffic lights and stop signs.
+
+Each lane segment of the map topology is linked to the traffic controls placed on it,
+and to the first traffic control found downstream of it (until the next junction).
+With it, the next traffic light / stop sign of a waypoint, and its distance, are
+obtained with a couple of dictionary lookups, instead of walking the map.
+
+As the index only depends on the town, it is cached to disk per map (see map_cache.py).
+"""
+
+import math
+import numpy as np
+
+import carla
+
+from srunner.tools.map_cache import load_map_cache, save_map_cache
+
+TRAFFIC_LIGHT = 'traffic_light'
+STOP_SIGN = 'stop_sign'
+
+
+def get_lane_key(waypoint):
+    """
+    Returns the key identifying the lane segment of a waypoint
+    """
+    return '{}:{}:{}'.format(waypoint.road_id, waypoint.section_id, waypoint.lane_id)
+
+
+def get_control_key(control):
+    """
+    Returns a key identifying a traffic light or stop sign. Actor ids aren't kept
+    between simulations, so their (static) location is used instead
+    """
+    location = control.get_transform().location
+    return '{:.1f}:{:.1f}:{:.1f}'.format(location.x, location.y, location.z)
+
+
+def get_traffic_light_waypoints(traffic_light, carla_map):
+    """
+    Returns the center of the trigger volume of a traffic light, as well as
+    the waypoints at its stop line (one per affected lane)
+    """
+    def rotate_point(point, angle):
+        """
+        rotate a given point by a given angle
+        """
+        x_ = math.cos(math.radians(angle)) * point.x - math.sin(math.radians(angle)) * point.y
+        y_ = math.sin(math.radians(angle)) * point.x + math.cos(math.radians(angle)) * point.y
+        return carla.Vector3D(x_, y_, point.z)
+
+    base_transform = traffic_light.get_transform()
+    base_rot = base_transform.rotation.yaw
+    area_loc = base_transform.transform(traffic_light.trigger_volume.location)
+
+    # Discretize the trigger box into points
+    area_ext = traffic_light.trigger_volume.extent
+    x_values = np.arange(-0.9 * area_ext.x, 0.9 * area_ext.x, 1.0)  # 0.9 to avoid crossing to adjacent lanes
+
+    area = []
+    for x in x_values:
+        point = rotate_point(carla.Vector3D(x, 0, area_ext.z), base_rot)
+        point_location = area_loc + carla.Location(x=point.x, y=point.y)
+        area.append(point_location)
+
+    # Get the waypoints of these points, removing duplicates
+    ini_wps = []
+    for pt in area:
+        wpx = carla_map.get_waypoint(pt)
+        # As x_values are arranged in order, only the last one has to be checked
+        if not ini_wps or ini_wps[-1].road_id != wpx.road_id or ini_wps[-1].lane_id != wpx.lane_id:
+            ini_wps.append(wpx)
+
+    # Advance them until the intersection
+    wps = []
+    for wpx in ini_wps:
+        while not wpx.is_intersection:
+            next_wps = wpx.next(0.5)
+            if next_wps and not next_wps[0].is_intersection:
+                wpx = next_wps[0]
+            else:
+                break
+        wps.append(wpx)
+
+    return area_loc, wps
+
+
+def get_stop_sign_waypoints(stop_sign, carla_map):
+    """
+    Returns the waypoints of the lanes overlapped by the trigger volume of a stop sign, one per lane,
+    at the point where the lane enters the volume.
+    The volume is sampled every meter along both of its axes, as stop triggers can span several lanes
+    """
+    transform = stop_sign.get_transform()
+    extent = stop_sign.trigger_volume.extent
+    x_values = np.arange(-0.9 * extent.x, 0.9 * extent.x + 0.01, 1.0) if extent.x > 0.5 else [0.0]
+    y_values = np.arange(-0.9 * extent.y, 0.9 * extent.y + 0.01, 1.0) if extent.y > 0.5 else [0.0]
+
+    wps = {}
+    for x in x_values:
+        for y in y_values:
+            point = transform.transform(stop_sign.trigger_volume.location + carla.Location(x=float(x), y=float(y)))
+            wp = carla_map.get_waypoint(point)
+            # Points outside of the driving lanes would be projected to the closest one, which might be outside the volume
+            if wp is None or wp.transform.location.distance(point) > wp.lane_width / 2.0:
+                continue
+
+            # Keep the first point of the volume in the lane direction ('s' grows along negative lane ids)
+            key = get_lane_key(wp)
+            direction = 1 if wp.lane_id < 0 else -1
+            if key not in wps or wp.s * direction < wps[key].s * direction:
+                wps[key] = wp
+
+    if not wps:
+        # Volume away from the lanes, use the lane closest to its center
+        wp = carla_map.get_waypoint(transform.transform(stop_sign.trigger_volume.location))
+        return [wp] if wp is not None else []
+    return list(wps.values())
+
+
+class TrafficControlIndex(object):
+
+    """
+    Map level index linking the lane segments to their governing traffic lights and stop signs.
+
+    The index is made out of three parts:
+    - segments: lane key -> [start s, end s, is junction, lane key of the next segment]
+    - controls: lane key -> {kind: [[s, control key], ...]}, the controls placed at each lane
+    - downstream: kind -> {lane key -> [control key, distance from the segment start]},
+      the first control found at or after each segment, without crossing a junction
+    """
+
+    CACHE_TAG = 'traffic_control_index'
+    CACHE_VERSION = 2
+
+    def __init__(self, carla_map, traffic_lights, stop_signs, use_cache=True):
+        """
+        Builds the index, or loads it from the cache if it matches the given traffic controls
+        """
+        self._actors = {TRAFFIC_LIGHT: {}, STOP_SIGN: {}}
+        for traffic_light in traffic_lights:
+            self._actors[TRAFFIC_LIGHT][get_control_key(traffic_light)] = traffic_light
+        for stop_sign in stop_signs:
+            self._actors[STOP_SIGN][get_control_key(stop_sign)] = stop_sign
+
+        data = load_map_cache(carla_map, self.CACHE_TAG, self.CACHE_VERSION) if use_cache else None
+        if data is None or not self._matches_actors(data):
+            data = self._build(carla_map)
+            if use_cache:
+                save_map_cache(carla_map, self.CACHE_TAG, self.CACHE_VERSION, data)
+
+        self._segments = data['segments']
+        self._controls = data['controls']
+        self._downstream = data['downstream']
+
+    def _matches_actors(self, data):
+        """
+        Checks that a cached index was made for the current set of traffic controls
+        """
+        for kind in (TRAFFIC_LIGHT, STOP_SIGN):
+            if set(data['keys'][kind]) != set(self._actors[kind]):
+                return False
+        return True
+
+    def _build(self, carla_map):
+        """
+        Computes the index by walking the map topology once
+        """
+        # Lane segments and their successors
+        segments = {}
+        for entry_wp, exit_wp in carla_map.get_topology():
+            key = get_lane_key(entry_wp)
+            if key in segments:
+                continue  # Forks appear several times at the topology, keep the first one (as waypoint.next()[0])
+
+            next_key = None
+            for next_wp in exit_wp.next(1.0):
+                if get_lane_key(next_wp) != key:
+                    next_key = get_lane_key(next_wp)
+                    break
+            segments[key] = [entry_wp.s, exit_wp.s, entry_wp.is_junction, next_key]
+
+        # Traffic controls placed at each lane
+        controls = {}
+        for control_key, traffic_light in self._actors[TRAFFIC_LIGHT].items():
+            _, stop_wps = get_traffic_light_waypoints(traffic_light, carla_map)
+            for wp in stop_wps:
+                lane_controls = controls.setdefault(get_lane_key(wp), {})
+                lane_controls.setdefault(TRAFFIC_LIGHT, []).append([wp.s, control_key])
+
+        for control_key, stop_sign in self._actors[STOP_SIGN].items():
+            for wp in get_stop_sign_waypoints(stop_sign, carla_map):
+                lane_controls = controls.setdefault(get_lane_key(wp), {})
+                lane_controls.setdefault(STOP_SIGN, []).append([wp.s, control_key])
+
+        data = {
+            'keys': {kind: list(self._actors[kind]) for kind in (TRAFFIC_LIGHT, STOP_SIGN)},
+            'segments': segments,
+            'controls': controls,
+            'downstream': {}
+        }
+        for kind in (TRAFFIC_LIGHT, STOP_SIGN):
+            data['downstream'][kind] = self._build_downstream(segments, controls, kind)
+
+        return data
+
+    @staticmethod
+    def _build_downstream(segments, controls, kind):
+        """
+        For each lane segment, get the first control of the given kind found at, or after it,
+        until the next junction, as well as its distance to the start of the segment
+        """
+        downstream = {}
+        for key in segments:
+            if key in downstream:
+                continue
+
+            # Walk the chain of segments until a solved one, a control, or a junction is found
+            chain = []
+            visited = set()
+            result = None
+            current = key
+            while current in segments and current not in visited:
+                if current in downstream:
+                    result = downstream[current]
+                    break
+                start_s, end_s, is_junction, next_key = segments[current]
+                if is_junction:
+                    break
+
+                visited.add(current)
+                chain.append(current)
+
+                lane_controls = controls.get(current, {}).get(kind)
+                if lane_controls:
+                    s, control_key = min(lane_controls, key=lambda x: abs(x[0] - start_s))
+                    result = [control_key, abs(s - start_s)]
+                    downstream[current] = result
+                    chain.pop()
+                    break
+                current = next_key
+
+            # And propagate it backwards, adding the length of each segment
+            for current in reversed(chain):
+                if result is not None:
+                    start_s, end_s, _, _ = segments[current]
+                    result = [result[0], result[1] + abs(end_s - start_s)]
+                downstream[current] = result
+
+        return {key: value for key, value in downstream.items() if value is not None}
+
+    def get_next_control(self, waypoint, kind):
+        """
+        Returns the next control of the given kind affecting the waypoint, until the next junction,
+        and the distance to it. (None, inf) is returned if there is no such control
+        """
+        if waypoint is None or waypoint.is_junction:
+            return None, float('inf')
+
+        key = get_lane_key(waypoint)
+        segment = self._segments.get(key)
+        if segment is None:
+            return None, float('inf')
+
+        start_s, end_s, _, next_key = segment
+        direction = 1 if end_s >= start_s else -1
+
+        # Controls at the same lane, ahead of the waypoint
+        best_key, best_distance = None, float('inf')
+        for s, control_key in self._controls.get(key, {}).get(kind, []):
+            distance = (s - waypoint.s) * direction
+            if 0 <= distance < best_distance:
+                best_key, best_distance = control_key, distance
+
+        # Otherwise, the first one after this segment
+        if best_key is None and next_key is not None:
+            next_control = self._downstream[kind].get(next_key)
+            if next_control is not None:
+                best_key = next_control[0]
+                best_distance = abs(end_s - waypoint.s) + next_control[1]
+
+        if best_key is None:
+            return None, float('inf')
+        return self._actors[kind].get(best_key), best_distance
+
+    def get_next_traffic_light(self, waypoint):
+        """
+        Returns the next traffic light affecting the waypoint, and the distance to its stop line.
+        Only the traffic lights whose stop line is at the lanes followed by the waypoint are returned,
+        so a waypoint reaching a junction without any of them has no traffic light
+        """
+        return self.get_next_control(waypoint, TRAFFIC_LIGHT)
+
+    def get_next_stop_sign(self, waypoint):
+        """
+        Returns the next stop sign affecting the waypoint, and the distance to the point where the lane
+        of the waypoint enters its trigger volume
+        """
+        return self.get_next_control(waypoint, STOP_SIGN)
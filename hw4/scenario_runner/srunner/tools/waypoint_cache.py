@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a cache of the map waypoint queries.
+
+Locations are quantized to a grid, and each cell is answered with the waypoint of its
+center, so repeated queries around the same place (i.e. stopped vehicles) are only
+computed once. The most recent waypoints are kept
+in memory, and the lanes found at each cell are saved per map, to be reused by later runs.
+"""
+
+from collections import OrderedDict
+
+import carla
+
+from srunner.tools.map_cache import load_map_cache, save_map_cache
+
+
+class WaypointCache(object):
+
+    """
+    Memoizes carla.Map.get_waypoint over a quantized grid of (x, y, z, lane type) cells.
+    - In memory, the waypoints are kept in an LRU of 'max_size' cells
+    - On disk, each cell stores the lane and s of its waypoint, so that the waypoint is
+      recreated with get_waypoint_xodr, without searching the map
+    """
+
+    CACHE_TAG = 'waypoint_cache'
+    CACHE_VERSION = 1
+
+    RESOLUTION = 0.1  # Size of the XY cells [m]
+    Z_RESOLUTION = 1.0  # Size of the cells at the Z axis [m]
+    MAX_SIZE = 100000  # Maximum amount of waypoints in memory
+    MAX_STORED = 200000  # Maximum amount of cells saved to disk
+
+    def __init__(self, carla_map, resolution=None, max_size=None, use_cache=True):
+        """
+        Args:
+            carla_map (carla.Map): Map of the queries
+            resolution (float): Overrides RESOLUTION
+            max_size (int): Overrides MAX_SIZE
+            use_cache (bool): Whether or not to load and save the cells of the map
+        """
+        self._map = carla_map
+        self.resolution = resolution or self.RESOLUTION
+        self.max_size = max_size or self.MAX_SIZE
+        self._use_cache = use_cache
+
+        self._waypoints = OrderedDict()
+        self._new_cells = {}  # Cells computed since the last save
+
+        self._stored = {}
+        data = load_map_cache(carla_map, self.CACHE_TAG, self.CACHE_VERSION) if use_cache else None
+        if data is not None and data['resolution'] == self.resolution:
+            self._stored = data['cells']
+
+        self.hits = 0
+        self.misses = 0
+
+    def _get_key(self, location, project_to_road, lane_type):
+        return (int(round(location.x / self.resolution)),
+                int(round(location.y / self.resolution)),
+                int(round(location.z / self.Z_RESOLUTION)),
+                bool(project_to_road),
+                int(lane_type))
+
+    def _compute_waypoint(self, key, project_to_road, lane_type):
+        """
+        Gets the waypoint of a cell, from the saved cells if possible, or by querying the map at the cell center
+        """
+        stored_key = ','.join(str(value) for value in key)
+        if stored_key in self._stored:
+            lane = self._stored[stored_key]
+            if lane is None:
+                return None
+            waypoint = self._map.get_waypoint_xodr(*lane)
+            if waypoint is not None:
+                return waypoint
+
+        center = carla.Location(x=key[0] * self.resolution, y=key[1] * self.resolution, z=key[2] * self.Z_RESOLUTION)
+        waypoint = self._map.get_waypoint(center, project_to_road=project_to_road, lane_type=lane_type)
+
+        if len(self._stored) < self.MAX_STORED:
+            lane = None if waypoint is None else [waypoint.road_id, waypoint.lane_id, waypoint.s]
+            self._stored[stored_key] = lane
+            self._new_cells[stored_key] = lane
+
+        return waypoint
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=carla.LaneType.Driving):
+        """
+        Same as carla.Map.get_waypoint, with the location quantized to the cache resolution
+        """
+        key = self._get_key(location, project_to_road, lane_type)
+        if key in self._waypoints:
+            self.hits += 1
+            self._waypoints.move_to_end(key)
+            return self._waypoints[key]
+
+        self.misses += 1
+        waypoint = self._compute_waypoint(key, project_to_road, lane_type)
+
+        self._waypoints[key] = waypoint
+        if len(self._waypoints) > self.max_size:
+            self._waypoints.popitem(last=False)
+
+        return waypoint
+
+    def prefetch_route(self, route, lane_types=(carla.LaneType.Driving,)):
+        """
+        Fills the cells along a route, given as a list of (carla.Transform, RoadOption)
+        """
+        locations = [transform.location for transform, _ in route]
+        for start, end in zip(locations[:-1], locations[1:]):
+            steps = max(int(start.distance(end) / self.resolution), 1)
+            for i in range(steps):
+                ratio = i / steps
+                location = carla.Location(x=start.x + (end.x - start.x) * ratio,
+                                          y=start.y + (end.y - start.y) * ratio,
+                                          z=start.z + (end.z - start.z) * ratio)
+                for lane_type in lane_types:
+                    self.get_waypoint(location, lane_type=lane_type)
+
+    def save(self):
+        """
+        Adds the new cells to the saved ones of the map, if any have been computed.
+        Other processes (i.e. the workers of a parallel evaluation) might have saved their cells
+        since this cache was loaded, so the file is read again and merged instead of overwritten
+        """
+        if not self._use_cache or not self._new_cells:
+            return
+
+        data = load_map_cache(self._map, self.CACHE_TAG, self.CACHE_VERSION)
+        cells = data['cells'] if data is not None and data['resolution'] == self.resolution else {}
+        for key, lane in self._new_cells.items():
+            if len(cells) >= self.MAX_STORED:
+                break
+            cells[key] = lane
+
+        save_map_cache(self._map, self.CACHE_TAG, self.CACHE_VERSION,
+                       {'resolution': self.resolution, 'cells': cells})
+        self._new_cells = {}
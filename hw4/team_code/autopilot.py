@@ -24,6 +24,7 @@ from privileged_route_planner import PrivilegedRoutePlanner
 from config import GlobalConfig
 import transfuser_utils as t_u
 from scenario_logger import ScenarioLogger
+from run_recorder import RunRecorder
 from longitudinal_controller import LongitudinalLinearRegressionController
 from kinematic_bicycle_model import KinematicBicycleModel
 import cv2 
@@ -38,6 +39,10 @@ class AutoPilot(autonomous_agent_local.AutonomousAgent):
       Drives by accessing the simulator directly.
       """
 
+    # Folder of the debug images streamed into video.mp4, and its frame rate
+    video_folder = 'debug_rgb'
+    video_fps = 20
+
     def setup(self, path_to_conf_file, route_index=None, traffic_manager=None, scenario_name=None):
         """
         Set up the autonomous agent for the CARLA simulation.
@@ -54,6 +59,7 @@ class AutoPilot(autonomous_agent_local.AutonomousAgent):
         self.step = -1
         self.initialized = False
         self.save_path = None
+        self.recorder = None
         self.route_index = route_index
 
         self.datagen = int(os.environ.get("DATAGEN", 0)) == 1
@@ -157,6 +163,10 @@ class AutoPilot(autonomous_agent_local.AutonomousAgent):
             
             (self.save_path / "debug_rgb").mkdir()
 
+            # Everything is written in the background, the video is encoded while driving
+            self.recorder = RunRecorder(self.save_path)
+            self.recorder.add_video(self.video_folder, "video.mp4", self.video_fps)
+
             if self.datagen:
                 (self.save_path / "measurements").mkdir()
                 # (self.save_path / 'boxes').mkdir()
@@ -507,7 +517,7 @@ class AutoPilot(autonomous_agent_local.AutonomousAgent):
             frame = self.step // self.config.data_save_freq
             
             # CARLA images are already in opencv's BGR format.
-            cv2.imwrite(str(self.save_path / 'debug_rgb' / (f'{frame:04}.jpg')), tick_data['rgb_debug'])
+            self.recorder.write_frame('debug_rgb', frame, tick_data['rgb_debug'])
             
         return control, driving_data
 
@@ -1075,9 +1085,7 @@ class AutoPilot(autonomous_agent_local.AutonomousAgent):
                 self.tp_sign_agrees_with_angle.append(same_direction)
 
         if ((self.step % self.config.data_save_freq == 0) and (self.save_path is not None) and self.datagen):
-            measurements_file = self.save_path / "measurements" / f"{frame:04}.json.gz"
-            with gzip.open(measurements_file, "wt", encoding="utf-8") as f:
-                ujson.dump(data, f, indent=4)
+            self.recorder.write_json(pathlib.Path("measurements") / f"{frame:04}.json.gz", data)
 
             # save bbox 
         # bbox = self.get_bounding_boxes()
@@ -1103,7 +1111,7 @@ class AutoPilot(autonomous_agent_local.AutonomousAgent):
                 ujson.dump(results.__dict__, f, indent=2)
 
         if self.save_path is not None:
-            self.lon_logger.dump_to_json()
+            self.lon_logger.close()
 
             # Save the target speed histogram to a compressed JSON file
             if len(self.speed_histogram) > 0:
@@ -1124,15 +1132,9 @@ class AutoPilot(autonomous_agent_local.AutonomousAgent):
         del self.walker_past_pos
         
         #cv2.imwrite(str(self.save_path / 'rgb_front' / (f'{frame:04}.jpg')), tick_data['rgb_front'])
-        # create video 
-        out = cv2.VideoWriter(str(self.save_path / "video.mp4"), cv2.VideoWriter_fourcc(*'mp4v'), 
-                        20,  (960, 540)) 
-        file_list = sorted(os.listdir(str(self.save_path / "debug_rgb")))
-        for file_name in file_list:
-            # print(self.save_path / "debug_rgb" / file_name)
-            tmp_img = cv2.imread(str(self.save_path / "debug_rgb" / file_name))
-            out.write(tmp_img)
-        out.release()
+        # Wait for the pending writes, the video was already encoded while driving
+        if self.recorder is not None:
+            self.recorder.close()
         
         
         # # metric info
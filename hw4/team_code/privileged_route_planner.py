@@ -9,6 +9,8 @@ import carla
 from scipy.interpolate import interp1d
 from scipy.spatial import cKDTree
 from agents.navigation.local_planner import RoadOption
+from srunner.scenariomanager.carla_data_provider import CarlaDataProvider
+from srunner.tools.route_progress import RouteProgress
 
 
 class PrivilegedRoutePlanner(object):
@@ -50,6 +52,7 @@ class PrivilegedRoutePlanner(object):
         self.route_waypoints = []
         self.route_points = np.array([[]])
         self.original_route_points = np.array([[]])
+        self.original_route_progress = None
         self.commands = []
         self.rotation_angles = []
 
@@ -252,6 +255,7 @@ class PrivilegedRoutePlanner(object):
     def get_closest_route_index(self, begin_idx, location):
         """
         Finds the index of the closest route point to a given location using gradient descent with constant gradient.
+        The descent is done by the route progress tracker, which evaluates the distances in vectorized chunks.
 
         Args:
             begin_idx (int): Starting index for the search.
@@ -260,30 +264,7 @@ class PrivilegedRoutePlanner(object):
         Returns:
             int: Index of the closest route point.
         """
-        index = begin_idx
-        location_np = np.array([location.x, location.y])
-
-        # calculate the search direction
-        direction = 1
-        if np.linalg.norm(location_np -
-                          self.original_route_points[index, :2]) < np.linalg.norm(location_np -
-                                                                                  self.original_route_points[index +
-                                                                                                             1, :2]):
-            direction = -1
-
-        # The following is like a gradient descent with a constant gradient.
-        while True:
-            # check if we have reached the first or last route point
-            if index + direction == 0 or index + direction == self.original_route_points.shape[0]:
-                return index
-
-            dist1 = np.linalg.norm(location_np - self.original_route_points[index, :2])
-            dist2 = np.linalg.norm(location_np - self.original_route_points[index + direction, :2])
-            # check if we have found the closest route point
-            if dist1 < dist2:
-                return index
-
-            index += direction
+        return self.original_route_progress.get_closest_index(location, begin_idx)
 
     def shift_route_for_invading_turn(self, first_cone, last_cone, lateral_offset):
         """
@@ -437,6 +418,7 @@ class PrivilegedRoutePlanner(object):
         # Smooth and interpolate the route
         self.route_points, self.commands = self.smooth_and_supersample(route_points, cmds)
         self.original_route_points = np.copy(self.route_points)
+        self.original_route_progress = RouteProgress(self.original_route_points)
         self.commands_orig = self.commands.copy()
 
         # Get the waypoint objects for the route points
@@ -529,8 +511,8 @@ class PrivilegedRoutePlanner(object):
             carla_map: Carla map instance.
         """
         self.rotation_angles = self.compute_rotation_angles(self.route_points)
-        self.compute_distances_to_traffic_lights(carla_world)
-        self.compute_distances_to_stop_signs(carla_world, carla_map)
+        self.compute_distances_to_traffic_lights()
+        self.compute_distances_to_stop_signs(carla_map)
         self.compute_speed_limits(carla_map)
         self.prevent_too_early_lane_changes()
 
@@ -568,13 +550,14 @@ class PrivilegedRoutePlanner(object):
                         [wp.transform.location.x, wp.transform.location.y, wp.transform.location.z])
                     j += 1
 
-    def compute_distances_to_traffic_lights(self, carla_world):
+    def compute_distances_to_traffic_lights(self):
         """
         Compute the distance to the next traffic light from each individual route location.
-
-        Args:
-            carla_world: Carla world instance.
+        The traffic lights are looked up at the map level traffic control index of the CarlaDataProvider,
+        which only returns the lights whose stop line is at the lanes of the route.
         """
+        traffic_control_index = CarlaDataProvider.get_traffic_control_index()
+
         # Initialize arrays to store distances and next traffic lights
         self.distances_to_next_traffic_lights = np.full(self.route_points.shape[0], np.inf)
         self.next_traffic_lights = [None] * self.route_points.shape[0]
@@ -587,13 +570,13 @@ class PrivilegedRoutePlanner(object):
         # Iterate over route points in reverse order
         for i in range(len(self.route_points) - 1, -1, -1):
             waypoint = self.route_waypoints[i]
-            traffic_lights = carla_world.get_traffic_lights_from_waypoint(waypoint, 5)
+            traffic_light, distance = traffic_control_index.get_next_traffic_light(waypoint)
 
             # Check if the found traffic light was already recorded in the past
-            if traffic_lights:
+            if traffic_light is not None and distance <= 5:
                 if not traffic_light_already_recorded:
                     distance_idx = 0
-                    next_traffic_light = traffic_lights[0]
+                    next_traffic_light = traffic_light
                 else:
                     distance_idx += 1
 
@@ -611,15 +594,15 @@ class PrivilegedRoutePlanner(object):
             [self.distances_to_next_traffic_lights[:-40], 40 * [np.inf]])
         self.next_traffic_lights = self.next_traffic_lights[:-40] + (40 * [None])
 
-    def compute_distances_to_stop_signs(self, carla_world, carla_map):
+    def compute_distances_to_stop_signs(self, carla_map):
         """
         Compute the distance to the next stop sign from each individual route location.
-        We use the official implementation that is used to test whether we ran a stop sign
-        The logic is copied from the class RunningStopTest in 
+        The candidate stop signs are looked up at the map level traffic control index of the CarlaDataProvider,
+        and then filtered with the official implementation that is used to test whether we ran a stop sign.
+        The logic is copied from the class RunningStopTest in
         scenario_runner/srunner/scenariomanager/scenarioatomics/atomic_criteria
 
         Args:
-            carla_world: Carla world instance.
             carla_map: Carla map instance.
         """
 
@@ -660,14 +643,6 @@ class PrivilegedRoutePlanner(object):
 
             return False
 
-        def _scan_for_stop_sign(list_stop_signs, list_stop_signs_extent, wp_list, stop_locations):
-            """Check which stop sign affects the actor."""
-            for (stop, stop_extent, stop_location) in zip(list_stop_signs, list_stop_signs_extent, stop_locations):
-                if is_actor_affected_by_stop(wp_list, stop_extent, stop_location):
-                    return stop
-
-            return None
-
         def _get_waypoints(start_loc, carla_map):
             """Returns a list of waypoints starting from the ego location and a set amount forward"""
             wp_list = []
@@ -689,38 +664,46 @@ class PrivilegedRoutePlanner(object):
             return wp_list
 
         # Initialize arrays to store distances and next stop signs
-        self.distances_to_next_stop_signs = np.full(self.route_points.shape[0], np.inf, dtype=np.float)
+        self.distances_to_next_stop_signs = np.full(self.route_points.shape[0], np.inf, dtype=float)
         self.next_stop_signs = [None] * self.route_points.shape[0]
 
-        # Get list of all stop signs
-        list_stop_signs = carla_world.get_actors().filter("*traffic.stop*")
+        traffic_control_index = CarlaDataProvider.get_traffic_control_index()
+        stop_sign_data = {}
 
         next_stop_signs = None
         distance_idx = np.inf
 
-        if list_stop_signs:
-            list_stop_signs_extent = [x.trigger_volume.extent for x in list_stop_signs]
-
-            # Adjust minimum extent for stop signs. That is necessary, since some stop signs are only 2cm thick
-            # and because we use waypoints 50 cm apart it's likely we would miss it
-            for extent in list_stop_signs_extent:
+        # The index gives the next stop sign until the lane enters its trigger volume, so the last one found is
+        # kept as the candidate, which is only affecting the route points that pass the RunningStopTest check.
+        # The route might start inside a trigger volume, so the first candidate is searched a bit before it
+        previous_wps = self.route_waypoints[0].previous(4.0) if self.route_waypoints else []
+        candidate = traffic_control_index.get_next_stop_sign(previous_wps[0])[0] if previous_wps else None
+        for i in range(self.route_points.shape[0]):
+            stop_sign, _ = traffic_control_index.get_next_stop_sign(self.route_waypoints[i])
+            if stop_sign is not None:
+                candidate = stop_sign
+            if candidate is None:
+                continue
+
+            if candidate.id not in stop_sign_data:
+                # Adjust minimum extent for stop signs. That is necessary, since some stop signs are only 2cm thick
+                # and because we use waypoints 50 cm apart it's likely we would miss it
+                extent = candidate.trigger_volume.extent
                 extent.x = max(extent.x, 1)
                 extent.y = max(extent.y, 1)
-
-            stop_locations = [stop.get_transform().transform(stop.trigger_volume.location) for stop in list_stop_signs]
-            stop_locations_np = np.array([[x.x, x.y, x.z] for x in stop_locations])
-
-            for i in range(self.route_points.shape[0]):
-                loc = self.route_points[i]
-                stop_sign = None
-
-                # Quick distance check to safe computation later
-                if np.linalg.norm(loc[None] - stop_locations_np, axis=1).min() < 4:
-                    start_loc = carla.Location(x=loc[0], y=loc[1], z=loc[2])
-                    check_wps = _get_waypoints(start_loc, carla_map)
-                    stop_sign = _scan_for_stop_sign(list_stop_signs, list_stop_signs_extent, check_wps, stop_locations)
-                self.next_stop_signs[i] = stop_sign
-
+                location = candidate.get_transform().transform(candidate.trigger_volume.location)
+                stop_sign_data[candidate.id] = (extent, location, np.array([location.x, location.y, location.z]))
+            stop_extent, stop_location, stop_location_np = stop_sign_data[candidate.id]
+
+            # Quick distance check to safe computation later
+            loc = self.route_points[i]
+            if np.linalg.norm(loc - stop_location_np) < 4:
+                start_loc = carla.Location(x=loc[0], y=loc[1], z=loc[2])
+                check_wps = _get_waypoints(start_loc, carla_map)
+                if is_actor_affected_by_stop(check_wps, stop_extent, stop_location):
+                    self.next_stop_signs[i] = candidate
+
+        if stop_sign_data:
             # Compute distances to next stop signs
             for i in range(self.distances_to_next_stop_signs.shape[0] - 1, -1, -1):
                 if self.next_stop_signs[i] is not None:
@@ -0,0 +1,199 @@
+"""
+This file implements the recorder used by the agents to save their driving and debug data.
+
+All the writes are done by background threads, so that the agent never waits for the disk.
+Per frame records (metadata, metric info...) are appended in chunks to compressed logs,
+instead of rewriting a growing file, and the videos are encoded while driving, directly
+from the frames in memory.
+"""
+
+import gzip
+import itertools
+import os
+import pathlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import ujson
+
+
+def to_uint8_image(image):
+    """
+    Converts an image to a contiguous uint8 array, as done by cv2.imwrite
+    """
+    if image.dtype != np.uint8:
+        image = np.clip(np.rint(image), 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(image)
+
+
+class VideoStream(object):
+    """
+    Encodes a video in a background thread. The size of the video is the one of its first frame.
+    """
+
+    def __init__(self, path, fps, max_pending=64):
+        self.path = str(path)
+        self.fps = fps
+        self._frames = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, frame):
+        """
+        Queues a BGR frame. Only waits if the encoder is more than 'max_pending' frames behind
+        """
+        self._frames.put(to_uint8_image(frame))
+
+    def _run(self):
+        writer = None
+        while True:
+            frame = self._frames.get()
+            if frame is None:
+                break
+
+            if writer is None:
+                height, width = frame.shape[:2]
+                writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (width, height))
+            writer.write(frame)
+
+        if writer is not None:
+            writer.release()
+
+    def close(self):
+        """
+        Encodes the remaining frames and closes the video
+        """
+        self._frames.put(None)
+        self._thread.join()
+
+
+class RunRecorder(object):
+    """
+    Saves the data of a run in the background. All the paths are relative to the save path.
+
+    Files are written by a pool of threads, while the logs are written by a single thread,
+    so that their chunks keep their order. The amount of pending writes is bounded,
+    so the agent only waits if the disk can't keep up with it.
+    """
+
+    def __init__(self, save_path, num_workers=2, max_pending=64, chunk_size=100):
+        """
+        Args:
+            save_path (str): Folder of the run
+            num_workers (int): Threads writing the files
+            max_pending (int): Maximum amount of queued writes
+            chunk_size (int): Amount of records of each log chunk
+        """
+        self.save_path = pathlib.Path(save_path)
+        self.chunk_size = chunk_size
+
+        self._file_writer = ThreadPoolExecutor(max_workers=num_workers)
+        self._log_writer = ThreadPoolExecutor(max_workers=1)
+        self._pending = threading.BoundedSemaphore(max_pending)
+
+        self._logs = {}
+        self._videos = {}
+
+    def _submit(self, executor, function, *args):
+        self._pending.acquire()
+        future = executor.submit(function, *args)
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        self._pending.release()
+        if future.exception() is not None:
+            print(f"WARNING: Failed to save the run data: {future.exception()}")
+
+    def _get_path(self, relative_path):
+        path = self.save_path / relative_path
+        os.makedirs(path.parent, exist_ok=True)
+        return path
+
+    def write_image(self, relative_path, image):
+        """
+        Saves a BGR image (format given by the extension). The image must not be modified afterwards
+        """
+        self._submit(self._file_writer, self._write_image, relative_path, image)
+
+    def _write_image(self, relative_path, image):
+        cv2.imwrite(str(self._get_path(relative_path)), image)
+
+    def write_json(self, relative_path, data, indent=4):
+        """
+        Saves a json file, compressed if the path ends with .gz.
+        The data is serialized right away, so it can be modified afterwards
+        """
+        self._submit(self._file_writer, self._write_text, relative_path, ujson.dumps(data, indent=indent))
+
+    def _write_text(self, relative_path, text):
+        path = self._get_path(relative_path)
+        if path.suffix == '.gz':
+            with gzip.open(path, 'wt', encoding='utf-8') as f:
+                f.write(text)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+
+    def add_video(self, folder, relative_path, fps):
+        """
+        Streams the frames written to 'folder' (see write_frame) into a video
+        """
+        self._videos[folder] = VideoStream(self._get_path(relative_path), fps)
+
+    def write_frame(self, folder, frame, image):
+        """
+        Saves the BGR debug image of a frame as 'folder/frame.jpg', and adds it to the video of the folder
+        """
+        image = to_uint8_image(image).copy()
+        self.write_image(pathlib.Path(folder) / f'{frame:04}.jpg', image)
+        if folder in self._videos:
+            self._videos[folder].write(image)
+
+    def append_log(self, name, record):
+        """
+        Appends a record to the log 'name.jsonl.gz'. Records are written in chunks of 'chunk_size',
+        each one as a new gzip member, so the file is never rewritten
+        """
+        lines = self._logs.setdefault(name, [])
+        lines.append(ujson.dumps(record))
+        if len(lines) >= self.chunk_size:
+            self._flush_log(name)
+
+    def _flush_log(self, name):
+        lines = self._logs.pop(name, None)
+        if lines:
+            self._submit(self._log_writer, self._write_chunk, f'{name}.jsonl.gz', lines)
+
+    def _write_chunk(self, relative_path, lines):
+        with gzip.open(self._get_path(relative_path), 'at', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def flush(self):
+        """
+        Queues the partial chunks of the logs
+        """
+        for name in list(self._logs):
+            self._flush_log(name)
+
+    def close(self):
+        """
+        Writes all the pending data and stops the threads
+        """
+        self.flush()
+        self._file_writer.shutdown(wait=True)
+        self._log_writer.shutdown(wait=True)
+        for video in self._videos.values():
+            video.close()
+        self._videos = {}
+
+    @staticmethod
+    def read_log(path, start=0, stop=None):
+        """
+        Iterates over the records of a log, from 'start' to 'stop'
+        """
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in itertools.islice(f, start, stop):
+                yield ujson.loads(line)
@@ -2,20 +2,95 @@
 Creates log files during evaluation with which we can visualize failures
 """
 
-import os
+import io
 import json
+import os
+import zipfile
+
 import carla
-import gzip
 import numpy as np
 from rdp import rdp
 
+# One row per actor / traffic light / route box and logged step. Angles are in radians and
+# the extents are the half sizes (y, x) of the boxes (the corners are (y, x), (y, -x), (-y, -x), (-y, x))
+ACTOR_DTYPE = np.dtype([
+    ('id', np.int32),
+    ('pos', np.float64, (2,)),
+    ('yaw', np.float32),
+    ('vel', np.float32, (2,)),
+    ('extent', np.float32, (2,)),
+    ('height', np.float32),
+    ('pitch', np.float32),
+    ('roll', np.float32),
+    ('type', 'S64'),
+    ('color', 'S16'),
+    ('steer', np.float32),
+    ('throttle', np.float32),
+    ('brake', np.float32),
+])
+LIGHT_DTYPE = np.dtype([
+    ('pos', np.float64, (2,)),
+    ('yaw', np.float32),
+    ('state', np.int8),
+    ('extent', np.float32, (2,)),
+])
+ROUTE_DTYPE = np.dtype([
+    ('pos', np.float64, (2,)),
+    ('yaw', np.float32),
+    ('id', np.int32),
+    ('extent', np.float32, (2,)),
+])
+# One row per logged step, with the amount of rows of the other tables. The ego is the first actor
+STEP_DTYPE = np.dtype([
+    ('step', np.int32),
+    ('frame', np.int64),
+    ('num_actors', np.int32),
+    ('num_lights', np.int32),
+    ('num_route', np.int32),
+    ('ego_steer', np.float32),
+    ('ego_throttle', np.float32),
+    ('ego_brake', np.float32),
+])
+TABLES = {'steps': STEP_DTYPE, 'actors': ACTOR_DTYPE, 'lights': LIGHT_DTYPE, 'route': ROUTE_DTYPE}
+
+
+class TableBuffer():
+  """
+  Preallocated structured array to which rows are appended, reused between chunks
+  """
+
+  def __init__(self, dtype, capacity=256):
+    self.data = np.zeros(capacity, dtype=dtype)
+    self.size = 0
+
+  def append(self, num_rows):
+    """
+    Reserves num_rows rows at the end of the table and returns them
+    """
+    if self.size + num_rows > len(self.data):
+      data = np.zeros(max(2 * len(self.data), self.size + num_rows), dtype=self.data.dtype)
+      data[:self.size] = self.data[:self.size]
+      self.data = data
+
+    rows = self.data[self.size:self.size + num_rows]
+    self.size += num_rows
+    return rows
+
+  def clear(self):
+    self.size = 0
+
 
 class ScenarioLogger():
   """
-  Creates log files during evaluation with which we can visualize failures
+  Creates log files during evaluation with which we can visualize failures.
+
+  Each logged step is read from a single world snapshot and written into preallocated structured
+  arrays. Every 'chunk_size' logged steps, each field is appended as a compressed .npy member of
+  'records.zip', so the memory doesn't grow with the route. Use ScenarioLogReader to load them.
   """
 
-  def __init__(self, save_path, route_index, logging_freq, log_only, route_only, roi=30, rdp_epsilon=0.5) -> None:
+  def __init__(self, save_path, route_index, logging_freq, log_only, route_only, roi=30, rdp_epsilon=0.5,
+               chunk_size=100) -> None:
     """
         """
     # logger_settings
@@ -25,10 +100,12 @@ class ScenarioLogger():
 
     self.roi = roi  # radius around ego agent in meters
     self.rdp_epsilon = rdp_epsilon  # hyperparameter for RDP simplification
+    self.chunk_size = chunk_size  # logged steps of each chunk of the records file
 
     # meta data
     self.save_path = save_path
     self.route_index = route_index
+    self.records_file_path = os.path.join(self.save_path, "records.zip")
 
     # simulation objects
     self.world = None
@@ -36,51 +113,47 @@ class ScenarioLogger():
     self.step = 0
 
     # logging objects
-    self.states = []
-    self.lights = []
-    self.route_boxes = []
-    self.ego_actions = []
-    self.adv_actions = []
-
-    self.ego_pos = None
-    self.ego_yaw = None
-    self.ego_vel = None
-    self.ego_extent = None
-    self.ego_id = None
-    self.ego_type = None
-    self.ego_color = None
-    self.ego_height = None
-    self.ego_pitch = None
-    self.ego_roll = None
+    self.tables = {name: TableBuffer(dtype) for name, dtype in TABLES.items()}
+    self.num_chunks = 0
+    self.num_steps = 0
 
+    self.ego_location = None
     self.bg_vehicles = []
-    self.bg_pos = None
-    self.bg_yaw = None
-    self.bg_vel = None
-    self.bg_extent = None
-    self.bg_id = None
-    self.bg_type = None
-    self.bg_color = None
-    self.bg_height = None
-    self.bg_pitch = None
-    self.bg_roll = None
-
-    self.bg_steer = None
-    self.bg_throttle = None
-    self.bg_brake = None
-
     self.tlights = []
-    self.tl_pos = None
-    self.tl_yaw = None
-    self.tl_state = None
-    self.tl_extent = None
 
-    self.route_pos = None
-    self.route_yaw = None
-    self.route_id = None
-    self.route_extent = None
+    # Data that doesn't change during the route, per actor id
+    self._static_actor_data = {}
+    self._static_light_data = {}
+
+  def _get_actor_transform(self, snapshot, actor):
+    actor_snapshot = snapshot.find(actor.id)
+    if actor_snapshot is None:
+      return actor.get_transform(), actor.get_velocity()
+    return actor_snapshot.get_transform(), actor_snapshot.get_velocity()
+
+  def _get_static_actor_data(self, vehicle):
+    """
+    Extent, type and color of a vehicle
+    """
+    if vehicle.id not in self._static_actor_data:
+      extent = vehicle.bounding_box.extent
+      color = vehicle.attributes.get("color", "0,0,0")
+      self._static_actor_data[vehicle.id] = ((extent.y, extent.x), vehicle.type_id, color)
+    return self._static_actor_data[vehicle.id]
 
-  def _initialize_bg_agents(self):
+  def _get_static_light_data(self, tlight):
+    """
+    Center, yaw and extent of the trigger box of a traffic light
+    """
+    if tlight.id not in self._static_light_data:
+      transform = tlight.get_transform()
+      center = transform.transform(tlight.trigger_volume.location)
+      yaw = tlight.trigger_volume.rotation.yaw + transform.rotation.yaw
+      extent = tlight.trigger_volume.extent
+      self._static_light_data[tlight.id] = (carla.Location(center.x, center.y, center.z), yaw, (extent.y, extent.x))
+    return self._static_light_data[tlight.id]
+
+  def _initialize_bg_agents(self, snapshot):
     """
     _initialize_bg_agents
     """
@@ -90,7 +163,7 @@ class ScenarioLogger():
     self.bg_vehicles = []
     for vehicle in vehicles:
       if vehicle.id != self.ego_vehicle.id:
-        vehicle_location = vehicle.get_transform().location
+        vehicle_location = self._get_actor_transform(snapshot, vehicle)[0].location
         if vehicle_location.distance(self.ego_location) < self.roi:
           self.bg_vehicles.append(vehicle)
 
@@ -98,124 +171,59 @@ class ScenarioLogger():
     self.tlights = []
     for tlight in tlights:
       if tlight.state != carla.libcarla.TrafficLightState.Green:
-        trigger_box_global_pos = tlight.get_transform().transform(tlight.trigger_volume.location)
-        trigger_box_global_pos = carla.Location(x=trigger_box_global_pos.x,
-                                                y=trigger_box_global_pos.y,
-                                                z=trigger_box_global_pos.z)
+        trigger_box_global_pos = self._get_static_light_data(tlight)[0]
         if trigger_box_global_pos.distance(self.ego_location) < self.roi:
           self.tlights.append(tlight)
 
-  def fetch_bg_state(self):
+  def fetch_bg_state(self, snapshot):
     """
-    fetch_bg_state
+    Writes the ego and background vehicles and the red and yellow traffic lights into the tables.
+    Returns the amount of vehicles and of traffic lights
     """
     # vehicles
-    positions = []
-    yaws = []
-    velocities = []
-    extents = []
-    ids = []
-    types = []
-    colors = []
-    heigths = []
-    pitchs = []
-    rolls = []
-
-    for vehicle in self.bg_vehicles:
-      # shape is batch_size x num_agents x state_dims
-      positions.append(np.array([[[vehicle.get_location().x, vehicle.get_location().y]]]))
-      yaws.append(np.array([[[vehicle.get_transform().rotation.yaw]]]))
-      velocities.append(np.array([[[vehicle.get_velocity().x, vehicle.get_velocity().y]]]))
-      extents.append(
-          np.array([[[
-              [vehicle.bounding_box.extent.y, vehicle.bounding_box.extent.x],
-              [vehicle.bounding_box.extent.y, -vehicle.bounding_box.extent.x],
-              [-vehicle.bounding_box.extent.y, -vehicle.bounding_box.extent.x],
-              [-vehicle.bounding_box.extent.y, vehicle.bounding_box.extent.x],
-          ]]]))
-      ids.append(np.array([[[vehicle.id]]]))
-
-      types.append(np.array([[[vehicle.type_id]]]))
-      try:
-        colors.append(np.array([[[vehicle.attributes["color"]]]]))
-      except KeyError:
-        colors.append(np.array([[["0,0,0"]]]))
-
-      heigths.append(np.array([[[vehicle.get_location().z]]]))
-
-      pitchs.append(np.array([[[vehicle.get_transform().rotation.pitch]]]))
-
-      rolls.append(np.array([[[vehicle.get_transform().rotation.roll]]]))
-
-    if self.bg_pos is None and len(positions) > 0:
-      self.bg_pos = np.concatenate(positions, axis=1)
-    if self.bg_yaw is None and len(yaws) > 0:
-      self.bg_yaw = np.concatenate(np.radians(yaws), axis=1)
-    if self.bg_vel is None and len(velocities) > 0:
-      self.bg_vel = np.concatenate(velocities, axis=1)
-    if self.bg_extent is None and len(extents) > 0:
-      self.bg_extent = np.concatenate(extents, axis=1)
-    if self.bg_id is None and len(ids) > 0:
-      self.bg_id = np.concatenate(ids, axis=1)
-    if self.bg_type is None and len(types) > 0:
-      self.bg_type = np.concatenate(types, axis=1)
-    if self.bg_color is None and len(colors) > 0:
-      self.bg_color = np.concatenate(colors, axis=1)
-    if self.bg_height is None and len(heigths) > 0:
-      self.bg_height = np.concatenate(heigths, axis=1)
-    if self.bg_pitch is None and len(pitchs) > 0:
-      self.bg_pitch = np.concatenate(pitchs, axis=1)
-    if self.bg_roll is None and len(rolls) > 0:
-      self.bg_roll = np.concatenate(rolls, axis=1)
-
-    # traffic lights
-    tl_positions = []
-    tl_yaws = []
-    tl_states = []
-    tl_extents = []
+    vehicles = [self.ego_vehicle] + self.bg_vehicles
+    rows = self.tables['actors'].append(len(vehicles))
+    for row, vehicle in zip(rows, vehicles):
+      transform, velocity = self._get_actor_transform(snapshot, vehicle)
+      extent, type_id, color = self._get_static_actor_data(vehicle)
+      row['id'] = vehicle.id
+      row['pos'] = (transform.location.x, transform.location.y)
+      row['yaw'] = np.radians(transform.rotation.yaw)
+      row['vel'] = (velocity.x, velocity.y)
+      row['extent'] = extent
+      row['height'] = transform.location.z
+      row['pitch'] = np.radians(transform.rotation.pitch)
+      row['roll'] = np.radians(transform.rotation.roll)
+      row['type'] = type_id
+      row['color'] = color
+
+    # traffic lights, only the red and yellow ones
+    lights = []
     for tlight in self.tlights:
       if tlight.state == carla.libcarla.TrafficLightState.Red:
-        state = 0
+        lights.append((tlight, 0))
       elif tlight.state == carla.libcarla.TrafficLightState.Yellow:
-        state = 1
-      else:  # unknown
-        state = -1
-        continue
-
-      center_bounding_box = tlight.get_transform().transform(tlight.trigger_volume.location)
-      center_bounding_box = carla.Location(center_bounding_box.x, center_bounding_box.y, center_bounding_box.z)
-      length_bounding_box = carla.Vector3D(tlight.trigger_volume.extent.x, tlight.trigger_volume.extent.y,
-                                           tlight.trigger_volume.extent.z)
-      # can only create a bounding box from a transform.location, not from a
-      # location
-      transform = carla.Transform(center_bounding_box)
-      bounding_box = carla.BoundingBox(transform.location, length_bounding_box)
-
-      gloabl_rot = tlight.get_transform().rotation
-      bounding_box.rotation = carla.Rotation(pitch=tlight.trigger_volume.rotation.pitch + gloabl_rot.pitch,
-                                             yaw=tlight.trigger_volume.rotation.yaw + gloabl_rot.yaw,
-                                             roll=tlight.trigger_volume.rotation.roll + gloabl_rot.roll)
-
-      # shape is batch_size x num_agents x state_dims
-      tl_positions.append(np.array([[[center_bounding_box.x, center_bounding_box.y]]]))
-      tl_yaws.append(np.array([[[bounding_box.rotation.yaw]]]))
-      tl_states.append(np.array([[[state]]]))
-      tl_extents.append(
-          np.array([[[
-              [bounding_box.extent.y, bounding_box.extent.x],
-              [bounding_box.extent.y, -bounding_box.extent.x],
-              [-bounding_box.extent.y, -bounding_box.extent.x],
-              [-bounding_box.extent.y, bounding_box.extent.x],
-          ]]]))
-
-    if self.tl_pos is None and len(tl_positions) > 0:
-      self.tl_pos = np.concatenate(tl_positions, axis=1)
-    if self.tl_yaw is None and len(tl_yaws) > 0:
-      self.tl_yaw = np.concatenate(np.radians(tl_yaws), axis=1)
-    if self.tl_state is None and len(tl_states) > 0:
-      self.tl_state = np.concatenate(tl_states, axis=1)
-    if self.tl_extent is None and len(tl_extents) > 0:
-      self.tl_extent = np.concatenate(tl_extents, axis=1)
+        lights.append((tlight, 1))
+
+    rows = self.tables['lights'].append(len(lights))
+    for row, (tlight, state) in zip(rows, lights):
+      center, yaw, extent = self._get_static_light_data(tlight)
+      row['pos'] = (center.x, center.y)
+      row['yaw'] = np.radians(yaw)
+      row['state'] = state
+      row['extent'] = extent
+
+    return len(vehicles), len(lights)
+
+  def fetch_bg_actions(self, actor_rows):
+    """
+    fetch_bg_actions
+    """
+    for row, vehicle in zip(actor_rows[1:], self.bg_vehicles):
+      control = vehicle.get_control()
+      row['steer'] = control.steer
+      row['throttle'] = control.throttle
+      row['brake'] = control.brake
 
   def log_step(self, route, ego_control=None):
     """
@@ -224,295 +232,174 @@ class ScenarioLogger():
     self.step += 1
 
     # only save sim state to log every k frames
-    if self.log_only and self.step % self.logging_freq != 0:
+    if self.route_only or self.step % self.logging_freq != 0:
       return
 
-    # we check if the logging objects are already set to avoid redundant
-    # computation in case they can be set from the agent
-    # shape is batch_size x num_agents x state_dims so e.g. 1 x 1 x 2 for
-    # the ego pos (since bs is always 1 and we just have a single ego agent)
-    if not self.ego_extent:
-      ego_extent = self.ego_vehicle.bounding_box.extent
-      self.ego_extent = np.array([[[
-          [ego_extent.y, ego_extent.x],
-          [ego_extent.y, -ego_extent.x],
-          [-ego_extent.y, -ego_extent.x],
-          [-ego_extent.y, ego_extent.x],
-      ]]])
+    snapshot = self.world.get_snapshot()
+    self.ego_location = self._get_actor_transform(snapshot, self.ego_vehicle)[0].location
 
-    if not self.ego_pos:
-      self.ego_pos = self.ego_vehicle.get_location()
-      self.ego_pos = np.array([[[self.ego_pos.x, self.ego_pos.y]]])
+    # fetch relevant (nearby) background agents
+    self._initialize_bg_agents(snapshot)
 
-    if not self.ego_yaw:
-      self.ego_orientation = self.ego_vehicle.get_transform()
-      self.ego_yaw = np.array([[[np.radians(self.ego_orientation.rotation.yaw)]]])
+    # vehicles and traffic lights
+    actor_start = self.tables['actors'].size
+    num_actors, num_lights = self.fetch_bg_state(snapshot)
 
-    if not self.ego_vel:
-      self.ego_vel = self.ego_vehicle.get_velocity()
-      self.ego_vel = np.array([[[self.ego_vel.x, self.ego_vel.y]]])
+    # actions, ego action logging only if provided
+    actor_rows = self.tables['actors'].data[actor_start:actor_start + num_actors]
+    actor_rows[0]['steer'] = actor_rows[0]['throttle'] = actor_rows[0]['brake'] = np.nan
+    self.fetch_bg_actions(actor_rows)
 
-    if not self.ego_id:
-      self.ego_id = np.array([[[self.ego_vehicle.id]]])
+    # route
+    num_route = self.route_as_boxes(route)
+
+    step = self.tables['steps'].append(1)[0]
+    step['step'] = self.step
+    step['frame'] = snapshot.frame
+    step['num_actors'] = num_actors
+    step['num_lights'] = num_lights
+    step['num_route'] = num_route
+    if ego_control is not None:
+      step['ego_steer'] = ego_control.steer
+      step['ego_throttle'] = ego_control.throttle
+      step['ego_brake'] = ego_control.brake
+    else:
+      step['ego_steer'] = step['ego_throttle'] = step['ego_brake'] = np.nan
 
-    if not self.ego_type:
-      self.ego_type = np.array([[[self.ego_vehicle.type_id]]])
+    self.num_steps += 1
+    if self.tables['steps'].size >= self.chunk_size:
+      self.write_chunk()
 
-    if not self.ego_color:
-      self.ego_color = np.array([[[self.ego_vehicle.attributes["color"]]]])
+  def route_as_boxes(self, route):
+    """
+    Writes the route, simplified and represented as bounding boxes, into the route table.
+    Returns the amount of boxes
+    """
+    shortened_route = rdp(route, epsilon=self.rdp_epsilon)
 
-    if not self.ego_height:
-      self.ego_height = np.array([[[self.ego_vehicle.get_location().z]]])
+    # convert points to vectors
+    vectors = shortened_route[1:] - shortened_route[:-1]
+    midpoints = shortened_route[:-1] + vectors / 2.
+    norms = np.linalg.norm(vectors, axis=1)
+    angles = np.arctan2(vectors[:, 1], vectors[:, 0])
 
-    if not self.ego_pitch:
-      self.ego_orientation = self.ego_vehicle.get_transform()
-      self.ego_pitch = np.array([[[np.radians(self.ego_orientation.rotation.pitch)]]])
+    # only store route boxes that are near the ego vehicle
+    ego_location = np.array([self.ego_location.x, self.ego_location.y, self.ego_location.z])
+    starts = np.zeros((len(midpoints), 3))
+    starts[:, :2] = shortened_route[:len(midpoints), :2]
+    ids = np.arange(len(midpoints))
+    far = (0 < ids) & (ids < 10) & (np.linalg.norm(starts - ego_location, axis=1) > self.roi)
+    ids = ids[~far]
+
+    rows = self.tables['route'].append(len(ids))
+    rows['pos'] = midpoints[ids, :2]
+    rows['yaw'] = angles[ids]
+    rows['id'] = ids
+    rows['extent'][:, 0] = self.ego_vehicle.bounding_box.extent.y
+    rows['extent'][:, 1] = norms[ids] / 2.
+    return len(ids)
+
+  def write_chunk(self):
+    """
+    Appends the buffered steps to the records file, one compressed member per table field
+    """
+    if self.tables['steps'].size == 0:
+      return
 
-    if not self.ego_roll:
-      self.ego_orientation = self.ego_vehicle.get_transform()
-      self.ego_roll = np.array([[[np.radians(self.ego_orientation.rotation.roll)]]])
+    os.makedirs(self.save_path, exist_ok=True)
+    with zipfile.ZipFile(self.records_file_path, "a", compression=zipfile.ZIP_DEFLATED) as records:
+      for name, table in self.tables.items():
+        for field in table.data.dtype.names:
+          buffer = io.BytesIO()
+          np.save(buffer, table.data[field][:table.size])
+          records.writestr(f"{name}/{field}/{self.num_chunks:05d}.npy", buffer.getvalue())
+        table.clear()
 
-    self.ego_location = self.ego_vehicle.get_location()
+    self.num_chunks += 1
 
-    # fetch relevant (nearby) background agents
-    if not self.route_only:
-      self._initialize_bg_agents()
+  def close(self):
+    """
+    Writes the remaining steps and the meta data of the route
+    """
+    if self.route_only:
+      return
 
-    # fetch and concat adv states
-    self.fetch_bg_state()
+    self.write_chunk()
 
-    # vehicles
-    if len(self.bg_vehicles) > 0 and self.bg_color is not None:
-      state = {
-          "pos": np.concatenate([self.ego_pos, self.bg_pos], axis=1).tolist(),
-          "yaw": np.concatenate([self.ego_yaw, self.bg_yaw], axis=1).tolist(),
-          "vel": np.concatenate([self.ego_vel, self.bg_vel], axis=1).tolist(),
-          "extent": np.concatenate([self.ego_extent, self.bg_extent], axis=1).tolist(),
-          "id": np.concatenate([self.ego_id, self.bg_id], axis=1).tolist(),
-          "type": np.concatenate([self.ego_type, self.bg_type], axis=1).tolist(),
-          "color": np.concatenate([self.ego_color, self.bg_color], axis=1).tolist(),
-          "height": np.concatenate([self.ego_height, self.bg_height], axis=1).tolist(),
-          "pitch": np.concatenate([self.ego_pitch, self.bg_pitch], axis=1).tolist(),
-          "roll": np.concatenate([self.ego_roll, self.bg_roll], axis=1).tolist(),
-      }
-    else:
-      state = {
-          "pos": self.ego_pos.tolist(),
-          "yaw": self.ego_yaw.tolist(),
-          "vel": self.ego_vel.tolist(),
-          "extent": self.ego_extent.tolist(),
-          "id": self.ego_id.tolist(),
-          "type": self.ego_type.tolist(),
-          "color": self.ego_color.tolist(),
-          "height": self.ego_height.tolist(),
-          "pitch": self.ego_pitch.tolist(),
-          "roll": self.ego_roll.tolist(),
-      }
-
-    # traffic lights
-    if len(self.tlights) > 0:
-      lights = {
-          "pos": self.tl_pos.tolist(),
-          "yaw": self.tl_yaw.tolist(),
-          "state": self.tl_state.tolist(),
-          "extent": self.tl_extent.tolist(),
-      }
+    if self.world is not None:
+      town_name = self.world.get_map().name
     else:
-      lights = {
-          "pos": [],
-          "yaw": [],
-          "state": [],
-          "extent": [],
-      }
-
-    # route
-    self.route_as_boxes(route)
-    route_boxes = {
-        "pos": self.route_pos.tolist(),
-        "yaw": self.route_yaw.tolist(),
-        "id": self.route_id.tolist(),
-        "extent": self.route_extent.tolist(),
+      town_name = "Unkown"
+
+    meta_data = {
+        "index": self.route_index,
+        "town": town_name,
+        "num_chunks": self.num_chunks,
+        "num_steps": self.num_steps,
+        "logging_freq": self.logging_freq,
     }
+    os.makedirs(self.save_path, exist_ok=True)
+    with zipfile.ZipFile(self.records_file_path, "a", compression=zipfile.ZIP_DEFLATED) as records:
+      records.writestr("meta_data.json", json.dumps(meta_data))
 
-    # actions
-    # ego action logging only if provided
-    if ego_control is not None:
-      ego_steer = [[[ego_control.steer]]]
-      ego_throttle = [[[ego_control.throttle]]]
-      ego_brake = [[[ego_control.brake]]]
-
-      ego_actions = {"steer": ego_steer, "throttle": ego_throttle, "brake": ego_brake}
-
-    if len(self.bg_vehicles) > 0:
-      self.fetch_bg_actions()
-      bg_actions = {
-          "steer": self.bg_steer.tolist(),
-          "throttle": self.bg_throttle.tolist(),
-          "brake": self.bg_brake.tolist(),
-      }
-    else:
-      bg_actions = {
-          "steer": [],
-          "throttle": [],
-          "brake": [],
-      }
 
-    # only save sim state to log every k frames
-    if not self.route_only and self.step % self.logging_freq == 0:
-      self.states.append(state)
-      self.lights.append(lights)
-      self.route_boxes.append(route_boxes)
-      if ego_control:
-        self.ego_actions.append(ego_actions)
-      self.adv_actions.append(bg_actions)
-
-    # reset logging objects after storing current timestep
-    self.ego_pos = None
-    self.ego_yaw = None
-    self.ego_vel = None
-    self.ego_extent = None
-    self.ego_id = None
-    self.ego_type = None
-    self.ego_color = None
-    self.ego_height = None
-    self.ego_pitch = None
-    self.ego_roll = None
-
-    self.bg_pos = None
-    self.bg_yaw = None
-    self.bg_vel = None
-    self.bg_extent = None
-    self.bg_id = None
-    self.bg_type = None
-    self.bg_color = None
-    self.bg_height = None
-    self.bg_pitch = None
-    self.bg_roll = None
-
-    self.bg_steer = None
-    self.bg_throttle = None
-    self.bg_brake = None
-
-    self.tl_pos = None
-    self.tl_yaw = None
-    self.tl_state = None
-    self.tl_extent = None
-
-    self.route_pos = None
-    self.route_yaw = None
-    self.route_id = None
-    self.route_extent = None
-
-    return state, lights, route_boxes, bg_actions
+class ScenarioLogReader():
+  """
+  Reads the records written by ScenarioLogger. Each field is decompressed once into an
+  uncompressed .npy file next to the records, which is then memory mapped, so only
+  the fields (and parts of them) that are used are loaded.
+  """
 
-  def route_as_boxes(self, route):
+  def __init__(self, records_file_path, cache_dir=None):
+    self.records_file_path = records_file_path
+    self.cache_dir = cache_dir or records_file_path + ".cache"
+
+    with zipfile.ZipFile(records_file_path, "r") as records:
+      self.members = sorted(records.namelist())
+      self.meta_data = json.loads(records.read("meta_data.json")) if "meta_data.json" in self.members else {}
+
+    self._offsets = {}
+
+  def fields(self, table):
     """
-    route_as_boxes
+    Returns the fields of a table
     """
-    shortened_route = rdp(route, epsilon=self.rdp_epsilon)
+    return sorted({member.split("/")[1] for member in self.members if member.startswith(table + "/")})
 
-    # convert points to vectors
-    vectors = shortened_route[1:] - shortened_route[:-1]
-    midpoints = shortened_route[:-1] + vectors / 2.
-    norms = np.linalg.norm(vectors, axis=1)
-    angles = np.arctan2(vectors[:, 1], vectors[:, 0])
+  def load(self, table, field, mmap_mode="r"):
+    """
+    Returns a field of a table for all the logged steps, memory mapped by default
+    """
+    cache_path = os.path.join(self.cache_dir, f"{table}.{field}.npy")
+    if not os.path.exists(cache_path):
+      prefix = f"{table}/{field}/"
+      with zipfile.ZipFile(self.records_file_path, "r") as records:
+        chunks = [np.load(io.BytesIO(records.read(member))) for member in self.members if member.startswith(prefix)]
+      if not chunks:
+        raise KeyError(f"{table}/{field} isn't in {self.records_file_path}")
+
+      os.makedirs(self.cache_dir, exist_ok=True)
+      tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+      np.save(tmp_path, np.concatenate(chunks))
+      os.replace(tmp_path, cache_path)
 
-    route_positions = []
-    route_yaws = []
-    route_ids = []
-    route_extents = []
-    for i, midpoint in enumerate(midpoints):
-      # represent the route element as a bounding box
-      center_bounding_box = carla.Location(midpoint[0], midpoint[1], 0.0)
-      transform = carla.Transform(center_bounding_box)
-
-      # only store route boxes that are near the ego vehicle
-      start_bounding_box = carla.Location(shortened_route[i][0], shortened_route[i][1], 0.0)
-      if 0 < i < 10 and start_bounding_box.distance(self.ego_location) > self.roi:
-        continue
-
-      length_bounding_box = carla.Vector3D(norms[i] / 2., self.ego_vehicle.bounding_box.extent.y,
-                                           self.ego_vehicle.bounding_box.extent.z)
-      bounding_box = carla.BoundingBox(transform.location, length_bounding_box)
-      bounding_box.rotation = carla.Rotation(pitch=0.0, yaw=angles[i] * 180 / np.pi, roll=0.0)
-
-      # shape is batch_size x num_agents x state_dims
-      route_positions.append(np.array([[[center_bounding_box.x, center_bounding_box.y]]]))
-      route_yaws.append(np.array([[[bounding_box.rotation.yaw]]]))
-      route_ids.append(np.array([[[i]]]))
-      route_extents.append(
-          np.array([[[
-              [bounding_box.extent.y, bounding_box.extent.x],
-              [bounding_box.extent.y, -bounding_box.extent.x],
-              [-bounding_box.extent.y, -bounding_box.extent.x],
-              [-bounding_box.extent.y, bounding_box.extent.x],
-          ]]]))
-
-    if self.route_pos is None and len(route_positions) > 0:
-      self.route_pos = np.concatenate(route_positions, axis=1)
-    if self.route_yaw is None and len(route_yaws) > 0:
-      self.route_yaw = np.concatenate(np.radians(route_yaws), axis=1)
-    if self.route_id is None and len(route_ids) > 0:
-      self.route_id = np.concatenate(route_ids, axis=1)
-    if self.route_extent is None and len(route_extents) > 0:
-      self.route_extent = np.concatenate(route_extents, axis=1)
-
-  def fetch_bg_actions(self):
+    return np.load(cache_path, mmap_mode=mmap_mode)
+
+  def __len__(self):
+    return len(self.load("steps", "step"))
+
+  def get_offsets(self, table):
     """
-    fetch_bg_actions
+    Returns the first row of each step at the given table, and the end of the last one
     """
-    steers = []
-    throttles = []
-    brakes = []
-    for vehicle in self.bg_vehicles:
-      # shape is batch_size x num_agents x state_dims
-      steers.append(np.array([[[vehicle.get_control().steer]]]))
-      throttles.append(np.array([[[vehicle.get_control().throttle]]]))
-      brakes.append(np.array([[[vehicle.get_control().brake]]]))
-
-    if self.bg_steer is None:
-      self.bg_steer = np.concatenate(steers, axis=1)
-    if self.bg_throttle is None:
-      self.bg_throttle = np.concatenate(throttles, axis=1)
-    if self.bg_brake is None:
-      self.bg_brake = np.concatenate(brakes, axis=1)
-
-  def dump_to_json(self):
+    if table not in self._offsets:
+      counts = self.load("steps", f"num_{table}")
+      self._offsets[table] = np.concatenate(([0], np.cumsum(counts)))
+    return self._offsets[table]
+
+  def get_step(self, index, table, field):
     """
-    dump_to_json
+    Returns the rows of a step at a table field. The ego is the first row of the actors
     """
-    if not self.route_only:
-      self.records_file_path = os.path.join(self.save_path, "records.json.gz")
-      if not os.path.exists(self.save_path):
-        os.mkdir(os.path.join(self.save_path))
-
-      if self.world is not None:
-        town_name = self.world.get_map().name
-      else:
-        town_name = "Unkown"
-
-      meta_data = {
-          "index": self.route_index,
-          "town": town_name,
-      }
-      records_dict = {
-          "meta_data": meta_data,
-          "states": [],
-          "lights": [],
-          "route": [],
-          "ego_actions": [],
-          "adv_actions": [],
-      }
-
-      for i in range(len(self.states)):
-        records_dict["states"].append(self.states[i])
-        records_dict["lights"].append(self.lights[i])
-        records_dict["route"].append(self.route_boxes[i])
-        records_dict["adv_actions"].append(self.adv_actions[i])
-
-      # ego actions only logged if provided
-      for i in range(len(self.ego_actions)):
-        records_dict["ego_actions"].append(self.ego_actions[i])
-
-      with gzip.open(self.records_file_path, "wt", encoding="utf-8") as f:
-        json.dump(records_dict, f)
+    offsets = self.get_offsets(table)
+    return self.load(table, field)[offsets[index]:offsets[index + 1]]
@@ -0,0 +1,167 @@
+"""
+This file implements the preprocessing stage of the camera and LiDAR inputs of the STP3 agent.
+
+The six camera pipelines (jpg artifacts, color conversion, resize, flip and normalization)
+run in a thread pool, and the LiDAR is splatted with a precomputed integer binning.
+Both are written straight into pinned, preallocated tensors, which are copied to the GPU
+without blocking, so that the preprocessing of a frame can overlap with the GPU work of the
+previous one.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+
+class CameraJob(object):
+    """
+    Handle of the camera preprocessing of one frame, running in the background
+    """
+
+    def __init__(self, preprocessor, slot, futures):
+        self._preprocessor = preprocessor
+        self._slot = slot
+        self._futures = futures
+
+    def result(self):
+        """
+        Waits for the cameras and returns the RGB images (dict camera id -> numpy array)
+        together with the normalized images at the device, with shape (cameras, 3, H, W)
+        """
+        imgs = {}
+        for camera_id, future in zip(self._preprocessor.camera_ids, self._futures):
+            imgs[camera_id] = future.result()
+
+        return imgs, self._preprocessor.to_device(self._preprocessor.image_slots[self._slot])
+
+
+class SensorPreprocessor(object):
+    """
+    Converts the raw sensor data into the network inputs, using a ring of pinned slots.
+    A slot is not written again until 'num_slots' frames later, so it is never overwritten
+    while its (non blocking) copy to the GPU may still be running.
+    """
+
+    IMAGE_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+    IMAGE_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+    # LiDAR histogram parameters
+    MAX_HEIGHT_LIDAR = 100.0  # Points above the vehicle are removed
+    LIDAR_SPLIT_HEIGHT = 0.2  # Height at which the points are split into the 2 channels
+    GROUND_HEIGHT = 0.05  # Points below this height are the ground channel
+    LIDAR_RANGE = 32.0  # Max and minimum LiDAR ranges used for voxelization
+    PIXELS_PER_METER = 4  # 256 x 256 grid
+    HIST_MAX_PER_PIXEL = 5  # Max number of LiDAR points per pixel in voxelized LiDAR
+
+    def __init__(self, camera_ids, image_size=(224, 400), device='cuda:0', num_slots=12, num_workers=None):
+        """
+        Args:
+            camera_ids (list): Ids of the cameras, in the order of the network input
+            image_size (tuple): (height, width) of the network images
+            device (torch.device): Device of the network
+            num_slots (int): Number of frames of the ring. Has to be larger than the amount
+                of frames whose inputs are kept at the same time
+            num_workers (int): Threads of the camera pipelines, one per camera by default
+        """
+        self.camera_ids = list(camera_ids)
+        self.image_size = image_size
+        self.device = torch.device(device)
+        self.num_slots = num_slots
+
+        self._pool = ThreadPoolExecutor(max_workers=num_workers or len(self.camera_ids))
+        self._image_slot = -1
+        self._lidar_slot = -1
+
+        # ToTensor + Normalize as a single multiply and subtract
+        self._image_scale = (1.0 / (255.0 * self.IMAGE_STD))[:, None, None]
+        self._image_offset = (self.IMAGE_MEAN / self.IMAGE_STD)[:, None, None]
+
+        self.grid_size = int(2 * self.LIDAR_RANGE * self.PIXELS_PER_METER)
+
+        pin_memory = self.device.type == 'cuda' and torch.cuda.is_available()
+        self.image_slots = torch.empty((num_slots, len(self.camera_ids), 3, *image_size),
+                                       dtype=torch.float32, pin_memory=pin_memory)
+        self.lidar_slots = torch.empty((num_slots, 2, self.grid_size, self.grid_size),
+                                       dtype=torch.float32, pin_memory=pin_memory)
+        self._image_arrays = self.image_slots.numpy()
+        self._lidar_arrays = self.lidar_slots.numpy()
+
+    def to_device(self, tensor):
+        """
+        Copies a slot to the device without blocking the host
+        """
+        return tensor.to(self.device, non_blocking=True)
+
+    def submit_cameras(self, input_data):
+        """
+        Starts the preprocessing of the cameras of a frame and returns its CameraJob
+        """
+        self._image_slot = slot = (self._image_slot + 1) % self.num_slots
+        futures = []
+        for i, camera_id in enumerate(self.camera_ids):
+            futures.append(self._pool.submit(self._process_camera, input_data[camera_id][1], slot, i))
+        return CameraJob(self, slot, futures)
+
+    def _process_camera(self, image, slot, index):
+        """
+        Preprocesses one camera, writing the network image into its slot. Returns the RGB image
+        """
+        camera = image[:, :, :3]
+        # Also add jpg artifacts at test time, because the training data was saved as jpg.
+        _, compressed_image = cv2.imencode('.jpg', camera)
+        camera = cv2.imdecode(compressed_image, cv2.IMREAD_UNCHANGED)
+        img = cv2.cvtColor(camera, cv2.COLOR_BGR2RGB)
+
+        # Same resize as the training data, then flip and normalize into the slot
+        height, width = self.image_size
+        scaled = np.asarray(Image.fromarray(img).resize((width, height)))
+        scaled = scaled[:, ::-1].transpose(2, 0, 1)
+
+        out = self._image_arrays[slot, index]
+        np.multiply(scaled, self._image_scale, out=out)
+        out -= self._image_offset
+        return img
+
+    def _splat_points(self, point_cloud, out):
+        """
+        Writes the clipped and normalized histogram of the points into 'out'.
+        The rows go from front to back and the columns from left to right, as the
+        transpose and rotation of the x / y histogram
+        """
+        bins = np.floor((point_cloud[:, :2] + self.LIDAR_RANGE) * self.PIXELS_PER_METER).astype(np.int64)
+        # The last bin includes its right edge
+        bins[point_cloud[:, :2] == self.LIDAR_RANGE] = self.grid_size - 1
+
+        valid = np.all((bins >= 0) & (bins < self.grid_size), axis=1)
+        bins = bins[valid]
+
+        flat_bins = (self.grid_size - 1 - bins[:, 0]) * self.grid_size + bins[:, 1]
+        hist = np.bincount(flat_bins, minlength=self.grid_size * self.grid_size)
+        hist = hist.reshape(self.grid_size, self.grid_size)
+
+        np.minimum(hist, self.HIST_MAX_PER_PIXEL, out=hist)
+        np.divide(hist, self.HIST_MAX_PER_PIXEL, out=out)
+
+    def lidar_to_histogram_features(self, lidar):
+        """
+        Converts the LiDAR point cloud into a 2-bin histogram over a fixed size grid
+        (points above the split height, and ground points) and copies it to the device
+        :param lidar: (N,3) numpy, LiDAR point cloud
+        :return: (2, H, W) tensor at the device
+        """
+        self._lidar_slot = slot = (self._lidar_slot + 1) % self.num_slots
+        lidar = lidar[lidar[:, 2] < self.MAX_HEIGHT_LIDAR]
+
+        self._splat_points(lidar[lidar[:, 2] > self.LIDAR_SPLIT_HEIGHT], self._lidar_arrays[slot, 0])
+        self._splat_points(lidar[lidar[:, 2] <= self.GROUND_HEIGHT], self._lidar_arrays[slot, 1])
+
+        return self.to_device(self.lidar_slots[slot])
+
+    def shutdown(self):
+        """
+        Stops the camera threads
+        """
+        self._pool.shutdown(wait=True)
@@ -1,3 +1,4 @@
+import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -7,6 +8,88 @@ from stp3.utils.geometry import calculate_birds_eye_view_parameters
 from skimage.draw import polygon
 
 
+def get_layer_probability(layer, inclusive=False):
+    '''
+    layer: torch.Tensor<float> (B, 1/2, 200, 200)
+    return: torch.Tensor<float> (B, 200, 200), probability of the layer. With two channels,
+    the probabilities below 0.5 (or equal to it, if inclusive) are set to 0
+    '''
+    assert layer.ndim == 4, 'layer ndim should be 4'
+    if layer.shape[1] == 2:
+        layer = torch.softmax(layer, dim=1)[:, 1]
+        mask = layer <= 0.5 if inclusive else layer < 0.5
+        layer[mask] = 0
+    else:
+        layer = layer[:, 0]
+    return layer
+
+
+def gather_cost_maps(cost_maps, queries):
+    '''
+    Evaluates several cost maps at several sets of grid cells with a single gather.
+    cost_maps: List[torch.Tensor<float> (B, n_future / 1, 200, 200)]
+    queries: List[(map index, torch.Tensor<int> (B, N, n_future, P))], flat cell indices
+    return: List[torch.Tensor<float> (B, N, n_future)], the sum of each query over its P cells
+    '''
+    B, _, H, W = cost_maps[0].shape
+    n_future = queries[0][1].shape[2]
+    dtype = cost_maps[0].dtype
+    for cost_map in cost_maps[1:]:
+        dtype = torch.promote_types(dtype, cost_map.dtype)
+
+    maps = torch.stack([cost_map.to(dtype).expand(B, n_future, H, W) for cost_map in cost_maps], dim=2)
+    maps = maps.view(B, n_future, len(cost_maps) * H * W)
+    index = torch.cat([cells + map_index * H * W for map_index, cells in queries], dim=-1)
+
+    ii = torch.arange(B, device=index.device)
+    tt = torch.arange(n_future, device=index.device)
+    values = maps[ii[:, None, None, None], tt[None, None, :, None], index]
+
+    sizes = [cells.shape[-1] for _, cells in queries]
+    return [value.sum(dim=-1) for value in values.split(sizes, dim=-1)]
+
+
+class TrajectoryRaster(object):
+    '''
+    Rasterization of the candidate trajectories onto the BEV grid, shared by all the cost terms.
+    The cells are stored as flat indices of the grid, so that they can be used by gather_cost_maps.
+    '''
+    def __init__(self, base_cost, trajs):
+        '''
+        base_cost: BaseCost, defining the grid and the ego footprint
+        trajs: torch.Tensor<float> (B, N, n_future, 2)
+        '''
+        self.base_cost = base_cost
+        self.trajs = trajs
+        self.width = int(base_cost.bev_dimension[1])
+        self._footprints = {}
+        self._points = None
+
+    def footprint(self, lambda_=0, offset=None):
+        '''
+        Cells covered by the ego footprint, enlarged by lambda_, with the trajectories shifted by offset (x, y)
+        return: torch.Tensor<int> (B, N, n_future, P)
+        '''
+        key = (lambda_, None if offset is None else tuple(offset))
+        if key not in self._footprints:
+            trajs = self.trajs
+            if offset is not None:
+                trajs = trajs + torch.tensor(offset, dtype=trajs.dtype, device=trajs.device)
+            rr, cc = self.base_cost.get_points(trajs, lambda_)
+            self._footprints[key] = rr * self.width + cc
+        return self._footprints[key]
+
+    def points(self):
+        '''
+        Cells of the trajectory points
+        return: torch.Tensor<int> (B, N, n_future, 1)
+        '''
+        if self._points is None:
+            yi, xi = self.base_cost.discretize(self.trajs)
+            self._points = (yi * self.width + xi).unsqueeze(-1)
+        return self._points
+
+
 class Cost_Function(nn.Module):
     def __init__(self, cfg):
         super(Cost_Function, self).__init__()
@@ -32,13 +115,33 @@ class Cost_Function(nn.Module):
         target_points: torch.Tensor<float> (B, 2)
         '''
         trajs = trajs * torch.tensor([-1, 1], device=trajs.device)
-        safetycost = torch.clamp(self.safetycost(trajs, semantic_pred), 0, 100)
-        headwaycost = torch.clamp(self.headwaycost(trajs, semantic_pred, drivable_area), 0, 100)
-        lrdividercost = torch.clamp(self.lrdividercost(trajs, lane_divider), 0, 100)
+
+        # The trajectories are rasterized once, and all the cost maps are evaluated with a single gather
+        raster = TrajectoryRaster(self.costvolume, trajs)
+        drivable_area = get_layer_probability(drivable_area)
+        cost_maps = [
+            semantic_pred,
+            self.headwaycost.get_cost_map(semantic_pred, drivable_area),
+            self.rulecost.get_cost_map(drivable_area),
+            self.lrdividercost.get_cost_map(lane_divider),
+            self.costvolume.get_cost_map(cost_volume),
+        ]
+        safety_area, safety_lambda_area, headway_area, rule_area, lrdivider, volume = gather_cost_maps(cost_maps, [
+            (0, raster.footprint()),
+            (0, raster.footprint(self.safetycost.get_lambda_cells())),
+            (1, raster.footprint(offset=self.headwaycost.get_offset())),
+            (2, raster.footprint()),
+            (3, raster.points()),
+            (4, raster.points()),
+        ])
+
+        safetycost = torch.clamp(self.safetycost.get_cost(trajs, safety_area, safety_lambda_area), 0, 100)
+        headwaycost = torch.clamp(headway_area * self.headwaycost.factor, 0, 100)
+        lrdividercost = torch.clamp(lrdivider * self.lrdividercost.factor, 0, 100)
         comfortcost = torch.clamp(self.comfortcost(trajs), 0, 100)
         progresscost = torch.clamp(self.progresscost(trajs, target_point), -100, 100)
-        rulecost = torch.clamp(self.rulecost(trajs, drivable_area), 0, 100)
-        costvolume = torch.clamp(self.costvolume(trajs, cost_volume), 0, 100)
+        rulecost = torch.clamp(rule_area * self.rulecost.factor, 0, 100)
+        costvolume = torch.clamp(volume * self.costvolume.factor, 0, 100)
 
         cost_fo = safetycost + headwaycost + lrdividercost + costvolume + rulecost
         cost_fc = comfortcost + progresscost
@@ -64,8 +167,15 @@ class BaseCost(nn.Module):
         self.W = cfg.EGO.WIDTH
         self.H = cfg.EGO.HEIGHT
 
+        # The footprints only depend on lambda, so they are computed once
+        self._origin_points = {}
+
 
     def get_origin_points(self, lambda_=0):
+        key = (lambda_, self.bx.device)
+        if key in self._origin_points:
+            return self._origin_points[key]
+
         W = self.W
         H = self.H
         pts = np.array([
@@ -78,7 +188,14 @@ class BaseCost(nn.Module):
         pts[:, [0, 1]] = pts[:, [1, 0]]
         rr , cc = polygon(pts[:,1], pts[:,0])
         rc = np.concatenate([rr[:,None], cc[:,None]], axis=-1)
-        return torch.from_numpy(rc).to(device=self.bx.device) # (27,2)
+        self._origin_points[key] = torch.from_numpy(rc).to(device=self.bx.device) # (27,2)
+        return self._origin_points[key]
+
+    def get_lambda_cells(self, _lambda=0):
+        '''
+        Converts the footprint margin from meters to cells
+        '''
+        return int(_lambda / self.dx[0])
 
     def get_points(self, trajs, lambda_=0):
         '''
@@ -107,18 +224,10 @@ class BaseCost(nn.Module):
         trajs: torch.Tensor<float> (B, N, n_future, 2)
         ego_velocity: torch.Tensor<float> (B, N, n_future)
         '''
-        _lambda = int(_lambda / self.dx[0])
-        rr, cc = self.get_points(trajs, _lambda)
-        B, N, n_future,_ = trajs.shape
-
-        if ego_velocity is None:
-            ego_velocity = torch.ones((B,N,n_future), device=semantic_pred.device)
-
-        ii = torch.arange(B)
-        kk = torch.arange(n_future)
-        subcost = semantic_pred[ii[:, None, None, None], kk[None, None, :, None], rr, cc].sum(dim=-1)
-        subcost = subcost * ego_velocity
-
+        raster = TrajectoryRaster(self, trajs)
+        subcost, = gather_cost_maps([semantic_pred], [(0, raster.footprint(self.get_lambda_cells(_lambda)))])
+        if ego_velocity is not None:
+            subcost = subcost * ego_velocity
 
         return subcost
 
@@ -142,16 +251,10 @@ class BaseCost(nn.Module):
     def evaluate(self, trajs, C):
         '''
             trajs: torch.Tensor<float> (B, N, n_future, 2)   N: sample number
-            C: torch.Tensor<float> (B, n_future, 200, 200)
+            C: torch.Tensor<float> (B, n_future / 1, 200, 200)
         '''
-        B, N, n_future, _ = trajs.shape
-
-        ii = torch.arange(B)
-        ti = torch.arange(n_future)
-
-        Syi, Sxi = self.discretize(trajs)
-
-        CS = C[ii[:, None, None], ti[None, None, :], Syi, Sxi]
+        raster = TrajectoryRaster(self, trajs)
+        CS, = gather_cost_maps([C], [(0, raster.points())])
         return CS
 
 class Cost_Volume(BaseCost):
@@ -160,15 +263,18 @@ class Cost_Volume(BaseCost):
 
         self.factor = cfg.COST_FUNCTION.VOLUME
 
+    def get_cost_map(self, cost_volume):
+        '''
+        cost_volume: torch.Tensor<float> (B, n_future, 200, 200)
+        '''
+        return torch.clamp(cost_volume, 0, 1000)
+
     def forward(self, trajs, cost_volume):
         '''
         cost_volume: torch.Tensor<float> (B, n_future, 200, 200)
         trajs: torch.Tensor<float> (B, N, n_future, 2)   N: sample number
         '''
-
-        cost_volume = torch.clamp(cost_volume, 0, 1000)
-
-        return self.evaluate(trajs, cost_volume) * self.factor
+        return self.evaluate(trajs, self.get_cost_map(cost_volume)) * self.factor
 
 class Rule(BaseCost):
     def __init__(self, cfg):
@@ -176,23 +282,18 @@ class Rule(BaseCost):
 
         self.factor = 5
 
+    def get_cost_map(self, drivable_area):
+        '''
+            drivable_area: torch.Tensor<float> (B, 200, 200), see get_layer_probability
+        '''
+        return torch.logical_not(drivable_area).float().unsqueeze(1)
+
     def forward(self, trajs, drivable_area):
         '''
             trajs: torch.Tensor<float> (B, N, n_future, 2)   N: sample number
             drivable_area: torch.Tensor<float> (B, 1/2, 200, 200)
         '''
-        assert drivable_area.ndim == 4, 'drivable area ndim should be 4'
-        if drivable_area.shape[1] == 2:
-            drivable_area = torch.softmax(drivable_area, dim=1)[:, 1]
-            mask = drivable_area < 0.5
-            drivable_area[mask] = 0
-        else:
-            drivable_area = drivable_area[:, 0]
-
-        B, _, n_future, _ = trajs.shape
-        _,H,W = drivable_area.shape
-
-        dangerous_area = torch.logical_not(drivable_area).float().view(B, 1, W, H).expand(B, n_future, W, H)
+        dangerous_area = self.get_cost_map(get_layer_probability(drivable_area))
         subcost = self.compute_area(dangerous_area, trajs)
 
         return subcost * self.factor
@@ -206,30 +307,44 @@ class SafetyCost(BaseCost):
         self._lambda = cfg.COST_FUNCTION.LAMBDA
         self.factor = cfg.COST_FUNCTION.SAFETY
 
-    def forward(self, trajs, semantic_pred):
+    def get_lambda_cells(self, _lambda=None):
+        return super(SafetyCost, self).get_lambda_cells(self._lambda if _lambda is None else _lambda)
+
+    @staticmethod
+    def get_velocity(trajs):
         '''
-        trajs: torch.Tensor<float> (B, N, n_future, 2)   N: sample number
-        semantic_pred: torch.Tensor<float> (B, n_future, 200, 200)
-        ego_velocity: torch.Tensor<float> (B, N, n_future)
+        trajs: torch.Tensor<float> (B, N, n_future, 2)
+        return: torch.Tensor<float> (B, N, n_future), ego velocity at each step
+        '''
+        steps = torch.diff(trajs, dim=2, prepend=torch.zeros_like(trajs[:, :, :1]))
+        return torch.sqrt((steps ** 2).sum(dim=-1)) / 0.5
+
+    def get_cost(self, trajs, subcost1, area_lambda):
+        '''
+        trajs: torch.Tensor<float> (B, N, n_future, 2)
+        subcost1: torch.Tensor<float> (B, N, n_future), o_c(tau, t, 0)
+        area_lambda: torch.Tensor<float> (B, N, n_future), o_c(tau, t, lambda)
         '''
-        B, N, n_future, _ = trajs.shape
-        ego_velocity = torch.zeros((B,N,n_future), device=semantic_pred.device)
-        for i in range(n_future):
-            if i == 0:
-                ego_velocity[:,:,i] = torch.sqrt((trajs[:,:,i] ** 2).sum(axis=-1)) / 0.5
-            else:
-                ego_velocity[:,:,i] = torch.sqrt(((trajs[:,:,i] - trajs[:,:,i-1]) ** 2).sum(dim=-1)) / 0.5
-
-        # o_c(tau, t, 0)
-        subcost1 = self.compute_area(semantic_pred, trajs)
         # o_c(tau, t, lambda) x v(tau, t)
-        subcost2 = self.compute_area(semantic_pred, trajs, ego_velocity, self._lambda)
+        subcost2 = area_lambda * self.get_velocity(trajs)
 
         subcost = subcost1 * self.w[0] + subcost2 * self.w[1]
 
-
         return subcost * self.factor
 
+    def forward(self, trajs, semantic_pred):
+        '''
+        trajs: torch.Tensor<float> (B, N, n_future, 2)   N: sample number
+        semantic_pred: torch.Tensor<float> (B, n_future, 200, 200)
+        '''
+        raster = TrajectoryRaster(self, trajs)
+        subcost1, area_lambda = gather_cost_maps([semantic_pred], [
+            (0, raster.footprint()),
+            (0, raster.footprint(self.get_lambda_cells())),
+        ])
+
+        return self.get_cost(trajs, subcost1, area_lambda)
+
 
 class HeadwayCost(BaseCost):
     def __init__(self, cfg):
@@ -237,27 +352,26 @@ class HeadwayCost(BaseCost):
         self.L = 10  # Longitudinal distance keep 10m
         self.factor = cfg.COST_FUNCTION.HEADWAY
 
+    def get_offset(self):
+        return (0, self.L)
+
+    def get_cost_map(self, semantic_pred, drivable_area):
+        '''
+        semantic_pred: torch.Tensor<float> (B, n_future, 200, 200)
+        drivable_area: torch.Tensor<float> (B, 200, 200), see get_layer_probability
+        '''
+        return semantic_pred * drivable_area.unsqueeze(1)
+
     def forward(self, trajs, semantic_pred, drivable_area):
         '''
         trajs: torch.Tensor<float> (B, N, n_future, 2)   N: sample number
         semantic_pred: torch.Tensor<float> (B, n_future, 200, 200)
         drivable_area: torch.Tensor<float> (B, 1/2, 200, 200)
         '''
-        assert drivable_area.ndim == 4, 'drivable area ndim should be 4'
-        if drivable_area.shape[1] == 2:
-            drivable_area = torch.softmax(drivable_area, dim=1)[:, 1]
-            mask = drivable_area < 0.5
-            drivable_area[mask] = 0
-        else:
-            drivable_area = drivable_area[:, 0]
-        B, N, n_future, _ = trajs.shape
-        _, W, H = drivable_area.shape
-        drivable_mask = drivable_area.view(B, 1, W, H).expand(B, n_future, W, H)
-        semantic_pred_ = semantic_pred * drivable_mask
-        tmp_trajs = trajs.clone()
-        tmp_trajs[:,:,:,1] = tmp_trajs[:,:,:,1]+self.L
+        semantic_pred_ = self.get_cost_map(semantic_pred, get_layer_probability(drivable_area))
 
-        subcost = self.compute_area(semantic_pred_, tmp_trajs)
+        raster = TrajectoryRaster(self, trajs)
+        subcost, = gather_cost_maps([semantic_pred_], [(0, raster.footprint(offset=self.get_offset()))])
 
         return subcost * self.factor
 
@@ -267,39 +381,41 @@ class LR_divider(BaseCost):
         self.L = 1 # Keep a distance of 2m from the lane line
         self.factor = cfg.COST_FUNCTION.LRDIVIDER
 
+    def get_cost_map(self, lane_divider):
+        '''
+        Cost of each cell, given by its distance to the closest lane divider cell.
+        Only the dividers closer than L matter, so the distance is computed over that neighborhood
+        lane_divider: torch.Tensor<float> (B, 1/2, 200, 200)
+        return: torch.Tensor<float> (B, 1, 200, 200)
+        '''
+        lane_divider = get_layer_probability(lane_divider, inclusive=True)
+        B, H, W = lane_divider.shape
+
+        # Offsets (rows, columns) of the neighborhood, and their distances
+        dx = reversed(self.dx)
+        radius = [int(math.ceil(self.L / float(d))) for d in dx]
+        offsets = torch.stack(torch.meshgrid(
+            torch.arange(-radius[0], radius[0] + 1, device=lane_divider.device),
+            torch.arange(-radius[1], radius[1] + 1, device=lane_divider.device), indexing='ij'), dim=-1).view(-1, 2)
+        offset_distances = torch.sqrt(((offsets * dx) ** 2).sum(dim=-1))
+        close = offset_distances <= self.L
+        offsets, offset_distances = offsets[close], offset_distances[close]
+
+        dividers = F.pad((lane_divider != 0).float(), (radius[1], radius[1], radius[0], radius[0])) > 0
+        distance = torch.full((B, H, W), float('inf'), device=lane_divider.device)
+        for (dy, dx_), offset_distance in zip(offsets.tolist(), offset_distances):
+            neighbors = dividers[:, radius[0] + dy:radius[0] + dy + H, radius[1] + dx_:radius[1] + dx_ + W]
+            distance = torch.where(neighbors, torch.minimum(distance, offset_distance), distance)
+
+        cost = torch.where(distance > self.L, torch.zeros_like(distance), (self.L - distance) ** 2)
+        return cost.unsqueeze(1)
+
     def forward(self, trajs, lane_divider):
         '''
         trajs: torch.Tensor<float> (B, N, n_future, 2)   N: sample number
         lane_divider: torch.Tensor<float> (B, 1/2, 200, 200)
         '''
-        assert lane_divider.ndim == 4, 'lane_divider ndim should be 4'
-        if lane_divider.shape[1] == 2:
-            lane_divider = torch.softmax(lane_divider, dim=1)[:,1]
-            mask = lane_divider <= 0.5
-            lane_divider[mask] = 0
-        else:
-            lane_divider = lane_divider[:,0]
-
-        B, N, n_future, _ = trajs.shape
-
-        yy, xx = self.discretize(trajs)
-        yx = torch.stack([yy,xx],dim=-1) # (B, N, n_future, 2)
-
-        # lane divider
-        res1 = []
-        for i in range(B):
-            index = torch.nonzero(lane_divider[i]) # (n, 2)
-            if len(index) != 0:
-                yx_batch = yx[i].view(N, n_future, 1, 2)
-                distance = torch.sqrt((((yx_batch - index) * reversed(self.dx))**2).sum(dim=-1)) # (N, n_future, n)
-                distance,_ = distance.min(dim=-1) # (N, n_future)
-                index = distance > self.L
-                distance = (self.L - distance) ** 2
-                distance[index] = 0
-            else:
-                distance = torch.zeros((N, n_future),device=trajs.device)
-            res1.append(distance)
-        res1 = torch.stack(res1, dim=0)
+        res1 = self.evaluate(trajs, self.get_cost_map(lane_divider))
 
         return res1 * self.factor
 
@@ -319,20 +435,11 @@ class Comfort(BaseCost):
         trajs: torch.Tensor<float> (B, N, n_future, 2)
         '''
         B, N, n_future, _ = trajs.shape
-        lateral_velocity = torch.zeros((B,N,n_future), device=trajs.device)
-        longitudinal_velocity = torch.zeros((B, N, n_future), device=trajs.device)
-        lateral_acc = torch.zeros((B,N,n_future), device=trajs.device)
-        longitudinal_acc = torch.zeros((B,N,n_future), device=trajs.device)
-        for i in range(n_future):
-            if i == 0:
-                lateral_velocity[:,:,i] = trajs[:,:,i,0] / 0.5
-                longitudinal_velocity[:,:,i] = trajs[:,:,i,1] / 0.5
-            else:
-                lateral_velocity[:,:,i] = (trajs[:,:,i,0] - trajs[:,:,i-1,0]) / 0.5
-                longitudinal_velocity[:,:,i] = (trajs[:,:,i,1] - trajs[:,:,i-1,1]) / 0.5
-        for i in range(1, n_future):
-            lateral_acc[:,:,i] = (lateral_velocity[:,:,i] - lateral_velocity[:,:,i-1]) / 0.5
-            longitudinal_acc[:,:,i] = (longitudinal_velocity[:,:,i] - longitudinal_velocity[:,:,i-1]) / 0.5
+        # lateral / longitudinal velocities and accelerations of every step
+        velocity = torch.diff(trajs, dim=2, prepend=torch.zeros_like(trajs[:, :, :1])) / 0.5
+        acc = torch.zeros_like(velocity)
+        acc[:, :, 1:] = torch.diff(velocity, dim=2) / 0.5
+        lateral_acc, longitudinal_acc = acc[..., 0], acc[..., 1]
         lateral_acc, _ = torch.abs(lateral_acc).max(dim=-1)
         longitudinal_acc, _ = torch.abs(longitudinal_acc).max(dim=-1)
         # v^2 - v_0^2 = 2ax
@@ -344,18 +451,11 @@ class Comfort(BaseCost):
         # longitudinal_acc[index] = 0.0
 
         # jerk
-        ego_velocity = torch.zeros((B, N, n_future), device=trajs.device)
-        ego_acc = torch.zeros((B,N,n_future), device=trajs.device)
-        ego_jerk = torch.zeros((B,N,n_future), device=trajs.device)
-        for i in range(n_future):
-            if i == 0:
-                ego_velocity[:, :, i] = torch.sqrt((trajs[:, :, i] ** 2).sum(dim=-1)) / 0.5
-            else:
-                ego_velocity[:, :, i] = torch.sqrt(((trajs[:, :, i] - trajs[:, :, i - 1]) ** 2).sum(dim=-1)) / 0.5
-        for i in range(1, n_future):
-            ego_acc[:,:,i] = (ego_velocity[:,:,i] - ego_velocity[:,:,i-1]) / 0.5
-        for i in range(2, n_future):
-            ego_jerk[:,:,i] = (ego_acc[:,:,i] - ego_acc[:,:,i-1]) / 0.5
+        ego_velocity = SafetyCost.get_velocity(trajs)
+        ego_acc = torch.zeros_like(ego_velocity)
+        ego_jerk = torch.zeros_like(ego_velocity)
+        ego_acc[:, :, 1:] = torch.diff(ego_velocity, dim=2) / 0.5
+        ego_jerk[:, :, 2:] = torch.diff(ego_acc[:, :, 1:], dim=2) / 0.5
         ego_jerk,_ = torch.abs(ego_jerk).max(dim=-1)
 
         subcost = torch.zeros((B, N), device=trajs.device)
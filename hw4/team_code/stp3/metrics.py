@@ -282,52 +282,50 @@ class PlanningMetric(Metric):
 
         self.n_future = n_future
 
-        self.add_state("obj_col", default=torch.zeros(self.n_future), dist_reduce_fx="sum")
-        self.add_state("obj_box_col", default=torch.zeros(self.n_future), dist_reduce_fx="sum")
-        self.add_state("L2", default=torch.zeros(self.n_future),dist_reduce_fx="sum")
-        self.add_state("total", default=torch.tensor(0), dist_reduce_fx="sum")
-
-
-    def evaluate_single_coll(self, traj, segmentation):
-        '''
-        gt_segmentation
-        traj: torch.Tensor (n_future, 2)
-        segmentation: torch.Tensor (n_future, 200, 200)
-        '''
+        # Pixel offsets (row, column) of the ego box, added to the position of the ego at each timestep.
+        # A non persistent buffer, so that it follows the device without being part of the checkpoints
         pts = np.array([
             [-self.H / 2. + 0.5, self.W / 2.],
             [self.H / 2. + 0.5, self.W / 2.],
             [self.H / 2. + 0.5, -self.W / 2.],
             [-self.H / 2. + 0.5, -self.W / 2.],
         ])
-        pts = (pts - self.bx.cpu().numpy()) / (self.dx.cpu().numpy())
+        pts = (pts - bx.numpy()) / (dx.numpy())
         pts[:, [0, 1]] = pts[:, [1, 0]]
         rr, cc = polygon(pts[:,1], pts[:,0])
         rc = np.concatenate([rr[:,None], cc[:,None]], axis=-1)
+        self.register_buffer('ego_footprint', torch.from_numpy(rc).to(dx.dtype), persistent=False)
 
-        n_future, _ = traj.shape
-        trajs = traj.view(n_future, 1, 2)
-        trajs[:,:,[0,1]] = trajs[:,:,[1,0]] # can also change original tensor
-        trajs = trajs / self.dx
-        trajs = trajs.cpu().numpy() + rc # (n_future, 32, 2)
+        self.add_state("obj_col", default=torch.zeros(self.n_future), dist_reduce_fx="sum")
+        self.add_state("obj_box_col", default=torch.zeros(self.n_future), dist_reduce_fx="sum")
+        self.add_state("L2", default=torch.zeros(self.n_future),dist_reduce_fx="sum")
+        self.add_state("total", default=torch.tensor(0), dist_reduce_fx="sum")
 
-        r = trajs[:,:,0].astype(np.int32)
-        r = np.clip(r, 0, self.bev_dimension[0] - 1)
 
-        c = trajs[:,:,1].astype(np.int32)
-        c = np.clip(c, 0, self.bev_dimension[1] - 1)
+    def evaluate_single_coll(self, traj, segmentation):
+        '''
+        gt_segmentation
+        traj: torch.Tensor (n_future, 2)
+        segmentation: torch.Tensor (n_future, 200, 200)
+        '''
+        return self.evaluate_box_coll(traj[None], segmentation[None])[0]
 
-        collision = np.full(n_future, False)
-        for t in range(n_future):
-            rr = r[t]
-            cc = c[t]
-            I = np.logical_and(
-                np.logical_and(rr >= 0, rr < self.bev_dimension[0]),
-                np.logical_and(cc >= 0, cc < self.bev_dimension[1]),
-            )
-            collision[t] = np.any(segmentation[t, rr[I], cc[I]].cpu().numpy())
+    def evaluate_box_coll(self, trajs, segmentation):
+        '''
+        Checks if the ego box, placed at each point of the trajectories, overlaps the segmentation
+        trajs: torch.Tensor (B, n_future, 2)
+        segmentation: torch.Tensor (B, n_future, 200, 200)
+        return: torch.Tensor (B, n_future) bool
+        '''
+        B, n_future, _ = trajs.shape
+        # (B, n_future, K, 2) pixels of the box, as (row, column)
+        pixels = trajs.flip(-1).unsqueeze(2) / self.dx + self.ego_footprint
+        r = pixels[..., 0].long().clamp(0, int(self.bev_dimension[0]) - 1)
+        c = pixels[..., 1].long().clamp(0, int(self.bev_dimension[1]) - 1)
 
-        return torch.from_numpy(collision).to(device=traj.device)
+        index = (r * int(self.bev_dimension[1]) + c).view(B, n_future, -1)
+        values = segmentation.reshape(B, n_future, -1).gather(2, index)
+        return values.bool().any(dim=-1)
 
     def evaluate_coll(self, trajs, gt_trajs, segmentation):
         '''
@@ -339,28 +337,27 @@ class PlanningMetric(Metric):
         trajs = trajs * torch.tensor([-1, 1], device=trajs.device)
         gt_trajs = gt_trajs * torch.tensor([-1, 1], device=gt_trajs.device)
 
-        obj_coll_sum = torch.zeros(n_future, device=segmentation.device)
-        obj_box_coll_sum = torch.zeros(n_future, device=segmentation.device)
-
-        for i in range(B):
-            gt_box_coll = self.evaluate_single_coll(gt_trajs[i], segmentation[i])
+        gt_box_coll = self.evaluate_box_coll(gt_trajs, segmentation)
 
-            xx, yy = trajs[i,:,0], trajs[i, :, 1]
-            yi = ((yy - self.bx[0]) / self.dx[0]).long()
-            xi = ((xx - self.bx[1]) / self.dx[1]).long()
+        # Collisions of the ego center, ignoring the timesteps in which the gt box already collides
+        xx, yy = trajs[..., 0], trajs[..., 1]
+        yi = ((yy - self.bx[0]) / self.dx[0]).long()
+        xi = ((xx - self.bx[1]) / self.dx[1]).long()
 
-            m1 = torch.logical_and(
-                torch.logical_and(yi >= 0, yi < self.bev_dimension[0]),
-                torch.logical_and(xi >= 0, xi < self.bev_dimension[1]),
-            )
-            m1 = torch.logical_and(m1, torch.logical_not(gt_box_coll))
+        m1 = torch.logical_and(
+            torch.logical_and(yi >= 0, yi < self.bev_dimension[0]),
+            torch.logical_and(xi >= 0, xi < self.bev_dimension[1]),
+        )
+        m1 = torch.logical_and(m1, torch.logical_not(gt_box_coll))
 
-            ti = torch.arange(n_future)
-            obj_coll_sum[ti[m1]] += segmentation[i, ti[m1], yi[m1], xi[m1]].long()
+        index = yi.clamp(0, int(self.bev_dimension[0]) - 1) * int(self.bev_dimension[1]) \
+            + xi.clamp(0, int(self.bev_dimension[1]) - 1)
+        obj_coll = segmentation.reshape(B, n_future, -1).gather(2, index.unsqueeze(-1)).squeeze(-1).long()
+        obj_coll_sum = (obj_coll * m1).sum(dim=0)
 
-            m2 = torch.logical_not(gt_box_coll)
-            box_coll = self.evaluate_single_coll(trajs[i], segmentation[i])
-            obj_box_coll_sum[ti[m2]] += (box_coll[ti[m2]]).long()
+        m2 = torch.logical_not(gt_box_coll)
+        box_coll = self.evaluate_box_coll(trajs, segmentation)
+        obj_box_coll_sum = torch.logical_and(box_coll, m2).long().sum(dim=0)
 
         return obj_coll_sum, obj_box_coll_sum
 
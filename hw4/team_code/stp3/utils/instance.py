@@ -155,9 +155,10 @@ def update_instance_ids(instance_seg, old_ids, new_ids):
     Returns
         new_instance_seg: torch.Tensor same shape as instance_seg with new ids
     """
+    old_ids = torch.as_tensor(old_ids, dtype=torch.long, device=instance_seg.device)
+    new_ids = torch.as_tensor(new_ids, dtype=torch.long, device=instance_seg.device)
     indices = torch.arange(old_ids.max() + 1, device=instance_seg.device)
-    for old_id, new_id in zip(old_ids, new_ids):
-        indices[old_id] = new_id
+    indices[old_ids] = new_ids
 
     return indices[instance_seg].long()
 
@@ -170,103 +171,104 @@ def make_instance_seg_consecutive(instance_seg):
     return instance_seg
 
 
+def get_instance_centers(instance_seg, grid, max_instance_id):
+    """
+    Parameters
+    ----------
+        instance_seg: torch.Tensor (h, w) with ids in [0, max_instance_id]
+        grid: torch.Tensor (2, h, w) position of each pixel
+        max_instance_id: largest id of instance_seg
+
+    Returns
+    -------
+        centers: torch.Tensor (max_instance_id + 1, 2) mean position of each id, nan for the missing ones
+        counts: torch.Tensor (max_instance_id + 1) amount of pixels of each id
+    """
+    ids = instance_seg.reshape(-1).long()
+    sums = torch.zeros(max_instance_id + 1, 2, dtype=grid.dtype, device=grid.device)
+    sums.index_add_(0, ids, grid.reshape(2, -1).t())
+    counts = torch.bincount(ids, minlength=max_instance_id + 1)
+    return sums / counts.unsqueeze(1), counts
+
+
 def make_instance_id_temporally_consistent(pred_inst, future_flow, matching_threshold=3.0):
     """
     Parameters
     ----------
-        pred_inst: torch.Tensor (1, seq_len, h, w)
-        future_flow: torch.Tensor(1, seq_len, 2, h, w)
+        pred_inst: torch.Tensor (b, seq_len, h, w)
+        future_flow: torch.Tensor(b, seq_len, 2, h, w)
         matching_threshold: distance threshold for a match to be valid.
 
     Returns
     -------
-    consistent_instance_seg: torch.Tensor(1, seq_len, h, w)
+    consistent_instance_seg: torch.Tensor(b, seq_len, h, w)
 
-    1. time t. Loop over all detected instances. Use flow to compute new centers at time t+1.
-    2. Store those centers
-    3. time t+1. Re-identify instances by comparing position of actual centers, and flow-warped centers.
+    1. time t. Compute the centers of all the detected instances, moved by the flow to time t+1.
+    2. time t+1. Re-identify instances by matching the actual centers with the flow-warped centers.
         Make the labels at t+1 consistent with the matching
-    4. Repeat
+    3. Repeat
     """
-    assert pred_inst.shape[0] == 1, 'Assumes batch size = 1'
-
-    # Initialise instance segmentations with prediction corresponding to the present
-    consistent_instance_seg = [pred_inst[0, 0]]
-    largest_instance_id = consistent_instance_seg[0].max().item()
-
-    _, seq_len, h, w = pred_inst.shape
+    _, _, h, w = pred_inst.shape
     device = pred_inst.device
-    for t in range(seq_len - 1):
-        # Compute predicted future instance means
-        grid = torch.stack(torch.meshgrid(
-            torch.arange(h, dtype=torch.float, device=device), torch.arange(w, dtype=torch.float, device=device)
-        ))
+    grid = torch.stack(torch.meshgrid(
+        torch.arange(h, dtype=torch.float, device=device), torch.arange(w, dtype=torch.float, device=device)
+    ))
 
-        # Add future flow
-        grid = grid + future_flow[0, t]
-        warped_centers = []
-        # Go through all ids, except the background
-        t_instance_ids = torch.unique(consistent_instance_seg[-1])[1:].cpu().numpy()
+    consistent_instance_seg = [
+        make_sequence_instance_id_consistent(pred_inst[b], future_flow[b], grid, matching_threshold)
+        for b in range(pred_inst.shape[0])
+    ]
+    return torch.stack(consistent_instance_seg)
 
-        if len(t_instance_ids) == 0:
-            # No instance so nothing to update
-            consistent_instance_seg.append(pred_inst[0, t + 1])
-            continue
 
-        for instance_id in t_instance_ids:
-            instance_mask = (consistent_instance_seg[-1] == instance_id)
-            warped_centers.append(grid[:, instance_mask].mean(dim=1))
-        warped_centers = torch.stack(warped_centers)
+def make_sequence_instance_id_consistent(pred_inst, future_flow, grid, matching_threshold):
+    """
+    Makes the instance ids of a single sequence consistent, see make_instance_id_temporally_consistent.
+    pred_inst: (seq_len, h, w), future_flow: (seq_len, 2, h, w), grid: (2, h, w)
+    """
+    # Initialise instance segmentations with prediction corresponding to the present
+    consistent_instance_seg = [pred_inst[0]]
+    largest_instance_id = int(consistent_instance_seg[0].max().item())
 
-        # Compute actual future instance means
-        centers = []
-        grid = torch.stack(torch.meshgrid(
-            torch.arange(h, dtype=torch.float, device=device), torch.arange(w, dtype=torch.float, device=device)
-        ))
-        n_instances = int(pred_inst[0, t + 1].max().item())
+    for t in range(pred_inst.shape[0] - 1):
+        # Go through all ids, except the background
+        t_instance_ids = torch.unique(consistent_instance_seg[-1])[1:]
+        n_instances = int(pred_inst[t + 1].max().item())
 
-        if n_instances == 0:
-            # No instance, so nothing to update.
-            consistent_instance_seg.append(pred_inst[0, t + 1])
+        if len(t_instance_ids) == 0 or n_instances == 0:
+            # No instance so nothing to update
+            consistent_instance_seg.append(pred_inst[t + 1])
             continue
 
-        for instance_id in range(1, n_instances + 1):
-            instance_mask = (pred_inst[0, t + 1] == instance_id)
-            centers.append(grid[:, instance_mask].mean(dim=1))
-        centers = torch.stack(centers)
+        # Compute predicted future instance means, adding the future flow, and the actual future ones
+        warped_centers, _ = get_instance_centers(
+            consistent_instance_seg[-1], grid + future_flow[t], int(t_instance_ids[-1].item()))
+        warped_centers = warped_centers[t_instance_ids]
+        centers, counts = get_instance_centers(pred_inst[t + 1], grid, n_instances)
+        centers = centers[1:]
 
         # Compute distance matrix between warped centers and actual centers
         distances = torch.norm(centers.unsqueeze(0) - warped_centers.unsqueeze(1), dim=-1).cpu().numpy()
         # outputs (row, col) with row: index in frame t, col: index in frame t+1
         # the missing ids in col must be added (correspond to new instances)
         ids_t, ids_t_one = linear_sum_assignment(distances)
-        matching_distances = distances[ids_t, ids_t_one]
+
+        # Filter low quality match, and swap the positions in the distance matrix with the real ids.
         # Offset by one as id=0 is the background
-        ids_t += 1
-        ids_t_one += 1
-
-        # swap ids_t with real ids. as those ids correspond to the position in the distance matrix.
-        id_mapping = dict(zip(np.arange(1, len(t_instance_ids) + 1), t_instance_ids))
-        ids_t = np.vectorize(id_mapping.__getitem__, otypes=[np.int64])(ids_t)
-
-        # Filter low quality match
-        ids_t = ids_t[matching_distances < matching_threshold]
-        ids_t_one = ids_t_one[matching_distances < matching_threshold]
-
-        # Elements that are in t+1, but weren't matched
-        remaining_ids = set(torch.unique(pred_inst[0, t + 1]).cpu().numpy()).difference(set(ids_t_one))
-        # remove background
-        remaining_ids.remove(0)
-        #  Set remaining_ids to a new unique id
-        for remaining_id in list(remaining_ids):
-            largest_instance_id += 1
-            ids_t = np.append(ids_t, largest_instance_id)
-            ids_t_one = np.append(ids_t_one, remaining_id)
-
-        consistent_instance_seg.append(update_instance_ids(pred_inst[0, t + 1], old_ids=ids_t_one, new_ids=ids_t))
-
-    consistent_instance_seg = torch.stack(consistent_instance_seg).unsqueeze(0)
-    return consistent_instance_seg
+        is_valid = distances[ids_t, ids_t_one] < matching_threshold
+        ids_t = t_instance_ids.cpu().numpy()[ids_t[is_valid]]
+        ids_t_one = ids_t_one[is_valid] + 1
+
+        # Set the elements that are in t+1, but weren't matched, to a new unique id
+        remaining_ids = np.setdiff1d(np.flatnonzero(counts[1:].cpu().numpy()) + 1, ids_t_one)
+        new_ids = np.arange(largest_instance_id + 1, largest_instance_id + 1 + len(remaining_ids))
+        largest_instance_id += len(remaining_ids)
+        ids_t = np.concatenate([ids_t, new_ids])
+        ids_t_one = np.concatenate([ids_t_one, remaining_ids])
+
+        consistent_instance_seg.append(update_instance_ids(pred_inst[t + 1], old_ids=ids_t_one, new_ids=ids_t))
+
+    return torch.stack(consistent_instance_seg)
 
 
 def predict_instance_segmentation_and_trajectories(
@@ -295,13 +297,8 @@ def predict_instance_segmentation_and_trajectories(
         if output['instance_flow'] is None:
             print('Using zero flow because instance_future_output is None')
             output['instance_flow'] = torch.zeros_like(output['instance_offset'])
-        consistent_instance_seg = []
-        for b in range(batch_size):
-            consistent_instance_seg.append(
-                make_instance_id_temporally_consistent(pred_inst[b:b+1],
-                                                       output['instance_flow'][b:b+1].detach())
-            )
-        consistent_instance_seg = torch.cat(consistent_instance_seg, dim=0)
+        consistent_instance_seg = make_instance_id_temporally_consistent(pred_inst,
+                                                                         output['instance_flow'].detach())
     else:
         consistent_instance_seg = pred_inst
 
@@ -45,201 +45,181 @@ def compute_affine(src_ref, tar_ref, src_yaw, tar_yaw):
     ])
     return R, T
 
+FRAME_TABLE_VERSION = 1
+
+def parse_frame(episode_name, frame, bev_dim):
+    """Parses the measurements, boxes and label masks of a frame into a row of the frame table"""
+    with gzip.open(episode_name + f"/measurements/{str(frame).zfill(4)}.json.gz","r") as read_file:
+        data = ujson.load(read_file)
+    with gzip.open(episode_name + f"/boxes/{str(frame).zfill(4)}.json.gz","r") as read_file:
+        bbox_i = ujson.load(read_file)
+
+    ego_yaw = np.nan
+    ped_boxes, stop_boxes = [], []
+    is_RY_light = is_stop = 0
+    for box in bbox_i:
+        if type(box) != list:
+            object_class = box['class']
+            if "ego_car" == object_class:
+                ego_yaw = np.degrees(extract_yaw_from_matrix(np.array(box['matrix'])))
+            elif "traffic_light" == object_class and \
+                box['state'] != "Green" and box['id'] == data['correct_traffic_light_id']:
+                stop_boxes.append([box['position'][0], box['position'][1], box['extent'][0], box['extent'][1]])
+                is_RY_light = 1
+            elif "walker" == object_class:
+                ped_boxes.append([box['position'][0], box['position'][1], box['extent'][0], box['extent'][1]])
+            elif 'stop' in object_class and box['id'] == data['correct_stop_sign_id']:
+                is_stop = 1
+    is_junction = 1 if data['junction'] else 0
+
+    vehicle, pedestrian, stop_area, obstacle = get_labels(episode_name + f"/bev_mask_merge_{bev_dim}/" + f"{str(frame).zfill(4)}.npz")
+    labels = [vehicle.sum() != 0, pedestrian.sum() != 0, stop_area.sum() != 0, obstacle.sum() != 0]
+
+    return {
+        'pose': [data['pos_global'][0], data['pos_global'][1], ego_yaw],
+        'control': [data['steer'], data['throttle'], data['brake'], data['speed']],
+        'command': data['command'],
+        'target_point': [data['target_point'][0], data['target_point'][1]],
+        'is_stop_moment': [is_RY_light, is_stop, is_junction],
+        'labels': labels,
+        'ped_boxes': ped_boxes,
+        'stop_boxes': stop_boxes,
+    }
+
+def build_frame_table(episode_name, num_frames, bev_dim):
+    """
+    Parses the frames 1 to 'num_frames' of an episode into arrays, where row i is the frame i + 1.
+    The boxes of all frames are concatenated, with 'X_offsets' giving the rows of each frame,
+    and their gaussian radius is precomputed. Frames without the ego box take the yaw of the previous one
+    """
+    rows = [parse_frame(episode_name, frame, bev_dim) for frame in range(1, num_frames + 1)]
+
+    table = {
+        'pose': np.array([row['pose'] for row in rows], dtype=np.float64).reshape(-1, 3),
+        'control': np.array([row['control'] for row in rows], dtype=np.float64).reshape(-1, 4),
+        'command': np.array([row['command'] for row in rows], dtype=np.int64),
+        'target_point': np.array([row['target_point'] for row in rows], dtype=np.float64).reshape(-1, 2),
+        'is_stop_moment': np.array([row['is_stop_moment'] for row in rows], dtype=np.int64).reshape(-1, 3),
+        'labels': np.array([row['labels'] for row in rows], dtype=bool).reshape(-1, 4),
+    }
+    yaws = table['pose'][:, 2]
+    for i in range(1, len(yaws)):
+        if np.isnan(yaws[i]):
+            yaws[i] = yaws[i - 1]
+
+    for name in ['ped', 'stop']:
+        boxes = [box for row in rows for box in row[f'{name}_boxes']]
+        boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+        table[f'{name}_boxes'] = boxes
+        table[f'{name}_radius'] = np.array([gaussian_radius(extent * 2, 0.1) for extent in boxes[:, 2:]], dtype=np.float64)
+        table[f'{name}_offsets'] = np.cumsum([0] + [len(row[f'{name}_boxes']) for row in rows]).astype(np.int64)
+    return table
+
+def load_frame_table(episode_name, num_frames, bev_dim):
+    """Loads the frame table of an episode, cached next to its data, building it if needed"""
+    path = os.path.join(episode_name, f"frame_table_{bev_dim}.npz")
+    if os.path.exists(path):
+        try:
+            with np.load(path) as cache:
+                if int(cache['version']) == FRAME_TABLE_VERSION and len(cache['command']) == num_frames:
+                    return {k: cache[k] for k in cache.files if k != 'version'}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    table = build_frame_table(episode_name, num_frames, bev_dim)
+    tmp_path = path + f".{os.getpid()}.tmp.npz"
+    try:
+        np.savez(tmp_path, version=FRAME_TABLE_VERSION, **table)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"WARNING: Couldn't cache the frame table of {episode_name}: {e}")
+    return table
+
+def get_box_heatmaps(table, name, row, R, T, bev_dim, factor):
+    """Transforms the boxes of a frame table row to the target frame, as heatmap centers"""
+    start, end = table[f'{name}_offsets'][row], table[f'{name}_offsets'][row + 1]
+    boxes = table[f'{name}_boxes'][start:end]
+    trans = boxes[:, :2].dot(R.T) + T
+    trans[:, 0] = np.trunc(bev_dim // 2 - trans[:, 0] * factor)
+    trans[:, 1] = np.trunc(bev_dim // 2 + trans[:, 1] * factor)
+
+    heatmap = []
+    for center, radius in zip(trans / factor, table[f'{name}_radius'][start:end]):
+        center_int = center.astype(int)
+        heatmap.append({'radius': float(radius), 'center': center_int,
+            'offset': center - center_int})
+    return heatmap
+
 def process_preloading_pathfiles(episode_name, receptive_field, 
         sequence_length, bev_dimension, is_train, factor=4):
     bev_dim = max(bev_dimension)
     results = {k: [] for k in keys}
     num_seq = len(os.listdir(episode_name + "/rgb_front/")) - sequence_length
-    scene = episode_name.split('/')[-1]
+    if num_seq <= 0:
+        return results, is_train
+
+    # Each frame is decoded once, and the windows are row ranges of the table
+    table = load_frame_table(episode_name, num_seq + sequence_length - 1, bev_dim)
+    poses = table['pose']
+
     for seq in range(num_seq):
-        fronts, front_lefts, front_rights, rears, rear_lefts, rear_rights = [], [], [], [], [], []
-        fr_depths, fr_le_depths, fr_ri_depths, re_depths, re_le_depths, re_ri_depths = [], [], [], [], [], []
-        xs, ys, thetas = [], [], []
-        ped_poss, stop_poss = [], []
-        ped_extents, stop_extents = [], []
-        ped_heatmaps, stop_heatmaps = [], []
-        is_stop_moments = []
-        hdmap = []
-        for i in range(receptive_field): # 0,3 
-            filename = f"{str(seq+1+i).zfill(4)}.jpg"
-            fronts.append(episode_name + "/rgb_front/" + filename)
-            front_lefts.append(episode_name + "/rgb_front_left/" + filename)
-            front_rights.append(episode_name + "/rgb_front_right/" + filename)
-            rears.append(episode_name + "/rgb_back/" + filename)
-            rear_lefts.append(episode_name + "/rgb_back_left/" + filename)
-            rear_rights.append(episode_name + "/rgb_back_right/" + filename)
-            filename = f"{str(seq+1+i).zfill(4)}.png"
-            fr_depths.append(episode_name + "/depth_front/" + filename)
-            fr_le_depths.append(episode_name + "/depth_front_left/" + filename)
-            fr_ri_depths.append(episode_name + "/depth_front_right/" + filename)
-            re_depths.append(episode_name + "/depth_back/" + filename)
-            re_le_depths.append(episode_name + "/depth_back_left/" + filename)
-            re_ri_depths.append(episode_name + "/depth_back_right/" + filename)
-            
-            
-            hdmap.append(episode_name + f"/bev_mask_merge_{bev_dim}/" + f"{str(seq+1+i).zfill(4)}.npz")
-            
-            # position
-            with gzip.open(episode_name + f"/measurements/{str(seq+1+i).zfill(4)}.json.gz","r") as read_file:
-                data = ujson.load(read_file)
-            
-            with gzip.open(episode_name + f"/boxes/{str(seq+1+i).zfill(4)}.json.gz","r") as read_file:
-                bbox_i = ujson.load(read_file)
-                ped_pos, stop_pos = [], []
-                ped_extent, stop_extent = [], []
-                is_RY_light = is_stop = is_junction = 0
-                for box in bbox_i:
-                    if type(box) != list:       
-                        object_class = box['class']
-                        if "ego_car" == object_class:  
-                            ego_matrix = np.array(box['matrix'])
-                            ego_yaw = extract_yaw_from_matrix(ego_matrix)
-                            ego_yaw = np.degrees(ego_yaw)
-                        elif "traffic_light" == object_class and \
-                            box['state'] != "Green" and box['id'] == data['correct_traffic_light_id']:
-                            stop_pos.append(np.array([box['position'][0], box['position'][1]]))
-                            stop_extent.append(np.array([box['extent'][0], box['extent'][1]]))
-                            is_RY_light = 1
-                        elif "walker" == object_class:
-                            ped_pos.append(np.array([box['position'][0], box['position'][1]]))
-                            ped_extent.append(np.array([box['extent'][0], box['extent'][1]]))
-                        elif 'stop' in object_class and box['id'] == data['correct_stop_sign_id']:
-                            is_stop = 1
-                if data['junction']:
-                    is_junction = 1
-                        
-                is_stop_moments.append(np.array([is_RY_light, is_stop, is_junction]))
-                ped_poss.append(ped_pos) 
-                stop_poss.append(stop_pos)
-                ped_extents.append(ped_extent) 
-                stop_extents.append(stop_extent)
-
-            xs.append(data['pos_global'][0])
-            ys.append(data['pos_global'][1])
-            thetas.append(ego_yaw)
-
-        command_point_x = int(bev_dim // 2 - data['target_point'][0] * factor)
-        command_point_y = int(bev_dim // 2 + data['target_point'][1] * factor)
+        frames = [str(seq+1+i).zfill(4) for i in range(sequence_length)]
+        rows = slice(seq, seq + sequence_length)
+        jpgs = [f"{frame}.jpg" for frame in frames[:receptive_field]]
+        pngs = [f"{frame}.png" for frame in frames[:receptive_field]]
+        results['front'].append([episode_name + "/rgb_front/" + filename for filename in jpgs])
+        results['front_left'].append([episode_name + "/rgb_front_left/" + filename for filename in jpgs])
+        results['front_right'].append([episode_name + "/rgb_front_right/" + filename for filename in jpgs])
+        results['rear'].append([episode_name + "/rgb_back/" + filename for filename in jpgs])
+        results['rear_left'].append([episode_name + "/rgb_back_left/" + filename for filename in jpgs])
+        results['rear_right'].append([episode_name + "/rgb_back_right/" + filename for filename in jpgs])
+        results['front_depth'].append([episode_name + "/depth_front/" + filename for filename in pngs])
+        results['front_left_depth'].append([episode_name + "/depth_front_left/" + filename for filename in pngs])
+        results['front_right_depth'].append([episode_name + "/depth_front_right/" + filename for filename in pngs])
+        results['rear_depth'].append([episode_name + "/depth_back/" + filename for filename in pngs])
+        results['rear_left_depth'].append([episode_name + "/depth_back_left/" + filename for filename in pngs])
+        results['rear_right_depth'].append([episode_name + "/depth_back_right/" + filename for filename in pngs])
+        results['hdmap'].append([episode_name + f"/bev_mask_merge_{bev_dim}/" + f"{frame}.npz" for frame in frames])
+        results['iamap'].append(episode_name + f"/bev_IA_{bev_dim}/" + f"{str(seq+receptive_field).zfill(4)}.npz")
+
+        # Controls of the last frame of the receptive field
+        last = seq + receptive_field - 1
+        target_point = table['target_point'][last]
+        command_point_x = int(bev_dim // 2 - target_point[0] * factor)
+        command_point_y = int(bev_dim // 2 + target_point[1] * factor)
         results['command_point'].append(np.array([command_point_x, command_point_y]))
-        results['steer'].append(data['steer'])
-        results['throttle'].append(data['throttle'])
-        results['brake'].append(data['brake'])
-        results['command'].append(data['command'])
-        results['velocity'].append(data['speed'])
-        
-        for i in range(receptive_field, sequence_length): # ( 3, 7)
-            with gzip.open(episode_name + f"/measurements/{str(seq+1+i).zfill(4)}.json.gz","r") as read_file:
-                data = ujson.load(read_file)
-            xs.append(data['pos_global'][0])
-            ys.append(data['pos_global'][1])
-            
-            with gzip.open(episode_name + f"/boxes/{str(seq+1+i).zfill(4)}.json.gz","r") as read_file:
-                bbox_i = ujson.load(read_file)
-                ped_pos, stop_pos = [], []
-                ped_extent, stop_extent = [], []
-                is_RY_light = is_stop = is_junction = 0
-                for box in bbox_i:
-                    if type(box) != list:       
-                        object_class = box['class']
-                        if "ego_car" == object_class:  
-                            ego_matrix = np.array(box['matrix'])
-                            ego_yaw = extract_yaw_from_matrix(ego_matrix)
-                            ego_yaw = np.degrees(ego_yaw)
-                        elif "traffic_light" == object_class and \
-                            box['state'] != "Green" and box['id'] == data['correct_traffic_light_id']:
-                            stop_pos.append(np.array([box['position'][0], box['position'][1]]))
-                            stop_extent.append(np.array([box['extent'][0], box['extent'][1]]))
-                            is_RY_light = 1
-                        elif "walker" == object_class:
-                            ped_pos.append(np.array([box['position'][0], box['position'][1]]))
-                            ped_extent.append(np.array([box['extent'][0], box['extent'][1]]))
-                        elif 'stop' in object_class and box['id'] == data['correct_stop_sign_id']:
-                            is_stop = 1
-                if data['junction']:
-                    is_junction = 1
-
-                is_stop_moments.append(np.array([is_RY_light, is_stop, is_junction]))
-                ped_poss.append(ped_pos) 
-                stop_poss.append(stop_pos)
-                ped_extents.append(ped_extent) 
-                stop_extents.append(stop_extent)
-
-            if np.isnan(ego_yaw):
-                thetas.append(0)
-            else:
-                thetas.append(ego_yaw)    
-            hdmap.append(episode_name + f"/bev_mask_merge_{bev_dim}/" + f"{str(seq+1+i).zfill(4)}.npz")
+        steer, throttle, brake, speed = table['control'][last].tolist()
+        results['steer'].append(steer)
+        results['throttle'].append(throttle)
+        results['brake'].append(brake)
+        results['command'].append(int(table['command'][last]))
+        results['velocity'].append(speed)
+
+        xs = poses[rows, 0].tolist()
+        ys = poses[rows, 1].tolist()
+        thetas = poses[rows, 2].tolist()
+        thetas[receptive_field:] = [0 if np.isnan(theta) else theta for theta in thetas[receptive_field:]]
 
         tar_ref = np.array([xs[receptive_field - 1], ys[receptive_field - 1]])
         tar_yaw = thetas[receptive_field - 1]
+        ped_heatmaps, stop_heatmaps = [], []
         for i in range(sequence_length):
             src_ref = np.array([xs[i], ys[i]])
-            src_yaw = thetas[i]
-            R, T = compute_affine(src_ref, tar_ref, src_yaw, tar_yaw)
-            ped_heatmap = []
-            for ped_pos, ped_ext in zip(ped_poss[i], ped_extents[i]):
-                ped_pos_trans = R.dot(ped_pos) + T
-                ped_pos_trans[0] = int(bev_dim // 2 - ped_pos_trans[0] * factor)
-                ped_pos_trans[1] = int(bev_dim // 2 + ped_pos_trans[1] * factor)
-                
-                center = ped_pos_trans / factor
-                center_int = center.astype(int)
-                radius = gaussian_radius(ped_ext * 2, 0.1)
-                ped_heatmap.append({'radius': radius, 'center': center_int, 
-                    'offset': center - center_int})
-            ped_heatmaps.append(ped_heatmap)
-
-            stop_heatmap = []
-            for stop_pos, stop_ext in zip(stop_poss[i], stop_extents[i]):
-                stop_pos_trans = R.dot(stop_pos) + T
-                stop_pos_trans[0] = int(bev_dim // 2 - stop_pos_trans[0] * factor)
-                stop_pos_trans[1] = int(bev_dim // 2 + stop_pos_trans[1] * factor)
-                
-                center = stop_pos_trans / factor
-                center_int = center.astype(int)
-                radius = gaussian_radius(stop_ext * 2, 0.1)
-                stop_heatmap.append({'radius': radius, 'center': center_int, 
-                    'offset': center - center_int})
-            stop_heatmaps.append(stop_heatmap)
-            
-        have_vehicle = False
-        have_pedestrian = False
-        have_stop_area = False
-        have_obstacle = False
-        for hd_path in hdmap[:2]:
-            vehicle, pedestrian, stop_area, obstacle = get_labels(hd_path)
-            if vehicle.sum() != 0:
-                have_vehicle = True
-            if pedestrian.sum() != 0:
-                have_pedestrian = True
-            if obstacle.sum() != 0:
-                have_obstacle = True
-            if stop_area.sum() != 0:
-                have_stop_area = True
+            R, T = compute_affine(src_ref, tar_ref, thetas[i], tar_yaw)
+            ped_heatmaps.append(get_box_heatmaps(table, 'ped', seq + i, R, T, bev_dim, factor))
+            stop_heatmaps.append(get_box_heatmaps(table, 'stop', seq + i, R, T, bev_dim, factor))
+
+        have_vehicle, have_pedestrian, have_stop_area, have_obstacle = table['labels'][seq:seq + 2].any(axis=0).tolist()
         results['have_vehicle'].append(have_vehicle)
         results['have_pedestrian'].append(have_pedestrian)
         results['have_stop_area'].append(have_stop_area)
         results['have_obstacle'].append(have_obstacle)
-        results['front'].append(fronts)
-        results['front_left'].append(front_lefts)
-        results['front_right'].append(front_rights)
-        results['rear'].append(rears)
-        results['rear_left'].append(rear_lefts)
-        results['rear_right'].append(rear_rights)
-        results['front_depth'].append(fr_depths)
-        results['front_left_depth'].append(fr_le_depths)
-        results['front_right_depth'].append(fr_ri_depths)
-        results['rear_depth'].append(re_depths)
-        results['rear_left_depth'].append(re_le_depths)
-        results['rear_right_depth'].append(re_ri_depths)
         results['x'].append(xs)
         results['y'].append(ys)
         results['theta'].append(thetas)
-        results['hdmap'].append(hdmap)
         results['pedestrian_heatmap'].append(ped_heatmaps)
         results['stop_area_heatmap'].append(stop_heatmaps)
-        results['is_stop_moment'].append(is_stop_moments)
-        results['iamap'].append(episode_name + f"/bev_IA_{bev_dim}/" + f"{str(seq+receptive_field).zfill(4)}.npz")
+        results['is_stop_moment'].append(list(table['is_stop_moment'][rows]))
     return results, is_train
 
 def normalize_angle(x):
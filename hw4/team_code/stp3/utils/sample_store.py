@@ -0,0 +1,225 @@
+"""
+Binary store of the STP3 training samples.
+
+The preloaded samples (see preprocess.process_preloading) only hold the paths of their files, so the
+dataset has to open and decode six JPEGs, six depth PNGs and the BEV masks of every frame of every sample.
+'pack_samples' decodes each frame once, offline, and writes them to fixed size shards of uncompressed
+arrays: resized cameras, normalized depth and bit-packed BEV masks. The samples are stored in an index,
+as the rows of their frames together with their ego motion, controls and labels.
+'SampleStore' memory maps the shards and gathers the samples, without decoding anything.
+
+    python stp3/utils/sample_store.py <preload file> <store folder> [--image-size 224 480]
+"""
+import argparse
+import os
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+CAMERA_DIRS = ['rgb_front', 'rgb_front_left', 'rgb_front_right', 'rgb_back', 'rgb_back_left', 'rgb_back_right']
+DEPTH_DIRS = ['depth_front', 'depth_front_left', 'depth_front_right', 'depth_back', 'depth_back_left', 'depth_back_right']
+
+# Per sample fields of the preloaded results stored as arrays
+SAMPLE_FIELDS = {
+    'x': np.float64, 'y': np.float64, 'theta': np.float64, 'command_point': np.int64,
+    'steer': np.float32, 'throttle': np.float32, 'brake': np.float32, 'command': np.int64, 'velocity': np.float32,
+    'is_stop_moment': np.int64, 'have_vehicle': bool, 'have_pedestrian': bool, 'have_stop_area': bool,
+    'have_obstacle': bool,
+}
+# Per sample fields with a variable size, pickled
+OBJECT_FIELDS = ['pedestrian_heatmap', 'stop_area_heatmap']
+
+
+def decode_depth(path, image_size):
+    """Converts a CARLA depth PNG to the normalized depth, resized to (height, width)"""
+    image = Image.open(path).convert('RGB').resize(image_size[::-1], Image.NEAREST)
+    data = np.asarray(image, dtype=np.float32)
+    depth = (data[..., 0] + data[..., 1] * 256 + data[..., 2] * 256 * 256) / (256 * 256 * 256 - 1)
+    return depth.astype(np.float16)
+
+def load_bev(path):
+    """Loads a BEV mask (C, H, W), bit-packed along its last axis. Returns None if it doesn't exist"""
+    if not os.path.exists(path):
+        return None
+    img = np.load(path, allow_pickle=True)['arr_0']
+    return np.packbits(img != 0, axis=-1)
+
+def decode_frame(inputs):
+    """Decodes all the data of a frame, given as (episode, frame name, bev dimension, image size)"""
+    episode, frame, bev_dim, image_size = inputs
+    images = np.stack([np.asarray(Image.open(f"{episode}/{camera}/{frame}.jpg").convert('RGB').resize(
+        image_size[::-1], Image.BILINEAR)) for camera in CAMERA_DIRS])
+    depths = np.stack([decode_depth(f"{episode}/{camera}/{frame}.png", image_size) for camera in DEPTH_DIRS])
+    hdmap = load_bev(f"{episode}/bev_mask_merge_{bev_dim}/{frame}.npz")
+    iamap = load_bev(f"{episode}/bev_IA_{bev_dim}/{frame}.npz")
+    return {'images': images, 'depths': depths, 'hdmap': hdmap, 'iamap': iamap}
+
+def get_frame_key(hdmap_path):
+    """Returns the (episode, frame name, bev dimension) of the path of a BEV mask"""
+    folder, filename = os.path.split(hdmap_path)
+    episode, bev_folder = os.path.split(folder)
+    return episode, os.path.splitext(filename)[0], int(bev_folder.split('_')[-1])
+
+def pack_samples(preload_path, out_dir, image_size=(224, 480), frames_per_shard=512, num_workers=16):
+    """
+    Packs the samples of a preload file into shards at 'out_dir'.
+
+    Args:
+        preload_path (str): File saved by preprocess.process_preloading
+        out_dir (str): Folder of the store
+        image_size (tuple): (height, width) of the stored cameras and depths
+        frames_per_shard (int): Amount of frames of each shard
+        num_workers (int): Processes decoding the frames
+    """
+    results = np.load(preload_path, allow_pickle=True).item()
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Frames shared by several samples are stored once
+    frame_rows = {}
+    sample_frames = []
+    for hdmaps in results['hdmap']:
+        sample_frames.append([frame_rows.setdefault(get_frame_key(path), len(frame_rows)) for path in hdmaps])
+    frames = [(episode, frame, bev_dim, tuple(image_size)) for episode, frame, bev_dim in frame_rows]
+
+    shard_offsets = list(range(0, len(frames), frames_per_shard)) + [len(frames)]
+    has_masks = {name: np.zeros(len(frames), dtype=bool) for name in ('hdmap', 'iamap')}
+    mask_shapes = {}
+    pool = multiprocessing.Pool(processes=num_workers)
+    pbar = tqdm(total=len(frames), desc="Packing frames")
+    for shard, (start, end) in enumerate(zip(shard_offsets[:-1], shard_offsets[1:])):
+        shard_dir = os.path.join(out_dir, f"shard_{shard:05d}")
+        os.makedirs(shard_dir, exist_ok=True)
+        arrays = {}
+        for i, data in enumerate(pool.imap(decode_frame, frames[start:end], chunksize=4)):
+            for name, value in data.items():
+                if value is None:
+                    # Missing BEV masks are left empty
+                    continue
+                if name not in arrays:
+                    # Each array is allocated by the first frame of the shard that has it
+                    arrays[name] = np.lib.format.open_memmap(os.path.join(shard_dir, f"{name}.npy"), mode='w+',
+                                                             dtype=value.dtype, shape=(end - start,) + value.shape)
+                arrays[name][i] = value
+                if name in has_masks:
+                    has_masks[name][start + i] = True
+                    mask_shapes.setdefault(name, value.shape)
+            pbar.update()
+        for array in arrays.values():
+            array.flush()
+        del arrays
+    pool.close()
+    pool.join()
+    pbar.close()
+
+    index = {name: np.array(results[name], dtype=dtype) for name, dtype in SAMPLE_FIELDS.items()}
+    np.savez(os.path.join(out_dir, 'index.npz'),
+        sample_frames=np.array(sample_frames, dtype=np.int64),
+        receptive_field=len(results['front'][0]) if results['front'] else 0,
+        shard_offsets=np.array(shard_offsets, dtype=np.int64),
+        bev_width=frames[0][2] if frames else 0,
+        has_hdmap=has_masks['hdmap'],
+        has_iamap=has_masks['iamap'],
+        hdmap_shape=np.array(mask_shapes.get('hdmap', ()), dtype=np.int64),
+        iamap_shape=np.array(mask_shapes.get('iamap', ()), dtype=np.int64),
+        **index)
+    np.save(os.path.join(out_dir, 'index_objects.npy'), {name: results[name] for name in OBJECT_FIELDS})
+
+
+class SampleStore(object):
+    """
+    Reads the samples packed by 'pack_samples'. The shards are memory mapped when first used, so that
+    each dataloader worker opens its own maps. Can be used as the data of a torch Dataset
+    """
+
+    def __init__(self, path, load_objects=True):
+        self.path = path
+        with np.load(os.path.join(path, 'index.npz')) as index:
+            self._index = {name: index[name] for name in index.files}
+        self._objects = np.load(os.path.join(path, 'index_objects.npy'), allow_pickle=True).item() if load_objects else {}
+
+        self.receptive_field = int(self._index['receptive_field'])
+        self._sample_frames = self._index['sample_frames']
+        self._shard_offsets = self._index['shard_offsets']
+        self._bev_width = int(self._index['bev_width'])
+        self._shards = {}
+
+    def __len__(self):
+        return len(self._sample_frames)
+
+    def _get_shard(self, shard):
+        if shard not in self._shards:
+            shard_dir = os.path.join(self.path, f"shard_{shard:05d}")
+            self._shards[shard] = {name[:-4]: np.load(os.path.join(shard_dir, name), mmap_mode='r')
+                                   for name in os.listdir(shard_dir) if name.endswith('.npy')}
+        return self._shards[shard]
+
+    def get_frames(self, name, rows):
+        """Gathers the field 'name' of the given frame rows"""
+        shards = np.searchsorted(self._shard_offsets, rows, side='right') - 1
+        return np.stack([self._get_shard(shard)[name][row - self._shard_offsets[shard]]
+                         for shard, row in zip(shards, rows)])
+
+    def get_masks(self, name, rows):
+        """Gathers and unpacks the BEV masks 'name' of the given frame rows, empty for the frames without them"""
+        rows = np.asarray(rows)
+        present = self._index[f"has_{name}"][rows]
+        masks = np.zeros((len(rows),) + tuple(self._index[f"{name}_shape"]), dtype=np.uint8)
+        if present.any():
+            masks[present] = self.get_frames(name, rows[present])
+        return np.unpackbits(masks, axis=-1, count=self._bev_width)
+
+    def get_subset(self, flag):
+        """Returns the indices of the samples with the given flag (i.e 'have_pedestrian')"""
+        return np.flatnonzero(self._index[flag])
+
+    def __getitem__(self, i):
+        rows = self._sample_frames[i]
+        receptive_rows = rows[:self.receptive_field]
+
+        sample = {name: self._index[name][i] for name in SAMPLE_FIELDS}
+        sample.update({name: self._objects[name][i] for name in self._objects})
+        sample['images'] = self.get_frames('images', receptive_rows)
+        sample['depths'] = self.get_frames('depths', receptive_rows)
+        sample['hdmap'] = self.get_masks('hdmap', rows)
+        last_row = receptive_rows[-1]
+        if self._index['has_iamap'][last_row]:
+            sample['iamap'] = self.get_masks('iamap', [last_row])[0]
+        return sample
+
+    def shard_order(self, seed=None):
+        """
+        Returns all the sample indices, grouped by the shard of their first frame. The order of the shards
+        and of the samples inside them is shuffled, so that reading them only touches one shard at a time
+        """
+        rng = np.random.default_rng(seed)
+        first_shards = np.searchsorted(self._shard_offsets, self._sample_frames[:, 0], side='right') - 1
+        indices = []
+        for shard in rng.permutation(len(self._shard_offsets) - 1):
+            shard_indices = np.flatnonzero(first_shards == shard)
+            indices.extend(rng.permutation(shard_indices).tolist())
+        return indices
+
+    def iter_samples(self, indices, num_workers=4, prefetch=16):
+        """Yields the given samples in order, gathering the next 'prefetch' ones with a pool of threads"""
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(self.__getitem__, i) for i in indices[:prefetch]]
+            for next_index in list(indices[prefetch:]) + [None] * min(prefetch, len(indices)):
+                sample = futures.pop(0).result()
+                if next_index is not None:
+                    futures.append(executor.submit(self.__getitem__, next_index))
+                yield sample
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Packs the samples of a preload file into a SampleStore")
+    parser.add_argument('preload_path', help='file saved by preprocess.process_preloading')
+    parser.add_argument('out_dir', help='folder of the store')
+    parser.add_argument('--image-size', type=int, nargs=2, default=[224, 480], metavar=('HEIGHT', 'WIDTH'),
+                        help='size of the stored cameras and depths')
+    parser.add_argument('--frames-per-shard', type=int, default=512, help='amount of frames of each shard')
+    parser.add_argument('--num-workers', type=int, default=16, help='processes decoding the frames')
+    args = parser.parse_args()
+
+    pack_samples(args.preload_path, args.out_dir, tuple(args.image_size), args.frames_per_shard, args.num_workers)
@@ -2,6 +2,7 @@ import os
 
 from copy import deepcopy
 import json
+import itertools
 import time
 import cv2
 import carla
@@ -28,6 +29,7 @@ from filterpy.kalman import UnscentedKalmanFilter as UKF
 from config import GlobalConfig
 
 from autopilot import AutoPilot
+from sensor_preprocessing import SensorPreprocessor
 
 # for debug 
 from srunner.scenariomanager.carla_data_provider import CarlaDataProvider
@@ -41,6 +43,9 @@ def get_entry_point():
 
 
 class Stp3Agent(AutoPilot):
+    video_folder = 'debug_stp3'
+    video_fps = 5
+
     # def setup(self, path_to_conf_file):
     def setup(self, path_to_conf_file, route_index=None, traffic_manager=None, scenario_name=None):
         super().setup(path_to_conf_file, route_index, traffic_manager, scenario_name)
@@ -50,6 +55,7 @@ class Stp3Agent(AutoPilot):
         self.step = -1
         self.wall_start = time.time()
         self.initialized = False
+        self.num_saved_metric_info = 0
                 
         
         trainer = TrainingModule.load_from_checkpoint(path_to_conf_file, strict=True)
@@ -57,6 +63,7 @@ class Stp3Agent(AutoPilot):
         trainer.eval()
         device = torch.device('cuda:0')
         trainer.to(device)
+        self.device = device
         self.model = trainer.model
         self.cfg = self.model.cfg
 
@@ -106,14 +113,13 @@ class Stp3Agent(AutoPilot):
         self.compass_prev = 0
         
         self.extrinsics, self.intrinsics = self.get_cam_para()
+        self.extrinsics = self.extrinsics.to(device)
+        self.intrinsics = self.intrinsics.to(device)
         
+        # Camera and LiDAR preprocessing, the cameras are in the order of the network input
+        self.camera_ids = ['CAM_FRONT','CAM_FRONT_LEFT','CAM_BACK_LEFT','CAM_FRONT_RIGHT','CAM_BACK_RIGHT', 'CAM_BACK']
+        self.preprocessor = SensorPreprocessor(self.camera_ids, image_size=(224, 400), device=device)
         
-        self.normalise_image = torchvision.transforms.Compose(
-        [
-            torchvision.transforms.ToTensor(),
-            torchvision.transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-            ]
-        )
         self.denormalise_img = torchvision.transforms.Compose(
                         [NormalizeInverse(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
                             torchvision.transforms.ToPILImage(),]
@@ -224,15 +230,8 @@ class Stp3Agent(AutoPilot):
         return result
 
     def tick(self, input_data):
-        imgs = {}
-        for cam in ['CAM_FRONT','CAM_FRONT_LEFT','CAM_BACK_LEFT','CAM_FRONT_RIGHT','CAM_BACK_RIGHT', 'CAM_BACK']:
-            camera = input_data[cam][1][:, :, :3]
-            # Also add jpg artifacts at test time, because the training data was saved as jpg.
-            _, compressed_image_i = cv2.imencode('.jpg', camera)
-            camera = cv2.imdecode(compressed_image_i, cv2.IMREAD_UNCHANGED)
-            img = cv2.cvtColor(camera, cv2.COLOR_BGR2RGB)
-            
-            imgs[cam] = img
+        # The cameras are preprocessed in the background while the rest of the data is handled
+        camera_job = self.preprocessor.submit_cameras(input_data)
             
         lidar = self.lidar_to_ego_coordinate(input_data['LIDAR'])
             
@@ -291,8 +290,11 @@ class Stp3Agent(AutoPilot):
         
         ego_target_point = self.inverse_conversion_2d(target_point, pos_carla, compass)
         
+        imgs, images = camera_job.result()
+        
         result = {
                 'imgs': imgs,
+                'images': images,
                 'lidar': lidar,
                 'gps': gps,
                 'pos': pos_carla,
@@ -338,27 +340,11 @@ class Stp3Agent(AutoPilot):
         self.lidar_buffer.append(lidar_full)
         self.lidar_last = deepcopy(tick_data['lidar'])
         
-        # prepare rgb  
-        images = []
-        
-        images.append(self.normalise_image(np.array(
-                self.scale_image(Image.fromarray(tick_data['imgs']['CAM_FRONT']), output_size=(224, 400)))).unsqueeze(0))
-        images.append(self.normalise_image(np.array(
-                self.scale_image(Image.fromarray(tick_data['imgs']['CAM_FRONT_LEFT']), output_size=(224, 400)))).unsqueeze(0))
-        images.append(self.normalise_image(np.array(
-                self.scale_image(Image.fromarray(tick_data['imgs']['CAM_BACK_LEFT']), output_size=(224, 400)))).unsqueeze(0))
-        images.append(self.normalise_image(np.array(
-                self.scale_image(Image.fromarray(tick_data['imgs']['CAM_FRONT_RIGHT']), output_size=(224, 400)))).unsqueeze(0))
-        images.append(self.normalise_image(np.array(
-                self.scale_image(Image.fromarray(tick_data['imgs']['CAM_BACK_RIGHT']), output_size=(224, 400)))).unsqueeze(0))
-        images.append(self.normalise_image(np.array(
-                self.scale_image(Image.fromarray(tick_data['imgs']['CAM_BACK']), output_size=(224, 400)))).unsqueeze(0))
-        images = torch.cat(images, dim=0)
-        self.input_buffer['rgb'].append(images) 
+        # prepare rgb (already normalized at the device by the preprocessor)
+        self.input_buffer['rgb'].append(tick_data['images']) 
         
         # prepare lidar 
-        lidar_feature = np.array(self.lidar_to_histogram_features(lidar_full, True))
-        lidar_feature = torch.from_numpy(lidar_feature).float()        
+        lidar_feature = self.preprocessor.lidar_to_histogram_features(lidar_full)
         self.input_buffer['lidar'].append(lidar_feature) 
         
         self.input_buffer['intrinsics'].append(self.intrinsics) 
@@ -406,6 +392,7 @@ class Stp3Agent(AutoPilot):
             yaw_t = self.input_buffer['yaw'][index_t]
             
             affine_mat = self.create_affine_mat(x_t, y_t, yaw_t, current_ego_x, current_ego_y, current_ego_yaw)
+            affine_mat = torch.as_tensor(affine_mat, dtype=torch.float32).to(self.device)
             affine_mats.append(affine_mat.unsqueeze(0))
             
             lidar_tensor = self.input_buffer['lidar'][index_t].unsqueeze(0) 
@@ -421,11 +408,12 @@ class Stp3Agent(AutoPilot):
             seq_theta.append(yaw_t)
         
         
-        images = torch.cat(images, dim=0).unsqueeze(0).to('cuda', dtype=torch.float32) # torch.Size([1, 3, 6, 3, 224, 400])
-        intrinsics = torch.cat(intrinsics, dim=0).unsqueeze(0).to('cuda', dtype=torch.float32) # torch.Size([1, 3, 6, 3, 3])
-        extrinsics = torch.cat(extrinsics, dim=0).unsqueeze(0).to('cuda', dtype=torch.float32) # torch.Size([1, 3, 6, 4, 4]) 
-        affine_mats = torch.cat(affine_mats, dim=0).unsqueeze(0).to('cuda', dtype=torch.float32) # torch.Size([1, 3, 2, 3])
-        lidar = torch.cat(lidar, dim=0).unsqueeze(0).to('cuda', dtype=torch.float32) # torch.Size([1, 3, 2, 256, 256])
+        # The buffered inputs are already at the device
+        images = torch.cat(images, dim=0).unsqueeze(0) # torch.Size([1, 3, 6, 3, 224, 400])
+        intrinsics = torch.cat(intrinsics, dim=0).unsqueeze(0) # torch.Size([1, 3, 6, 3, 3])
+        extrinsics = torch.cat(extrinsics, dim=0).unsqueeze(0) # torch.Size([1, 3, 6, 4, 4]) 
+        affine_mats = torch.cat(affine_mats, dim=0).unsqueeze(0) # torch.Size([1, 3, 2, 3])
+        lidar = torch.cat(lidar, dim=0).unsqueeze(0) # torch.Size([1, 3, 2, 256, 256])
         future_egomotion = self.get_future_egomotion(seq_x, seq_y, seq_theta).unsqueeze(0).to('cuda', dtype=torch.float32) # torch.Size([1, 2, 6])
         
         
@@ -642,7 +630,7 @@ class Stp3Agent(AutoPilot):
         if (self.step % self.config.data_save_freq == 0) :
             frame = self.step // self.config.data_save_freq
             
-            cv2.imwrite(str(self.save_path / 'debug_stp3' / (f'{frame:04}.jpg')), bgr)
+            self.recorder.write_frame('debug_stp3', frame, bgr)
                 
         
         # self.save_path / "debug_stp3"
@@ -651,31 +639,26 @@ class Stp3Agent(AutoPilot):
     def save(self, tick_data):
         frame = self.step // 10
 
-        Image.fromarray(tick_data['imgs']['CAM_FRONT']).save(self.save_path / 'rgb_front' / ('%04d.png' % frame))
-        Image.fromarray(tick_data['imgs']['CAM_FRONT_LEFT']).save(self.save_path / 'rgb_front_left' / ('%04d.png' % frame))
-        Image.fromarray(tick_data['imgs']['CAM_FRONT_RIGHT']).save(self.save_path / 'rgb_front_right' / ('%04d.png' % frame))
-        Image.fromarray(tick_data['imgs']['CAM_BACK']).save(self.save_path / 'rgb_back' / ('%04d.png' % frame))
-        Image.fromarray(tick_data['imgs']['CAM_BACK_LEFT']).save(self.save_path / 'rgb_back_left' / ('%04d.png' % frame))
-        Image.fromarray(tick_data['imgs']['CAM_BACK_RIGHT']).save(self.save_path / 'rgb_back_right' / ('%04d.png' % frame))
-        
+        folders = {'CAM_FRONT': 'rgb_front', 'CAM_FRONT_LEFT': 'rgb_front_left', 'CAM_FRONT_RIGHT': 'rgb_front_right',
+                   'CAM_BACK': 'rgb_back', 'CAM_BACK_LEFT': 'rgb_back_left', 'CAM_BACK_RIGHT': 'rgb_back_right'}
+        for cam, folder in folders.items():
+            # The images are RGB, the recorder expects BGR
+            self.recorder.write_image(f'{folder}/{frame:04}.png', tick_data['imgs'][cam][..., ::-1].copy())
 
-        outfile = open(self.save_path / 'meta' / ('%04d.json' % frame), 'w')
-        json.dump(self.pid_metadata, outfile, indent=4)
-        outfile.close()
+        self.recorder.append_log('meta', {'frame': frame, 'meta': self.pid_metadata})
 
-        # metric info
-        outfile = open(self.save_path / 'metric_info.json', 'w')
-        json.dump(self.metric_info, outfile, indent=4)
-        outfile.close()
+        # metric info, only the new steps are appended
+        for step, info in itertools.islice(self.metric_info.items(), self.num_saved_metric_info, None):
+            self.recorder.append_log('metric_info', {'step': step, 'info': info})
+        self.num_saved_metric_info = len(self.metric_info)
 
     def destroy(self, results=None):
-        out = cv2.VideoWriter(str(self.save_path / "video.mp4"), cv2.VideoWriter_fourcc(*'mp4v'), 
-                        5,  (768, 512)) 
-        file_list = sorted(os.listdir(str(self.save_path / "debug_stp3")))
-        for file_name in file_list:
-            tmp_img = cv2.imread(str(self.save_path / "debug_stp3" / file_name))
-            out.write(tmp_img)
-        out.release()
+        self.preprocessor.shutdown()
+        
+        # Wait for the pending writes, the video was already encoded while driving
+        if self.num_saved_metric_info > 0:
+            self.recorder.write_json('metric_info.json', self.metric_info)
+        self.recorder.close()
         
         pass
     
@@ -941,75 +924,6 @@ class Stp3Agent(AutoPilot):
 
         return ego_lidar        
 
-    def lidar_to_histogram_features(self, lidar, use_ground_plane=False):
-        """
-        Convert LiDAR point cloud into 2-bin histogram over a fixed size grid
-        :param lidar: (N,3) numpy, LiDAR point cloud
-        :param use_ground_plane, whether to use the ground plane
-        :return: (2, H, W) numpy, LiDAR as sparse image
-        """
-
-        max_height_lidar = 100.0
-        lidar_split_height = 0.2
-
-        def splat_points(point_cloud):
-        
-            # Max and minimum LiDAR ranges used for voxelization
-            min_x = -32
-            max_x = 32
-            min_y = -32
-            max_y = 32
-
-            pixels_per_meter = 4.0
-            
-            # Max number of LiDAR points per pixel in voxelized LiDAR
-            hist_max_per_pixel = 5
-            # Height at which the LiDAR points are split into the 2 channels.
-            # Is relative to lidar_pos[2]
-
-            # 256 x 256 grid
-            xbins = np.linspace(min_x, max_x,
-                                (max_x - min_x) * int(pixels_per_meter) + 1)
-            ybins = np.linspace(min_y, max_y,
-                                (max_y - min_y) * int(pixels_per_meter) + 1)
-            hist = np.histogramdd(point_cloud[:, :2], bins=(xbins, ybins))[0]
-            hist[hist > hist_max_per_pixel] = hist_max_per_pixel
-            overhead_splat = hist / hist_max_per_pixel
-            # The transpose here is an efficient axis swap.
-            # Comes from the fact that carla is x front, y right, whereas the image is y front, x right
-            # (x height channel, y width channel)
-            return overhead_splat.T
-
-        # Remove points above the vehicle
-        lidar = lidar[lidar[..., 2] < max_height_lidar]
-        
-        above = lidar[lidar[..., 2] > lidar_split_height]
-        above_features = splat_points(above)
-        
-        below = lidar[lidar[..., 2] <= 0.05 ]
-        below_features = splat_points(below)
-        
-        above_features = np.rot90(above_features)
-        below_features = np.rot90(below_features)
-        
-        if use_ground_plane:
-            features = np.stack([above_features, below_features], axis=-1)
-        else:
-            features = np.stack([above_features], axis=-1)
-        features = np.transpose(features, (2, 0, 1)).astype(np.float32)
-        return features
-    
-    # preprocess images 
-    def scale_image(self, image, output_size):
-        """
-        Scale and crop a PIL image, returning a channels-first numpy array.
-        """
-        image = image.resize((output_size[1], output_size[0]))
-        image = np.asarray(image)
-        image = image[:, ::-1]
-        return image
-    
-    
     def create_affine_mat(self, x1, y1, theta1, x2, y2, theta2):
         """
         Create an affine transformation matrix to map the BEV representation from one ego vehicle pose to another.